@@ -0,0 +1,97 @@
+"""在不同事件循环上回放弹幕包，比较解析、校验、分发路径的吞吐和循环延迟
+
+    python scripts/bench_runners.py --rooms 50 --packs 200
+"""
+import asyncio
+import json
+import time
+from pathlib import Path
+
+import brotli
+import typer
+
+from ubw.clients._wsbase import WSMessageParserMixin, HEADER_STRUCT, ProtoVer, Operation
+from ubw.handlers import BaseHandler
+from ubw.runner import LagProbe, loop_factory
+
+SAMPLES = Path(__file__).parent.parent / 'tests' / 'ubw' / 'handlers'
+
+
+def make_pack(body: bytes, ver: int, operation: int = Operation.SEND_MSG_REPLY) -> bytes:
+    return HEADER_STRUCT.pack(HEADER_STRUCT.size + len(body), HEADER_STRUCT.size, ver, operation, 1) + body
+
+
+def make_message(commands: list[dict]) -> bytes:
+    inner = b''.join(make_pack(json.dumps(c).encode(), ProtoVer.NORMAL) for c in commands)
+    return make_pack(brotli.compress(inner), ProtoVer.BROTLI)
+
+
+class ReplayClient(WSMessageParserMixin):
+    clientc: str = 'replay'
+
+    @property
+    def user_ident(self) -> str:
+        return 'replay'
+
+    async def start(self):
+        pass
+
+    async def join(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+class CountingHandler(BaseHandler):
+    cls: str = 'counting'
+    handled: int = 0
+
+    async def on_known_cmd(self, client, model):
+        self.handled += 1
+
+
+class FakeMessage:
+    def __init__(self, data: bytes):
+        self.data = data
+
+
+async def replay(rooms: int, packs: int, per_pack: int) -> tuple[int, float, LagProbe]:
+    commands = [json.loads(p.read_text('utf-8')) for p in sorted(SAMPLES.glob('danmu_msg_*.json'))]
+    message = FakeMessage(make_message([commands[i % len(commands)] for i in range(per_pack)]))
+    handler = CountingHandler()
+    probe = LagProbe(interval=0.01, threshold=0.1)
+    probe_task = asyncio.create_task(probe.run())
+
+    async def room(room_id):
+        client = ReplayClient(room_id=room_id, deduper=None)  # 回放的是同一批弹幕
+        client.add_handler(handler)
+        for _ in range(packs):
+            await client._on_ws_message(message)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(room(i) for i in range(rooms)))
+    elapsed = time.perf_counter() - start
+    probe_task.cancel()
+    return handler.handled, elapsed, probe
+
+
+def main(rooms: int = 50, packs: int = 100, per_pack: int = 10):
+    for kind in ['asyncio', 'uvloop']:
+        try:
+            factory = loop_factory(kind)
+        except ImportError:
+            print(f'{kind:8} not installed')
+            continue
+        with asyncio.Runner(loop_factory=factory) as runner:
+            handled, elapsed, probe = runner.run(replay(rooms, packs, per_pack))
+        lag = probe.percentiles(50, 99)
+        print(f'{kind:8} {handled} commands in {elapsed:.2f}s = {handled / elapsed:,.0f}/s, '
+              f'loop lag p50={lag["p50"] * 1000:.1f}ms p99={lag["p99"] * 1000:.1f}ms max={probe.max_lag * 1000:.1f}ms')
+
+
+if __name__ == '__main__':
+    typer.run(main)
@@ -0,0 +1,76 @@
+"""按给定速率回放弹幕语料，测量热词统计的循环延迟、积压和主进程 CPU 占用
+
+    python scripts/bench_trends.py --rate 2000 --rooms 50 --seconds 30
+    python scripts/bench_trends.py --corpus danmaku.txt   # 每行一条弹幕
+
+不给语料时用一个按 Zipf 分布重复的合成语料，重复率与热门直播间相近。
+"""
+import asyncio
+import random
+import time
+from datetime import timedelta
+from pathlib import Path
+
+import typer
+
+from ubw.handlers.trends import TrendsHandler
+from ubw.runner import LagProbe
+
+PHRASES = ('主播', '好强', '哈哈哈', '草', '晚上好', '666', '上舰', '来了来了', '这波', '太离谱了', '下次一定', '可爱',
+           '前排', '打卡', '好耶', '破防了', '牛', '什么鬼', '唱歌', '再来一首', '加油', '好听', '？？？', '笑死')
+
+
+def synthetic_corpus(size: int, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    weights = [1 / (i + 1) for i in range(len(PHRASES))]
+    corpus = []
+    for _ in range(size):
+        if rng.random() < 0.7:  # 复读或套话
+            corpus.append(''.join(rng.choices(PHRASES, weights, k=rng.randint(1, 2))))
+        else:
+            corpus.append(''.join(rng.choices(PHRASES, k=rng.randint(2, 4))) + str(rng.randint(0, 10000)))
+    return corpus
+
+
+async def replay(corpus: list[str], rate: int, rooms: int, seconds: float, workers: int) -> dict:
+    handler = TrendsHandler(workers=workers, publish_metrics=False, refresh_interval=timedelta(hours=1))
+    probe = LagProbe(interval=0.01, threshold=0.1)
+    probe_task = asyncio.create_task(probe.run())
+    handler._batch_task = asyncio.create_task(handler.t_batch())
+    await handler.tokenizer.tokenize_many(['预热'])  # 先把进程池和词典加载好
+
+    tick = 0.01
+    per_tick = rate * tick
+    fed, backlog = 0, 0
+    cpu, start = time.process_time(), time.perf_counter()
+    while (elapsed := time.perf_counter() - start) < seconds:
+        due = int(elapsed / tick * per_tick) - fed
+        now = time.time()
+        for i in range(due):
+            handler.feed((fed + i) % rooms, now, corpus[(fed + i) % len(corpus)])
+        fed += due
+        backlog = max(backlog, len(handler.pending))
+        await asyncio.sleep(tick)
+    await handler.drain()
+    elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu
+    probe_task.cancel()
+    for room_id in range(min(rooms, 3)):
+        print(f'room {room_id}: {handler.rooms[room_id].top(time.time(), 5)}')
+    stats = handler.stats()
+    await handler.stop()
+    return {'fed': fed, 'elapsed': elapsed, 'cpu': cpu, 'max_backlog': backlog, 'probe': probe, **stats}
+
+
+def main(rate: int = 2000, rooms: int = 50, seconds: float = 30, workers: int = 1, corpus: Path = None):
+    texts = corpus.read_text('utf-8').splitlines() if corpus else synthetic_corpus(100_000)
+    r = asyncio.run(replay([t for t in texts if t.strip()], rate, rooms, seconds, workers))
+    lag = r['probe'].percentiles(50, 99)
+    hits = r['cache_hits'] / max(r['cache_hits'] + r['cache_misses'], 1)
+    print(f"{r['fed']} danmaku in {r['elapsed']:.1f}s = {r['fed'] / r['elapsed']:,.0f}/s, "
+          f"main process cpu {r['cpu'] / r['elapsed']:.0%}, dropped {r['dropped']}, max backlog {r['max_backlog']}")
+    print(f"cache hit rate {hits:.1%}, {r['batches']} batches, "
+          f"loop lag p50={lag['p50'] * 1000:.1f}ms p99={lag['p99'] * 1000:.1f}ms max={r['probe'].max_lag * 1000:.1f}ms")
+
+
+if __name__ == '__main__':
+    typer.run(main)
@@ -6,8 +6,10 @@ from .downloader import DownloaderApp
 from .favsync import FavSyncApp
 from .full_connect import FullConnectApp
 from .observer import ObserverApp
+from .recorder import RecorderApp
 from .simple import SimpleApp
 
-App = Annotated[SimpleApp | ObserverApp | DownloaderApp | FullConnectApp | FavSyncApp, Field(discriminator='cls')]
+App = Annotated[SimpleApp | ObserverApp | DownloaderApp | FullConnectApp | FavSyncApp | RecorderApp,
+                Field(discriminator='cls')]
 
 AppTypeAdapter = TypeAdapter[App](App)
@@ -1,3 +1,5 @@
+import asyncio
+import logging
 from typing import Union
 
 from pydantic import model_validator
@@ -7,6 +9,8 @@ from ..clients import BilibiliClient
 from ..downloader.dynamic_downloader import DynamicDownloader
 from ..downloader.video_downloader import VideoDownloader
 
+logger = logging.getLogger('app.downloader')
+
 Query = Union[
     tuple[Literal['dynamic'], int | str],
     tuple[Literal['bvid'], str],
@@ -18,6 +22,7 @@ class DownloaderApp(BaseApp):
     cls: Literal['downloader'] = 'downloader'
 
     queries: list[Query] = []
+    concurrency: int = 4  # queries running at the same time, connections are further limited by the scheduler
 
     # DI
     bilibili_client: BilibiliClient
@@ -48,8 +53,20 @@ class DownloaderApp(BaseApp):
         if self.bilibili_client_owner:
             await self.bilibili_client.__aenter__()
 
+        queue: asyncio.Queue[Query] = asyncio.Queue()
         for query in self.queries:
-            await self.run_query(query)
+            queue.put_nowait(query)
+        async with asyncio.TaskGroup() as tg:
+            for _ in range(min(self.concurrency, queue.qsize())):
+                tg.create_task(self._worker(queue))
+
+    async def _worker(self, queue: asyncio.Queue[Query]):
+        while not queue.empty():
+            query = queue.get_nowait()
+            try:
+                await self.run_query(query)
+            except Exception as e:
+                logger.exception(f'exception in run_query({query!r})', exc_info=e)
 
     async def run_query(self, query: Query):
         match query:
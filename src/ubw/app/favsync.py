@@ -3,21 +3,102 @@ import json
 import logging
 import os
 import warnings
-from contextlib import nullcontext, asynccontextmanager
+from contextlib import nullcontext, aclosing
 from pathlib import Path
+from typing import Annotated
 
-import aiofiles
-import aiofiles.os
-from bilibili_api import video, HEADERS, get_client
+from bilibili_api import video, HEADERS
 from bilibili_api.favorite_list import FavoriteList
-from pydantic import TypeAdapter, field_validator
+from pydantic import TypeAdapter, field_validator, Field
+from typing_extensions import Doc
 
 from ._base import *
 from ..clients import BilibiliClient
+from ..clients._ratelimit import Priority, rate_limited
+from ..downloader._base import BaseDownloader
+from ..downloader.asset_cache import AssetCache, shared_asset_cache
+from ..downloader.remux import RemuxPool, find_ffmpeg, shared_remux_pool
+from ..downloader.scheduler import DownloadPriority
 from ..models import FavList, Response
 
 logger = logging.getLogger('favsync')
 
+COMPLETE = 'v1'
+
+
+class SyncJournal:
+    """同步记录
+
+    ``.archive.json`` 是快照，``bvid -> 状态列表``，``'v1'`` 表示全部分P已下载，``'p{n}'`` 表示第 n P 已下载，
+    空列表表示曾经失败、需要重试。
+    运行中每完成一P就向 ``.archive.journal`` 追加一行并 fsync，启动时重放，结束时合并回快照。
+    """
+
+    def __init__(self, root: Path):
+        self.snapshot_path = root / '.archive.json'
+        self.journal_path = root / '.archive.journal'
+        self.archive: dict[str, list[str]] = {}
+        self._file = None
+        self._lock = asyncio.Lock()
+
+    def load(self):
+        if self.snapshot_path.exists():
+            archive = json.loads(self.snapshot_path.read_text(encoding='utf-8'))
+            if not isinstance(archive, dict):
+                warnings.warn('Archive is not a dict')
+                archive = {}
+            self.archive = archive
+        if self.journal_path.exists():
+            with self.journal_path.open(encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        bvid, status = json.loads(line)
+                    except ValueError:  # torn last line after a crash
+                        logger.warning(f'ignored broken journal line {line!r}')
+                        continue
+                    self._apply(bvid, status)
+
+    def _apply(self, bvid: str, status: str | None):
+        statuses = self.archive.setdefault(bvid, [])
+        if status is not None and status not in statuses:
+            statuses.append(status)
+
+    def complete(self, bvid: str) -> bool:
+        return COMPLETE in self.archive.get(bvid, ())
+
+    def has(self, bvid: str, status: str) -> bool:
+        return status in self.archive.get(bvid, ())
+
+    def pending(self) -> set[str]:
+        return {bvid for bvid, statuses in self.archive.items() if COMPLETE not in statuses}
+
+    def _append(self, line: str):
+        if self._file is None:
+            self._file = self.journal_path.open('a', encoding='utf-8')
+        self._file.write(line)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    async def record(self, bvid: str, status: str | None = None):
+        """*status* 为 None 时仅登记 bvid，使其在下次运行时被重试"""
+        self._apply(bvid, status)
+        async with self._lock:
+            await asyncio.to_thread(self._append, json.dumps([bvid, status], ensure_ascii=False) + '\n')
+
+    def compact(self):
+        tmp = self.snapshot_path.with_name(self.snapshot_path.name + '.tmp')
+        tmp.write_text(json.dumps(self.archive, ensure_ascii=False, indent=2), encoding='utf-8')
+        os.replace(tmp, self.snapshot_path)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self.journal_path.unlink(missing_ok=True)
+
+
+@rate_limited('get_fav_list', Priority.BULK)
+async def _get_fav_page(fav_list: FavoriteList, page: int) -> dict:
+    return await fav_list.get_content(page=page)
+
 
 class FavSyncApp(BaseApp):
     cls: Literal['favsync'] = 'favsync'
@@ -27,10 +108,17 @@ class FavSyncApp(BaseApp):
 
     # low config
     ffmpeg: Path = None
+    concurrency: Annotated[int, Doc('pages downloaded at the same time')] = 3
+    stop_after_synced: Annotated[int, Doc('stop listing after this many consecutive synced medias')] = 20
+    full_scan: Annotated[bool, Doc('list the whole favourite list even if nothing changed')] = False
 
     # DI
     bilibili_client: BilibiliClient
     bilibili_client_owner: bool = True
+    downloader: BaseDownloader = Field(default_factory=BaseDownloader)
+    downloader_owner: bool = True
+    remux_pool: RemuxPool = Field(default_factory=shared_remux_pool)
+    asset_cache: AssetCache = Field(default_factory=shared_asset_cache)
 
     @field_validator('target_path', mode='after')
     @classmethod
@@ -39,132 +127,105 @@ class FavSyncApp(BaseApp):
 
     @field_validator('ffmpeg', mode='before')
     @classmethod
-    def find_ffmpeg(cls, v):
-        if v is not None:
-            return v
-        gen_possible_names = (
-            Path(i) / fn
-            for i in os.environ['PATH'].split(os.path.pathsep)
-            for fn in ['ffmpeg', 'ffmpeg.exe']
-        )
-        for p in gen_possible_names:
-            if p.is_file():
-                return p
-        return None
+    def default_ffmpeg(cls, v):
+        return find_ffmpeg() if v is None else v
 
     async def _fetch_fav_list(self, credential):
         fav_list = FavoriteList(media_id=self.favlist_id, credential=credential)
         has_more = True
         page = 1
         while has_more:
-            content = TypeAdapter(Response[FavList]).validate_python(await fav_list.get_content(page=page))
+            content = TypeAdapter(Response[FavList]).validate_python(await _get_fav_page(fav_list, page))
             for media in content.data.medias:
                 yield media
             has_more = content.data.has_more
             page += 1
 
-    @asynccontextmanager
-    async def _archive(self):
-        archive = {}
-        if (self.target_path / '.archive.json').exists():
-            async with aiofiles.open(self.target_path / '.archive.json') as f:
-                archive = json.loads(await f.read())
-                if not isinstance(archive, dict):
-                    warnings.warn('Archive is not a dict')
-                    archive = {}
-
-        yield archive
-
-        async with aiofiles.open(self.target_path / 'archive.json.tmp', 'w') as f:
-            await f.write(json.dumps(archive, ensure_ascii=False, indent=2))
-
-        await aiofiles.os.replace(self.target_path / 'archive.json.tmp', self.target_path / 'archive.json')
-
     async def _run(self):
         if not self.target_path.is_dir():
             raise FileNotFoundError(f'{self.target_path} is not a directory')
-        archive = {}
-        if (self.target_path / '.archive.json').exists():
-            async with aiofiles.open(self.target_path / '.archive.json') as f:
-                archive = json.loads(await f.read())
-                if not isinstance(archive, dict):
-                    warnings.warn('Archive is not a dict')
-                    archive = {}
-        async with (self.bilibili_client if self.bilibili_client_owner else nullcontext()):
-            credential = await self.bilibili_client.make_credential()
-            async for media in self._fetch_fav_list(credential):
-                bvid = media.bvid
-                bvid_root = self.target_path / f'{media.title} [{bvid}]'
-                for page in range(1, media.page + 1):
-                    status = set(archive.get(bvid, []))
-                    if 'v1' not in status:
-                        v = video.Video(bvid=bvid, credential=credential)
-                        download_url_data = await v.get_download_url()
-                        detector = video.VideoDownloadURLDataDetecter(data=download_url_data)
-                        streams = detector.detect_best_streams()
-                        if detector.check_flv_mp4_stream():
-                            # FLV
-                            final_path = bvid_root / f'p{page}.flv'
-                            await self._download_file(streams[0].url, final_path, f"{bvid} FLV流")
-                            print(f'已下载到 {final_path}')
-                        else:
-                            # MP4
-                            tmp_video = bvid_root / f'p{page}_video_temp.m4s'
-                            tmp_audio = bvid_root / f'p{page}_audio_temp.m4s'
-                            final_path = bvid_root / f'p{page}.mp4'
-                            await self._download_file(streams[0].url, tmp_video, f"{bvid} 视频流")
-                            await self._download_file(streams[1].url, tmp_audio, f"{bvid} 音频流")
-                            proc = await asyncio.create_subprocess_exec(
-                                str(self.ffmpeg), '-i', str(tmp_video), '-i', str(tmp_audio),
-                                '-c:v', 'copy', '-c:a', 'copy', str(final_path),
-                                stdout=asyncio.subprocess.PIPE,
-                                stderr=asyncio.subprocess.PIPE,
-                            )
-                            stdout, stderr = await proc.communicate()
-                            if proc.returncode != 0:
-                                stdout = stdout.decode(errors='ignore')
-                                stderr = stderr.decode(errors='ignore')
-                                logger.error(
-                                    f'{bvid} ffmpeg 混流失败，保留临时文件：' '\n'
-                                    f'视频：{tmp_video}' '\n'
-                                    f'音频：{tmp_audio}' '\n'
-                                    '\n'
-                                    '==STDOUT==\n'
-                                    f'{stdout}' '\n'
-                                    '\n'
-                                    '==STDERR==\n'
-                                    f'{stderr}')
-                            else:
-                                await aiofiles.os.remove(tmp_video)
-                                await aiofiles.os.remove(tmp_audio)
-                                print(f'已下载到 {final_path}')
-
-        async with aiofiles.open(self.target_path / 'archive.json.tmp', 'w') as f:
-            await f.write(json.dumps(archive, ensure_ascii=False, indent=2))
-
-        await aiofiles.os.replace(self.target_path / 'archive.json.tmp', self.target_path / 'archive.json')
+        journal = SyncJournal(self.target_path)
+        journal.load()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        try:
+            async with (self.bilibili_client if self.bilibili_client_owner else nullcontext()):
+                credential = await self.bilibili_client.make_credential()
+                seen = set()
+                async with asyncio.TaskGroup() as tg:
+                    synced_streak = 0
+                    async with aclosing(self._fetch_fav_list(credential)) as medias:
+                        async for media in medias:
+                            seen.add(media.bvid)
+                            if journal.complete(media.bvid):
+                                synced_streak += 1
+                                if not self.full_scan and synced_streak >= self.stop_after_synced:
+                                    logger.info(f'reached {synced_streak} synced medias, stop listing')
+                                    break
+                                continue
+                            synced_streak = 0
+                            tg.create_task(self._sync_media(credential, journal, semaphore,
+                                                            media.bvid, media.title, media.page, media.cover))
+                    for bvid in journal.pending() - seen:  # failed last time and not listed this time
+                        tg.create_task(self._sync_pending(credential, journal, semaphore, bvid))
+        finally:
+            journal.compact()
 
         self._task = None
 
-    async def _download_file(self, url: str, out: Path, intro: str) -> list[Path]:
+    async def _sync_pending(self, credential, journal: SyncJournal, semaphore: asyncio.Semaphore, bvid: str):
         try:
-            out.parent.mkdir(parents=True, exist_ok=True)
-            dwn_id = await get_client().download_create(url, HEADERS)
-            bts = 0
-            tot = get_client().download_content_length(dwn_id)
-            async with aiofiles.open(self.out_dir / out, mode='wb') as f:
-                while True:
-                    bts += await f.write(await get_client().download_chunk(dwn_id))
-                    print(f"{intro} - {out} [{bts} / {tot}]", end="\r")
-                    if bts == tot:
-                        break
-            return [out]
+            info = await video.Video(bvid=bvid, credential=credential).get_info()
         except Exception as e:
-            logger.exception('exception in download_file()', exc_info=e)
-            return []
-        except BaseException as e:
-            logger.exception('exception in download_file()', exc_info=e)
-            raise
+            logger.exception(f'{bvid} 获取视频信息失败', exc_info=e)
+            return
+        await self._sync_media(credential, journal, semaphore, bvid, info['title'], len(info['pages']),
+                               info.get('pic', ''))
+
+    async def _sync_media(self, credential, journal: SyncJournal, semaphore: asyncio.Semaphore,
+                          bvid: str, title: str, pages: int, cover: str = ''):
+        bvid_root = self.target_path / f'{title} [{bvid}]'
+        if cover:
+            try:
+                await self.asset_cache.materialize(cover, bvid_root / 'cover')
+            except Exception as e:
+                logger.warning(f'{bvid} 封面下载失败: {e!r}')
+        for page in range(1, pages + 1):
+            if journal.has(bvid, f'p{page}'):
+                continue
+            async with semaphore:
+                try:
+                    await self._sync_page(credential, bvid, bvid_root, page)
+                except Exception as e:
+                    logger.exception(f'{bvid} p{page} 下载失败', exc_info=e)
+                    await journal.record(bvid)
+                    return
+            await journal.record(bvid, f'p{page}')
+        await journal.record(bvid, COMPLETE)
+
+    async def _sync_page(self, credential, bvid: str, bvid_root: Path, page: int):
+        v = video.Video(bvid=bvid, credential=credential)
+        download_url_data = await v.get_download_url(page_index=page - 1)
+        detector = video.VideoDownloadURLDataDetecter(data=download_url_data)
+        streams = detector.detect_best_streams()
+        if detector.check_flv_mp4_stream():
+            # FLV
+            final_path = bvid_root / f'p{page}.flv'
+            if not await self.downloader.download_file(streams[0].url, final_path,
+                                                       get_kwargs={'headers': HEADERS},
+                                                       priority=DownloadPriority.VIDEO):
+                raise RuntimeError(f'failed to download {final_path}')
+        else:
+            # MP4，边下载边混流
+            final_path = bvid_root / f'p{page}.mp4'
+            await self.remux_pool.remux(
+                self.downloader.iter_content(streams[0].url, f"{bvid} 视频流",
+                                             get_kwargs={'headers': HEADERS}, priority=DownloadPriority.VIDEO),
+                self.downloader.iter_content(streams[1].url, f"{bvid} 音频流",
+                                             get_kwargs={'headers': HEADERS}, priority=DownloadPriority.VIDEO),
+                final_path, ffmpeg=self.ffmpeg)
+        print(f'已下载到 {final_path}')
 
     async def close(self):
-        pass
+        if self.downloader_owner:
+            await self.downloader.close()
+        await self.asset_cache.save()
@@ -10,7 +10,8 @@ from pydantic import Field
 from typing_extensions import Doc
 
 from ubw import models
-from ubw.clients import BilibiliCookieClient, BilibiliClient, WSWebCookieLiveClient
+from ubw.clients import BilibiliCookieClient, BilibiliClient, WSWebCookieLiveClient, LiveStatusPoller, \
+    shared_status_poller, DynamicFeedScheduler, shared_dynamic_feed
 from ubw.handlers.observe import ObserverHandler
 from ubw.push.qmsg import QMsgPusher
 from ubw.push.serverchan import ServerChanPusher, ServerChanMessage
@@ -31,6 +32,10 @@ class ObserverApp(InitLoopFinalizeApp):
     uid: int
     watch_live: bool = True
     watch_dynamic: bool = True
+    poll_live_status: Annotated[bool, Doc('also watch live status via batch polling, shared among apps')] = False
+    use_dynamic_feed: Annotated[bool, Doc('watch dynamics via the scheduler shared among apps '
+                                          '(with its own cookie client), '
+                                          'instead of polling every dynamic_poll_interval')] = False
 
     # low config
     dynamic_poll_interval: float = 60
@@ -45,6 +50,8 @@ class ObserverApp(InitLoopFinalizeApp):
     owned_server_chan: bool = True
     qmsg: QMsgPusher | None = None
     owned_qmsg: bool = True
+    status_poller: LiveStatusPoller | None = None
+    dynamic_feed: DynamicFeedScheduler | None = None
 
     # states
     last_got: set = Field(default_factory=set)
@@ -82,15 +89,30 @@ class ObserverApp(InitLoopFinalizeApp):
             self._live_client.add_handler(self._live_handler)
             await self._live_handler.start(self._live_client)
             await self._live_client.start()
-        await self._fetch_print_update(init=True)
+            if self.poll_live_status:
+                if self.status_poller is None:
+                    self.status_poller = shared_status_poller()
+                self.status_poller.subscribe(self.uid, self._on_polled_status)
+        if self.watch_dynamic and self.use_dynamic_feed:
+            if self.dynamic_feed is None:
+                self.dynamic_feed = shared_dynamic_feed()
+            await self._print_update(await self.dynamic_feed.subscribe(self.uid, self._on_feed_items), init=True)
+        else:
+            await self._fetch_print_update(init=True)
         await self.ui.add_record(Record(segments=[PlainText(text=" ===== 以上为历史消息 ===== ")]))
 
     async def _fetch_print_update(self, *, init=False):
         if not self.watch_dynamic:
             return
         s = await self.bilibili_client.get_user_dynamic(self.uid)
-        this_got = {item.id_str for item in s.items}
-        for item in sorted(s.items, key=key):
+        await self._print_update(s.items, init=init)
+
+    async def _on_feed_items(self, items: list[models.DynamicItem]):
+        await self._print_update(items, accumulate=True)
+
+    async def _print_update(self, items: list[models.DynamicItem], *, init=False, accumulate=False):
+        this_got = {item.id_str for item in items}
+        for item in sorted(items, key=key):
             if item.id_str not in self.last_got:
                 if item.is_topped:
                     await self.ui.add_record(Record(segments=[
@@ -144,7 +166,13 @@ class ObserverApp(InitLoopFinalizeApp):
                     ], time=item.pub_date))
                     if not init:
                         await self._deal_with_push(f"{self.name} 发布动态", item)
-        self.last_got = this_got
+        self.last_got = self.last_got | this_got if accumulate else this_got
+
+    async def _on_polled_status(self, command: dict):
+        living = self._live_handler.living
+        if command['cmd'] == 'LIVE' and living or command['cmd'] == 'PREPARING' and living is False:
+            return
+        await self._live_handler.handle(self._live_client, command)
 
     async def _deal_with_push(self, title, item: models.DynamicItem):
         if self.server_chan is not None:
@@ -153,6 +181,8 @@ class ObserverApp(InitLoopFinalizeApp):
             await self.qmsg.push(title + "\n" + re.sub(r"https?://[\w\-.]+/[^\s()\[\]{}]+", "<URL>", item.text))
 
     async def _loop(self):
+        if self.use_dynamic_feed:
+            await asyncio.Event().wait()  # nothing to poll here, new dynamics come from the feed
         await asyncio.sleep(self.dynamic_poll_interval * (self.exponential_delay_base ** self._fail_count))
         try:
             await self._fetch_print_update()
@@ -178,6 +208,10 @@ class ObserverApp(InitLoopFinalizeApp):
                 raise
 
     async def _finalize(self):
+        if self.status_poller is not None:
+            self.status_poller.unsubscribe(self.uid, self._on_polled_status)
+        if self.dynamic_feed is not None:
+            self.dynamic_feed.unsubscribe(self.uid, self._on_feed_items)
         if self.watch_live:
             if self._live_client is not None:
                 await self._live_client.stop()
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+from functools import cached_property
+from typing import Awaitable, Callable
+
+from pydantic import Field
+
+from ubw import metrics
+from ubw.clients import BilibiliCookieClient, BilibiliClient, WSWebCookieLiveClient
+from ubw.downloader.live import LiveRecorder, RecordOptions
+from ubw.handlers import BaseHandler
+from ._base import *
+
+logger = logging.getLogger('app.recorder')
+
+
+class LiveSignalHandler(BaseHandler):
+    """只关心开播 / 下播"""
+    cls: Literal['live_signal'] = 'live_signal'
+
+    # DI
+    callback: Callable[[int, bool], Awaitable] = Field(exclude=True)
+
+    async def on_live(self, client, model):
+        await self.callback(client.room_id, True)
+
+    async def on_preparing(self, client, model):
+        await self.callback(client.room_id, False)
+
+
+class RecorderApp(BaseApp):
+    """开播（LIVE）时开始录制，下播（PREPARING）时停止；启动时已经在播的房间立即开始"""
+    cls: Literal['recorder'] = 'recorder'
+
+    rooms: list[int]
+    options: RecordOptions = RecordOptions()
+    listen_live: bool = True
+
+    # DI
+    bilibili_client: BilibiliClient = Field(default_factory=BilibiliCookieClient)
+    bilibili_client_owner: bool = True
+
+    @cached_property
+    def _clients(self) -> dict[int, WSWebCookieLiveClient]:
+        return {}
+
+    @cached_property
+    def _recorders(self) -> dict[int, LiveRecorder]:
+        return {}
+
+    def stats(self) -> dict:
+        return {room_id: recorder.stats() for room_id, recorder in list(self._recorders.items())}
+
+    async def _run(self):
+        if self.bilibili_client_owner:
+            await self.bilibili_client.__aenter__()
+        metrics.registry.register_stats('recorder', self.stats, label='room')
+        if self.listen_live:
+            handler = LiveSignalHandler(callback=self.on_live_status)
+            for room_id in self.rooms:
+                client = self._clients[room_id] = WSWebCookieLiveClient(
+                    room_id=room_id, bilibili_client=self.bilibili_client, bilibili_client_owner=False)
+                client.add_handler(handler)
+                await client.start()
+        for room_id in self.rooms:
+            try:
+                info = await self.bilibili_client.get_room_play_info(room_id, self.options.qn)
+            except Exception as e:
+                logger.exception(f'failed to get play info of room {room_id}', exc_info=e)
+                continue
+            if info.live_status == 1:
+                await self.on_live_status(room_id, True)
+        if self.listen_live:
+            await asyncio.gather(*(client.join() for client in self._clients.values()))
+        else:  # 没人会再开始录制，录完启动时在播的房间就结束
+            await asyncio.gather(*(recorder.join() for recorder in self._recorders.values()), return_exceptions=True)
+
+    async def on_live_status(self, room_id: int, living: bool):
+        recorder = self._recorders.get(room_id)
+        if living:
+            if recorder is None:
+                recorder = self._recorders[room_id] = LiveRecorder(
+                    room_id=room_id, options=self.options, bilibili_client=self.bilibili_client)
+            if not recorder.is_running:
+                logger.info(f'room {room_id} is living, start recording')
+                recorder.start()
+        elif recorder is not None and recorder.is_running:
+            logger.info(f'room {room_id} stopped living, stop recording')
+            await recorder.stop()
+
+    async def stop(self):
+        await asyncio.gather(*(recorder.stop() for recorder in self._recorders.values()))
+        await asyncio.gather(*(client.stop() for client in self._clients.values()))
+        await super().stop()
+
+    async def close(self):
+        await asyncio.gather(*(recorder.close() for recorder in self._recorders.values()))
+        await asyncio.gather(*(client.close() for client in self._clients.values()))
+        if self.bilibili_client_owner:
+            await self.bilibili_client.close()
@@ -1,6 +1,7 @@
 import asyncio
 import copy
 import importlib
+from datetime import datetime
 from pathlib import Path
 from typing import Annotated
 
@@ -34,6 +35,37 @@ def init_logging(cd):
     logging.config.dictConfig(logging_config_dict)
 
 
+def init_rate_limit(cd):
+    from ubw.clients._ratelimit import rate_limiter
+    rate_limiter.configure(cd['rate_limit'])
+
+
+def init_metrics(cd):
+    from ubw.metrics import serve_metrics
+    metrics_config = dict(cd['metrics'])
+    if metrics_config.pop('enabled', True):
+        serve_metrics(**metrics_config)
+
+
+def init_runner(cd, loop):
+    from ubw.runner import configure
+    runner_config = dict(cd.get('runner', {}))
+    if loop is not None:
+        runner_config['loop'] = loop
+    configure(**runner_config)
+
+
+def init_profiling(modes):
+    import atexit
+    from ubw.profiling import profiler, install_signal_handlers
+    install_signal_handlers()
+    for mode in modes:
+        if mode not in ('stacks', 'slow'):
+            raise typer.BadParameter(f'unknown profile mode {mode!r}, expected stacks or slow')
+        profiler.toggle(mode)
+        atexit.register(profiler.dump, mode)
+
+
 def load_config(c: Path):
     import toml
     with c.open(encoding='utf-8') as f:
@@ -166,6 +198,27 @@ async def bhashm(rooms: list[int], famous_people: Annotated[list[int], typer.Opt
     await listen_to_all(rooms, HashMarkHandler(famous_people=famous_people))
 
 
+@app.command('analytics')
+@sync
+async def analytics(rooms: list[int]):
+    from ubw.handlers import AnalyticsHandler
+    await listen_to_all(rooms, AnalyticsHandler())
+
+
+@app.command('audience')
+@sync
+async def audience(rooms: list[int]):
+    from ubw.handlers import AudienceHandler
+    await listen_to_all(rooms, AudienceHandler())
+
+
+@app.command('trends')
+@sync
+async def trends(rooms: list[int], workers: Annotated[int, typer.Option('--workers', '-j')] = 1):
+    from ubw.handlers import TrendsHandler
+    await listen_to_all(rooms, TrendsHandler(workers=workers))
+
+
 @app.command('dump_raw')
 @sync
 async def dump_raw(rooms: list[int]):
@@ -176,9 +229,9 @@ async def dump_raw(rooms: list[int]):
 @app.command('saver')
 @app.command('s')
 @sync
-async def saver(rooms: list[int]):
+async def saver(rooms: list[int], backend: Annotated[str, typer.Option('--backend', '-b')] = 'tinydb'):
     from ubw.handlers import SaverHandler
-    await listen_to_all(rooms, handler_factory=lambda r: SaverHandler(room_id=r))
+    await listen_to_all(rooms, handler_factory=lambda r: SaverHandler(room_id=r, backend=backend))
 
 
 @app.command('test_account')
@@ -284,6 +337,30 @@ async def app_run(
         await application.close()
 
 
+@app.command('record')
+@sync
+async def record(
+        rooms: list[int],
+        out_dir: Path = Path('output/record'),
+        qn: int = 10000,
+):
+    """record rooms whenever they go live, split into files by size and duration"""
+    from pydantic import TypeAdapter
+    from ubw.app.recorder import RecorderApp
+    from ubw.clients.bilibili import BilibiliClient
+    from ubw.downloader.live import RecordOptions
+
+    application = RecorderApp(
+        rooms=rooms, options=RecordOptions(out_dir=out_dir, qn=qn),
+        bilibili_client=TypeAdapter(BilibiliClient).validate_python(main.config['accounts']['default']))
+    try:
+        await application.start()
+        await application.join()
+    finally:
+        await application.stop()
+        await application.close()
+
+
 app.command()(get_play_url)
 
 
@@ -299,6 +376,88 @@ async def shark(
     await listen_to_all(rooms, handler)
 
 
+@app.command()
+def query(
+        rooms: Annotated[list[int], typer.Argument(help="rooms to scan, all when omitted")] = None,
+        since: Annotated[datetime, typer.Option(help="local time")] = None,
+        until: Annotated[datetime, typer.Option(help="local time")] = None,
+        cmd: Annotated[list[str], typer.Option('--cmd', '-C')] = (),
+        uid: Annotated[list[int], typer.Option('--uid', '-u')] = (),
+        regex: Annotated[str, typer.Option('--regex', '-r', help="searched in danmaku / sc text")] = None,
+        where: Annotated[str, typer.Option('--where', '-w', help="shark expression")] = None,
+        group_by: Annotated[list[str], typer.Option(
+            '--group-by', '-g', help="room, cmd, uid, month, day, hour or a shark expression")] = (),
+        count: Annotated[bool, typer.Option('--count', help="only count matched records")] = False,
+        sum_: Annotated[str, typer.Option('--sum', '-s', help="price (in CNY) or a shark expression")] = None,
+        limit: int = None,
+        source: Annotated[str, typer.Option(help="saver or dump_raw")] = 'saver',
+        jobs: Annotated[int, typer.Option('--jobs', '-j')] = None,
+):
+    """scan saved shards with a process pool, printing matched records or aggregations as json lines"""
+    import json
+    from ubw.userdata.query import Query, aggregate, iter_records
+    from ubw.userdata.shards import SHARD_ROOTS, find_shards
+
+    q = Query(since=since and since.astimezone(), until=until and until.astimezone(), cmds=cmd, uids=uid,
+              regex=regex, where=where, group_by=group_by, sum=sum_, limit=limit)
+    shards = find_shards(SHARD_ROOTS[source], rooms, q.since, q.until)
+    if count or q.aggregating:
+        result = aggregate(q, shards, jobs)
+        for key, (n, total) in sorted(result.items(), key=lambda kv: tuple(map(str, kv[0]))):
+            line = {**dict(zip(group_by, key)), 'count': n}
+            if sum_ is not None:
+                line['sum'] = total
+            print(json.dumps(line, ensure_ascii=False))
+    else:
+        for shard, doc in iter_records(q, shards, jobs):
+            print(json.dumps({'room_id': shard.room_id, 'record': doc}, ensure_ascii=False))
+
+
+@app.command()
+def overlap(
+        rooms: list[int],
+        since: Annotated[datetime, typer.Option(help="local date")] = None,
+        until: Annotated[datetime, typer.Option(help="local date, same as --since when omitted")] = None,
+        kind: Annotated[str, typer.Option(help="viewers or chatters")] = 'viewers',
+):
+    """estimate distinct and shared audience of rooms from the sketches written by `ubw audience`"""
+    import json
+    from ubw.userdata.sketches import SketchStore, estimate
+
+    since = (since or datetime.now()).date()
+    result = estimate(SketchStore(), rooms, since, until and until.date(), kind)
+    print(json.dumps({'per_room': {r: round(n) for r, n in result.per_room.items()}, 'union': round(result.union),
+                      'shared': round(result.shared), 'jaccard': round(result.jaccard, 4)}))
+
+
+@app.command()
+def compact(
+        rooms: Annotated[list[int], typer.Argument(help="rooms to compact, all when omitted")] = None,
+        source: Annotated[str, typer.Option(help="saver or dump_raw")] = 'saver',
+        jobs: Annotated[int, typer.Option('--jobs', '-j')] = None,
+        keep_original: bool = False,
+        dry_run: bool = False,
+):
+    """convert closed tinydb shards into indexed .jsonl.gz files, removing originals once verified"""
+    from ubw.userdata.compact import ShardIndex, closed_shards, compact_all
+    from ubw.userdata.shards import SHARD_ROOTS, find_shards
+
+    shards = find_shards(SHARD_ROOTS[source], rooms)
+    if dry_run:
+        for shard in closed_shards(shards):
+            print(shard.path)
+        return
+    failed = 0
+    for shard, result in compact_all(shards, jobs, keep_original):
+        if isinstance(result, ShardIndex):
+            print(f'{shard.path}: {result.records} records, {len(result.blocks)} blocks')
+        else:
+            failed += 1
+            print(f'{shard.path}: FAILED {result}')
+    if failed:
+        raise typer.Exit(1)
+
+
 @app.command()
 def print_config():
     from rich import print
@@ -320,6 +479,9 @@ def main(
         verbose: Annotated[int, typer.Option('--verbose', '-v', count=True)] = 0,
         remote_debug_with_port: int = 0,
         config_override: Annotated[list[str], typer.Option('--config-override', '-D')] = (),
+        loop: Annotated[str, typer.Option(help="event loop: auto, asyncio or uvloop")] = None,
+        profile: Annotated[list[str], typer.Option(
+            help="start profiling right away: stacks and/or slow; toggle later with SIGUSR1/SIGUSR2")] = (),
 ):
     cd = Path(cd)
     config = load_config(cd)
@@ -334,6 +496,12 @@ def main(
         init_logging(config)
     if sentry:
         init_sentry(config)
+    if 'rate_limit' in config:
+        init_rate_limit(config)
+    if 'metrics' in config:
+        init_metrics(config)
+    init_runner(config, loop)
+    init_profiling(profile)
     if 0 < remote_debug_with_port < 65536:
         import pdb_attach
         pdb_attach.listen(remote_debug_with_port)
@@ -3,9 +3,12 @@ from typing import Annotated
 from pydantic import Field
 
 from ._b_base import BilibiliClientABC, BilibiliApiError
+from ._dedup import EventDeduper, TaggedCommand, dup_of, shared_event_deduper
 from ._livebase import LiveClientABC, HandlerInterface
 from .bilibili import BilibiliUnauthorizedClient, BilibiliCookieClient, BilibiliClient
+from .dynamic_feed import DynamicFeedScheduler, shared_dynamic_feed
 from .openlive import OpenLiveClient
+from .status_poller import LiveStatusPoller, shared_status_poller
 from .testing import MockClient, MockBilibiliClient
 from .wsweb import WSWebCookieLiveClient
 
@@ -19,4 +22,7 @@ __all__ = (
     'OpenLiveClient', 'WSWebCookieLiveClient', 'MockClient',
     'LiveClient',
     'BilibiliApiError',
+    'LiveStatusPoller', 'shared_status_poller',
+    'DynamicFeedScheduler', 'shared_dynamic_feed',
+    'EventDeduper', 'TaggedCommand', 'dup_of', 'shared_event_deduper',
 )
@@ -17,11 +17,14 @@ from bilibili_api import user, Credential
 from pydantic import BaseModel, TypeAdapter
 
 from ubw.models.bilibili import *
+from ._cache import api_cache, cached_api
+from ._ratelimit import Priority, rate_limited
 
 ROOM_INIT_URL = 'https://api.live.bilibili.com/xlive/web-room/v1/index/getInfoByRoom'
 DANMAKU_SERVER_CONF_URL = 'https://api.live.bilibili.com/xlive/web-room/v1/index/getDanmuInfo'
 EMOTICON_URL = 'https://api.live.bilibili.com/xlive/web-ucenter/v2/emoticon/GetEmoticons'
 FINGER_SPI_URL = 'https://api.bilibili.com/x/frontend/finger/spi'
+STATUS_INFO_BY_UIDS_URL = 'https://api.live.bilibili.com/room/v1/Room/get_status_info_by_uids'
 ROOM_PLAY_INFO_URL = 'https://api.live.bilibili.com/xlive/app-room/v2/index/getRoomPlayInfo'
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/118.0.0.0 Safari/537.36"
 
@@ -52,7 +55,9 @@ def _get_type_adapter(type_):
 
 
 class BilibiliApiError(Exception):
-    pass
+    def __init__(self, *args, code: int | None = None):
+        super().__init__(*args)
+        self.code = code
 
 
 class BilibiliClientABC(BaseModel, abc.ABC):
@@ -61,6 +66,12 @@ class BilibiliClientABC(BaseModel, abc.ABC):
 
     user_agent: str = USER_AGENT
     try_limit: int = 3
+    cache_ttl: dict[str, float] = {
+        'get_info_by_room': 10,
+        'get_danmaku_server': 60,
+        'get_emoticons': 3600,
+        'get_account_info': 600,
+    }
 
     _session: aiohttp.ClientSession | None = None
     _credential: Credential | None = None
@@ -112,7 +123,7 @@ class BilibiliClientABC(BaseModel, abc.ABC):
                     logger.debug(f"successfully get {url!r} {kwargs!r}")
                     return data.data
                 else:
-                    raise BilibiliApiError(data.message)
+                    raise BilibiliApiError(data.message, code=data.code)
         except Exception as e:  # TODO: only capture retry-able exceptions
             if isinstance(e, pydantic.ValidationError):  # this cannot be solved by retry
                 raise
@@ -137,7 +148,7 @@ class BilibiliClientABC(BaseModel, abc.ABC):
                     logger.debug(f"successfully get {url!r} {kwargs!r}")
                     return data['data']
                 else:
-                    raise BilibiliApiError(data['message'])
+                    raise BilibiliApiError(data['message'], code=data['code'])
         except Exception as e:  # TODO: only capture retry-able exceptions
             if (try_count := _try_count.get()) < self.try_limit:
                 _try_count.set(try_count + 1)
@@ -145,24 +156,40 @@ class BilibiliClientABC(BaseModel, abc.ABC):
             logger.exception(f"Bilibili API Error on get {url!r} {kwargs!r}", exc_info=e)
             raise
 
+    def _cache_key(self, endpoint: str, args: tuple, kwargs: dict) -> tuple:
+        """API 缓存的 key；带上账号（SESSDATA 的摘要），登录不同账号的 client 不共享 token 等结果"""
+        sessdata = self._credential.sessdata if self._credential is not None else None
+        account = hashlib.sha256(sessdata.encode()).hexdigest()[:16] if sessdata else None
+        return endpoint, self.auth_type, account, args, tuple(sorted(kwargs.items()))
+
+    def invalidate_cache(self, endpoint: str, *args, **kwargs):
+        api_cache.invalidate(self._cache_key(endpoint, args, kwargs))
+
+    @cached_api('get_info_by_room')
+    @rate_limited('get_info_by_room')
     async def get_info_by_room(self, room_id: int) -> InfoByRoom:
         credential = await self.get_credential()
         from bilibili_api import live
         r = live.LiveRoom(room_display_id=room_id, credential=credential)
         return InfoByRoom.model_validate(await r.get_room_info())
 
+    @rate_limited('get_info_by_room_raw')
     async def get_info_by_room_raw(self, room_id: int):
         credential = await self.get_credential()
         from bilibili_api import live
         r = live.LiveRoom(room_display_id=room_id, credential=credential)
         return await r.get_room_info()
 
+    @cached_api('get_danmaku_server')
+    @rate_limited('get_danmaku_server', Priority.CRITICAL)
     async def get_danmaku_server(self, room_id: int) -> DanmuInfo:
         credential = await self.get_credential()
         from bilibili_api import live
         r = live.LiveRoom(room_display_id=room_id, credential=credential)
         return DanmuInfo.model_validate(await r.get_danmu_info())
 
+    @cached_api('get_emoticons')
+    @rate_limited('get_emoticons')
     async def get_emoticons(self, room_id: int, platform: str = 'pc') -> RoomEmoticons:
         async with (await self.get_session()).get(EMOTICON_URL,
                                                   params={'platform': platform, 'id': room_id}) as res:
@@ -170,16 +197,29 @@ class BilibiliClientABC(BaseModel, abc.ABC):
             if data.code == 0:
                 return data.data
             else:
-                raise BilibiliApiError(data.message)
+                raise BilibiliApiError(data.message, code=data.code)
+
+    @rate_limited('get_status_info_by_uids')
+    async def get_status_info_by_uids(self, uids: list[int], *,
+                                      url: str = STATUS_INFO_BY_UIDS_URL) -> dict[int, StatusInfo]:
+        """一次请求获取多个主播的直播状态，单次请求建议不超过 100 个 uid"""
+        async with (await self.get_session()).post(url, json={'uids': list(uids)}) as res:
+            data = Response[dict[int, StatusInfo] | list].model_validate(await res.json())
+            if data.code == 0:
+                return data.data if isinstance(data.data, dict) else {}  # nothing found results in `[]`
+            else:
+                raise BilibiliApiError(data.message, code=data.code)
 
+    @rate_limited('get_finger_spi')
     async def get_finger_spi(self, ) -> FingerSPI:
         async with (await self.get_session()).get(FINGER_SPI_URL) as res:
             data = Response[FingerSPI].model_validate(await res.json())
             if data.code == 0:
                 return data.data
             else:
-                raise BilibiliApiError(data.message)
+                raise BilibiliApiError(data.message, code=data.code)
 
+    @rate_limited('get_room_play_info', Priority.CRITICAL)
     async def get_room_play_info(self, room_id: int, quality: int = 10000) -> RoomPlayInfo:
         async with (await self.get_session()).get(ROOM_PLAY_INFO_URL, params={
             'build': 6215200,
@@ -203,8 +243,9 @@ class BilibiliClientABC(BaseModel, abc.ABC):
             if data.code == 0:
                 return data.data
             else:
-                raise BilibiliApiError(data.message)
+                raise BilibiliApiError(data.message, code=data.code)
 
+    @rate_limited('get_dynamic', Priority.BULK)
     async def get_dynamic(self, dynamic_id: int | str, features: list[str] = ()) -> Dynamic:
         async with (await self.get_session()).get('https://api.bilibili.com/x/polymer/web-dynamic/v1/detail',
                                                   params={'id': dynamic_id, 'features': ','.join(features)}, ) as res:
@@ -213,8 +254,10 @@ class BilibiliClientABC(BaseModel, abc.ABC):
                 return data.data
             else:
                 request_info = res.request_info
-                raise BilibiliApiError(data.message)
+                raise BilibiliApiError(data.message, code=data.code)
 
+    @cached_api('get_account_info')
+    @rate_limited('get_account_info')
     async def get_account_info(self, uid: int, ) -> AccountInfo:
         credential = await self.get_credential()
         u = user.User(uid=uid, credential=credential)
@@ -236,14 +279,16 @@ class BilibiliClientABC(BaseModel, abc.ABC):
         params["w_rid"] = hashlib.md5(ek.encode(encoding="utf-8")).hexdigest()
         return params
 
+    @rate_limited('get_nav')
     async def get_nav(self) -> Nav:
         async with (await self.get_session()).get("https://api.bilibili.com/x/web-interface/nav") as res:
             data = Response[Nav].model_validate(await res.json())
             if data.code == 0:
                 return data.data
             else:
-                raise BilibiliApiError(data.message)
+                raise BilibiliApiError(data.message, code=data.code)
 
+    @rate_limited('get_user_dynamic', Priority.BULK)
     async def get_user_dynamic(self, uid, offset="") -> OffsetList[DynamicItem]:
         credential = await self.get_credential()
         u = user.User(uid=uid, credential=credential)
@@ -279,43 +324,50 @@ class BilibiliClientABC(BaseModel, abc.ABC):
                 offset = dd.offset
 
         async def future(dd):
+            known = {it.id_str for it in dd.items}
+            future_p = max((it.pub_date for it in dd.items), default=None)
             while True:
-                future_p = max(it.pub_date for it in dd.items) if dd.items else None
+                await asyncio.sleep(poll_interval.total_seconds())
                 jj = []
-                fetch_more = True
                 offset = ""
-                while fetch_more:
+                while True:
                     dd = await self.get_user_dynamic(uid, offset=offset)
-                    extends = dd.items if future_p is None else [it for it in dd.items if it.pub_date > future_p]
+                    extends = [it for it in dd.items if it.id_str not in known and (
+                            future_p is None or it.pub_date > future_p)]
                     jj.extend(extends)
-                    if len(extends) < len(dd.items):
-                        fetch_more = False
-                    else:
-                        offset = dd.offset
+                    # 遇到已知动态即停止翻页，而不是翻到头
+                    if len(extends) < len(dd.items) or not dd.has_more:
+                        break
+                    offset = dd.offset
                 for item in sorted(jj, key=lambda it: it.pub_date):
+                    known.add(item.id_str)
+                    future_p = item.pub_date if future_p is None else max(future_p, item.pub_date)
                     yield item
-                await asyncio.sleep(poll_interval.total_seconds())
 
         return past(d), future(d)
 
+    @rate_limited('get_video_pagelist', Priority.BULK)
     async def get_video_pagelist(self, bvid):
         from bilibili_api import video
         credential = await self.get_credential()
         v = video.Video(bvid=bvid, credential=credential)
         return _get_type_adapter(list[VideoP]).validate_python(await v.get_pages())
 
+    @rate_limited('get_video_download', Priority.BULK)
     async def get_video_download(self, bvid, cid):
         from bilibili_api import video
         credential = await self.get_credential()
         v = video.Video(bvid=bvid, credential=credential)
         return VideoPlayInfo.model_validate(await v.get_download_url(cid=cid))
 
+    @rate_limited('get_video_download_raw', Priority.BULK)
     async def get_video_download_raw(self, bvid, cid):
         from bilibili_api import video
         credential = await self.get_credential()
         v = video.Video(bvid=bvid, credential=credential)
         return await v.get_download_url(cid=cid)
 
+    @rate_limited('get_history_danmaku')
     async def get_history_danmaku(self, room_id):
         async with (await self.get_session()).get(
                 f"https://api.live.bilibili.com/xlive/web-room/v1/dM/gethistory?roomid={room_id}&room_type=0") as res:
@@ -323,7 +375,7 @@ class BilibiliClientABC(BaseModel, abc.ABC):
             if data.code == 0:
                 return data.data
             else:
-                raise BilibiliApiError(data.message)
+                raise BilibiliApiError(data.message, code=data.code)
 
     async def iter_live_danmaku(self, room_id, history=False, connect=True):
         if history:
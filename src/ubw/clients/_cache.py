@@ -0,0 +1,99 @@
+import asyncio
+import time
+from functools import wraps
+from typing import Any, Awaitable, Callable, Hashable
+
+from .. import metrics
+
+__all__ = ('TTLCache', 'api_cache', 'cached_api',)
+
+
+class TTLCache:
+    """带过期时间的缓存，同一个 key 同时只会有一个请求在飞（single-flight），其余调用者共享结果。"""
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._data: dict[Hashable, tuple[float, Any]] = {}
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: Hashable, default=None):
+        try:
+            expire, value = self._data[key]
+        except KeyError:
+            return default
+        if expire < time.monotonic():
+            del self._data[key]
+            return default
+        return value
+
+    def set(self, key: Hashable, value, ttl: float):
+        if len(self._data) >= self.maxsize:
+            self.purge()
+            if len(self._data) >= self.maxsize:
+                del self._data[next(iter(self._data))]
+        self._data[key] = (time.monotonic() + ttl, value)
+
+    def invalidate(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def purge(self):
+        now = time.monotonic()
+        for key in [key for key, (expire, _) in self._data.items() if expire < now]:
+            del self._data[key]
+
+    def clear(self):
+        self._data.clear()
+
+    async def get_or_fetch(self, key: Hashable, ttl: float, fetch: Callable[[], Awaitable]):
+        sentinel = object()
+        if (value := self.get(key, sentinel)) is not sentinel:
+            self.hits += 1
+            return value
+        if (task := self._inflight.get(key)) is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = self._inflight[key] = asyncio.create_task(self._fetch(key, ttl, fetch))
+        # 某个调用者被取消不应影响其他等待者
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key, ttl, fetch):
+        try:
+            value = await fetch()
+            self.set(key, value, ttl)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        return {'size': len(self._data), 'inflight': len(self._inflight),
+                'hits': self.hits, 'misses': self.misses, 'coalesced': self.coalesced}
+
+
+api_cache = TTLCache()
+metrics.registry.register_stats('api_cache', api_cache.stats)
+
+
+def cached_api(endpoint: str):
+    """按 ``self.cache_ttl[endpoint]`` 缓存 API 调用结果，TTL 不为正数时直接调用；不同账号分开缓存"""
+
+    def decorator(f):
+        @wraps(f)
+        async def wrapper(self, *args, **kwargs):
+            ttl = self.cache_ttl.get(endpoint, 0)
+            if ttl <= 0:
+                return await f(self, *args, **kwargs)
+            await self.get_credential()  # key 里的账号取自 credential
+            key = self._cache_key(endpoint, args, kwargs)
+            return await api_cache.get_or_fetch(key, ttl, lambda: f(self, *args, **kwargs))
+
+        wrapper.endpoint = endpoint
+        return wrapper
+
+    return decorator
@@ -0,0 +1,145 @@
+"""跨房间的事件去重
+
+联动直播（``COLLABORATION_LIVE_*``）和镜像弹幕（``DANMU_MSG_MIRROR``）会把同一个事件发给每个参与的房间，
+同时监听这些房间时，每个 handler 都要处理、保存 N 遍。进程内所有 client 共用一个 ``EventDeduper``，
+在分发给 handler（校验之前）用原始 dict 算出事件标识，*window* 内由 **其他房间** 先收到过的标识视为重复；
+同一房间开多个 client（比如一个存原始数据、一个存弹幕）时，每个 client 都照常收到。
+
+默认只打标记，不丢弃：标记放在 :class:`TaggedCommand` 的属性上，不写进原始 dict，原样保存时不会多出
+B 站没有发的字段；校验后的 model 上是 ``dup_of``。保存类的 handler（saver、dump_raw、事件归档）跳过重复事件，
+显示类的 handler 由自己决定。
+
+标识按以下顺序取：
+
+- 弹幕（含镜像）：``extra.id_str``，没有时用 (uid, 发送时间, rnd)，与 cmd 无关，镜像和原弹幕算同一个事件
+- 顶层 ``msg_id``
+- ``data.id_str`` / ``data.msg_id``
+- ``COLLABORATION_LIVE_*``：整个 ``data``；这些是全队共享的状态快照，*window* 内重复推送的相同数值也一并去掉
+
+都取不到的（心跳、各房间自己的消息等）不去重。
+"""
+import json
+import logging
+import re
+import time
+from datetime import timedelta
+from functools import cached_property
+from typing import Hashable, Literal
+
+from pydantic import BaseModel
+
+from .. import metrics
+
+__all__ = ('EventDeduper', 'TaggedCommand', 'dup_of', 'event_identity', 'shared_event_deduper',)
+
+logger = logging.getLogger('ubw.clients.dedup')
+
+_ID_STR = re.compile(r'"id_str":"(\w+)"')
+
+
+class TaggedCommand(dict):
+    """带去重标记的 command，内容与收到的完全一致
+
+    :var dup_of: 最先收到同一事件的房间号
+    """
+    __slots__ = ('dup_of',)
+
+    def __init__(self, command: dict, dup_of: int):
+        super().__init__(command)
+        self.dup_of = dup_of
+
+
+def dup_of(command: dict) -> int | None:
+    """command 是其他房间先收到过的事件时返回那个房间号"""
+    return getattr(command, 'dup_of', None)
+
+
+def event_identity(command: dict) -> Hashable | None:
+    cmd = command.get('cmd', '')
+    if (pos := cmd.find(':')) != -1:
+        cmd = cmd[:pos]
+    if cmd in ('DANMU_MSG', 'DANMU_MSG_MIRROR'):
+        try:
+            info = command['info']
+            meta = info[0]
+            if isinstance(extra := meta[15].get('extra'), str) and (m := _ID_STR.search(extra)):
+                return 'danmaku', m[1]
+            return 'danmaku', info[2][0], meta[4], meta[5]
+        except (KeyError, IndexError, TypeError, AttributeError):
+            return None
+    if msg_id := command.get('msg_id'):
+        return cmd, msg_id
+    data = command.get('data')
+    if isinstance(data, dict):
+        if ident := data.get('id_str') or data.get('msg_id'):
+            return cmd, ident
+        if cmd.startswith('COLLABORATION_LIVE_'):
+            return cmd, json.dumps(data, sort_keys=True, ensure_ascii=False)
+    return None
+
+
+class EventDeduper(BaseModel):
+    """
+    :var mode: ``drop`` 直接丢弃重复事件；``tag`` 照常分发 :class:`TaggedCommand`，
+        handler 可用 :func:`dup_of` 或 ``model.dup_of`` 自行决定
+    """
+    window: timedelta = timedelta(seconds=30)
+    max_entries: int = 1 << 17
+    mode: Literal['drop', 'tag'] = 'tag'
+
+    # runtime
+    _duplicates: int = 0
+    _evicted: int = 0
+
+    @cached_property
+    def _seen(self) -> dict[Hashable, tuple[float, int]]:
+        """标识 -> (首次收到的 monotonic 时间, 房间号)，按首次收到的先后排列"""
+        return {}
+
+    def _expire(self, now: float):
+        deadline = now - self.window.total_seconds()
+        seen = self._seen
+        while seen:
+            key = next(iter(seen))
+            if seen[key][0] >= deadline:
+                break
+            del seen[key]
+
+    def check(self, room_id: int, command: dict) -> int | None:
+        """首次出现或最先由本房间收到返回 ``None``，其他房间先收到的返回那个房间号"""
+        if (key := event_identity(command)) is None:
+            return None
+        now = time.monotonic()
+        self._expire(now)
+        if (first := self._seen.get(key)) is not None:
+            if first[1] == room_id:
+                return None
+            self._duplicates += 1
+            return first[1]
+        self._seen[key] = (now, room_id)
+        if len(self._seen) > self.max_entries:
+            del self._seen[next(iter(self._seen))]
+            self._evicted += 1
+        return None
+
+    def filter(self, room_id: int, command: dict) -> dict | None:
+        """按 *mode* 处理，返回要分发的 command，丢弃时返回 ``None``"""
+        if (first := self.check(room_id, command)) is None:
+            return command
+        if self.mode == 'drop':
+            return None
+        return TaggedCommand(command, first)
+
+    def stats(self) -> dict:
+        return {'tracked': len(self._seen), 'duplicates': self._duplicates, 'evicted': self._evicted}
+
+
+_shared: EventDeduper | None = None
+
+
+def shared_event_deduper() -> EventDeduper:
+    global _shared
+    if _shared is None:
+        _shared = EventDeduper()
+        metrics.registry.register_stats('dedup', _shared.stats)
+    return _shared
@@ -0,0 +1,197 @@
+import asyncio
+import enum
+import heapq
+import itertools
+import logging
+import time
+from contextlib import asynccontextmanager
+from functools import wraps
+
+import aiohttp
+
+from .. import metrics
+
+__all__ = ('Priority', 'TokenBucket', 'RateLimiter', 'rate_limiter', 'rate_limited', 'is_risk_control',)
+
+logger = logging.getLogger('ubw.clients._ratelimit')
+
+RISK_CONTROL_CODES = frozenset({-352, -412})
+
+
+class Priority(enum.IntEnum):
+    """数值越小越优先"""
+    CRITICAL = 0  # 维持直播连接所必须，如弹幕服务器 token
+    NORMAL = 1
+    BULK = 2  # 下载、动态扫描、收藏夹翻页等批量任务
+
+
+def is_risk_control(e: BaseException) -> bool:
+    """412 状态码与 -352/-412 返回码都是风控"""
+    if isinstance(e, aiohttp.ClientResponseError):
+        return e.status == 412
+    if getattr(e, 'status', None) == 412:  # bilibili_api.exceptions.NetworkException
+        return True
+    return getattr(e, 'code', None) in RISK_CONTROL_CODES
+
+
+class TokenBucket:
+    """按优先级排队的令牌桶，速率以 AIMD 方式调整：成功时线性回升，风控时减半并冷却一段时间。
+
+    :var rate: 当前每秒补充的令牌数
+    :var burst: 桶容量
+    """
+
+    def __init__(self, name: str, rate: float, burst: float = 1, *,
+                 min_rate: float = 0.05, increase: float = 0.05, decrease: float = 0.5, cooldown: float = 30):
+        self.name = name
+        self.max_rate = self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._timer: asyncio.TimerHandle | None = None
+
+        # stats
+        self.acquired = 0
+        self.throttled = 0
+        self.wait_sum = {p: 0. for p in Priority}
+        self.wait_count = {p: 0 for p in Priority}
+        self.wait_max = 0.
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _dispatch(self):
+        self._timer = None
+        now = time.monotonic()
+        self._refill(now)
+        while self._waiters and now >= self._paused_until:
+            if self._waiters[0][2].done():  # cancelled
+                heapq.heappop(self._waiters)
+                continue
+            if self._tokens < 1:
+                break
+            self._tokens -= 1
+            heapq.heappop(self._waiters)[2].set_result(None)
+        if self._waiters:
+            delay = max(self._paused_until - now, (1 - self._tokens) / self.rate, 0)
+            self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    async def acquire(self, priority: Priority = Priority.NORMAL):
+        start = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        if self._timer is None:
+            self._dispatch()
+        await future
+        waited = time.monotonic() - start
+        self.acquired += 1
+        self.wait_sum[priority] += waited
+        self.wait_count[priority] += 1
+        self.wait_max = max(self.wait_max, waited)
+        return waited
+
+    def reward(self):
+        self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def penalize(self):
+        self.throttled += 1
+        self.rate = max(self.min_rate, self.rate * self.decrease)
+        self._paused_until = time.monotonic() + self.cooldown
+        self._tokens = 0
+        logger.warning(f'bucket {self.name} hit risk control, rate lowered to {self.rate:.3f}/s, '
+                       f'paused for {self.cooldown}s')
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for _, _, f in self._waiters if not f.done())
+
+    def stats(self) -> dict:
+        return {
+            'rate': self.rate, 'queued': self.queued, 'acquired': self.acquired, 'throttled': self.throttled,
+            'wait_max': self.wait_max,
+            'wait_avg': {p.name: self.wait_sum[p] / self.wait_count[p] if self.wait_count[p] else 0. for p in Priority},
+        }
+
+
+class RateLimiter:
+    """进程级限流器：每个 endpoint 一个桶，另有一个全局桶，二者均需取得令牌"""
+
+    DEFAULTS: dict[str, dict] = {
+        'global': {'rate': 10, 'burst': 20},
+        'default': {'rate': 5, 'burst': 10},
+        'get_user_dynamic': {'rate': 1, 'burst': 3},
+        'get_video_download': {'rate': 2, 'burst': 4},
+        'get_status_info_by_uids': {'rate': 1, 'burst': 2},
+        'get_fav_list': {'rate': 1, 'burst': 3},
+    }
+
+    def __init__(self, config: dict[str, dict] | None = None):
+        self.config = {**self.DEFAULTS, **(config or {})}
+        self.buckets: dict[str, TokenBucket] = {}
+
+    def configure(self, config: dict[str, dict]):
+        self.config.update(config)
+        for name in config:
+            self.buckets.pop(name, None)
+        if 'default' in config:
+            self.buckets.clear()
+
+    def bucket(self, name: str) -> TokenBucket:
+        if (b := self.buckets.get(name)) is None:
+            b = self.buckets[name] = TokenBucket(name, **self.config.get(name, self.config['default']))
+        return b
+
+    @asynccontextmanager
+    async def limit(self, endpoint: str, priority: Priority = Priority.NORMAL):
+        bucket = self.bucket(endpoint)
+        global_bucket = self.bucket('global')
+        await bucket.acquire(priority)
+        await global_bucket.acquire(priority)
+        try:
+            yield
+        except Exception as e:
+            if is_risk_control(e):
+                bucket.penalize()
+                global_bucket.penalize()
+            raise
+        else:
+            bucket.reward()
+            global_bucket.reward()
+
+    def stats(self) -> dict[str, dict]:
+        return {name: b.stats() for name, b in self.buckets.items()}
+
+
+rate_limiter = RateLimiter()
+metrics.registry.register_stats('rate_limit', rate_limiter.stats, label='bucket')
+
+
+def rate_limited(endpoint: str, priority: Priority = Priority.NORMAL):
+    seconds = metrics.api_seconds.labels(endpoint)
+    errors = metrics.api_errors.labels(endpoint)
+
+    def decorator(f):
+        @wraps(f)
+        async def wrapper(*args, **kwargs):
+            async with rate_limiter.limit(endpoint, priority):
+                start = time.perf_counter()
+                try:
+                    return await f(*args, **kwargs)
+                except Exception:
+                    errors.inc()
+                    raise
+                finally:
+                    seconds.observe(time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
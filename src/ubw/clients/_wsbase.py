@@ -3,13 +3,17 @@ import asyncio
 import json
 import logging
 import struct
-from functools import partial
+import time
+from functools import partial, cached_property
 from typing import AsyncGenerator, Any
 
 import aiohttp
 import brotli
+from pydantic import Field
 
+from ._dedup import EventDeduper, shared_event_deduper
 from ._livebase import *
+from .. import metrics
 
 __all__ = (
     # types
@@ -41,12 +45,28 @@ class YieldRestBytes(BaseException):
 
 
 class WSMessageParserMixin(LiveClientABC, abc.ABC):
+    # DI
+    deduper: EventDeduper | None = Field(default_factory=shared_event_deduper, exclude=True)
+
+    @cached_property
+    def _metrics_room(self):
+        room = str(self.room_id)
+        return room, metrics.ws_messages.labels(room), metrics.ws_bytes.labels(room)
+
+    @cached_property
+    def _metrics_cmds(self) -> dict[str, tuple]:
+        """cmd -> (条数, 字节数) 子指标，每个 cmd 只查找一次标签"""
+        return {}
+
     async def _on_ws_message(self, message: aiohttp.WSMessage):
         """
         收到websocket消息
 
         :param message: websocket消息
         """
+        _, messages, received = self._metrics_room
+        messages.inc()
+        received.inc(len(message.data))
         try:
             await self._parse_ws_message(message.data)
         except (asyncio.CancelledError, AuthError):  # pragma: no cover
@@ -70,13 +90,18 @@ class WSMessageParserMixin(LiveClientABC, abc.ABC):
                 body: bytes = pack[offset + header.raw_header_size:offset + header.pack_len]
                 offset += header.pack_len
                 if header.ver == ProtoVer.BROTLI:
+                    start = time.perf_counter()
                     body_decoded = await asyncio.to_thread(partial(brotli.decompress, body))
+                    metrics.decompress_seconds.observe(time.perf_counter() - start)
                     async for header, body in self._iter_pack(body_decoded):
                         yield header, body
                 elif header.ver == ProtoVer.NORMAL:
                     if body:
                         try:
-                            yield header, json.loads(body.decode('utf-8'))
+                            start = time.perf_counter()
+                            decoded = json.loads(body.decode('utf-8'))
+                            metrics.parse_seconds.observe(time.perf_counter() - start)
+                            yield header, decoded
                         except Exception as e:  # pragma: no cover, not reachable
                             logger.error(f'room={self.room_id} ProtoVer.NORMAL json error\n{body = }\n{e = }')
                             yield header, body
@@ -105,7 +130,7 @@ class WSMessageParserMixin(LiveClientABC, abc.ABC):
         it = self._iter_pack(data)
         async for header, body in it:
             if header.operation == Operation.SEND_MSG_REPLY:
-                await self._handle_command(body)
+                await self._handle_command(body, header.pack_len - header.raw_header_size)
             elif header.operation == Operation.AUTH_REPLY:
                 assert body[1] == b''
                 body = body[0]
@@ -125,12 +150,24 @@ class WSMessageParserMixin(LiveClientABC, abc.ABC):
                 logger.warning('room=%d unknown message operation=%d, header=%s, body=%s', self.room_id,
                                header.operation, header, body)
 
-    async def _handle_command(self, command: dict):
+    async def _handle_command(self, command: dict, size: int = 0):
         """
         解析并处理业务消息
 
         :param command: 业务消息
+        :param size: 业务消息解压后的字节数
         """
+        cmd = command.get('cmd', '')
+        try:
+            count, received = self._metrics_cmds[cmd]
+        except KeyError:
+            room = self._metrics_room[0]
+            count, received = self._metrics_cmds[cmd] = (metrics.commands.labels(room, cmd),
+                                                         metrics.command_bytes.labels(room, cmd))
+        count.inc()
+        received.inc(size)
+        if self.deduper is not None and (command := self.deduper.filter(self.room_id, command)) is None:
+            return
         # 外部代码可能不能正常处理取消，所以这里加shield
         results = await asyncio.shield(
             asyncio.gather(
@@ -0,0 +1,236 @@
+import asyncio
+import heapq
+import logging
+import random
+import time
+from datetime import datetime, timedelta
+from functools import cached_property
+from typing import Awaitable, Callable
+
+from pydantic import BaseModel, Field, SkipValidation
+
+from .bilibili import BilibiliClient, BilibiliCookieClient
+from .. import metrics
+from ..models.bilibili import DynamicItem
+
+__all__ = ('DynamicFeedScheduler', 'FeedState', 'FeedCallback', 'shared_dynamic_feed',)
+
+logger = logging.getLogger('ubw.clients.dynamic_feed')
+
+FeedCallback = Callable[[list[DynamicItem]], Awaitable]
+
+
+class FeedState(BaseModel):
+    """单个 uid 的抓取状态
+
+    :var interval: 当前轮询间隔（秒），随发动态的频率自适应
+    :var due: 下次轮询的 monotonic 时间
+    :var known: 已见过的 id_str，按插入顺序保留最近若干条
+    :var newest: 已见过的最新非置顶动态时间
+    :var latest: 最近一次抓到的第一页，供后来的订阅者作为历史消息
+    """
+    interval: float
+    due: float = 0.
+    known: dict[str, None] = Field(default_factory=dict)
+    newest: datetime | None = None
+    latest: SkipValidation[list[DynamicItem]] = Field(default_factory=list)  # already validated by the client
+
+
+class DynamicFeedScheduler(BaseModel):
+    """多个 uid 共享的动态轮询调度器
+    每个 uid 独立计算间隔并加入随机抖动，避免大量 uid 在同一时刻请求；
+    翻页遇到已知的 id_str 即停止，新动态按时间顺序发给该 uid 的订阅者。
+    """
+    min_interval: timedelta = timedelta(seconds=60)
+    max_interval: timedelta = timedelta(minutes=30)
+    jitter: float = 0.2
+    backoff: float = 1.5
+    max_pages: int = 5
+    known_size: int = 200
+
+    # DI
+    bilibili_client: BilibiliClient = Field(default_factory=BilibiliCookieClient)
+    bilibili_client_owner: bool = True
+
+    # states
+    feeds: dict[int, FeedState] = Field(default_factory=dict)
+
+    # runtime
+    _task: asyncio.Task | None = None
+    _polls: int = 0
+    _requests: int = 0
+    _new_items: int = 0
+
+    @cached_property
+    def _subscribers(self) -> dict[int, list[FeedCallback]]:
+        return {}
+
+    @cached_property
+    def _heap(self) -> list[tuple[float, int]]:
+        return []
+
+    @cached_property
+    def _wakeup(self) -> asyncio.Event:
+        return asyncio.Event()
+
+    async def subscribe(self, uid: int, callback: FeedCallback) -> list[DynamicItem]:
+        """订阅 uid 的新动态，返回当前第一页作为历史消息"""
+        callbacks = self._subscribers.setdefault(uid, [])
+        if callback not in callbacks:
+            callbacks.append(callback)
+        if uid not in self.feeds:
+            page = await self.bilibili_client.get_user_dynamic(uid)
+            self._requests += 1
+            if uid not in self.feeds:  # another subscriber may have finished first
+                state = FeedState(interval=self._initial_interval(page.items), latest=page.items)
+                self._remember(state, page.items)
+                # 首次轮询时间在一个间隔内均匀分布
+                self._schedule(uid, state, random.uniform(0, state.interval))
+                self.feeds[uid] = state
+        if self._task is None:
+            self._task = asyncio.create_task(self.t_poll())
+        return list(self.feeds[uid].latest)
+
+    def unsubscribe(self, uid: int, callback: FeedCallback):
+        callbacks = self._subscribers.get(uid, [])
+        try:
+            callbacks.remove(callback)
+        except ValueError:
+            pass
+        if not callbacks:
+            self._subscribers.pop(uid, None)
+            self.feeds.pop(uid, None)  # the heap entry is dropped lazily
+        if not self._subscribers and self._task is not None:
+            self._task.cancel('no subscriber')
+            self._task = None
+
+    async def stop(self):
+        task = self._task
+        self._task = None
+        if task is None:
+            return
+        task.cancel('stop')
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    async def close(self):
+        if self.bilibili_client_owner:
+            await self.bilibili_client.close()
+
+    async def stop_and_close(self):
+        try:
+            await self.stop()
+        finally:
+            await self.close()
+
+    def _clamp(self, interval: float) -> float:
+        return min(max(interval, self.min_interval.total_seconds()), self.max_interval.total_seconds())
+
+    def _initial_interval(self, items: list[DynamicItem]) -> float:
+        """以最近动态的平均间隔的 1/4 作为初始轮询间隔"""
+        dates = sorted(item.pub_date for item in items if not item.is_topped)
+        if len(dates) < 2:
+            return self.max_interval.total_seconds()
+        return self._clamp((dates[-1] - dates[0]).total_seconds() / (len(dates) - 1) / 4)
+
+    def _schedule(self, uid: int, state: FeedState, delay: float):
+        state.due = time.monotonic() + delay
+        heapq.heappush(self._heap, (state.due, uid))
+        self._wakeup.set()
+
+    def _remember(self, state: FeedState, items: list[DynamicItem]):
+        for item in items:
+            state.known[item.id_str] = None
+            if not item.is_topped and (state.newest is None or item.pub_date > state.newest):
+                state.newest = item.pub_date
+        while len(state.known) > self.known_size:
+            del state.known[next(iter(state.known))]
+
+    async def fetch_new(self, uid: int, state: FeedState) -> list[DynamicItem]:
+        """从第一页开始翻页，直到遇到已知动态"""
+        new_items = []
+        offset = ""
+        for page_no in range(self.max_pages):
+            page = await self.bilibili_client.get_user_dynamic(uid, offset)
+            self._requests += 1
+            if page_no == 0:
+                state.latest = page.items
+            reached_known = False
+            for item in page.items:
+                if item.is_topped:  # 置顶动态总在最前，不能作为停止依据
+                    if item.id_str not in state.known:
+                        new_items.append(item)
+                    continue
+                if item.id_str in state.known or state.newest is not None and item.pub_date <= state.newest:
+                    reached_known = True
+                    break
+                new_items.append(item)
+            if reached_known or not page.has_more:
+                break
+            offset = page.offset
+        return new_items
+
+    async def poll_uid(self, uid: int):
+        state = self.feeds[uid]
+        self._polls += 1
+        try:
+            new_items = await self.fetch_new(uid, state)
+        except Exception as e:
+            logger.exception(f'get_user_dynamic() failed for uid={uid}', exc_info=e)
+            return
+        if any(not item.is_topped for item in new_items):
+            state.interval = self._clamp(state.interval / self.backoff)
+        else:
+            state.interval = self._clamp(state.interval * self.backoff)
+        if not new_items:
+            return
+        self._remember(state, new_items)
+        self._new_items += len(new_items)
+        new_items.sort(key=lambda item: item.pub_date)
+        logger.debug(f'uid={uid} got {len(new_items)} new dynamic(s), next interval {state.interval:.0f}s')
+        for callback in list(self._subscribers.get(uid, ())):
+            try:
+                await callback(new_items)
+            except Exception as e:
+                logger.exception(f'exception in feed callback {callback!r}', exc_info=e)
+
+    async def t_poll(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            due, uid = self._heap[0]
+            state = self.feeds.get(uid)
+            if state is None or state.due != due:  # unsubscribed or rescheduled
+                heapq.heappop(self._heap)
+                continue
+            if (delay := due - time.monotonic()) > 0:
+                self._wakeup.clear()
+                try:  # an earlier entry may be pushed while sleeping
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._heap)
+            await self.poll_uid(uid)
+            if (state := self.feeds.get(uid)) is not None:
+                self._schedule(uid, state, state.interval * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def stats(self) -> dict:
+        return {'uids': len(self.feeds), 'polls': self._polls, 'requests': self._requests,
+                'new_items': self._new_items}
+
+
+_shared_dynamic_feed: DynamicFeedScheduler | None = None
+
+
+def shared_dynamic_feed() -> DynamicFeedScheduler:
+    """进程内共享的动态调度器；使用自己的 client，不随任何一个订阅的 app 关闭"""
+    global _shared_dynamic_feed
+    if _shared_dynamic_feed is None:
+        _shared_dynamic_feed = DynamicFeedScheduler()
+        metrics.registry.register_stats('dynamic_feed', _shared_dynamic_feed.stats)
+    return _shared_dynamic_feed
@@ -13,6 +13,7 @@ from pydantic import Field
 
 from ._b_base import BilibiliApiError, USER_AGENT
 from ._wsbase import *
+from .. import metrics
 from ..models import Response
 
 logger = logging.getLogger('open_live_client')
@@ -303,6 +304,7 @@ class OpenLiveClient(WSMessageParserMixin, LiveClientABC):
 
                 # 准备重连
                 retry_count += 1
+                metrics.ws_reconnects.labels(str(self.room_id)).inc()
                 logger.warning('room=%d is reconnecting, retry_count=%d', self.room_id, retry_count)
                 await asyncio.sleep(1)
         finally:
@@ -0,0 +1,153 @@
+import asyncio
+import logging
+from datetime import timedelta
+from functools import cached_property
+from typing import Awaitable, Callable
+
+from pydantic import BaseModel, Field
+
+from ._b_base import STATUS_INFO_BY_UIDS_URL
+from .bilibili import BilibiliClient, BilibiliUnauthorizedClient
+from ..models.bilibili import StatusInfo
+
+__all__ = ('LiveStatusPoller', 'StatusCallback', 'shared_status_poller',)
+
+logger = logging.getLogger('ubw.clients.status_poller')
+
+StatusCallback = Callable[[dict], Awaitable]
+
+
+class LiveStatusPoller(BaseModel):
+    """批量轮询直播状态
+    对比前后两次结果，向订阅者发送合成的 LIVE / PREPARING / ROOM_CHANGE 消息，
+    一次请求最多覆盖 *batch_size* 个 uid。
+
+    :var status: 最近一次获取到的状态，以 uid 为键
+    """
+    poll_interval: timedelta = timedelta(seconds=60)
+    batch_size: int = 100
+    url: str = STATUS_INFO_BY_UIDS_URL
+
+    # DI
+    bilibili_client: BilibiliClient = Field(default_factory=BilibiliUnauthorizedClient)
+    bilibili_client_owner: bool = True
+
+    # states
+    status: dict[int, StatusInfo] = Field(default_factory=dict)
+
+    # runtime
+    _task: asyncio.Task | None = None
+
+    @cached_property
+    def _subscribers(self) -> dict[int, list[StatusCallback]]:
+        return {}
+
+    def subscribe(self, uid: int, callback: StatusCallback):
+        callbacks = self._subscribers.setdefault(uid, [])
+        if callback not in callbacks:
+            callbacks.append(callback)
+        if self._task is None:
+            self._task = asyncio.create_task(self.t_poll())
+
+    def unsubscribe(self, uid: int, callback: StatusCallback):
+        callbacks = self._subscribers.get(uid, [])
+        try:
+            callbacks.remove(callback)
+        except ValueError:
+            pass
+        if not callbacks:
+            self._subscribers.pop(uid, None)
+            self.status.pop(uid, None)
+        if not self._subscribers and self._task is not None:
+            self._task.cancel('no subscriber')
+            self._task = None
+
+    async def stop(self):
+        task = self._task
+        self._task = None
+        if task is None:
+            return
+        task.cancel('stop')
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    async def close(self):
+        if self.bilibili_client_owner:
+            await self.bilibili_client.close()
+
+    async def stop_and_close(self):
+        try:
+            await self.stop()
+        finally:
+            await self.close()
+
+    @staticmethod
+    def diff(old: StatusInfo, new: StatusInfo) -> list[dict]:
+        """由两次状态推出合成消息，字段尽量与真实消息保持一致"""
+        commands = []
+        if (old.title, old.area_v2_id) != (new.title, new.area_v2_id):
+            commands.append({'cmd': 'ROOM_CHANGE', 'data': {
+                'title': new.title,
+                'area_id': new.area_v2_id,
+                'parent_area_id': new.area_v2_parent_id,
+                'area_name': new.area_v2_name,
+                'parent_area_name': new.area_v2_parent_name,
+                'live_key': '',
+                'sub_session_key': '',
+            }})
+        if not old.living and new.living:
+            commands.append({
+                'cmd': 'LIVE',
+                'roomid': new.room_id,
+                'live_key': '',
+                'voice_background': '',
+                'sub_session_key': '',
+                'live_platform': 'ubw_status_poller',
+                'live_model': 0,
+                'live_time': int(new.live_time.timestamp()) if new.live_time is not None else None,
+            })
+        elif old.living and not new.living:
+            commands.append({'cmd': 'PREPARING', 'roomid': new.room_id})
+        return commands
+
+    async def poll_once(self):
+        uids = list(self._subscribers)
+        for i in range(0, len(uids), self.batch_size):
+            batch = uids[i:i + self.batch_size]
+            try:
+                result = await self.bilibili_client.get_status_info_by_uids(batch, url=self.url)
+            except Exception as e:
+                logger.exception(f'get_status_info_by_uids() failed for {len(batch)} uids', exc_info=e)
+                continue
+            for uid, new in result.items():
+                if uid not in self._subscribers:  # unsubscribed while polling
+                    continue
+                old = self.status.get(uid)
+                self.status[uid] = new
+                if old is None:
+                    continue
+                for command in self.diff(old, new):
+                    logger.debug(f'uid={uid} room={new.room_id} polled {command["cmd"]}')
+                    for callback in list(self._subscribers.get(uid, ())):
+                        try:
+                            await callback(command)
+                        except Exception as e:
+                            logger.exception(f'exception in status callback {callback!r}', exc_info=e)
+
+    async def t_poll(self):
+        while True:
+            await self.poll_once()
+            await asyncio.sleep(self.poll_interval.total_seconds())
+
+
+_shared_status_poller: LiveStatusPoller | None = None
+
+
+def shared_status_poller() -> LiveStatusPoller:
+    """进程内共享的轮询器，供多个 app 合并请求"""
+    global _shared_status_poller
+    if _shared_status_poller is None:
+        _shared_status_poller = LiveStatusPoller()
+    return _shared_status_poller
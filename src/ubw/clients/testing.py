@@ -11,6 +11,7 @@ class MockBilibiliClient(BilibiliClientABC):
 
     read_cookie = cached_property(lambda self: AsyncMock(name='read_cookie'))
     make_session = cached_property(lambda self: Mock(name='make_session'))
+    make_credential = cached_property(lambda self: AsyncMock(name='make_credential'))
     close = cached_property(lambda self: AsyncMock(name='close'))
     __aenter__ = cached_property(lambda self: AsyncMock(name='__aenter__'))
 
@@ -18,16 +19,19 @@ class MockBilibiliClient(BilibiliClientABC):
     get_user_dynamic = cached_property(lambda self: AsyncMock(name='get_user_dynamic'))
     get_info_by_room = cached_property(lambda self: AsyncMock(name='get_info_by_room'))
     get_danmaku_server = cached_property(lambda self: AsyncMock(name='get_danmaku_server'))
+    get_room_play_info = cached_property(lambda self: AsyncMock(name='get_room_play_info'))
 
     if TYPE_CHECKING:
         read_cookie: AsyncMock
         make_session: Mock
+        make_credential: AsyncMock
         close: AsyncMock
         __aenter__: AsyncMock
         get_account_info: AsyncMock
         get_user_dynamic: AsyncMock
         get_info_by_room: AsyncMock
         get_danmaku_server: AsyncMock
+        get_room_play_info: AsyncMock
 
 
 class MockClient(LiveClientABC):
@@ -11,6 +11,7 @@ from pydantic import Field
 from . import BilibiliCookieClient
 from ._wsbase import *
 from .bilibili import BilibiliApiError, USER_AGENT, BilibiliClient
+from .. import metrics
 from ..models.bilibili import Host
 
 logger = logging.getLogger('ubw.clients.wsweb')
@@ -180,6 +181,7 @@ class WSWebCookieLiveClient(WSMessageParserMixin, LiveClientABC):
             except AuthError:
                 # 认证失败了，应该重新获取token再重连
                 logger.exception('room=%d auth failed, trying init_room() again', self.room_id)
+                self.bilibili_client.invalidate_cache('get_danmaku_server', self.room_id)
                 await self._init_room()
             except ssl_.SSLError:  # noqa
                 logger.error('room=%d a SSLError happened, cannot reconnect', self.room_id)
@@ -190,6 +192,7 @@ class WSWebCookieLiveClient(WSMessageParserMixin, LiveClientABC):
 
             # 准备重连
             retry_count += 1
+            metrics.ws_reconnects.labels(str(self.room_id)).inc()
             logger.warning('room=%d is reconnecting, retry_count=%d', self.room_id, retry_count)
             await asyncio.sleep(1.618 ** retry_count)
 
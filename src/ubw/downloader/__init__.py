@@ -1,2 +1,4 @@
 from .dynamic_downloader import DynamicDownloader
 from .video_downloader import VideoDownloader
+from .scheduler import DownloadPriority, DownloadScheduler, shared_download_scheduler
+from .asset_cache import AssetCache, shared_asset_cache
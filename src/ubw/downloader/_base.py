@@ -1,22 +1,78 @@
 import asyncio
 import logging
+import os
+import re
+import time
 from functools import cached_property
 from os import PathLike
 from pathlib import Path
-from typing import Coroutine, Any, TypeAlias
+from collections import deque
+from typing import Coroutine, Any, TypeAlias, Callable, Awaitable, AsyncIterator
 
 import aiofiles
+import aiofiles.os
 import aiohttp
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+from .scheduler import DownloadJob, DownloadPriority, DownloadScheduler, shared_download_scheduler
 
 PathList: TypeAlias = list[str | PathLike[str]]
+ProgressListener: TypeAlias = Callable[['DownloadProgress'], Any]
 logger = logging.getLogger('downloader')
 
+CONTENT_RANGE_RE = re.compile(r'bytes (\d+)-(\d+)/(\d+)')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+class Segment(BaseModel):
+    """闭区间 [start, end]，已写入 done 字节"""
+    start: int
+    end: int
+    done: int = 0
+
+    @property
+    def remaining(self) -> int:
+        return self.end - self.start + 1 - self.done
+
+
+class DownloadJournal(BaseModel):
+    """断点续传记录，与 ``<target>.part`` 一起保存在 ``<target>.part.json``
+
+    :var validator: 服务器给出的 ETag 或 Last-Modified，变化时放弃续传
+    """
+    size: int
+    validator: str | None = None
+    segments: list[Segment]
+
+    @property
+    def received(self) -> int:
+        return sum(s.done for s in self.segments)
+
+
+class DownloadProgress(BaseModel):
+    """:var speed: 本次调用的平均速度（字节/秒），不含续传前已有的部分"""
+    target: str
+    received: int
+    total: int | None
+    elapsed: float
+    speed: float
+    finished: bool = False
+
 
 class BaseDownloader(BaseModel):
     # low config
     out_dir: Path = Path('output/download')
     chunk_size: int = 1 * 1024 * 1024  # 1M
+    segment_size: int = 8 * 1024 * 1024  # 8M, files no larger than this are fetched by a single request
+    max_segments: int = 4  # concurrent connections per file
+    segment_retries: int = 3
+    progress_interval: float = 2.
+
+    # DI
+    scheduler: DownloadScheduler = Field(default_factory=shared_download_scheduler)
 
     async def __aenter__(self):
         return self
@@ -31,9 +87,14 @@ class BaseDownloader(BaseModel):
         logger.debug(f'created aiohttp session by BaseDownloader {session!r}')
         return session
 
-    async def download_file(self, url, target, *, get_kwargs=None, session=None) -> PathList:
+    @cached_property
+    def progress_listeners(self) -> list[ProgressListener]:
+        return []
+
+    async def download_file(self, url, target, *, get_kwargs=None, session=None,
+                            priority: DownloadPriority = DownloadPriority.DEFAULT) -> PathList:
         try:
-            return await self._download_file(url, target, get_kwargs=get_kwargs, session=session)
+            return await self._download_file(url, target, get_kwargs=get_kwargs, session=session, priority=priority)
         except Exception as e:
             logger.exception('exception in download_file()', exc_info=e)
             return []
@@ -41,18 +102,234 @@ class BaseDownloader(BaseModel):
             logger.exception('exception in download_file()', exc_info=e)
             raise
 
-    async def _download_file(self, url, target, *, get_kwargs=None, session=None) -> PathList:
-        self.out_dir.mkdir(parents=True, exist_ok=True)
-        async with (session or self._session).get(url, **(get_kwargs or {})) as resp:
-            async with aiofiles.open(self.out_dir / target, mode='wb') as f:
-                content_length = resp.content_length
-                received = 0
+    async def _download_file(self, url, target, *, get_kwargs=None, session=None,
+                             priority: DownloadPriority = DownloadPriority.DEFAULT) -> PathList:
+        """先请求第一个分段探测大小；服务器支持 Range 时其余分段并发下载，写入 ``.part`` 的对应偏移，
+        并在 ``.part.json`` 中记录进度，中断后再次调用会从记录处继续。
+        每个连接都要从 :attr:`scheduler` 取得名额。"""
+        job = self.scheduler.job(str(target), url, priority)
+        try:
+            return await self._download_job(url, target, job, get_kwargs=get_kwargs, session=session)
+        finally:
+            self.scheduler.finish(job)
+
+    async def _download_job(self, url, target, job: DownloadJob, *, get_kwargs=None, session=None) -> PathList:
+        session = session or self._session
+        get_kwargs = get_kwargs or {}
+        path = self.out_dir / target
+        path.parent.mkdir(parents=True, exist_ok=True)
+        part = path.with_name(path.name + '.part')
+        journal_path = path.with_name(path.name + '.part.json')
+        progress = _ProgressReporter(self, str(target), job)
+
+        journal = self._load_journal(journal_path, part)
+        if journal is None:
+            probe = Segment(start=0, end=self.segment_size - 1)
+        elif (probe := next((seg for seg in journal.segments if seg.remaining > 0), None)) is None:
+            return self._finish(part, path, journal_path, progress)
+        await self.scheduler.acquire(job)
+        probe_held = True
+
+        def release_probe():  # by whoever finishes with the probe response first
+            nonlocal probe_held
+            if probe_held:
+                probe_held = False
+                self.scheduler.release(job)
+
+        resp = None
+        try:
+            resp = await session.get(url, **_with_range(get_kwargs, probe.start + probe.done, probe.end))
+            if resp.status == 416 and journal is None:  # 空文件没有可请求的范围
+                resp.release()
+                resp = await session.get(url, **get_kwargs)
+            resp.raise_for_status()
+            if resp.status != 206:  # server ignored Range, fall back to a single stream
+                await self._download_whole(resp, part, progress)
+                return self._finish(part, path, journal_path, progress)
+            size = int(CONTENT_RANGE_RE.fullmatch(resp.headers['Content-Range']).group(3))
+            validator = resp.headers.get('ETag') or resp.headers.get('Last-Modified')
+            if journal is None or journal.size != size or journal.validator != validator:
+                if journal is not None:  # the probe was not for the new first segment
+                    logger.info(f'{target} changed on server, restart download')
+                    resp.release()
+                    resp = None
+                journal = DownloadJournal(size=size, validator=validator, segments=[
+                    Segment(start=start, end=min(start + self.segment_size, size) - 1)
+                    for start in range(0, size, self.segment_size)])
+                probe = journal.segments[0]
+                async with aiofiles.open(part, mode='wb') as f:
+                    await f.truncate(size)
+            else:
+                logger.info(f'{target} resuming from {journal.received}/{size}')
+            progress.total = size
+            progress.add(journal.received, baseline=True)
+
+            saver = _JournalSaver(journal, journal_path, self.progress_interval)
+            semaphore = asyncio.Semaphore(self.max_segments)
+
+            async def fetch(seg: Segment, r: aiohttp.ClientResponse | None = None):
+                async with semaphore, aiofiles.open(part, mode='r+b') as f:
+                    async def write(offset: int, chunk: bytes):
+                        await f.seek(offset)
+                        await f.write(chunk)
+                        await f.flush()  # journal must not claim bytes still buffered here
+                        await saver.tick()
+
+                    if r is not None:  # the probe, whose connection slot is already held
+                        try:
+                            await self._fetch_segment(session, url, get_kwargs, seg, progress, write, r)
+                        finally:
+                            release_probe()
+                        return
+                    async with self.scheduler.connection(job):
+                        await self._fetch_segment(session, url, get_kwargs, seg, progress, write)
+
+            try:
+                async with asyncio.TaskGroup() as tg:  # one failed segment cancels the others
+                    if resp is not None:
+                        tg.create_task(fetch(probe, resp))
+                    else:
+                        release_probe()
+                        tg.create_task(fetch(probe))
+                    for seg in journal.segments:
+                        if seg is not probe and seg.remaining > 0:
+                            tg.create_task(fetch(seg))
+            finally:
+                await saver.save()
+        finally:
+            if resp is not None:
+                resp.release()
+            release_probe()
+
+        if any(seg.remaining for seg in journal.segments):
+            raise RuntimeError(f'{target} incomplete after download')
+        return self._finish(part, path, journal_path, progress)
+
+    @staticmethod
+    def _finish(part: Path, path: Path, journal_path: Path, progress: '_ProgressReporter') -> PathList:
+        os.replace(part, path)
+        journal_path.unlink(missing_ok=True)
+        progress.finish()
+        return [progress.target]
+
+    @staticmethod
+    def _load_journal(journal_path: Path, part: Path) -> DownloadJournal | None:
+        if not journal_path.exists() or not part.exists() or part.stat().st_size == 0:
+            return None  # 空的 .part 没有可续传的内容，按新下载处理
+        try:
+            journal = DownloadJournal.model_validate_json(journal_path.read_bytes())
+        except ValueError as e:
+            logger.warning(f'ignored broken download journal {journal_path}: {e!r}')
+            return None
+        return journal if journal.size > 0 else None
+
+    async def _download_whole(self, resp: aiohttp.ClientResponse, part: Path, progress: '_ProgressReporter'):
+        progress.total = resp.content_length
+        async with aiofiles.open(part, mode='wb') as f:
+            async for chunk in resp.content.iter_chunked(self.chunk_size):
+                await f.write(chunk)
+                progress.add(len(chunk))
+                await self.scheduler.consume(progress.job, len(chunk))
+
+    async def _fetch_segment(self, session: aiohttp.ClientSession, url, get_kwargs, seg: Segment,
+                             progress: '_ProgressReporter', write: Callable[[int, bytes], Awaitable],
+                             resp: aiohttp.ClientResponse | None = None):
+        """下载一个分段，断开时从已写入处重试；*write* 接收 (偏移, 数据)"""
+        tries = 0
+        while seg.remaining > 0:
+            try:
+                if resp is None:
+                    resp = await session.get(url, **_with_range(get_kwargs, seg.start + seg.done, seg.end))
+                    resp.raise_for_status()
+                    if resp.status != 206:
+                        raise RangeNotSatisfiable(f'expected 206, got {resp.status}')
                 async for chunk in resp.content.iter_chunked(self.chunk_size):
-                    chunk: bytes
-                    received += len(chunk)
-                    print(f'{target} completed {received}/{content_length}')
-                    await f.write(chunk)
-        return [target]
+                    chunk = chunk[:seg.remaining]
+                    await write(seg.start + seg.done, chunk)
+                    seg.done += len(chunk)
+                    progress.add(len(chunk))
+                    await self.scheduler.consume(progress.job, len(chunk))
+                    if seg.remaining <= 0:
+                        break
+                if seg.remaining > 0:
+                    raise aiohttp.ClientPayloadError(f'segment {seg.start}-{seg.end} ended early')
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                tries += 1
+                if tries > self.segment_retries:
+                    raise
+                logger.warning(f'{progress.target} segment {seg.start}-{seg.end} failed at {seg.done} '
+                               f'({tries}/{self.segment_retries}): {e!r}')
+            finally:
+                if resp is not None:
+                    resp.release()
+                resp = None
+
+    async def iter_content(self, url, target, *, get_kwargs=None, session=None,
+                           priority: DownloadPriority = DownloadPriority.DEFAULT) -> AsyncIterator[bytes]:
+        """按顺序产出文件内容，供边下载边处理（如 remux）。
+        服务器支持 Range 时同时最多有 *max_segments* 个分段在内存中下载，不写盘，因此也不支持续传。"""
+        session = session or self._session
+        get_kwargs = get_kwargs or {}
+        job = self.scheduler.job(str(target), url, priority)
+        progress = _ProgressReporter(self, str(target), job)
+        try:
+            await self.scheduler.acquire(job)
+            probe_held = True
+
+            def release_probe():
+                nonlocal probe_held
+                if probe_held:
+                    probe_held = False
+                    self.scheduler.release(job)
+
+            resp = None
+            pending: deque[asyncio.Task[bytearray]] = deque()
+            try:
+                resp = await session.get(url, **_with_range(get_kwargs, 0, self.segment_size - 1))
+                resp.raise_for_status()
+                if resp.status != 206:  # server ignored Range, pass the single stream through
+                    progress.total = resp.content_length
+                    async for chunk in resp.content.iter_chunked(self.chunk_size):
+                        progress.add(len(chunk))
+                        await self.scheduler.consume(job, len(chunk))
+                        yield chunk
+                    progress.finish()
+                    return
+                size = int(CONTENT_RANGE_RE.fullmatch(resp.headers['Content-Range']).group(3))
+                progress.total = size
+                segments = iter([Segment(start=start, end=min(start + self.segment_size, size) - 1)
+                                 for start in range(0, size, self.segment_size)])
+
+                async def read(seg: Segment, r: aiohttp.ClientResponse | None = None) -> bytearray:
+                    buf = bytearray()
+
+                    async def write(_offset: int, chunk: bytes):
+                        buf.extend(chunk)
+
+                    if r is not None:
+                        try:
+                            await self._fetch_segment(session, url, get_kwargs, seg, progress, write, r)
+                        finally:
+                            release_probe()
+                    else:
+                        async with self.scheduler.connection(job):
+                            await self._fetch_segment(session, url, get_kwargs, seg, progress, write)
+                    return buf
+
+                pending.append(asyncio.create_task(read(next(segments), resp)))
+                while pending:
+                    while len(pending) < self.max_segments and (seg := next(segments, None)) is not None:
+                        pending.append(asyncio.create_task(read(seg)))
+                    yield await pending.popleft()
+                progress.finish()
+            finally:
+                for task in pending:
+                    task.cancel()
+                if resp is not None:
+                    resp.release()
+                release_probe()
+        finally:
+            self.scheduler.finish(job)
 
     async def gather_download(self, downloads: list[Coroutine[Any, Any, PathList]]) -> PathList:
         gathered: list[PathList] = await asyncio.gather(*downloads)
@@ -61,3 +338,69 @@ class BaseDownloader(BaseModel):
     async def close(self):
         if '_session' in self.__dict__:
             await self._session.close()
+
+
+def _with_range(get_kwargs: dict, start: int, end: int) -> dict:
+    headers = dict(get_kwargs.get('headers') or {})
+    headers['Range'] = f'bytes={start}-{end}'
+    return {**get_kwargs, 'headers': headers}
+
+
+class _ProgressReporter:
+    """节流后的进度事件，替代逐块 print"""
+
+    def __init__(self, downloader: BaseDownloader, target: str, job: DownloadJob):
+        self.downloader = downloader
+        self.target = target
+        self.job = job
+        self.total: int | None = None
+        self.received = 0
+        self.baseline = 0  # resumed bytes, excluded from speed
+        self.started = self.last_report = time.monotonic()
+
+    def add(self, n: int, *, baseline=False):
+        self.received += n
+        if baseline:
+            self.baseline += n
+        now = time.monotonic()
+        if now - self.last_report >= self.downloader.progress_interval:
+            self.last_report = now
+            self.emit()
+
+    def finish(self):
+        self.emit(finished=True)
+
+    def emit(self, finished=False):
+        elapsed = time.monotonic() - self.started
+        speed = (self.received - self.baseline) / elapsed if elapsed > 0 else 0.
+        progress = DownloadProgress(target=self.target, received=self.received, total=self.total,
+                                    elapsed=elapsed, speed=speed, finished=finished)
+        logger.info(f'{self.target} {"finished" if finished else "completed"} '
+                    f'{self.received}/{self.total} ({speed / 1024 / 1024:.2f} MiB/s)')
+        for listener in self.downloader.progress_listeners:
+            try:
+                listener(progress)
+            except Exception as e:
+                logger.exception(f'exception in progress listener {listener!r}', exc_info=e)
+
+
+class _JournalSaver:
+    def __init__(self, journal: DownloadJournal, path: Path, interval: float):
+        self.journal = journal
+        self.path = path
+        self.interval = interval
+        self.last_save = 0.
+        self._lock = asyncio.Lock()
+
+    async def tick(self):
+        if time.monotonic() - self.last_save >= self.interval:
+            await self.save()
+
+    async def save(self):
+        """先写临时文件再替换，中途崩溃也不会留下半截记录"""
+        self.last_save = time.monotonic()
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        async with self._lock:
+            async with aiofiles.open(tmp, mode='w', encoding='utf-8') as f:
+                await f.write(self.journal.model_dump_json())
+            await aiofiles.os.replace(tmp, self.path)
@@ -0,0 +1,300 @@
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import os
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from functools import cached_property
+from pathlib import Path, PurePosixPath
+
+import aiohttp
+from pydantic import BaseModel, Field, TypeAdapter
+from yarl import URL
+
+from .. import metrics
+from .scheduler import DownloadPriority, DownloadScheduler, shared_download_scheduler
+
+__all__ = ('AssetEntry', 'AssetCache', 'shared_asset_cache',)
+
+logger = logging.getLogger('downloader.asset_cache')
+
+
+def _default_root() -> Path:
+    from ..userdata.paths import get_path
+    return get_path(ensure_exists=False).cache_path / 'assets'
+
+
+class AssetEntry(BaseModel):
+    """
+    :var checked: 上次与服务器确认内容的时间（epoch 秒）
+    :var used: 上次被访问的时间，用于 LRU 淘汰
+    """
+    hash: str
+    ext: str
+    size: int
+    etag: str | None = None
+    last_modified: str | None = None
+    checked: float
+    used: float
+
+
+_index_adapter = TypeAdapter(dict[str, AssetEntry])
+
+
+class AssetCache(BaseModel):
+    """按内容寻址的图片等小文件缓存：URL -> sha256 -> ``objects/ab/<sha256><ext>``。
+
+    同一内容只存一份；过了 *revalidate_after* 之后带 ETag / Last-Modified 做条件请求；
+    总大小超过 *max_size* 时按最近使用时间淘汰；*index* 保持最近使用的在后，淘汰时从头取即可。
+    索引每隔 *save_interval* 在线程里写出一次。
+    """
+    root: Path = Field(default_factory=_default_root)
+    max_size: int = 1024 * 1024 * 1024  # 1G
+    revalidate_after: timedelta = timedelta(days=1)
+    save_interval: float = 10.
+    timeout: float = 60.
+
+    # DI
+    scheduler: DownloadScheduler = Field(default_factory=shared_download_scheduler)
+
+    # runtime
+    _last_save: float = 0.
+    _dirty: bool = False
+    _saving: asyncio.Task | None = None
+    _loaded: bool = False
+    _size: int = 0
+
+    @cached_property
+    def index(self) -> OrderedDict[str, AssetEntry]:
+        return OrderedDict()
+
+    @cached_property
+    def _refs(self) -> dict[str, set[str]]:
+        """hash -> urls"""
+        return {}
+
+    @cached_property
+    def _inflight(self) -> dict[str, asyncio.Task[Path]]:
+        return {}
+
+    @cached_property
+    def _stats(self) -> dict[str, int]:
+        return {'hits': 0, 'revalidated': 0, 'downloads': 0, 'deduplicated': 0, 'evictions': 0}
+
+    @property
+    def index_path(self) -> Path:
+        return self.root / 'index.json'
+
+    @property
+    def size(self) -> int:
+        """去重后的对象总大小"""
+        return self._size
+
+    def object_path(self, entry: AssetEntry) -> Path:
+        return self.root / 'objects' / entry.hash[:2] / f'{entry.hash}{entry.ext}'
+
+    def load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            loaded = _index_adapter.validate_json(self.index_path.read_bytes())
+            self.index.update(sorted(loaded.items(), key=lambda kv: kv[1].used))
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            logger.warning(f'ignored broken asset index {self.index_path}: {e!r}')
+        for url, entry in list(self.index.items()):
+            if self.object_path(entry).exists():
+                self._ref(url, entry)
+            else:
+                del self.index[url]
+
+    def _write_index(self, index: dict[str, AssetEntry]):
+        self.root.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix='index.', suffix='.tmp')
+        try:
+            with open(fd, 'wb') as f:
+                f.write(_index_adapter.dump_json(index))
+            os.replace(tmp, self.index_path)
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+
+    async def save(self):
+        """在线程里写出索引的快照，不阻塞事件循环"""
+        saving = self._saving
+        if (saving is not None and saving is not asyncio.current_task() and not saving.done()
+                and saving.get_loop() is asyncio.get_running_loop()):
+            await asyncio.shield(saving)  # 保证较新的快照最后落盘
+        if not self._dirty:
+            return
+        self._dirty = False
+        self._last_save = time.monotonic()
+        try:
+            await asyncio.to_thread(self._write_index, dict(self.index))
+        except BaseException:
+            self._dirty = True
+            raise
+
+    async def _save_in_background(self):
+        try:
+            await self.save()
+        except Exception as e:
+            logger.exception(f'failed to save asset index {self.index_path}', exc_info=e)
+
+    def _touch(self):
+        self._dirty = True
+        if (time.monotonic() - self._last_save >= self.save_interval
+                and (self._saving is None or self._saving.done())):
+            self._saving = asyncio.create_task(self._save_in_background())
+
+    def _use(self, url: str, entry: AssetEntry, now: float):
+        entry.used = now
+        self.index.move_to_end(url)
+
+    def lookup(self, url: str) -> Path | None:
+        """只查本地，不发请求"""
+        self.load()
+        if (entry := self.index.get(url)) is None:
+            return None
+        self._use(url, entry, time.time())
+        self._dirty = True
+        return self.object_path(entry)
+
+    async def fetch(self, url: str, *, headers: dict | None = None) -> Path:
+        """返回 *url* 对应的本地文件，同一 URL 的并发请求合并为一次"""
+        self.load()
+        if (task := self._inflight.get(url)) is None:
+            task = self._inflight[url] = asyncio.create_task(self._fetch(url, headers or {}))
+            task.add_done_callback(lambda _: self._inflight.pop(url, None))
+        return await asyncio.shield(task)
+
+    async def _fetch(self, url: str, headers: dict) -> Path:
+        now = time.time()
+        entry = self.index.get(url)
+        if entry is not None:
+            self._use(url, entry, now)
+            if now - entry.checked < self.revalidate_after.total_seconds():
+                self._stats['hits'] += 1
+                self._touch()
+                return self.object_path(entry)
+            headers = dict(headers)
+            if entry.etag is not None:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified is not None:
+                headers['If-Modified-Since'] = entry.last_modified
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        job = self.scheduler.job(url, url, DownloadPriority.PICTURE)
+        try:
+            # 每次新建会话：缓存命中时不发请求，且共享实例可能跨越多个事件循环
+            async with (self.scheduler.connection(job),
+                        aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session,
+                        session.get(url, headers=headers) as resp):
+                if resp.status == 304 and entry is not None:
+                    self._stats['revalidated'] += 1
+                    entry.checked = now
+                    self._touch()
+                    return self.object_path(entry)
+                resp.raise_for_status()
+                digest = hashlib.sha256()
+                fd, tmp = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+                size = 0
+                try:
+                    with open(fd, 'wb') as f:
+                        async for chunk in resp.content.iter_chunked(64 * 1024):
+                            digest.update(chunk)
+                            f.write(chunk)
+                            size += len(chunk)
+                            await self.scheduler.consume(job, len(chunk))
+                    new = AssetEntry(hash=digest.hexdigest(), ext=self._ext(url, resp.content_type), size=size,
+                                     etag=resp.headers.get('ETag'), last_modified=resp.headers.get('Last-Modified'),
+                                     checked=now, used=now)
+                    path = self.object_path(new)
+                    if path.exists():
+                        self._stats['deduplicated'] += 1
+                    else:
+                        path.parent.mkdir(parents=True, exist_ok=True)
+                        os.replace(tmp, path)
+                finally:
+                    if os.path.exists(tmp):
+                        os.unlink(tmp)
+        finally:
+            self.scheduler.finish(job)
+        self._stats['downloads'] += 1
+        if entry is not None:
+            self._unref(url, entry)
+        self.index[url] = new
+        self.index.move_to_end(url)
+        self._ref(url, new)
+        self._evict(keep=url)
+        self._touch()
+        return path
+
+    @staticmethod
+    def _ext(url: str, content_type: str) -> str:
+        suffix = PurePosixPath(URL(url).path).suffix.lower()
+        if suffix and len(suffix) <= 5 and suffix[1:].isalnum():
+            return suffix
+        return mimetypes.guess_extension(content_type) or ''
+
+    def _ref(self, url: str, entry: AssetEntry):
+        if (urls := self._refs.get(entry.hash)) is None:
+            urls = self._refs[entry.hash] = set()
+            self._size += entry.size
+        urls.add(url)
+
+    def _unref(self, url: str, entry: AssetEntry):
+        urls = self._refs.get(entry.hash, set())
+        urls.discard(url)
+        if not urls and self._refs.pop(entry.hash, None) is not None:
+            self._size -= entry.size
+            self.object_path(entry).unlink(missing_ok=True)
+
+    def _evict(self, keep: str):
+        """从最久未用的开始淘汰；*keep* 刚被用过，排在最后"""
+        while self._size > self.max_size and self.index:
+            url, entry = next(iter(self.index.items()))
+            if url == keep:
+                break
+            del self.index[url]
+            self._unref(url, entry)
+            self._stats['evictions'] += 1
+
+    async def materialize(self, url: str, target: Path, *, headers: dict | None = None) -> Path:
+        """把缓存内容放到 *target*，优先硬链接，因此多次保存同一张图不额外占空间。
+
+        *target* 没有后缀时使用缓存对象的后缀。
+        """
+        source = await self.fetch(url, headers=headers)
+        if not target.suffix:
+            target = target.with_name(target.name + source.suffix)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if target.exists():
+            if target.samefile(source):
+                return target
+            target.unlink()
+        try:
+            os.link(source, target)
+        except OSError:  # cross-device or unsupported
+            shutil.copyfile(source, target)
+        return target
+
+    def stats(self) -> dict:
+        return {'entries': len(self.index), 'objects': len(self._refs), 'size': self.size, **self._stats}
+
+
+_shared_asset_cache: AssetCache | None = None
+
+
+def shared_asset_cache() -> AssetCache:
+    global _shared_asset_cache
+    if _shared_asset_cache is None:
+        _shared_asset_cache = AssetCache()
+        metrics.registry.register_stats('asset_cache', _shared_asset_cache.stats)
+    return _shared_asset_cache
@@ -1,8 +1,9 @@
 from aiofiles.threadpool.text import AsyncTextIOWrapper
-from pydantic import model_validator
+from pydantic import model_validator, Field
 
 from ubw.clients import BilibiliClient
 from ._base import *
+from .asset_cache import AssetCache, shared_asset_cache
 from .video_downloader import VideoDownloader
 from .. import models
 
@@ -13,6 +14,7 @@ class DynamicDownloader(BaseDownloader):
     bilibili_client_owner: bool = True
     video_downloader: VideoDownloader | None = None
     video_downloader_owner: bool = True
+    asset_cache: AssetCache = Field(default_factory=shared_asset_cache)
 
     async def __aenter__(self):
         if self.video_downloader_owner:
@@ -44,9 +46,18 @@ class DynamicDownloader(BaseDownloader):
                 await f.write(f"![]({asset})")
         return [fname]
 
+    async def _download_pic(self, url: str, name: str) -> PathList:
+        try:
+            path = await self.asset_cache.materialize(url, self.out_dir / name)
+        except Exception as e:
+            logger.exception(f'failed to download {url}', exc_info=e)
+            return []
+        return [path.name]
+
     async def download_dynamic_pics(self, dynamic_item: models.DynamicItem) -> PathList:
+        """图片经由共享的 :class:`AssetCache`，重复的图片不再重新下载，保存为硬链接"""
         return [y
-                for x in await asyncio.gather(*(self.download_file(pic, f'{dynamic_item.id_str}-{idx}.png')
+                for x in await asyncio.gather(*(self._download_pic(pic, f'{dynamic_item.id_str}-{idx}')
                                                 for idx, pic in enumerate(dynamic_item.pictures)))
                 for y in x]
 
@@ -65,4 +76,5 @@ class DynamicDownloader(BaseDownloader):
             await self.video_downloader.close()
         if self.bilibili_client_owner:
             await self.bilibili_client.close()
+        await self.asset_cache.save()
         await super().close()
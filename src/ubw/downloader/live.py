@@ -0,0 +1,408 @@
+"""直播录制：从 ``get_room_play_info`` 给出的地址拉 FLV / HLS 流写到磁盘
+
+- 收到的数据先攒在内存里，满 *buffer_size*（默认 4 MiB）才在线程里一次写出，网络读到的每块只做一次拼接
+- FLV 只在 tag 头上走一遍，记下文件头、元数据和编码参数，按大小 / 时长切分时在关键帧处切开，新文件先写入这些头部
+- HLS 按分片下载，每个分片都从关键帧开始，可直接在分片之间切分；fMP4 的初始化段写在每个文件开头
+- 超过 *stall_timeout* 没有新数据就换 ``url_info`` 里的下一个地址，已收到的数据都已写出；地址快过期时重新获取
+"""
+import asyncio
+import logging
+import re
+import struct
+import time
+from datetime import datetime, timedelta
+from functools import cached_property
+from pathlib import Path
+from typing import NamedTuple
+from urllib.parse import parse_qs, urljoin, urlparse
+
+import aiohttp
+from pydantic import BaseModel
+
+from ..clients import BilibiliClient
+from ..models import RoomPlayInfo
+
+__all__ = ('StreamCandidate', 'stream_candidates', 'FlvError', 'FlvParser', 'SegmentWriter', 'HlsPlaylist',
+           'parse_playlist', 'RecordOptions', 'LiveRecorder',)
+
+logger = logging.getLogger('downloader.live')
+
+EXTENSIONS = {'flv': 'flv', 'ts': 'ts', 'fmp4': 'mp4'}
+
+
+class StreamCandidate(NamedTuple):
+    """:var expires: 地址过期的 epoch 秒"""
+    url: str
+    protocol: str
+    format: str
+    codec: str
+    qn: int
+    host: str
+    expires: float
+
+
+def stream_candidates(play_info: RoomPlayInfo, qn: int = 10000, protocols=('http_stream', 'http_hls'),
+                      formats=('flv', 'fmp4', 'ts'), codecs=('avc', 'hevc'), now: float | None = None,
+                      ) -> list[StreamCandidate]:
+    """按 *protocols* / *formats* / *codecs* 的先后排序，同一路流的各个 host 相邻，便于切换"""
+    now = time.time() if now is None else now
+    result = []
+    if play_info.playurl_info is None or play_info.playurl_info.playurl is None:
+        return result
+    for stream in play_info.playurl_info.playurl.stream:
+        if stream.protocol_name not in protocols:
+            continue
+        for fmt in stream.format:
+            if fmt.format_name not in formats:
+                continue
+            for cdc in fmt.codec:
+                if cdc.codec_name not in codecs:
+                    continue
+                for url_info in cdc.url_info:
+                    url = f"{url_info.host}{cdc.base_url}{url_info.extra}"
+                    expires = parse_qs(urlparse(url).query).get('expires', [None])[0]
+                    result.append(StreamCandidate(
+                        url, stream.protocol_name, fmt.format_name, cdc.codec_name, cdc.current_qn,
+                        url_info.host, float(expires) if expires else now + url_info.stream_ttl))
+    result.sort(key=lambda c: (protocols.index(c.protocol), formats.index(c.format), codecs.index(c.codec),
+                               c.qn != qn))
+    return result
+
+
+class FlvError(Exception):
+    pass
+
+
+_TAG_HEADER = struct.Struct('>I')
+
+
+class FlvParser:
+    """在 FLV 字节流上找 tag 边界；不完整的 tag 留到下次"""
+
+    def __init__(self):
+        self.pending = bytearray()
+        self.header: bytes | None = None
+        self.init_tags: dict[str, bytes] = {}
+
+    def feed(self, data: bytes) -> tuple[bytes, list[int]]:
+        """返回由完整 tag 组成的数据，以及其中各个视频关键帧 tag 的起始偏移"""
+        buf = self.pending
+        buf += data
+        n, pos, keyframes = len(buf), 0, []
+        if self.header is None:
+            if n < 13:
+                return b'', keyframes
+            if buf[:3] != b'FLV':
+                raise FlvError(f'not a flv stream: {bytes(buf[:16])!r}')
+            pos = _TAG_HEADER.unpack_from(buf, 5)[0] + 4
+            if n < pos:
+                return b'', keyframes
+            self.header = bytes(buf[:pos])
+        while pos + 11 <= n:
+            head = _TAG_HEADER.unpack_from(buf, pos)[0]
+            tag_type, size = head >> 24, head & 0xFFFFFF
+            end = pos + 11 + size + 4
+            if end > n:
+                break
+            if tag_type == 9 and size > 1:
+                b0 = buf[pos + 11]
+                if b0 & 0x80:  # enhanced flv
+                    sequence_header = b0 & 0x0F == 0
+                else:
+                    sequence_header = b0 & 0x0F in (7, 12) and buf[pos + 12] == 0
+                if sequence_header:
+                    self.init_tags['video'] = bytes(buf[pos:end])
+                elif (b0 >> 4) & 0x07 == 1:
+                    keyframes.append(pos)
+            elif tag_type == 8 and size > 1:
+                if buf[pos + 11] >> 4 == 10 and buf[pos + 12] == 0:  # AAC sequence header
+                    self.init_tags['audio'] = bytes(buf[pos:end])
+            elif tag_type == 18:
+                self.init_tags.setdefault('script', bytes(buf[pos:end]))
+            elif tag_type not in (8, 9):
+                raise FlvError(f'unknown tag type {tag_type} at {pos}')
+            pos = end
+        out = bytes(buf[:pos])
+        del buf[:pos]
+        return out, keyframes
+
+    def init_bytes(self) -> bytes:
+        """新文件开头要写的部分：文件头、元数据、音视频编码参数"""
+        tags = self.init_tags
+        return (self.header or b'') + b''.join(tags[k] for k in ('script', 'video', 'audio') if k in tags)
+
+
+class SegmentWriter:
+    """一个输出文件；数据满 *buffer_size* 后在线程里整块写出"""
+
+    def __init__(self, path: Path, buffer_size: int = 4 << 20):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.size = 0
+        self.started = time.monotonic()
+        self._buffer = bytearray()
+        self._file = None
+
+    async def write(self, data: bytes | memoryview):
+        self._buffer += data
+        self.size += len(data)
+        if len(self._buffer) >= self.buffer_size:
+            await self.flush()
+
+    def _write(self, data: bytearray):
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = self.path.open('wb', buffering=0)
+        self._file.write(data)
+
+    async def flush(self):
+        if self._buffer:
+            data, self._buffer = self._buffer, bytearray()
+            await asyncio.to_thread(self._write, data)
+
+    async def close(self):
+        try:
+            await self.flush()
+        finally:
+            if self._file is not None:
+                await asyncio.to_thread(self._file.close)
+                self._file = None
+
+
+class HlsPlaylist(NamedTuple):
+    media_sequence: int
+    target_duration: float
+    map_uri: str | None
+    segments: list[tuple[int, str]]
+    ended: bool
+
+
+def parse_playlist(text: str, base_url: str) -> HlsPlaylist:
+    """只解析录制需要的部分；分片地址已转成绝对地址"""
+    sequence, target, map_uri, segments, ended = 0, 1., None, [], False
+    expect_uri = False
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+            sequence = int(line.split(':', 1)[1])
+        elif line.startswith('#EXT-X-TARGETDURATION:'):
+            target = float(line.split(':', 1)[1])
+        elif line.startswith('#EXT-X-MAP:'):
+            if m := re.search(r'URI="([^"]+)"', line):
+                map_uri = urljoin(base_url, m[1])
+        elif line.startswith('#EXTINF:'):
+            expect_uri = True
+        elif line.startswith('#EXT-X-ENDLIST'):
+            ended = True
+        elif not line.startswith('#') and expect_uri:
+            segments.append((sequence + len(segments), urljoin(base_url, line)))
+            expect_uri = False
+    return HlsPlaylist(sequence, target, map_uri, segments, ended)
+
+
+class _Stalled(Exception):
+    pass
+
+
+class _Expiring(Exception):
+    pass
+
+
+class RecordOptions(BaseModel):
+    out_dir: Path = Path('output/record')
+    qn: int = 10000
+    protocols: list[str] = ['http_stream', 'http_hls']
+    formats: list[str] = ['flv', 'fmp4', 'ts']
+    codecs: list[str] = ['avc', 'hevc']
+    segment_size: int = 2 << 30  # 2G
+    segment_duration: timedelta = timedelta(hours=1)
+    buffer_size: int = 4 << 20  # 4M
+    stall_timeout: timedelta = timedelta(seconds=15)
+    url_refresh_margin: timedelta = timedelta(seconds=60)
+    retry_interval: timedelta = timedelta(seconds=5)
+    max_retries: int = 20  # 连续这么多轮都没收到数据就放弃
+
+
+class LiveRecorder(BaseModel):
+    room_id: int
+    options: RecordOptions = RecordOptions()
+
+    # DI
+    bilibili_client: BilibiliClient
+
+    # runtime
+    _task: asyncio.Task | None = None
+    _segment: SegmentWriter | None = None
+    _received: int = 0
+    _switches: int = 0
+    _refreshes: int = 0
+
+    @cached_property
+    def segments(self) -> list[Path]:
+        return []
+
+    @cached_property
+    def _session(self) -> aiohttp.ClientSession:
+        return aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(sock_connect=10))
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> asyncio.Task:
+        if not self.is_running:
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def join(self):
+        if self._task is not None:
+            await asyncio.shield(self._task)
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    async def close(self):
+        await self.stop()
+        if '_session' in self.__dict__:
+            await self._session.close()
+
+    def stats(self) -> dict:
+        return {'running': int(self.is_running), 'received': self._received, 'segments': len(self.segments),
+                'switches': self._switches, 'refreshes': self._refreshes}
+
+    # segments
+
+    async def _open_segment(self, ext: str, init: bytes = b'') -> SegmentWriter:
+        await self._close_segment()
+        name = f'{self.room_id}_{datetime.now():%Y%m%d_%H%M%S}_{len(self.segments):03d}.{ext}'
+        self._segment = SegmentWriter(self.options.out_dir / str(self.room_id) / name, self.options.buffer_size)
+        self.segments.append(self._segment.path)
+        logger.info(f'room {self.room_id}: recording to {self._segment.path}')
+        if init:
+            await self._segment.write(init)
+        return self._segment
+
+    async def _close_segment(self):
+        segment, self._segment = self._segment, None
+        if segment is not None:
+            await segment.close()
+
+    def _should_cut(self, segment: SegmentWriter) -> bool:
+        return (segment.size >= self.options.segment_size
+                or time.monotonic() - segment.started >= self.options.segment_duration.total_seconds())
+
+    async def _write(self, data: bytes, cut_points: list[int], ext: str, init: bytes):
+        """*cut_points* 是 *data* 中可以开始新文件的偏移；需要切分时在第一个可切分处换文件并先写入 *init*"""
+        self._received += len(data)
+        segment = self._segment
+        if segment is None:
+            segment = await self._open_segment(ext)
+        elif cut_points and self._should_cut(segment):
+            view = memoryview(data)
+            await segment.write(view[:cut_points[0]])
+            segment = await self._open_segment(ext, init)
+            data = view[cut_points[0]:]
+        await segment.write(data)
+
+    # main loop
+
+    async def run(self):
+        opts = self.options
+        failures = 0
+        try:
+            while True:
+                info = await self.bilibili_client.get_room_play_info(self.room_id, opts.qn)
+                if info.live_status != 1:
+                    logger.info(f'room {self.room_id}: not living ({info.live_status}), recording finished')
+                    return
+                candidates = stream_candidates(info, opts.qn, tuple(opts.protocols), tuple(opts.formats),
+                                               tuple(opts.codecs))
+                received = self._received
+                for i, candidate in enumerate(candidates):
+                    if i and time.time() > candidate.expires - opts.url_refresh_margin.total_seconds():
+                        break
+                    if i:
+                        self._switches += 1
+                        logger.info(f'room {self.room_id}: switching to {candidate.host}')
+                    try:
+                        await self._record(candidate)
+                    except _Expiring:
+                        break
+                    except (_Stalled, asyncio.TimeoutError) as e:
+                        logger.warning(f'room {self.room_id}: {candidate.host} stalled ({e!r})')
+                    except (aiohttp.ClientError, FlvError) as e:
+                        logger.warning(f'room {self.room_id}: {candidate.host} failed: {e!r}')
+                    finally:
+                        await self._close_segment()  # 下一个连接的流从头开始，写到新文件里
+                self._refreshes += 1
+                if self._received > received:
+                    failures = 0
+                    continue
+                failures += 1
+                if failures > opts.max_retries:
+                    logger.error(f'room {self.room_id}: no data after {failures} rounds, giving up')
+                    return
+                await asyncio.sleep(opts.retry_interval.total_seconds())
+        finally:
+            await self._close_segment()
+
+    async def _record(self, candidate: StreamCandidate):
+        if candidate.protocol == 'http_hls':
+            await self._record_hls(candidate)
+        else:
+            await self._record_flv(candidate)
+
+    async def _record_flv(self, candidate: StreamCandidate):
+        stall = self.options.stall_timeout.total_seconds()
+        timeout = aiohttp.ClientTimeout(sock_connect=10, sock_read=stall)
+        async with self._session.get(candidate.url, timeout=timeout) as resp:
+            resp.raise_for_status()
+            parser = FlvParser()
+            while data := await resp.content.readany():
+                out, keyframes = parser.feed(data)
+                if out:
+                    await self._write(out, keyframes, 'flv', parser.init_bytes())
+        raise _Stalled('stream closed by server')
+
+    async def _fetch(self, url: str) -> bytes:
+        timeout = aiohttp.ClientTimeout(sock_connect=10, sock_read=self.options.stall_timeout.total_seconds())
+        async with self._session.get(url, timeout=timeout) as resp:
+            resp.raise_for_status()
+            return await resp.read()
+
+    async def _record_hls(self, candidate: StreamCandidate):
+        opts = self.options
+        ext = EXTENSIONS.get(candidate.format, 'ts')
+        last_seq, map_uri, init = -1, None, b''
+        progressed = time.monotonic()
+        while True:
+            playlist = parse_playlist((await self._fetch(candidate.url)).decode('utf-8'), candidate.url)
+            if playlist.map_uri != map_uri:
+                map_uri, init = playlist.map_uri, await self._fetch(playlist.map_uri) if playlist.map_uri else b''
+                if self._segment is not None:
+                    await self._close_segment()
+            fresh = [(seq, uri) for seq, uri in playlist.segments if seq > last_seq]
+            if fresh and last_seq >= 0 and fresh[0][0] > last_seq + 1:
+                logger.warning(f'room {self.room_id}: missed hls fragments {last_seq + 1}..{fresh[0][0] - 1}')
+            for seq, uri in fresh:
+                data = await self._fetch(uri)
+                if self._segment is None:
+                    await self._open_segment(ext, init)
+                await self._write(data, [0], ext, init)
+                last_seq = seq
+                progressed = time.monotonic()
+            if playlist.ended:
+                raise _Stalled('playlist ended')
+            if time.monotonic() - progressed > opts.stall_timeout.total_seconds():
+                raise _Stalled(f'no new fragment since #{last_seq}')
+            if time.time() > candidate.expires - opts.url_refresh_margin.total_seconds():
+                raise _Expiring()
+            await asyncio.sleep(max(playlist.target_duration / 2, 0.2))
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import os
+import tempfile
+from functools import cached_property
+from pathlib import Path
+from typing import AsyncIterable
+
+from pydantic import BaseModel, field_validator
+
+__all__ = ('RemuxError', 'RemuxPool', 'find_ffmpeg', 'shared_remux_pool',)
+
+logger = logging.getLogger('downloader.remux')
+
+
+class RemuxError(Exception):
+    pass
+
+
+def find_ffmpeg() -> Path | None:
+    c = (Path(i) / fn
+         for i in os.environ['PATH'].split(os.path.pathsep)
+         for fn in ['ffmpeg', 'ffmpeg.exe'])
+    for p in c:
+        if p.is_file():
+            return p
+    return None
+
+
+def _write_all(pipe, data: bytes):
+    view = memoryview(data)
+    while view:
+        view = view[pipe.write(view):]
+
+
+async def _feed(pipe, source: AsyncIterable[bytes]):
+    try:
+        async for data in source:
+            await asyncio.to_thread(_write_all, pipe, data)
+    except BrokenPipeError:
+        pass  # ffmpeg quit early, its exit code tells why
+    finally:
+        pipe.close()  # EOF for ffmpeg
+        if hasattr(source, 'aclose'):  # stop the download right away if ffmpeg quit
+            await source.aclose()
+
+
+class RemuxPool(BaseModel):
+    """共享的 ffmpeg 进程池，把 DASH 视频流与音频流边下载边混流成一个 mp4。
+
+    POSIX 下两路流经由管道直接传给 ffmpeg，不落临时文件；其他平台退化为先写临时文件。
+    """
+    ffmpeg: Path | None = None
+    max_workers: int = 2
+    codec_args: list[str] = ['-c', 'copy']
+
+    @field_validator('ffmpeg', mode='before')
+    @classmethod
+    def default_ffmpeg(cls, v):
+        if v is not None:
+            return v
+        return find_ffmpeg()
+
+    @cached_property
+    def _semaphore(self) -> asyncio.Semaphore:
+        return asyncio.Semaphore(self.max_workers)
+
+    async def remux(self, video: AsyncIterable[bytes], audio: AsyncIterable[bytes], out: Path, *,
+                    ffmpeg: Path | None = None) -> Path:
+        ffmpeg = ffmpeg or self.ffmpeg
+        if ffmpeg is None:
+            raise RemuxError('ffmpeg not found')
+        out.parent.mkdir(parents=True, exist_ok=True)
+        tmp_out = out.with_name(out.name + '.part')
+        async with self._semaphore:
+            logger.debug(f'remuxing into {out}')
+            try:
+                if os.name == 'posix':
+                    await self._remux_pipes(ffmpeg, video, audio, tmp_out)
+                else:
+                    await self._remux_files(ffmpeg, video, audio, tmp_out)
+            except BaseException:
+                tmp_out.unlink(missing_ok=True)
+                raise
+        os.replace(tmp_out, out)
+        return out
+
+    def _args(self, ffmpeg: Path, video_input: str, audio_input: str, out: Path) -> list[str]:
+        return [str(ffmpeg), '-nostdin', '-hide_banner', '-loglevel', 'error', '-y',
+                '-i', video_input, '-i', audio_input, '-map', '0:v:0', '-map', '1:a:0',
+                *self.codec_args, '-f', 'mp4', str(out)]
+
+    async def _run(self, args: list[str], feeding=None, **kwargs):
+        proc = await asyncio.create_subprocess_exec(
+            *args, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE, **kwargs)
+        stderr = asyncio.create_task(proc.stderr.read())
+        try:
+            if feeding is not None:
+                await feeding()
+            await proc.wait()
+        except BaseException:
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            raise
+        finally:
+            stderr = await stderr
+        if proc.returncode != 0:
+            raise RemuxError(f'ffmpeg exited with {proc.returncode}: {stderr.decode(errors="ignore")}')
+
+    async def _remux_pipes(self, ffmpeg: Path, video: AsyncIterable[bytes], audio: AsyncIterable[bytes],
+                           out: Path):
+        r_video, w_video = os.pipe()
+        r_audio, w_audio = os.pipe()
+        video_pipe = open(w_video, 'wb', buffering=0)
+        audio_pipe = open(w_audio, 'wb', buffering=0)
+        read_ends = [r_video, r_audio]
+
+        def close_read_ends():
+            while read_ends:
+                os.close(read_ends.pop())
+
+        async def feeding():
+            close_read_ends()  # the child holds its own copies now
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(_feed(video_pipe, video))
+                tg.create_task(_feed(audio_pipe, audio))
+
+        try:
+            await self._run(self._args(ffmpeg, f'pipe:{r_video}', f'pipe:{r_audio}', out),
+                            feeding, pass_fds=(r_video, r_audio))
+        finally:
+            close_read_ends()
+            video_pipe.close()
+            audio_pipe.close()
+
+    async def _remux_files(self, ffmpeg: Path, video: AsyncIterable[bytes], audio: AsyncIterable[bytes],
+                           out: Path):
+        with tempfile.TemporaryDirectory(dir=out.parent) as tmp:
+            video_path, audio_path = Path(tmp) / 'video.m4s', Path(tmp) / 'audio.m4s'
+
+            async def save(source, path: Path):
+                with path.open('wb') as f:
+                    async for data in source:
+                        await asyncio.to_thread(f.write, data)
+
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(save(video, video_path))
+                tg.create_task(save(audio, audio_path))
+            await self._run(self._args(ffmpeg, str(video_path), str(audio_path), out))
+
+
+_shared_remux_pool: RemuxPool | None = None
+
+
+def shared_remux_pool() -> RemuxPool:
+    global _shared_remux_pool
+    if _shared_remux_pool is None:
+        _shared_remux_pool = RemuxPool()
+    return _shared_remux_pool
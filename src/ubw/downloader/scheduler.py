@@ -0,0 +1,200 @@
+import asyncio
+import enum
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from functools import cached_property
+
+from pydantic import BaseModel, Field
+from yarl import URL
+
+from .. import metrics
+
+__all__ = ('DownloadPriority', 'DownloadJob', 'DownloadScheduler', 'shared_download_scheduler',)
+
+logger = logging.getLogger('downloader.scheduler')
+
+
+class DownloadPriority(enum.IntEnum):
+    """数值越小越优先"""
+    PICTURE = 0
+    DEFAULT = 1
+    VIDEO = 2
+
+
+class DownloadJob(BaseModel):
+    """一个文件的下载统计
+
+    :var waited: 所有连接排队等待的总时长
+    """
+    target: str
+    host: str
+    priority: DownloadPriority
+    created: float = Field(default_factory=time.monotonic)
+    started: float | None = None
+    finished: float | None = None
+    received: int = 0
+    connections: int = 0
+    waited: float = 0.
+
+    @property
+    def duration(self) -> float:
+        if self.started is None:
+            return 0.
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def throughput(self) -> float:
+        return self.received / self.duration if self.duration > 0 else 0.
+
+    def summary(self) -> dict:
+        return {'target': self.target, 'host': self.host, 'priority': self.priority.name,
+                'received': self.received, 'connections': self.connections, 'waited': self.waited,
+                'duration': self.duration, 'throughput': self.throughput, 'finished': self.finished is not None}
+
+
+class DownloadScheduler(BaseModel):
+    """所有下载器共享的连接调度：全局与每个 host 的并发上限、总带宽预算，排队时按优先级出队。
+
+    :var bandwidth: 总带宽上限（字节/秒），0 为不限
+    """
+    max_connections: int = 8
+    max_connections_per_host: int = 4
+    bandwidth: int = 0
+    history_size: int = 256
+
+    # runtime
+    _active: int = 0
+    _tokens: float = 0.
+    _updated: float = 0.
+
+    @cached_property
+    def _seq(self) -> itertools.count:
+        return itertools.count()
+
+    @cached_property
+    def _waiters(self) -> list[tuple[int, int, str, asyncio.Future]]:
+        return []
+
+    @cached_property
+    def _host_active(self) -> dict[str, int]:
+        return {}
+
+    @cached_property
+    def jobs(self) -> list[DownloadJob]:
+        return []
+
+    @cached_property
+    def history(self) -> deque[DownloadJob]:
+        return deque(maxlen=self.history_size)
+
+    def _can_start(self, host: str) -> bool:
+        return (self._active < self.max_connections
+                and self._host_active.get(host, 0) < self.max_connections_per_host)
+
+    def _dispatch(self):
+        # 按优先级扫描，跳过 host 已满的等待者，避免队头阻塞
+        skipped = []
+        while self._waiters and self._active < self.max_connections:
+            item = heapq.heappop(self._waiters)
+            _, _, host, future = item
+            if future.done():
+                continue
+            if not self._can_start(host):
+                skipped.append(item)
+                continue
+            self._active += 1
+            self._host_active[host] = self._host_active.get(host, 0) + 1
+            future.set_result(None)
+        for item in skipped:
+            heapq.heappush(self._waiters, item)
+
+    def _release(self, host: str):
+        self._active -= 1
+        if (n := self._host_active[host] - 1) > 0:
+            self._host_active[host] = n
+        else:
+            del self._host_active[host]
+        self._dispatch()
+
+    def job(self, target: str, url: str, priority: DownloadPriority = DownloadPriority.DEFAULT) -> DownloadJob:
+        job = DownloadJob(target=target, host=URL(url).host or '', priority=priority)
+        self.jobs.append(job)
+        return job
+
+    def finish(self, job: DownloadJob):
+        job.finished = time.monotonic()
+        self.jobs[:] = [j for j in self.jobs if j is not job]
+        self.history.append(job)
+        logger.info(f'{job.target} {job.received} bytes in {job.duration:.1f}s '
+                    f'({job.throughput / 1024 / 1024:.2f} MiB/s), queued {job.waited:.1f}s '
+                    f'over {job.connections} connection(s)')
+
+    async def acquire(self, job: DownloadJob):
+        """占用一个连接，之后必须调用 ``release(job)``"""
+        start = time.monotonic()
+        if not self._can_start(job.host) or self._waiters:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (job.priority, next(self._seq), job.host, future))
+            self._dispatch()
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():  # granted right before being cancelled
+                    self._release(job.host)
+                raise
+        else:
+            self._active += 1
+            self._host_active[job.host] = self._host_active.get(job.host, 0) + 1
+        now = time.monotonic()
+        job.waited += now - start
+        job.connections += 1
+        if job.started is None:
+            job.started = now
+
+    def release(self, job: DownloadJob):
+        self._release(job.host)
+
+    @asynccontextmanager
+    async def connection(self, job: DownloadJob):
+        await self.acquire(job)
+        try:
+            yield
+        finally:
+            self.release(job)
+
+    async def consume(self, job: DownloadJob, n: int):
+        """记录收到的字节，超出带宽预算时等待"""
+        job.received += n
+        if self.bandwidth <= 0:
+            return
+        now = time.monotonic()
+        self._tokens = min(self.bandwidth, self._tokens + (now - self._updated) * self.bandwidth) - n
+        self._updated = now
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self.bandwidth)
+
+    def counters(self) -> dict:
+        return {'active': self._active, 'queued': sum(1 for *_, f in self._waiters if not f.done()),
+                'jobs': len(self.jobs), 'received': sum(job.received for job in self.jobs)}
+
+    def stats(self) -> dict:
+        return {
+            'active': self._active, 'queued': sum(1 for *_, f in self._waiters if not f.done()),
+            'hosts': dict(self._host_active),
+            'jobs': [job.summary() for job in itertools.chain(self.history, self.jobs)],
+        }
+
+
+_shared_download_scheduler: DownloadScheduler | None = None
+
+
+def shared_download_scheduler() -> DownloadScheduler:
+    global _shared_download_scheduler
+    if _shared_download_scheduler is None:
+        _shared_download_scheduler = DownloadScheduler()
+        metrics.registry.register_stats('download', _shared_download_scheduler.counters)
+    return _shared_download_scheduler
@@ -1,10 +1,11 @@
-import os
 from operator import attrgetter
 
-from pydantic import field_validator
+from pydantic import field_validator, Field
 
 from ubw.clients import BilibiliClient
 from ._base import *
+from .remux import RemuxPool, find_ffmpeg, shared_remux_pool
+from .scheduler import DownloadPriority
 
 
 class VideoDownloader(BaseDownloader):
@@ -14,6 +15,7 @@ class VideoDownloader(BaseDownloader):
     # DI
     bilibili_client: BilibiliClient
     bilibili_client_owner: bool = True
+    remux_pool: RemuxPool = Field(default_factory=shared_remux_pool)
 
     async def __aenter__(self):
         if self.bilibili_client_owner:
@@ -22,16 +24,8 @@ class VideoDownloader(BaseDownloader):
 
     @field_validator('ffmpeg', mode='before')
     @classmethod
-    def find_ffmpeg(cls, v):
-        if v is not None:
-            return v
-        c = (Path(i) / fn
-             for i in os.environ['PATH'].split(os.path.pathsep)
-             for fn in ['ffmpeg', 'ffmpeg.exe'])
-        for p in c:
-            if p.is_file():
-                return p
-        return None
+    def default_ffmpeg(cls, v):
+        return find_ffmpeg() if v is None else v
 
     async def download_bvid(self, bvid) -> PathList:
         pages = await self.bilibili_client.get_video_pagelist(bvid)
@@ -56,11 +50,27 @@ class VideoDownloader(BaseDownloader):
             'user-agent': "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
                           "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/118.0.0.0 Safari/537.36",
             'referer': 'https://www.bilibili.com/video/' + bvid}}
-        await asyncio.gather(self.download_file(chosen_video.base_url, target + f".f{chosen_video.apparent_fid}.m4s",
-                                                get_kwargs=get_kwargs),
-                             self.download_file(chosen_audio.base_url, target + f".f{chosen_audio.apparent_fid}.m4a",
-                                                get_kwargs=get_kwargs))
-        # todo: ffmpeg re-mux
+        video_target = target + f".f{chosen_video.apparent_fid}.m4s"
+        audio_target = target + f".f{chosen_audio.apparent_fid}.m4a"
+        if self.ffmpeg is None:
+            logger.warning(f'ffmpeg not found, {target} is saved as separate video and audio streams')
+            return await self.gather_download([
+                self.download_file(chosen_video.base_url, video_target,
+                                   get_kwargs=get_kwargs, priority=DownloadPriority.VIDEO),
+                self.download_file(chosen_audio.base_url, audio_target,
+                                   get_kwargs=get_kwargs, priority=DownloadPriority.VIDEO),
+            ])
+        # 边下载边混流，不落临时文件
+        try:
+            await self.remux_pool.remux(
+                self.iter_content(chosen_video.base_url, video_target,
+                                  get_kwargs=get_kwargs, priority=DownloadPriority.VIDEO),
+                self.iter_content(chosen_audio.base_url, audio_target,
+                                  get_kwargs=get_kwargs, priority=DownloadPriority.VIDEO),
+                self.out_dir / f'{target}.mp4', ffmpeg=self.ffmpeg)
+        except Exception as e:
+            logger.exception(f'exception in remuxing {target}', exc_info=e)
+            return []
         return [Path(f'{target}.mp4')]
 
     async def close(self):
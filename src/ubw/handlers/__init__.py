@@ -3,6 +3,8 @@ from typing import Annotated, Union
 from pydantic import Field
 
 from ._base import BaseHandler
+from .analytics import AnalyticsHandler
+from .audience import AudienceHandler
 from .bhashm import HashMarkHandler
 from .danmakup import DanmakuPHandler
 from .dump_raw import DumpRawHandler
@@ -11,6 +13,7 @@ from .living_status import LivingStatusHandler
 from .saver import SaverHandler
 from .strange_stalker import StrangeStalkerHandler
 from .testing import MockHandler
+from .trends import TrendsHandler
 from .vod import VodHandler
 from .vodt import VodTextualHandler
 from .warn_nebd import WarnNoEntranceButDanmakuHandler
@@ -18,6 +21,8 @@ from .wocpian import PianHandler
 
 Handler = Annotated[
     Union[
+        AnalyticsHandler,
+        AudienceHandler,
         HashMarkHandler,
         DanmakuPHandler,
         DumpRawHandler,
@@ -30,5 +35,6 @@ Handler = Annotated[
         VodTextualHandler,
         WarnNoEntranceButDanmakuHandler,
         MockHandler,
+        TrendsHandler,
     ],
     Field(discriminator='cls')]
@@ -3,18 +3,21 @@ import asyncio
 import inspect
 import logging
 import os
+import sys
 import time
 import warnings
 from functools import cached_property
 from typing import *
 
 import rich
-import sentry_sdk
-from pydantic import ValidationError, BaseModel
+from pydantic import ValidationError, BaseModel, Field
 from rich.markup import escape
 
-from .. import models
-from ..clients import LiveClientABC
+from .. import metrics, models
+from ..profiling import profiler
+from ..clients import LiveClientABC, dup_of
+from ..models._base import default_interner
+from ._sampler import UnknownCmdSampler, shared_unknown_sampler
 
 __all__ = (
     'BaseHandler',
@@ -44,6 +47,10 @@ def _func_info(func: Callable):
 class BaseHandler(BaseModel):
     cls: str
     ignored_cmd: list[str] = []
+    intern_models: bool = False
+
+    # DI
+    unknown_sampler: UnknownCmdSampler = Field(default_factory=shared_unknown_sampler, exclude=True)
 
     async def start(self, client: LiveClientABC):
         pass
@@ -63,15 +70,30 @@ class BaseHandler(BaseModel):
         finally:
             await self.close()
 
+    @cached_property
+    def _metrics_handler(self):
+        return metrics.handler_seconds.labels(self.cls), metrics.validate_seconds.labels(self.cls)
+
+    async def _timed_process_one(self, client: LiveClientABC, command: dict):
+        if (recorder := profiler.slow_calls) is not None:
+            call = recorder.begin(self.cls, command.get('cmd', ''), client.room_id, sys._getframe())
+        start = time.perf_counter()
+        try:
+            return await self.process_one(client, command)
+        finally:
+            self._metrics_handler[0].observe(time.perf_counter() - start)
+            if recorder is not None:
+                recorder.end(call)
+
     if DEBUGGING_TOO_LONG:
         async def handle(self, client: LiveClientABC, command: dict):
             start = time.time()
-            await self.process_one(client, command)
+            await self._timed_process_one(client, command)
             if time.time() - start > 1:
                 warnings.warn(f"command `{command['cmd']}` process too long (>1s)")
     else:
         async def handle(self, client: LiveClientABC, command: dict):
-            await self.process_one(client, command)
+            await self._timed_process_one(client, command)
 
     async def process_one(self, client: LiveClientABC, command: dict):
         try:
@@ -89,8 +111,16 @@ class BaseHandler(BaseModel):
 
             try:
                 extras = []
-                model: models.CommandModel = models.BLIVE_ADAPTER.validate_python(command, context={
-                    'collect_extra': extras.append})
+                context = {'collect_extra': extras.append}
+                if self.intern_models:
+                    context['interner'] = default_interner
+                start = time.perf_counter()
+                try:
+                    model: models.CommandModel = models.BLIVE_ADAPTER.validate_python(command, context=context)
+                finally:
+                    self._metrics_handler[1].observe(time.perf_counter() - start)
+                if (first := dup_of(command)) is not None:
+                    model.dup_of = first
                 for model_name, extra_dict in extras:
                     await self.on_xx_extra_field(client, command, model_name, extra_dict)
             except ValidationError as e:
@@ -126,34 +156,11 @@ class BaseHandler(BaseModel):
             logger.debug(f"got a {cmd}, processing with {_func_info(self.on_else)})")
             return await self.on_else(client, model)
 
-    @cached_property
-    def logged_extra(self):
-        return set()
-
-    @staticmethod
-    def frozen_extra(model_name: str, extra: dict):
-        return model_name, frozenset(extra.keys())
-
     async def on_xx_extra_field(self, client: LiveClientABC, command: dict, model_name: str, extra_dict: dict):
-        # aggregate model_name and extra(frozen) log only once for one instance
-        frozen = self.frozen_extra(model_name, extra_dict)
-        if frozen in self.logged_extra:
-            return
-
-        self.logged_extra.add(frozen)
-
-        import json
-        import aiofiles.os
+        # 按多出来的字段的结构聚合，全进程只保存少量样本
         cmd = command.get('cmd', None)
-        await aiofiles.os.makedirs("output/unknown_cmd", exist_ok=True)
-        async with aiofiles.open(f"output/unknown_cmd/XX_EXTRA_{model_name}.json", mode='a', encoding='utf-8') as afp:
-            await afp.write(json.dumps(extra_dict, indent=2))
-            await afp.write("\n")
-        # also writes the full command for checking
-        async with aiofiles.open(f"output/unknown_cmd/{cmd}.json", mode='a', encoding='utf-8') as afp:
-            await afp.write(json.dumps(command, indent=2, ensure_ascii=False))
-            await afp.write("\n")
-        sentry_sdk.capture_event(
+        self.unknown_sampler.capture(
+            f'XX_EXTRA_{model_name}', command, shape_of=extra_dict,
             event={'level': 'warning', 'message': f'extra fields in command {model_name}'},
             user={'id': client.user_ident},
             contexts={'extra': extra_dict, 'command': command},
@@ -162,15 +169,10 @@ class BaseHandler(BaseModel):
         )
 
     async def on_unknown_cmd(self, client: LiveClientABC, command: dict, err: ValidationError):
-        import json
-        import aiofiles.os
         cmd = command.get('cmd', None)
-        await aiofiles.os.makedirs("output/unknown_cmd", exist_ok=True)
-        async with aiofiles.open(f"output/unknown_cmd/{cmd}.json", mode='a', encoding='utf-8') as afp:
-            await afp.write(json.dumps(command, indent=2, ensure_ascii=False))
-            await afp.write("\n")
         error_details = err.errors(include_url=False)
-        sentry_sdk.capture_event(
+        self.unknown_sampler.capture(
+            str(cmd), command,
             event={'level': 'warning', 'message': f'error parsing command {cmd}'},
             user={'id': client.user_ident},
             contexts={'ValidationError': {'command': command, 'error': error_details}},
@@ -306,11 +308,16 @@ class QueuedProcessorMixin(BaseHandler):
             await task
         await super().stop()
 
+    @cached_property
+    def _metrics_queue_depth(self):
+        return metrics.queue_depth.labels(self.cls)
+
     async def handle(self, client: LiveClientABC, command: dict):
         if not self.__queue_running:
             return
         await self._queue.put((client, command))
         qsize = self._queue.qsize()
+        self._metrics_queue_depth.set(qsize)
         if qsize > 20:
             logger.warning(f'CANNOT KEEP UP! {qsize=}>20')
 
@@ -322,6 +329,7 @@ class QueuedProcessorMixin(BaseHandler):
                 if t == 'END':  #
                     return
                 client, command = t
-                await self.process_one(client, command)
+                self._metrics_queue_depth.set(self._queue.qsize())
+                await self._timed_process_one(client, command)
         finally:
             self.__queue_running = False
@@ -0,0 +1,199 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import deque
+from functools import cached_property
+from pathlib import Path
+from typing import Any, Iterator
+
+import sentry_sdk
+from pydantic import BaseModel
+
+from .. import metrics
+
+__all__ = ('schema_shape', 'shape_hash', 'UnknownCmdSampler', 'shared_unknown_sampler', 'iter_samples',)
+
+logger = logging.getLogger('ubw.handlers.sampler')
+
+
+def schema_shape(value: Any) -> Any:
+    """只保留结构：dict 保留键，list 合并元素结构，标量只留类型名"""
+    match value:
+        case dict():
+            return {k: schema_shape(v) for k, v in sorted(value.items())}
+        case list() | tuple():
+            shapes = {json.dumps(schema_shape(v), sort_keys=True) for v in value}
+            return [json.loads(s) for s in sorted(shapes)]
+        case bool():
+            return 'bool'
+        case int() | float():
+            return 'number'
+        case str():
+            return 'str'
+        case None:
+            return 'null'
+        case _:
+            return type(value).__name__
+
+
+def shape_hash(value: Any) -> str:
+    return hashlib.blake2b(json.dumps(schema_shape(value), sort_keys=True).encode(), digest_size=8).hexdigest()
+
+
+class ShapeStats(BaseModel):
+    count: int = 0
+    stored: int = 0
+    first_seen: float = 0.
+    last_seen: float = 0.
+    reported: float = 0.
+
+
+class UnknownCmdSampler(BaseModel):
+    """进程内共享的未知命令采样：按 (cmd, 结构) 分组，每组只保存前 *examples_per_shape* 条，
+    其余只计数，定期把汇总写入 ``summary.json``；Sentry 事件每组限频，全局再限总数。
+
+    样本保存在 ``{root}/{cmd}/{shape}.jsonl``，每行一条完整命令。
+    """
+    root: Path = Path('output/unknown_cmd')
+    examples_per_shape: int = 3
+    flush_interval: float = 60.
+    sentry_interval: float = 3600.
+    sentry_max_per_minute: int = 10
+
+    # runtime
+    _last_flush: float = 0.
+    _loaded: bool = False
+    _dirty: bool = False
+
+    @cached_property
+    def shapes(self) -> dict[str, dict[str, ShapeStats]]:
+        """cmd -> shape -> stats"""
+        return {}
+
+    @cached_property
+    def _sentry_sent(self) -> deque[float]:
+        return deque()
+
+    @property
+    def summary_path(self) -> Path:
+        return self.root / 'summary.json'
+
+    def load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            summary = json.loads(self.summary_path.read_text(encoding='utf-8'))
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            logger.warning(f'ignored broken summary {self.summary_path}: {e!r}')
+            return
+        for name, shapes in summary.items():
+            self.shapes[name] = {h: ShapeStats.model_validate(s) for h, s in shapes.items()}
+
+    def flush(self):
+        if not self._dirty:
+            return
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.summary_path.with_name('summary.json.tmp')
+        tmp.write_text(json.dumps({name: {h: s.model_dump() for h, s in shapes.items()}
+                                   for name, shapes in self.shapes.items()}, indent=2), encoding='utf-8')
+        os.replace(tmp, self.summary_path)
+        self._dirty = False
+        self._last_flush = time.monotonic()
+
+    def record(self, name: str, sample: dict, shape_of: Any = None) -> tuple[str, bool]:
+        """记录一次出现，返回 (结构哈希, 是否为新结构)
+
+        :param name: 分组名，一般是 cmd
+        :param sample: 要保存的样本
+        :param shape_of: 按它计算结构，默认为 *sample*
+        """
+        self.load()
+        h = shape_hash(sample if shape_of is None else shape_of)
+        now = time.time()
+        stats = self.shapes.setdefault(name, {}).get(h)
+        new = stats is None
+        if new:
+            stats = self.shapes[name][h] = ShapeStats(first_seen=now)
+            logger.info(f'new shape {h} of {name}')
+        stats.count += 1
+        stats.last_seen = now
+        if stats.stored < self.examples_per_shape:
+            stats.stored += 1
+            path = self.root / name / f'{h}.jsonl'
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with path.open('a', encoding='utf-8') as f:
+                f.write(json.dumps(sample, ensure_ascii=False))
+                f.write('\n')
+        self._dirty = True
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+        return h, new
+
+    def should_report(self, name: str, h: str) -> bool:
+        """每个结构每 *sentry_interval* 至多一次，全局每分钟至多 *sentry_max_per_minute* 次"""
+        stats = self.shapes[name][h]
+        now = time.time()
+        if stats.reported and now - stats.reported < self.sentry_interval:
+            return False
+        sent = self._sentry_sent
+        while sent and now - sent[0] > 60:
+            sent.popleft()
+        if len(sent) >= self.sentry_max_per_minute:
+            return False
+        sent.append(now)
+        stats.reported = now
+        return True
+
+    def capture(self, name: str, sample: dict, *, shape_of: Any = None, event: dict, **kwargs):
+        """记录并在限频内上报 Sentry"""
+        h, _ = self.record(name, sample, shape_of)
+        if self.should_report(name, h):
+            stats = self.shapes[name][h]
+            tags = {**kwargs.pop('tags', {}), 'shape': h}
+            sentry_sdk.capture_event(event={**event, 'extra': {'occurrences': stats.count}}, tags=tags, **kwargs)
+
+    def stats(self) -> dict:
+        return {name: {h: s.count for h, s in shapes.items()} for name, shapes in self.shapes.items()}
+
+    def counters(self) -> dict:
+        return {'cmds': len(self.shapes), 'shapes': sum(map(len, self.shapes.values())),
+                'occurrences': sum(s.count for shapes in self.shapes.values() for s in shapes.values())}
+
+
+def iter_samples(root: Path, name: str | None = None) -> Iterator[tuple[str, dict]]:
+    """遍历保存的样本，产出 (分组名, 样本)；兼容旧的 ``{cmd}.json`` 文件"""
+    decoder = json.JSONDecoder()
+    for path in sorted(root.glob('*.json') if name is None else [root / f'{name}.json']):
+        if path.name == 'summary.json' or not path.exists():
+            continue
+        text = path.read_text('utf-8')
+        idx = 0
+        while idx < len(text):
+            if text[idx].isspace():
+                idx += 1
+                continue
+            sample, idx = decoder.raw_decode(text, idx)
+            yield path.stem, sample
+    for path in sorted(root.glob('*/*.jsonl') if name is None else (root / name).glob('*.jsonl')):
+        with path.open(encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield path.parent.name, json.loads(line)
+
+
+_shared_unknown_sampler: UnknownCmdSampler | None = None
+
+
+def shared_unknown_sampler() -> UnknownCmdSampler:
+    global _shared_unknown_sampler
+    if _shared_unknown_sampler is None:
+        _shared_unknown_sampler = UnknownCmdSampler()
+        metrics.registry.register_stats('unknown_cmd', _shared_unknown_sampler.counters)
+        atexit.register(_shared_unknown_sampler.flush)
+    return _shared_unknown_sampler
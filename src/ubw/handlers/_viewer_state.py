@@ -0,0 +1,231 @@
+"""按 uid 保存的观众状态，所有字段存在 ``array`` 里，每个观众只占几百字节
+
+每个观众一个槽位：上次进场 / 上次弹幕时间、最近 *memory_limit* 条弹幕的文本哈希和分数组成的环，
+以及环内不同文本数、分数和，均在写入时增量更新。按最近访问顺序淘汰（LRU），超过 *ttl* 未出现的也会淘汰。
+发过弹幕的观众另有一个环内哈希 -> 次数的小字典，复读计数不用扫描环。
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+from array import array
+from datetime import timedelta
+from functools import cached_property
+from pathlib import Path
+from typing import NamedTuple
+
+from pydantic import BaseModel
+
+__all__ = ('ViewerState', 'ViewerStateStore', 'msg_hash',)
+
+logger = logging.getLogger('ubw.handlers.viewer_state')
+
+_SNAPSHOT_VERSION = 1
+
+
+def msg_hash(msg: str) -> int:
+    """跨进程稳定的 64 位哈希，快照恢复后仍能判断复读"""
+    return int.from_bytes(hashlib.blake2b(msg.encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+
+
+class ViewerState(NamedTuple):
+    """
+    :var entrance: 上次进场时间（epoch 秒），没有记录为 ``None``
+    :var danmu: 本条之前的上次弹幕时间
+    :var repeats: 本条文本在环内出现的次数（含本条）
+    :var distinct: 环内不同文本数
+    :var score: 环内之前各条的分数和
+    """
+    entrance: float | None
+    danmu: float | None
+    repeats: int
+    distinct: int
+    score: int
+
+
+class _Columns:
+    """槽位 i 的字段在各数组的第 i 项；环形字段占 ``[i * L, (i + 1) * L)``"""
+    SCALARS = (('uids', 'q'), ('touched', 'd'), ('entrance', 'd'), ('danmu', 'd'),
+               ('pos', 'H'), ('length', 'H'), ('distinct', 'H'), ('score', 'q'))
+    RINGS = (('hashes', 'q'), ('scores', 'i'))
+
+    def __init__(self):
+        for name, typecode in self.SCALARS + self.RINGS:
+            setattr(self, name, array(typecode))
+
+    def arrays(self) -> list[tuple[str, array]]:
+        return [(name, getattr(self, name)) for name, _ in self.SCALARS + self.RINGS]
+
+
+class ViewerStateStore(BaseModel):
+    memory_limit: int = 20
+    max_viewers: int = 1 << 18
+    ttl: timedelta | None = timedelta(days=7)
+
+    # runtime
+    _evicted: int = 0
+
+    @cached_property
+    def _cols(self) -> _Columns:
+        return _Columns()
+
+    @cached_property
+    def _slots(self) -> dict[int, int]:
+        """uid -> 槽位，按最近访问排序"""
+        return {}
+
+    @cached_property
+    def _free(self) -> list[int]:
+        return []
+
+    @cached_property
+    def _counts(self) -> dict[int, dict[int, int]]:
+        """槽位 -> 环内各文本哈希的出现次数，首次用到时由环建立"""
+        return {}
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, uid: int):
+        return uid in self._slots
+
+    def _expire(self, now: float):
+        if self.ttl is None:
+            return
+        deadline = now - self.ttl.total_seconds()
+        touched = self._cols.touched
+        while self._slots:
+            uid, slot = next(iter(self._slots.items()))
+            if touched[slot] >= deadline:
+                break
+            self._evict(uid)
+
+    def _evict(self, uid: int):
+        slot = self._slots.pop(uid)
+        self._counts.pop(slot, None)
+        self._free.append(slot)
+        self._evicted += 1
+
+    def _alloc(self, uid: int) -> int:
+        c = self._cols
+        if self._free:
+            slot = self._free.pop()
+            c.uids[slot] = uid
+            c.entrance[slot] = c.danmu[slot] = 0.
+            c.pos[slot] = c.length[slot] = c.distinct[slot] = c.score[slot] = 0
+            return slot
+        slot = len(c.uids)
+        for name, _ in _Columns.SCALARS:
+            getattr(c, name).append(0)
+        c.uids[slot] = uid
+        c.hashes.extend(array('q', [0]) * self.memory_limit)
+        c.scores.extend(array('i', [0]) * self.memory_limit)
+        return slot
+
+    def _slot_of(self, uid: int, now: float) -> int:
+        self._expire(now)
+        if (slot := self._slots.pop(uid, None)) is None:
+            if len(self._slots) >= self.max_viewers:
+                self._evict(next(iter(self._slots)))
+            slot = self._alloc(uid)
+        self._slots[uid] = slot
+        self._cols.touched[slot] = now
+        return slot
+
+    def see_entrance(self, uid: int, ts: float | None = None):
+        ts = time.time() if ts is None else ts
+        self._cols.entrance[self._slot_of(uid, ts)] = ts
+
+    def push_danmaku(self, uid: int, msg: str, ts: float | None = None) -> ViewerState:
+        """把 *msg* 放进环（挤掉最旧的一条），返回放入后的状态；本条的分数随后用 ``set_score`` 填入"""
+        ts = time.time() if ts is None else ts
+        c = self._cols
+        slot = self._slot_of(uid, ts)
+        size = self.memory_limit
+        base = slot * size
+        n = c.length[slot]
+        if (counts := self._counts.get(slot)) is None:
+            counts = self._counts[slot] = {}
+            for old in c.hashes[base:base + n]:
+                counts[old] = counts.get(old, 0) + 1
+        h = msg_hash(msg)
+        if n == size:
+            i = c.pos[slot]
+            c.score[slot] -= c.scores[base + i]
+            old = c.hashes[base + i]
+            if (left := counts[old] - 1) > 0:
+                counts[old] = left
+            else:
+                del counts[old]
+        else:
+            i = n
+            c.length[slot] = n + 1
+        repeats = counts[h] = counts.get(h, 0) + 1
+        c.distinct[slot] = len(counts)
+        c.hashes[base + i] = h
+        c.scores[base + i] = 0
+        c.pos[slot] = (i + 1) % size
+
+        state = ViewerState(c.entrance[slot] or None, c.danmu[slot] or None, repeats, c.distinct[slot],
+                            c.score[slot])
+        c.danmu[slot] = ts
+        return state
+
+    def set_score(self, uid: int, score: int) -> int:
+        """填入最近一条弹幕的分数，返回环内分数和"""
+        c = self._cols
+        slot = self._slots[uid]
+        c.scores[slot * self.memory_limit + (c.pos[slot] - 1) % self.memory_limit] = score
+        c.score[slot] += score
+        return c.score[slot]
+
+    def save(self, path: Path):
+        """按 LRU 顺序紧凑写出：一行 JSON 头，之后依次是各数组的原始字节"""
+        c = self._cols
+        order = list(self._slots.values())
+        size = self.memory_limit
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + '.tmp')
+        with tmp.open('wb') as f:
+            f.write(json.dumps({'version': _SNAPSHOT_VERSION, 'memory_limit': size, 'count': len(order)}).encode())
+            f.write(b'\n')
+            for name, typecode in _Columns.SCALARS:
+                column = getattr(c, name)
+                array(typecode, (column[s] for s in order)).tofile(f)
+            for name, typecode in _Columns.RINGS:
+                column, out = getattr(c, name), array(typecode)
+                for s in order:
+                    out.extend(column[s * size:(s + 1) * size])
+                out.tofile(f)
+        os.replace(tmp, path)
+
+    def load(self, path: Path) -> bool:
+        """读取 ``save`` 写出的快照，替换当前状态；文件不存在或不兼容时返回 ``False``"""
+        try:
+            with path.open('rb') as f:
+                header = json.loads(f.readline())
+                if header.get('version') != _SNAPSHOT_VERSION or header.get('memory_limit') != self.memory_limit:
+                    logger.warning(f'ignored incompatible viewer state snapshot {path}: {header}')
+                    return False
+                count = header['count']
+                c = _Columns()
+                for name, column in c.arrays():
+                    column.fromfile(f, count * (self.memory_limit if name in dict(_Columns.RINGS) else 1))
+        except FileNotFoundError:
+            return False
+        except (ValueError, EOFError) as e:
+            logger.warning(f'ignored broken viewer state snapshot {path}: {e!r}')
+            return False
+        self.__dict__['_cols'] = c
+        self.__dict__['_slots'] = {uid: slot for slot, uid in enumerate(c.uids)}
+        self.__dict__['_free'] = []
+        self.__dict__['_counts'] = {}
+        self._expire(time.time())
+        while len(self._slots) > self.max_viewers:
+            self._evict(next(iter(self._slots)))
+        return True
+
+    def stats(self) -> dict:
+        return {'viewers': len(self._slots), 'slots': len(self._cols.uids), 'evicted': self._evicted,
+                'bytes': sum(a.itemsize * len(a) for _, a in self._cols.arrays())}
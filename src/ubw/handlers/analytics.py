@@ -0,0 +1,219 @@
+"""按房间的滚动窗口统计：弹幕数、发言人数、礼物 / 上舰 / SC 营收、进场数、人气值
+
+每个窗口把时长等分为 *buckets* 个桶，每项统计一个定长 ``array('d')`` 环，写入只改当前桶和累计值，
+时间前进时清掉移出窗口的桶；发言人数用每桶一个位图做线性计数（linear counting），查询时按位或。
+结果定期以置顶记录显示在 stream view 上，并通过 ``metrics`` 输出。
+"""
+import asyncio
+import math
+import time
+from array import array
+from datetime import timedelta
+from functools import cached_property
+
+from ubw.ui.stream_view import *
+from ._base import *
+from .. import metrics
+from ..userdata.sketches import mix64
+
+__all__ = ('RingWindow', 'RoomAnalytics', 'AnalyticsHandler', 'window_name',)
+
+CHANNELS = ('danmaku', 'gift', 'guard', 'super_chat', 'entries', 'popularity', 'heartbeats')
+
+
+def window_name(span: timedelta) -> str:
+    seconds = int(span.total_seconds())
+    for unit, size in (('d', 86400), ('h', 3600), ('m', 60)):
+        if seconds % size == 0:
+            return f'{seconds // size}{unit}'
+    return f'{seconds}s'
+
+
+class RingWindow:
+    """时长 *span* 秒的滚动窗口，所有通道共用一个桶时钟"""
+    __slots__ = ('span', 'width', 'size', 'bits', 'head', 'data', 'totals', 'senders')
+
+    def __init__(self, span: float, buckets: int = 60, sender_bits: int = 2048):
+        self.span = span
+        self.width = span / buckets
+        self.size = buckets
+        self.bits = sender_bits
+        self.head: int | None = None
+        self.data = {c: array('d', [0.]) * buckets for c in CHANNELS}
+        self.totals = dict.fromkeys(CHANNELS, 0.)
+        self.senders = [0] * buckets
+
+    def _bucket(self, ts: float) -> int | None:
+        """前进到 *ts* 所在的桶，返回其下标；早于窗口的返回 ``None``"""
+        idx = int(ts // self.width)
+        if self.head is None:
+            self.head = idx
+        elif idx > self.head:
+            steps = idx - self.head
+            if steps >= self.size:
+                for c in CHANNELS:
+                    self.data[c] = array('d', [0.]) * self.size
+                    self.totals[c] = 0.
+                self.senders = [0] * self.size
+            else:
+                for k in range(self.head + 1, idx + 1):
+                    i = k % self.size
+                    for c, column in self.data.items():
+                        self.totals[c] -= column[i]
+                        column[i] = 0.
+                    self.senders[i] = 0
+            self.head = idx
+        elif idx <= self.head - self.size:
+            return None
+        return idx % self.size
+
+    def add(self, ts: float, channel: str, value: float = 1., uid: int | None = None):
+        if (i := self._bucket(ts)) is None:
+            return
+        self.data[channel][i] += value
+        self.totals[channel] += value
+        if uid is not None:
+            self.senders[i] |= 1 << (mix64(uid) % self.bits)
+
+    def distinct_senders(self) -> float:
+        bitmap = 0
+        for b in self.senders:
+            bitmap |= b
+        zeros = self.bits - bitmap.bit_count()
+        if zeros == 0:
+            return self.bits * math.log(self.bits)
+        return -self.bits * math.log(zeros / self.bits)
+
+    def snapshot(self, now: float) -> dict[str, float]:
+        self._bucket(now)
+        t = self.totals
+        return {
+            'danmaku': round(t['danmaku']),
+            'senders': round(self.distinct_senders()),
+            'revenue': round(t['gift'] + t['guard'] + t['super_chat'], 2),
+            'gift': round(t['gift'], 2),
+            'guard': round(t['guard'], 2),
+            'super_chat': round(t['super_chat'], 2),
+            'entries': round(t['entries']),
+            'popularity': round(t['popularity'] / t['heartbeats']) if t['heartbeats'] else 0,
+        }
+
+
+class RoomAnalytics:
+    __slots__ = ('windows',)
+
+    def __init__(self, spans: list[timedelta], buckets: int = 60, sender_bits: int = 2048):
+        self.windows = {window_name(span): RingWindow(span.total_seconds(), buckets, sender_bits) for span in spans}
+
+    def add(self, ts: float, channel: str, value: float = 1., uid: int | None = None):
+        for window in self.windows.values():
+            window.add(ts, channel, value, uid)
+
+    def snapshot(self, now: float | None = None) -> dict[str, dict[str, float]]:
+        now = time.time() if now is None else now
+        return {name: window.snapshot(now) for name, window in self.windows.items()}
+
+
+class AnalyticsHandler(BaseHandler):
+    cls: Literal['analytics'] = 'analytics'
+
+    windows: list[timedelta] = [timedelta(minutes=1), timedelta(minutes=5), timedelta(hours=1)]
+    buckets: int = 60
+    sender_bits: int = 2048
+    refresh_interval: timedelta = timedelta(seconds=10)
+    publish_metrics: bool = True
+
+    # DI
+    ui: StreamView = Richy()
+    owned_ui: bool = True
+
+    # runtime
+    _ui_started: bool = False
+    _refresh_task: asyncio.Task | None = None
+
+    @cached_property
+    def rooms(self) -> dict[int, RoomAnalytics]:
+        return {}
+
+    @cached_property
+    def _ui_keys(self) -> dict[int, str]:
+        return {}
+
+    def room(self, room_id: int) -> RoomAnalytics:
+        if (room := self.rooms.get(room_id)) is None:
+            room = self.rooms[room_id] = RoomAnalytics(self.windows, self.buckets, self.sender_bits)
+        return room
+
+    def stats(self) -> dict:
+        now = time.time()
+        return {room_id: room.snapshot(now) for room_id, room in list(self.rooms.items())}
+
+    async def start(self, client):
+        self.room(client.room_id)
+        if self.owned_ui and not self._ui_started:
+            await self.ui.start()
+            self._ui_started = True
+        if self.publish_metrics:
+            metrics.registry.register_stats('analytics', self.stats, label='room')
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self.t_refresh())
+
+    async def stop(self):
+        task, self._refresh_task = self._refresh_task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await super().stop()
+        if self.owned_ui and self._ui_started:
+            await self.ui.stop()
+            self._ui_started = False
+
+    @staticmethod
+    def make_record(room_id: int, snapshot: dict[str, dict[str, float]]) -> Record:
+        segments = [PlainText(text=f"[{room_id}] ")]
+        for name, s in snapshot.items():
+            segments.append(PlainText(
+                text=f"{name}：弹幕 {s['danmaku']}（{s['senders']} 人） 营收 ¥{s['revenue']:.1f} "
+                     f"进场 {s['entries']} 人气 {s['popularity']}"))
+            segments.append(LineBreak())
+        return Record(segments=segments[:-1], importance=0)
+
+    async def refresh_records(self):
+        for room_id, snapshot in self.stats().items():
+            record = self.make_record(room_id, snapshot)
+            if room_id in self._ui_keys:
+                await self.ui.edit_record(self._ui_keys[room_id], record=record)
+            else:
+                self._ui_keys[room_id] = await self.ui.add_record(record, sticky=True)
+
+    async def t_refresh(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval.total_seconds())
+            await self.refresh_records()
+
+    async def on_danmu_msg(self, client, message: models.DanmakuCommand):
+        self.room(client.room_id).add(message.ct.timestamp(), 'danmaku', uid=message.info.uid)
+
+    async def on_send_gift(self, client, message: models.GiftCommand):
+        if message.data.coin_type == 'gold':
+            self.room(client.room_id).add(message.ct.timestamp(), 'gift',
+                                          message.data.price * message.data.num / 1000)
+
+    async def on_guard_buy(self, client, message: models.GuardBuyCommand):
+        self.room(client.room_id).add(message.ct.timestamp(), 'guard', message.data.price * message.data.num / 1000)
+
+    async def on_super_chat_message(self, client, message: models.SuperChatCommand):
+        self.room(client.room_id).add(message.ct.timestamp(), 'super_chat', message.data.price)
+
+    async def on_interact_word(self, client, model: models.InteractWordCommand):
+        if model.data.msg_type == 1:  # 进入
+            self.room(client.room_id).add(model.ct.timestamp(), 'entries')
+
+    async def on_x_ubw_heartbeat(self, client, message: models.XHeartbeatCommand):
+        room = self.room(client.room_id)
+        ts = message.ct.timestamp()
+        room.add(ts, 'popularity', message.popularity)
+        room.add(ts, 'heartbeats')
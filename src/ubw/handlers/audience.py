@@ -0,0 +1,88 @@
+"""按 (日期, 房间) 统计去重观众 / 发言人数
+
+进场、弹幕、礼物的 uid 记入 ``viewers``，弹幕的 uid 另记入 ``chatters``。每个房间每天每类只保存一个
+HyperLogLog 和一个 bottom-k 草图（约 6 KB），定期合并进 ``SketchStore``，之后清空内存里的草图重新累计。
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from functools import cached_property
+from pathlib import Path
+
+from ._base import *
+from ..userdata.sketches import RoomDaySketch, SketchStore
+
+__all__ = ('AudienceHandler',)
+
+logger = logging.getLogger('ubw.handlers.audience')
+
+
+class AudienceHandler(BaseHandler):
+    cls: Literal['audience'] = 'audience'
+
+    path: Path | None = None
+    precision: int = 12
+    k: int = 256
+    flush_interval: timedelta = timedelta(minutes=1)
+
+    # runtime
+    _flush_task: asyncio.Task | None = None
+
+    @cached_property
+    def store(self) -> SketchStore:
+        return SketchStore(self.path)
+
+    @cached_property
+    def pending(self) -> dict[tuple[str, int, str], RoomDaySketch]:
+        return {}
+
+    def add(self, room_id: int, ct: datetime, kind: str, uid: int):
+        key = (ct.astimezone().date().isoformat(), room_id, kind)
+        if (sketch := self.pending.get(key)) is None:
+            sketch = self.pending[key] = RoomDaySketch(self.precision, self.k)
+        sketch.add(uid)
+
+    async def flush(self):
+        if not self.pending:
+            return
+        pending = self.pending.copy()
+        self.pending.clear()
+        try:
+            await asyncio.to_thread(self.store.merge, pending)
+        except Exception as e:
+            logger.exception(f'failed to merge {len(pending)} sketches into {self.store.path}', exc_info=e)
+            for key, sketch in pending.items():  # 放回去，下次再试
+                if (newer := self.pending.get(key)) is not None:
+                    sketch.hll.merge(newer.hll)
+                    sketch.kmv.merge(newer.kmv)
+                self.pending[key] = sketch
+
+    async def t_flush(self):
+        while True:
+            await asyncio.sleep(self.flush_interval.total_seconds())
+            await self.flush()
+
+    async def start(self, client):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self.t_flush())
+
+    async def stop(self):
+        task, self._flush_task = self._flush_task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+        await super().stop()
+
+    async def on_interact_word(self, client, model: models.InteractWordCommand):
+        self.add(client.room_id, model.ct, 'viewers', model.data.uid)
+
+    async def on_danmu_msg(self, client, message: models.DanmakuCommand):
+        self.add(client.room_id, message.ct, 'viewers', message.info.uid)
+        self.add(client.room_id, message.ct, 'chatters', message.info.uid)
+
+    async def on_send_gift(self, client, message: models.GiftCommand):
+        self.add(client.room_id, message.ct, 'viewers', message.data.uid)
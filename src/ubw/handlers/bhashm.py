@@ -1,12 +1,8 @@
-import asyncio
 from datetime import datetime
 
-import aiocsv
-import aiofiles
-import aiofiles.os
-
 from ._base import *
 from ..clients import BilibiliUnauthorizedClient
+from ..writer import FileWriter, format_csv_row
 
 live_start_times: dict[int, datetime | None] = {}
 
@@ -16,52 +12,36 @@ async def get_live_start_time(room_id: int) -> datetime | None:
         return (await client.get_info_by_room(room_id)).room_info.live_start_time
 
 
-def create_csv_writer(room_id: int) -> tuple[asyncio.Task, asyncio.Queue]:
-    queue = asyncio.Queue()
-
-    async def task():
-        while True:
-            dirname = f"output/bhashm/{room_id}"
-            await aiofiles.os.makedirs(dirname, exist_ok=True)
-            filename = f"{dirname}/{room_id}_{datetime.now().astimezone().strftime('%Y年%m月%d日%H点%M%S')}.csv"
-            mode: Literal['a', 'w']
-            if await aiofiles.os.path.isfile(filename):
-                mode = 'a'
-            else:
-                mode = 'w'
-
-            async with aiofiles.open(filename, mode=mode, encoding='utf-8', newline="") as afp:
-                writer = aiocsv.AsyncDictWriter(afp, ['time', 't', 'marker', 'symbol'])
-                if mode == 'w':
-                    await writer.writeheader()
-                    await afp.flush()
-
-                while True:
-                    to_write = await queue.get()
-                    if to_write == 'RESTART':
-                        live_start_times[room_id] = await get_live_start_time(room_id)
-                        queue.task_done()
-                        break
-                    else:
-                        await writer.writerow(to_write)
-                        await afp.flush()
-                        queue.task_done()
-
-    task = asyncio.create_task(task())
-    return task, queue
+CSV_FIELDS = ['time', 't', 'marker', 'symbol']
+
+
+def create_csv_writer(room_id: int) -> FileWriter:
+    filename = f"output/bhashm/{room_id}/{room_id}_{datetime.now().astimezone().strftime('%Y年%m月%d日%H点%M%S')}.csv"
+    return FileWriter(path=filename, header=format_csv_row(CSV_FIELDS))
 
 
 class HashMarkHandler(BaseHandler):
     cls: Literal['bhashm'] = 'bhashm'
     famous_people: list[int] = []
 
-    _csv_writer_task: dict[int, asyncio.Task] = {}
-    _csv_queues: dict[int, asyncio.Queue] = {}
+    _csv_writers: dict[int, FileWriter] = {}
+
+    def get_csv_writer_for(self, room_id) -> FileWriter:
+        if room_id not in self._csv_writers:
+            self._csv_writers[room_id] = create_csv_writer(room_id)
+        return self._csv_writers[room_id]
+
+    async def restart(self, room_id):
+        """开播 / 下播时换一个文件，并重新获取开播时间"""
+        if (writer := self._csv_writers.pop(room_id, None)) is not None:
+            await writer.close()
+        live_start_times[room_id] = await get_live_start_time(room_id)
 
-    def get_csv_queue_for(self, room_id) -> asyncio.Queue:
-        if room_id not in self._csv_queues:
-            self._csv_writer_task[room_id], self._csv_queues[room_id] = create_csv_writer(room_id)
-        return self._csv_queues[room_id]
+    async def close(self):
+        for writer in self._csv_writers.values():
+            await writer.close()
+        self._csv_writers.clear()
+        await super().close()
 
     async def on_summary(self, client, summary):
         line = rf"\[{summary.raw.ct.strftime('%Y-%m-%d %H:%M:%S')}] " \
@@ -88,13 +68,13 @@ class HashMarkHandler(BaseHandler):
                 rf"\[[bright_cyan]{client.room_id}[/]] "
                 f"[blue]marker[/] {uname}: "
                 f"[bright_white]{escape(msg)}[/][bright_green]{live_start_suffix}[/]")
-            await self.get_csv_queue_for(room_id).put({
+            await self.get_csv_writer_for(room_id).write(format_csv_row(CSV_FIELDS, {
                 'time': (
                     time.astimezone()
                     .replace(tzinfo=None)
                     .isoformat(sep=" ", timespec='seconds')),
                 't': t, 'marker': uname, 'symbol': msg
-            })
+            }))
         elif message.info.uid in self.famous_people:
             rich.print(
                 rf"\[{message.ct.strftime('%Y-%m-%d %H:%M:%S')}] "
@@ -138,14 +118,14 @@ class HashMarkHandler(BaseHandler):
             rf"\[{message.ct.strftime('%Y-%m-%d %H:%M:%S')}] "
             rf"\[[bright_cyan]{client.room_id}[/]] "
             "[black on #eeaaaa]:black_right__pointing_triangle_with_double_vertical_bar-text:直播开始[/]")
-        await self.get_csv_queue_for(client.room_id).put('RESTART')
+        await self.restart(client.room_id)
 
     async def on_preparing(self, client, message):
         rich.print(
             rf"\[{message.ct.strftime('%Y-%m-%d %H:%M:%S')}] "
             rf"\[[bright_cyan]{client.room_id}[/]] "
             "[black on #eeaaaa]:black_square_for_stop-text:直播结束[/]")
-        await self.get_csv_queue_for(client.room_id).put('RESTART')
+        await self.restart(client.room_id)
 
     async def on_notice_msg(self, client, model):
         if model.msg_type in {1, 2}:
@@ -6,7 +6,9 @@ from functools import cached_property
 from aiotinydb import AIOTinyDB
 
 from ._base import *
-from ..clients import BilibiliUnauthorizedClient
+from ..clients import BilibiliUnauthorizedClient, dup_of
+from ..userdata.compact import compact_in_background
+from ..userdata.shards import SHARD_ROOTS
 
 logger = logging.getLogger('blive_dumpraw')
 
@@ -15,9 +17,12 @@ class DumpRawHandler(BaseHandler):
     cls: Literal['dump_raw'] = 'dump_raw'
     max_shard_length: timedelta = timedelta(days=1)
     room_id: int
+    # 切换分片后在后台进程里压缩本房间已关闭的分片，见 ubw compact
+    compact_closed: bool = False
     _living: bool = False
     _wait_sharding: asyncio.Future | None = None
     _sharder_task: asyncio.Task | None = None
+    _compact_task: asyncio.Task | None = None
 
     async def start(self, client):
         self._sharder_task = asyncio.create_task(self.t_sharder())
@@ -34,6 +39,8 @@ class DumpRawHandler(BaseHandler):
             await task
         except asyncio.CancelledError:
             pass
+        if self._compact_task is not None:
+            self._compact_task.cancel()
         await super().stop()
 
     @cached_property
@@ -52,6 +59,8 @@ class DumpRawHandler(BaseHandler):
         if cmd in self.ignored_cmd:
             logger.debug(f"got a {cmd}, processed with ignore")
             return
+        if dup_of(command) is not None:  # 其他房间已经存过
+            return
         async with self.db as db:
             logger.debug(f"got a {cmd}, logged")
             db.insert(command)
@@ -76,3 +85,15 @@ class DumpRawHandler(BaseHandler):
         self.__dict__.pop('db', None)
         async with self.db as db:
             db.insert(info.model_dump(exclude_defaults=True, by_alias=True))
+        if self.compact_closed:
+            self.s_compact()
+
+    def s_compact(self):
+        if self._compact_task is None or self._compact_task.done():
+            self._compact_task = asyncio.create_task(self.t_compact())
+
+    async def t_compact(self):
+        try:
+            await compact_in_background(SHARD_ROOTS['dump_raw'], self.room_id)
+        except Exception as e:
+            logger.exception("exception in t_compact()", exc_info=e)
@@ -1,9 +1,8 @@
 import json
 import logging
 
-import aiofiles
-
 from ._base import *
+from ..writer import shared_writer
 
 logger = logging.getLogger('edge_collect')
 
@@ -63,5 +62,5 @@ class EdgeCollector(BaseHandler):
 
         if reason:
             logger.info(f"collected a {cmd}, {reason=}")
-            async with aiofiles.open(f"output/edge_collect/{reason}.json", mode='a', encoding='utf-8') as afp:
-                await afp.write(json.dumps(command, indent=2, ensure_ascii=False))
+            await shared_writer(f"output/edge_collect/{reason}.json").write(
+                json.dumps(command, indent=2, ensure_ascii=False))
@@ -1,12 +1,13 @@
 import asyncio
 import random
 from datetime import datetime, timedelta
+from functools import partial, cached_property
 
 from pydantic import Field, BaseModel
 
 from ubw.ui.stream_view import *
 from ._base import *
-from ..clients import BilibiliClient
+from ..clients import BilibiliClient, LiveStatusPoller
 
 
 class Info(BaseModel):
@@ -44,10 +45,13 @@ class LivingStatusHandler(BaseHandler):
 
     # low config
     active_refresh_interval: timedelta = timedelta(seconds=60)
+    poll_status: bool = True
 
     # DI
     bilibili_client: BilibiliClient
     bilibili_client_owner: bool = True
+    status_poller: LiveStatusPoller | None = None
+    owned_status_poller: bool = True
     ui: StreamView = Richy()
     owned_ui: bool = True
 
@@ -61,6 +65,10 @@ class LivingStatusHandler(BaseHandler):
     _ui_started: bool = False
     _refresh_task: asyncio.Task | None = None
 
+    @cached_property
+    def _status_callbacks(self) -> dict[int, tuple[int, partial]]:
+        return {}
+
     async def join(self):
         await asyncio.gather(super().join(), self._refresh_task)
 
@@ -89,6 +97,13 @@ class LivingStatusHandler(BaseHandler):
         await self.refresh_record(room_id)
         if self._refresh_task is None:
             self._refresh_task = asyncio.create_task(self.t_active_refresh())
+        if self.poll_status and room_id not in self._status_callbacks:
+            if self.status_poller is None:
+                self.status_poller = LiveStatusPoller(bilibili_client=self.bilibili_client, bilibili_client_owner=False)
+            uid = self.info_cache[room_id].up_id
+            callback = partial(self.on_polled_status, client)
+            self._status_callbacks[room_id] = uid, callback
+            self.status_poller.subscribe(uid, callback)
 
     async def stop(self):
         task = self._refresh_task
@@ -99,6 +114,13 @@ class LivingStatusHandler(BaseHandler):
         except asyncio.CancelledError:
             pass
 
+        if self.status_poller is not None:
+            for uid, callback in self._status_callbacks.values():
+                self.status_poller.unsubscribe(uid, callback)
+            self._status_callbacks.clear()
+            if self.owned_status_poller:
+                await self.status_poller.stop_and_close()
+
         await super().stop()
 
         if self.owned_ui and self._ui_started:
@@ -150,6 +172,14 @@ class LivingStatusHandler(BaseHandler):
             to_refresh = random.choice(list(self.info_cache.keys()))
             await self.refresh_record(to_refresh, force_update=True)
 
+    async def on_polled_status(self, client, command: dict):
+        """批量轮询得到的合成消息，已由 websocket 得知的状态变化不再重复处理"""
+        info = self.info_cache.get(client.room_id)
+        if info is not None:
+            if command['cmd'] == 'LIVE' and info.living or command['cmd'] == 'PREPARING' and not info.living:
+                return
+        await self.handle(client, command)
+
     async def on_room_change(self, client, message):
         room_id = client.room_id
         title = message.data.title
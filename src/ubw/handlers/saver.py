@@ -7,11 +7,15 @@ from pathlib import Path
 
 from aiotinydb import AIOTinyDB, AIOJSONStorage
 from aiotinydb.middleware import AIOMiddleware
+from pydantic import BaseModel, Field
 from tinydb_serialization import SerializationMiddleware as _SyncSerializationMiddleware
 from tinydb_serialization.serializers import DateTimeSerializer, Serializer
 
 from ._base import *
-from ..clients import BilibiliUnauthorizedClient
+from ..clients import BilibiliUnauthorizedClient, dup_of
+from ..userdata.archive import EventArchive, shared_event_archive
+from ..userdata.compact import compact_in_background
+from ..userdata.shards import SHARD_ROOTS
 
 logger = logging.getLogger('blive_saver')
 
@@ -37,17 +41,29 @@ class _State(Enum):
 
 
 class SaverHandler(BaseHandler):
+    """
+    :var backend: ``tinydb`` 按直播场次分片写 JSON；``sqlite`` 写入共享的 :class:`EventArchive`，可按索引查询
+    """
     cls: Literal['saver'] = 'saver'
 
     max_shard_length: timedelta = timedelta(days=1)
     room_id: int
+    backend: Literal['tinydb', 'sqlite'] = 'tinydb'
+    # 切换分片后在后台进程里压缩本房间已关闭的分片，见 ubw compact
+    compact_closed: bool = False
+
+    # DI
+    archive: EventArchive = Field(default_factory=shared_event_archive, exclude=True)
 
     _living: _State = _State.init
     _sharder_task: asyncio.Task | None = None
     _shard_timer_handle: asyncio.TimerHandle | None = None
     _shard_event: asyncio.Event | None = None
+    _compact_task: asyncio.Task | None = None
 
     async def start(self, client):
+        if self.backend == 'sqlite':
+            await self.archive.start()
         self._sharder_task = asyncio.create_task(self.t_sharder())
         await super().start(client)
 
@@ -62,6 +78,10 @@ class SaverHandler(BaseHandler):
             await task
         except asyncio.CancelledError:
             pass
+        if self._compact_task is not None:
+            self._compact_task.cancel()
+        if self.backend == 'sqlite':
+            await self.archive.stop()
         await super().stop()
 
     @cached_property
@@ -80,28 +100,34 @@ class SaverHandler(BaseHandler):
         db = AIOTinyDB(fname, storage=serialization)
         return db
 
+    async def save(self, doc: dict | BaseModel, cmd: str | None = None):
+        if dup_of(doc) is not None:  # 其他房间已经存过
+            return
+        if self.backend == 'sqlite':
+            self.archive.put(self.room_id, doc, cmd=cmd)
+            return
+        if isinstance(doc, BaseModel):
+            doc = doc.model_dump(exclude_defaults=True, by_alias=True)
+        async with self.db as db:
+            db.insert(doc)
+
     async def on_danmu_msg(self, client, message):
         logger.debug(f"{message.info.uname} ({message.info.uid}): {message.info.msg}")
-        async with self.db as db:
-            db.insert(message.model_dump(exclude_defaults=True, by_alias=True))
+        await self.save(message)
 
     async def on_send_gift(self, client, message):
-        async with self.db as db:
-            db.insert(message.model_dump(exclude_defaults=True, by_alias=True))
+        await self.save(message)
 
     async def on_guard_buy(self, client, message):
-        async with self.db as db:
-            db.insert(message.model_dump(exclude_defaults=True, by_alias=True))
+        await self.save(message)
 
     async def on_super_chat_message(self, client, message):
         logger.debug(f"{message.data.user_info.uname} ({message.data.uid}): "
                      f"{message.data.message} (¥{message.data.price})")
-        async with self.db as db:
-            db.insert(message.model_dump(exclude_defaults=True, by_alias=True))
+        await self.save(message)
 
     async def on_room_change(self, client, message):
-        async with self.db as db:
-            db.insert(message.model_dump(exclude_defaults=True, by_alias=True))
+        await self.save(message)
 
     async def on_live(self, client, message):
         if self._living != _State.living:
@@ -118,16 +144,13 @@ class SaverHandler(BaseHandler):
             logger.warning(f'!!STRANGE!! received PREPARING while {self._living=}')
 
     async def on_room_block_msg(self, client, message):
-        async with self.db as db:
-            db.insert(message.model_dump(exclude_defaults=True, by_alias=True))
+        await self.save(message)
 
     async def on_warning(self, client, message):
-        async with self.db as db:
-            db.insert(message.model_dump(exclude_defaults=True, by_alias=True))
+        await self.save(message)
 
     async def on_unknown_cmd(self, client, command, err):
-        async with self.db as db:
-            db.insert({**command, 'UNKNOWN': True})
+        await self.save({**command, 'UNKNOWN': True})
         await super().on_unknown_cmd(client, command, err)
 
     async def t_sharder(self):
@@ -181,10 +204,21 @@ class SaverHandler(BaseHandler):
         logger.info("really making shard")
         self.__dict__.pop('shard_start', None)
         self.__dict__.pop('db', None)
-        async with self.db as db:
-            db.insert(info.model_dump(exclude_defaults=True, by_alias=True))
+        await self.save(info, cmd='X_UBW_INFO_BY_ROOM')
+        if self.compact_closed and self.backend == 'tinydb':
+            self.s_compact()
         if self._shard_timer_handle is not None:
             self._shard_timer_handle.cancel()
         logger.info(f"next sharding in {self.max_shard_length}")
         self._shard_timer_handle = asyncio.get_running_loop().call_later(
             self.max_shard_length.total_seconds(), self.s_shard_now)
+
+    def s_compact(self):
+        if self._compact_task is None or self._compact_task.done():
+            self._compact_task = asyncio.create_task(self.t_compact())
+
+    async def t_compact(self):
+        try:
+            await compact_in_background(SHARD_ROOTS['saver'], self.room_id)
+        except Exception as e:
+            logger.exception("exception in t_compact()", exc_info=e)
@@ -3,12 +3,10 @@ import functools
 import json
 import logging
 import pathlib
-from datetime import datetime
-
-import aiofiles
 
 from ._base import *
 from ..models.blive.danmu_msg import parse_danmaku_info
+from ..writer import FileWriter, shared_writer
 
 logger = logging.getLogger('shark')
 
@@ -96,13 +94,15 @@ class SharkHandler(BaseHandler):
 
     rule: str
     out_dir: pathlib.Path
+    rotate_size: int | None = 64 << 20
+
+    @property
+    def writer(self) -> FileWriter:
+        return shared_writer(self.out_dir / '{date}.jsonl', rotate_size=self.rotate_size)
 
     async def process_one(self, client, command):
         try:
             if eval_on_cmd(parse_expr(self.rule), command):
-                basename = str(datetime.now().replace(microsecond=0)).replace(':', '.')
-                async with aiofiles.open(self.out_dir / f"{basename}.json",
-                                         mode='a', encoding='utf-8') as afp:
-                    await afp.write(json.dumps(command, indent=2, ensure_ascii=False))
+                await self.writer.write(json.dumps(command, ensure_ascii=False) + '\n')
         except Exception as e:
             logger.exception("exception", exc_info=e)
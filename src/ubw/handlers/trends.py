@@ -0,0 +1,174 @@
+"""弹幕热词和突增提醒
+
+缓存命中的弹幕直接计数；未命中的攒成一批，每 *batch_interval* 交给分词进程池一次，积压超过 *max_pending* 时丢弃。
+每个房间的热词以置顶记录显示，新出现的突增另发一条记录。
+"""
+import asyncio
+import logging
+import time
+from datetime import timedelta
+from functools import cached_property
+
+from pydantic import model_validator
+
+from ubw.ui.stream_view import *
+from ._base import *
+from .. import metrics
+from ..phrases import PhraseTrends, Tokenizer, normalize
+
+__all__ = ('TrendsHandler',)
+
+logger = logging.getLogger('ubw.handlers.trends')
+
+
+class TrendsHandler(BaseHandler):
+    cls: Literal['trends'] = 'trends'
+
+    short_window: timedelta = timedelta(minutes=1)
+    long_window: timedelta = timedelta(minutes=10)
+    buckets: int = 6
+    cms_width: int = 2048
+    cms_depth: int = 4
+    top_k: int = 8
+    spike_ratio: float = 3.
+    spike_min_count: int = 8
+    workers: int = 1
+    batch_interval: timedelta = timedelta(milliseconds=250)
+    batch_size: int = 512
+    max_pending: int = 20000
+    cache_size: int = 1 << 16
+    refresh_interval: timedelta = timedelta(seconds=10)
+    publish_metrics: bool = True
+
+    # DI
+    ui: StreamView = Richy()
+    owned_ui: bool = True
+
+    # runtime
+    _ui_started: bool = False
+    _batch_task: asyncio.Task | None = None
+    _refresh_task: asyncio.Task | None = None
+    _dropped: int = 0
+
+    @model_validator(mode='after')
+    def long_window_longer(self):
+        if self.long_window <= self.short_window:
+            raise ValueError('long window should be longer than short window')
+        return self
+
+    @cached_property
+    def tokenizer(self) -> Tokenizer:
+        return Tokenizer(self.workers, self.cache_size, self.batch_size)
+
+    @cached_property
+    def rooms(self) -> dict[int, PhraseTrends]:
+        return {}
+
+    @cached_property
+    def pending(self) -> list[tuple[int, float, str]]:
+        return []
+
+    @cached_property
+    def _ui_keys(self) -> dict[int, str]:
+        return {}
+
+    @cached_property
+    def _spiking(self) -> dict[int, set[str]]:
+        return {}
+
+    def room(self, room_id: int) -> PhraseTrends:
+        if (room := self.rooms.get(room_id)) is None:
+            room = self.rooms[room_id] = PhraseTrends(
+                self.short_window.total_seconds(), self.long_window.total_seconds(), self.buckets,
+                self.cms_width, self.cms_depth, max_candidates=32 * self.top_k)
+        return room
+
+    def feed(self, room_id: int, ts: float, text: str):
+        text = normalize(text)
+        if not text:
+            return
+        if (tokens := self.tokenizer.cache.get(text)) is not None:
+            self.room(room_id).add(ts, tokens)
+        elif len(self.pending) < self.max_pending:
+            self.pending.append((room_id, ts, text))
+        else:
+            self._dropped += 1
+
+    async def drain(self):
+        """把积压的弹幕分词并计数"""
+        while self.pending:
+            batch = self.pending[:]
+            self.pending.clear()
+            tokenized = await self.tokenizer.tokenize_many([text for _, _, text in batch])
+            for (room_id, ts, _), tokens in zip(batch, tokenized):
+                self.room(room_id).add(ts, tokens)
+
+    async def t_batch(self):
+        while True:
+            await asyncio.sleep(self.batch_interval.total_seconds())
+            try:
+                await self.drain()
+            except Exception as e:
+                logger.exception('failed to tokenize danmaku', exc_info=e)
+
+    def stats(self) -> dict:
+        return {'rooms': len(self.rooms), 'pending': len(self.pending), 'dropped': self._dropped,
+                **self.tokenizer.stats()}
+
+    async def start(self, client):
+        self.room(client.room_id)
+        if self.owned_ui and not self._ui_started:
+            await self.ui.start()
+            self._ui_started = True
+        if self.publish_metrics:
+            metrics.registry.register_stats('trends', self.stats)
+        if self._batch_task is None:
+            self._batch_task = asyncio.create_task(self.t_batch())
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self.t_refresh())
+
+    async def stop(self):
+        for name in ('_batch_task', '_refresh_task'):
+            task = getattr(self, name)
+            setattr(self, name, None)
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self.tokenizer.close()
+        await super().stop()
+        if self.owned_ui and self._ui_started:
+            await self.ui.stop()
+            self._ui_started = False
+
+    async def refresh_records(self, now: float | None = None):
+        now = time.time() if now is None else now
+        for room_id, room in list(self.rooms.items()):
+            top = room.top(now, self.top_k)
+            record = Record(segments=[PlainText(
+                text=f"[{room_id}] 热词：" + ' '.join(f'{phrase}×{n}' for phrase, n in top))], importance=0)
+            if room_id in self._ui_keys:
+                await self.ui.edit_record(self._ui_keys[room_id], record=record)
+            else:
+                self._ui_keys[room_id] = await self.ui.add_record(record, sticky=True)
+
+            spikes = room.spikes(now, self.spike_ratio, self.spike_min_count)
+            previous = self._spiking.get(room_id, set())
+            self._spiking[room_id] = {s.phrase for s in spikes}
+            for spike in spikes:
+                if spike.phrase not in previous:
+                    logger.info(f'room {room_id}: {spike.phrase!r} spiked to {spike.count} '
+                                f'(expected {spike.expected:.1f})')
+                    await self.ui.add_record(Record(segments=[PlainText(
+                        text=f"[{room_id}] 突增：{spike.phrase}×{spike.count}")], importance=20))
+
+    async def t_refresh(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval.total_seconds())
+            await self.refresh_records()
+
+    async def on_danmu_msg(self, client, message: models.DanmakuCommand):
+        if message.info.dm_type == 0:
+            self.feed(client.room_id, message.ct.timestamp(), message.info.msg)
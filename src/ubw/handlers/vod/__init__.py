@@ -1,23 +1,30 @@
-import csv
 import json
 import logging
 import re
 import warnings
-from datetime import timedelta, datetime
 from functools import cached_property
-from operator import itemgetter
-from pathlib import Path
-from typing import IO, ContextManager, AsyncContextManager
+from typing import ContextManager, AsyncContextManager
 
 from bilibili_api import ApiException
-from bilibili_api.video import Video
+from pydantic import Field
 
 from ubw.clients import LiveClientABC, BilibiliClient
 from ubw.models.blive.super_chat_message import SuperChatCommand
 from ubw.ui.stream_view import StreamView, Richy, Record, User, PlainText, Anchor
+from ubw.writer import FileWriter, format_csv_row
 from .._base import *
-
-owner = itemgetter('name', 'mid', 'face')
+from .cache import VideoMetaCache, shared_video_cache
+
+CSV_FIELDS = [
+    # demand info
+    'demander_uname', 'demander_uid', 'demander_face',
+    'vod_time', 'original_text', 'price',
+    'bvid',
+    # video info
+    'duration', 'title', 'cover',
+    'owner_uname', 'owner_uid', 'owner_face',
+    'tags',
+]
 
 _LOG = logging.getLogger('ubw.handlers.vod')
 
@@ -59,47 +66,38 @@ class VodHandler(MultiContextMixin, BaseHandler):
     # DI
     ui: StreamView = Richy()
     owned_ui: bool = True
+    video_cache: VideoMetaCache = Field(default_factory=shared_video_cache, exclude=True)
 
     async def stop(self):
         if self.owned_ui:
             await self.ui.stop()
 
-    @classmethod
-    def format_path(cls, strpath: str) -> Path:
-        if "{date}" in strpath:
-            strpath = strpath.replace("{date}", datetime.today().strftime("%Y%m%d"))
-        path = Path(strpath)
-        path.parent.mkdir(parents=True, exist_ok=True)
-        return path
-
     @cached_property
-    def csv_writer(self) -> csv.DictWriter | None:
+    def csv_writer(self) -> FileWriter | None:
         if self.save_csv is None:
             return None
-        path = self.format_path(self.save_csv)
-        write_header = not path.exists() or path.stat().st_size == 0
-        f = self.with_(open(path, 'a', encoding='utf-8', newline=''))
-        writer = csv.DictWriter(f, [
-            # demand info
-            'demander_uname', 'demander_uid', 'demander_face',
-            'vod_time', 'original_text', 'price',
-            'bvid',
-            # video info
-            'duration', 'title', 'cover',
-            'owner_uname', 'owner_uid', 'owner_face',
-            'tags',
-        ])
-        if write_header:
-            writer.writeheader()
-        return writer
+        return FileWriter(path=self.save_csv, header=format_csv_row(CSV_FIELDS))
 
     @cached_property
-    def jsonl_file(self) -> IO[str] | None:
+    def jsonl_file(self) -> FileWriter | None:
         if self.save_jsonl is None:
             return None
-        path = self.format_path(self.save_jsonl)
-        f = self.with_(open(path, 'a', encoding='utf-8'))
-        return f
+        return FileWriter(path=self.save_jsonl)
+
+    async def close(self):
+        await self.video_cache.save()
+        for writer in (self.csv_writer, self.jsonl_file):
+            if writer is not None:
+                await writer.close()
+        await super().close()
+
+    def write_jsonl(self, record: dict):
+        if (jsonf := self.jsonl_file) is not None:
+            jsonf.write_nowait(json.dumps(record, ensure_ascii=True) + '\n')
+
+    def write_csv(self, row: dict):
+        if (csv_writer := self.csv_writer) is not None:
+            csv_writer.write_nowait(format_csv_row(CSV_FIELDS, row))
 
     async def on_super_chat_message(self, client: LiveClientABC, message: SuperChatCommand):
         bclient: BilibiliClient = client.bilibili_client
@@ -109,9 +107,10 @@ class VodHandler(MultiContextMixin, BaseHandler):
         original_text = message.data.message
         vod_time = message.ct.isoformat()
         price = message.data.price
-        for mat in re.finditer(r"BV\w{,10}", original_text):
+        bvids = [mat.group(0) for mat in re.finditer(r"BV\w{,10}", original_text)]
+        self.video_cache.prefetch(bvids, bclient)
+        for bvid in bvids:
             warning = None
-            bvid = mat.group(0)
             if len(bvid) != 12:
                 warnings.warn(warning := f"{bvid=}长度不足12，可能无法获取信息")
             elif set(bvid) - set('123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'):
@@ -119,14 +118,9 @@ class VodHandler(MultiContextMixin, BaseHandler):
             done_csv = False
             done_jsonl = False
             try:
-                detail = await Video(bvid, credential=await bclient.get_credential()).get_detail()
-                duration = timedelta(seconds=detail['View']['duration'])
-                cover = detail['View']['pic']
-                title = detail['View']['title']
-                print(f"{detail.keys()=}")
-                tags = [f"#{tag_info['tag_name']}#" if tag_info['tag_type'] == 'topic' else tag_info['tag_name']
-                        for tag_info in detail['Tags']]
-                owner_uname, owner_uid, owner_face = owner(detail['View']['owner'])
+                meta = await self.video_cache.get(bvid, bclient)
+                duration, cover, title, tags = meta.duration, meta.cover, meta.title, meta.tags
+                owner_uname, owner_uid, owner_face = meta.owner_uname, meta.owner_uid, meta.owner_face
                 await self.ui.add_record(Record(segments=[
                     User(name=demander_uname, uid=demander_uid, face=demander_face),
                     PlainText(text=" 点播了 "),
@@ -136,46 +130,40 @@ class VodHandler(MultiContextMixin, BaseHandler):
                     PlainText(text="时长：{0}".format(duration)),
                 ]))
 
-                jsonf = self.jsonl_file
-                if jsonf is not None:
-                    json.dump({
-                        'bvid': bvid,
-                        'duration': duration.total_seconds(),
-                        'title': title,
-                        'cover': cover,
-                        'demander_uname': demander_uname,
-                        'demander_uid': demander_uid,
-                        'demander_face': demander_face,
-                        'owner_uname': owner_uname,
-                        'owner_uid': owner_uid,
-                        'owner_face': owner_face,
-                        'vod_time': vod_time,
-                        'original_text': original_text,
-                        'price': (price),
-                        'tags': tags,
-                    }, jsonf, ensure_ascii=True)
-                    jsonf.write('\n')
-                    jsonf.flush()
+                self.write_jsonl({
+                    'bvid': bvid,
+                    'duration': duration.total_seconds(),
+                    'title': title,
+                    'cover': cover,
+                    'demander_uname': demander_uname,
+                    'demander_uid': demander_uid,
+                    'demander_face': demander_face,
+                    'owner_uname': owner_uname,
+                    'owner_uid': owner_uid,
+                    'owner_face': owner_face,
+                    'vod_time': vod_time,
+                    'original_text': original_text,
+                    'price': (price),
+                    'tags': tags,
+                })
                 done_jsonl = True
 
-                csv_writer = self.csv_writer
-                if csv_writer is not None:
-                    csv_writer.writerow({
-                        'bvid': bvid,
-                        'duration': duration.total_seconds(),
-                        'title': title,
-                        'cover': cover,
-                        'demander_uname': demander_uname,
-                        'demander_uid': demander_uid,
-                        'demander_face': demander_face,
-                        'owner_uname': owner_uname,
-                        'owner_uid': owner_uid,
-                        'owner_face': owner_face,
-                        'vod_time': vod_time,
-                        'original_text': original_text,
-                        'price': price,
-                        'tags': '|'.join(tags),
-                    })
+                self.write_csv({
+                    'bvid': bvid,
+                    'duration': duration.total_seconds(),
+                    'title': title,
+                    'cover': cover,
+                    'demander_uname': demander_uname,
+                    'demander_uid': demander_uid,
+                    'demander_face': demander_face,
+                    'owner_uname': owner_uname,
+                    'owner_uid': owner_uid,
+                    'owner_face': owner_face,
+                    'vod_time': vod_time,
+                    'original_text': original_text,
+                    'price': price,
+                    'tags': '|'.join(tags),
+                })
                 done_csv = True
             except ApiException as e:
                 _LOG.error(warning := f"获取{bvid=}视频信息出错：{e.msg}")
@@ -184,32 +172,26 @@ class VodHandler(MultiContextMixin, BaseHandler):
 
             # 尝试拯救一些信息，避免真丢失
             if not done_jsonl:
-                jsonf = self.jsonl_file
-                if jsonf is not None:
-                    json.dump({
-                        '_broken': True,
-                        'bvid': bvid,
-                        'demander_uname': demander_uname,
-                        'demander_uid': demander_uid,
-                        'demander_face': demander_face,
-                        'vod_time': vod_time,
-                        'original_text': original_text,
-                        'price': price,
-                        'warning': warning,
-                    }, jsonf, ensure_ascii=True)
-                    jsonf.write('\n')
-                    jsonf.flush()
+                self.write_jsonl({
+                    '_broken': True,
+                    'bvid': bvid,
+                    'demander_uname': demander_uname,
+                    'demander_uid': demander_uid,
+                    'demander_face': demander_face,
+                    'vod_time': vod_time,
+                    'original_text': original_text,
+                    'price': price,
+                    'warning': warning,
+                })
             if not done_csv:
-                csv_writer = self.csv_writer
-                if csv_writer is not None:
-                    csv_writer.writerow({
-                        'bvid': bvid,
-                        'demander_uname': demander_uname,
-                        'demander_uid': demander_uid,
-                        'demander_face': demander_face,
-                        'vod_time': vod_time,
-                        'original_text': original_text,
-                        'price': price,
-                        'warning': warning,
-                        'duration': '_broken',
-                    })
+                self.write_csv({
+                    'bvid': bvid,
+                    'demander_uname': demander_uname,
+                    'demander_uid': demander_uid,
+                    'demander_face': demander_face,
+                    'vod_time': vod_time,
+                    'original_text': original_text,
+                    'price': price,
+                    'warning': warning,
+                    'duration': '_broken',
+                })
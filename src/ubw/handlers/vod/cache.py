@@ -0,0 +1,192 @@
+"""点播用的视频信息缓存：bvid -> 标题、时长、作者、标签、封面
+
+同一首歌一场直播会被点很多次，``get_detail`` 又慢；这里按 *ttl* 缓存并持久化到缓存目录，
+同一 bvid 的并发请求合并为一次，一条 SC 里的多个 bvid 可以用 ``prefetch`` 同时请求。
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import timedelta
+from functools import cached_property
+from pathlib import Path
+from typing import Iterable
+
+from bilibili_api.video import Video
+from pydantic import BaseModel, Field, TypeAdapter
+
+from ... import metrics
+from ...clients import BilibiliClient
+
+__all__ = ('VideoMeta', 'VideoMetaCache', 'shared_video_cache',)
+
+logger = logging.getLogger('ubw.handlers.vod.cache')
+
+
+def _default_path() -> Path:
+    from ...userdata.paths import get_path
+    return get_path(ensure_exists=False).cache_path / 'video_meta.json'
+
+
+class VideoMeta(BaseModel):
+    """
+    :var tags: 话题标签带 ``#``，与 ``VodHandler`` 保存的格式一致
+    :var fetched: 获取时间（epoch 秒）
+    """
+    bvid: str
+    title: str
+    duration: timedelta
+    cover: str
+    owner_uname: str
+    owner_uid: int
+    owner_face: str
+    tags: list[str] = []
+    fetched: float
+
+    @classmethod
+    def from_detail(cls, bvid: str, detail: dict) -> 'VideoMeta':
+        owner = detail['View']['owner']
+        return cls(
+            bvid=bvid,
+            title=detail['View']['title'],
+            duration=timedelta(seconds=detail['View']['duration']),
+            cover=detail['View']['pic'],
+            owner_uname=owner['name'], owner_uid=owner['mid'], owner_face=owner['face'],
+            tags=[f"#{tag_info['tag_name']}#" if tag_info['tag_type'] == 'topic' else tag_info['tag_name']
+                  for tag_info in detail.get('Tags') or []],
+            fetched=time.time(),
+        )
+
+
+_entries_adapter = TypeAdapter(dict[str, VideoMeta])
+
+
+class VideoMetaCache(BaseModel):
+    """失败不缓存，下次点播时重试"""
+    path: Path = Field(default_factory=_default_path)
+    ttl: timedelta = timedelta(days=7)
+    max_entries: int = 65536
+    save_interval: float = 10.
+
+    # runtime
+    _last_save: float = 0.
+    _dirty: bool = False
+    _saving: asyncio.Task | None = None
+    _loaded: bool = False
+
+    @cached_property
+    def entries(self) -> dict[str, VideoMeta]:
+        return {}
+
+    @cached_property
+    def _inflight(self) -> dict[str, asyncio.Task[VideoMeta]]:
+        return {}
+
+    @cached_property
+    def _stats(self) -> dict[str, int]:
+        return {'hits': 0, 'misses': 0, 'coalesced': 0, 'errors': 0}
+
+    def load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            self.entries.update(_entries_adapter.validate_json(self.path.read_bytes()))
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            logger.warning(f'ignored broken video cache {self.path}: {e!r}')
+
+    def _write(self, entries: dict[str, VideoMeta]):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        tmp.write_bytes(_entries_adapter.dump_json(entries))
+        os.replace(tmp, self.path)
+
+    async def save(self):
+        """在线程里写出快照，不阻塞事件循环"""
+        saving = self._saving
+        if (saving is not None and saving is not asyncio.current_task() and not saving.done()
+                and saving.get_loop() is asyncio.get_running_loop()):
+            await asyncio.shield(saving)  # 两次写出不能同时用同一个临时文件
+        if not self._dirty:
+            return
+        self._dirty = False
+        self._last_save = time.monotonic()
+        try:
+            await asyncio.to_thread(self._write, dict(self.entries))
+        except BaseException:
+            self._dirty = True
+            raise
+
+    async def _save_in_background(self):
+        try:
+            await self.save()
+        except Exception as e:
+            logger.exception(f'failed to save video cache {self.path}', exc_info=e)
+
+    def _touch(self):
+        self._dirty = True
+        if (time.monotonic() - self._last_save >= self.save_interval
+                and (self._saving is None or self._saving.done())):
+            self._saving = asyncio.create_task(self._save_in_background())
+
+    def lookup(self, bvid: str) -> VideoMeta | None:
+        """只查本地，过期的视为没有"""
+        self.load()
+        if (meta := self.entries.get(bvid)) is None or time.time() - meta.fetched >= self.ttl.total_seconds():
+            return None
+        return meta
+
+    async def get(self, bvid: str, bclient: BilibiliClient) -> VideoMeta:
+        if (meta := self.lookup(bvid)) is not None:
+            self._stats['hits'] += 1
+            return meta
+        if (task := self._inflight.get(bvid)) is not None:
+            self._stats['coalesced'] += 1
+        else:
+            task = self._start(bvid, bclient)
+        return await asyncio.shield(task)
+
+    def prefetch(self, bvids: Iterable[str], bclient: BilibiliClient):
+        """同时开始请求没有缓存的 bvid，不等待结果；之后的 ``get`` 会合并到这些请求上"""
+        for bvid in bvids:
+            if bvid not in self._inflight and self.lookup(bvid) is None:
+                self._start(bvid, bclient)
+
+    def _start(self, bvid: str, bclient: BilibiliClient) -> asyncio.Task[VideoMeta]:
+        self._stats['misses'] += 1
+        task = self._inflight[bvid] = asyncio.create_task(self._fetch(bvid, bclient))
+        task.add_done_callback(self._done)
+        return task
+
+    def _done(self, task: asyncio.Task[VideoMeta]):
+        for bvid, t in list(self._inflight.items()):
+            if t is task:
+                del self._inflight[bvid]
+        if not task.cancelled() and task.exception() is not None:  # 也避免没人等待时的 never retrieved 警告
+            self._stats['errors'] += 1
+
+    async def _fetch(self, bvid: str, bclient: BilibiliClient) -> VideoMeta:
+        detail = await Video(bvid, credential=await bclient.get_credential()).get_detail()
+        meta = VideoMeta.from_detail(bvid, detail)
+        self.entries.pop(bvid, None)
+        self.entries[bvid] = meta
+        while len(self.entries) > self.max_entries:
+            del self.entries[next(iter(self.entries))]
+        self._touch()
+        return meta
+
+    def stats(self) -> dict:
+        return {'entries': len(self.entries), 'inflight': len(self._inflight), **self._stats}
+
+
+_shared_video_cache: VideoMetaCache | None = None
+
+
+def shared_video_cache() -> VideoMetaCache:
+    global _shared_video_cache
+    if _shared_video_cache is None:
+        _shared_video_cache = VideoMetaCache()
+        metrics.registry.register_stats('video_cache', _shared_video_cache.stats)
+    return _shared_video_cache
@@ -5,11 +5,10 @@ import sys
 import typing
 from datetime import timedelta, datetime
 from functools import cached_property
-from operator import itemgetter
 from typing import Literal
 
 import attr
-from bilibili_api.video import Video
+from pydantic import Field
 from textual.app import App, ComposeResult
 from textual.containers import VerticalScroll, HorizontalGroup
 from textual.reactive import reactive
@@ -19,8 +18,7 @@ from ubw import models
 from ubw.clients import LiveClientABC, BilibiliClient
 from ubw.handlers import BaseHandler
 from ._base import QueuedProcessorMixin
-
-owner = itemgetter('name', 'mid', 'face')
+from .vod.cache import VideoMetaCache, shared_video_cache
 
 DEBUG_VODT = os.environ.get('DEBUG_VODT')
 
@@ -123,6 +121,9 @@ class UI(App):
 class VodTextualHandler(QueuedProcessorMixin, BaseHandler):
     cls: Literal['vodt'] = 'vodt'
 
+    # DI
+    video_cache: VideoMetaCache = Field(default_factory=shared_video_cache, exclude=True)
+
     _ui_task: asyncio.Task | None = None
     _ui: UI
 
@@ -135,22 +136,24 @@ class VodTextualHandler(QueuedProcessorMixin, BaseHandler):
         self._ui_task = task = asyncio.create_task(self._ui.run_async())
         task.add_done_callback(lambda fut: sys.exit(fut.cancelled() or fut.exception() is not None))
 
+    async def close(self):
+        await self.video_cache.save()
+        await super().close()
+
     async def on_super_chat_message(self, client: LiveClientABC, message: models.SuperChatCommand):
         bclient: BilibiliClient = client.bilibili_client
-        for bvid in re.findall(r"BV\w{10}", message.data.message):
-            detail = await Video(bvid, credential=await bclient.get_credential()).get_detail()
-            duration = timedelta(seconds=detail['View']['duration'])
-            cover = detail['View']['pic']
-            title = detail['View']['title']
+        bvids = re.findall(r"BV\w{10}", message.data.message)
+        self.video_cache.prefetch(bvids, bclient)
+        for bvid in bvids:
+            meta = await self.video_cache.get(bvid, bclient)
             demander_uname = message.data.user_info.uname
             demander_uid = message.data.uid
             demander_face = message.data.user_info.face
-            owner_uname, owner_uid, owner_face = owner(detail['View']['owner'])
             async with self._ui_lock:
                 self._ui.add_item(VodInfo(
-                    bvid=bvid, duration=duration, title=title, cover=cover,
+                    bvid=bvid, duration=meta.duration, title=meta.title, cover=meta.cover,
                     demander_uname=demander_uname, demander_uid=demander_uid, demander_face=demander_face,
-                    owner_uname=owner_uname, owner_uid=owner_uid, owner_face=owner_face,
+                    owner_uname=meta.owner_uname, owner_uid=meta.owner_uid, owner_face=meta.owner_face,
                     vod_time=message.ct, original_text=message.data.message,
                 ))
 
@@ -1,14 +1,18 @@
 import abc
 import importlib.resources
 import re
+import time
 from collections import Counter
 from datetime import datetime, timedelta, date
+from functools import cached_property
+from pathlib import Path
 from typing import Annotated
 
 from pydantic import BaseModel, Field, TypeAdapter
 
 from ubw.ui.stream_view import *
 from ._base import *
+from ._viewer_state import ViewerState, ViewerStateStore
 
 check_in_words_txt = importlib.resources.files('ubw.handlers') / 'check_in_words.txt'
 
@@ -32,6 +36,72 @@ def effective_day(dt: datetime) -> date:
     return (dt - timedelta(hours=6)).date()
 
 
+def message_problems(c: models.DanmakuCommand) -> tuple[list[str], int]:
+    """只看这条弹幕本身的问题"""
+    problems = []
+    msg = c.info.msg
+    score = 0
+    if is_shitting(msg):
+        problems.append('shitting')
+        score += 5
+
+    if c.info.mode_info.extra.emoticon_unique:
+        problems.append('emoticon')
+        score += 3
+
+    if (emot := c.info.mode_info.extra.emots) is not None:
+        for emot in emot.keys():
+            if emot in msg:
+                problems.append("emot")
+                score += 3
+                break
+    return problems, score
+
+
+def history_problems(problems: list[str], score: int, repeating_ratio: float,
+                     entrance: datetime | None, danmu: datetime | None, now: datetime) -> int:
+    """结合复读比例和上次进场 / 发言时间，追加到 *problems*，返回这条弹幕的分数"""
+    if repeating_ratio > 1:
+        problems.append("repeating")
+        score += 5
+    else:
+        problems.append(f"({repeating_ratio=:.2f})")
+
+    if entrance is None:
+        problems.append("no entrance")
+        score += 3
+    else:
+        ago = now - entrance
+        if ago > timedelta(days=2):
+            problems.append("entrance > 2d")
+        elif ago <= timedelta(hours=1):
+            pass
+        elif effective_day(now) != effective_day(entrance):
+            problems.append("no entrance today")
+        else:
+            problems.append("entrance > 1h")
+
+    if danmu is None:
+        problems.append("first danmu")
+    else:
+        ago = now - danmu
+        if ago > timedelta(days=2):
+            problems.append("danmu > 2d")
+        elif ago < timedelta(seconds=1):
+            problems.append("<1s")
+            score += 2
+        elif ago < timedelta(minutes=1):
+            problems.append("<1min")
+            score *= 2
+        elif ago <= timedelta(hours=1):
+            pass
+        elif effective_day(now) != effective_day(danmu):
+            problems.append("first danmu today")
+        else:
+            problems.append("danmu > 1h")
+    return score
+
+
 class InteractCheckerABC(BaseModel, abc.ABC):
     method: str
 
@@ -73,7 +143,6 @@ class LastInteract(InteractCheckerABC):
         self.entrance = datetime.now().astimezone()
 
     def shift_danmaku(self, c: models.DanmakuCommand) -> tuple[list[str], int]:
-        problems = []
         msg = c.info.msg
         self.latest_danmakus.append(c)
         g = 0
@@ -81,63 +150,10 @@ class LastInteract(InteractCheckerABC):
             self.latest_danmakus.pop(0)
             g += 1
 
-        score = 0
-        if is_shitting(msg):
-            problems.append('shitting')
-            score += 5
-
-        if c.info.mode_info.extra.emoticon_unique:
-            problems.append('emoticon')
-            score += 3
-
-        if (emot := c.info.mode_info.extra.emots) is not None:
-            for emot in emot.keys():
-                if emot in msg:
-                    problems.append("emot")
-                    score += 3
-                    break
-
+        problems, score = message_problems(c)
         counter = Counter(dmk.info.msg for dmk in self.latest_danmakus)
-        repeating_ratio = counter[msg] / len(counter)
-        if repeating_ratio > 1:
-            problems.append("repeating")
-            score += 5
-        else:
-            problems.append(f"({repeating_ratio=:.2f})")
-
         now = datetime.now().astimezone()
-        if self.entrance is None:
-            problems.append("no entrance")
-            score += 3
-        else:
-            ago = now - self.entrance
-            if ago > timedelta(days=2):
-                problems.append("entrance > 2d")
-            elif ago <= timedelta(hours=1):
-                pass
-            elif effective_day(now) != effective_day(self.entrance):
-                problems.append("no entrance today")
-            else:
-                problems.append("entrance > 1h")
-
-        if self.danmu is None:
-            problems.append("first danmu")
-        else:
-            ago = now - self.danmu
-            if ago > timedelta(days=2):
-                problems.append("danmu > 2d")
-            elif ago < timedelta(seconds=1):
-                problems.append("<1s")
-                score += 2
-            elif ago < timedelta(minutes=1):
-                problems.append("<1min")
-                score *= 2
-            elif ago <= timedelta(hours=1):
-                pass
-            elif effective_day(now) != effective_day(self.danmu):
-                problems.append("first danmu today")
-            else:
-                problems.append("danmu > 1h")
+        score = history_problems(problems, score, counter[msg] / len(counter), self.entrance, self.danmu, now)
 
         self.latest_scores.append(score)
         self.latest_scores[:g] = []
@@ -167,20 +183,61 @@ class WarnNoEntranceButDanmakuHandler(BaseHandler):
     # ui: Annotated[StreamView, di(factory=Richy), sub_actor()]
     # ui: StreamView @ di(factory=Richy) @ sub_actor()
 
+    # method == 'last' 时的观众状态
+    memory_limit: int = 20
+    max_viewers: int = 1 << 18
+    viewer_ttl: timedelta | None = timedelta(days=7)
+    snapshot_path: Path | None = None
+
+    _snapshot_loaded: bool = False
+
+    # 其它 method 仍使用完整的 InteractChecker
     ics: dict[int, InteractChecker] = {}
 
     # ics: Annotated[dict[int, LastInteract], store()]
     # ics: dict[int, LastInteract] @ store()
 
+    @cached_property
+    def viewers(self) -> ViewerStateStore:
+        return ViewerStateStore(memory_limit=self.memory_limit, max_viewers=self.max_viewers, ttl=self.viewer_ttl)
+
     async def start(self, client):
+        if self.snapshot_path is not None and not self._snapshot_loaded:
+            self._snapshot_loaded = True
+            self.viewers.load(self.snapshot_path)
         if self.owned_ui and self.ui is not None and not self._ui_started:
             await self.ui.start()
 
+    async def close(self):
+        if self.snapshot_path is not None and self._snapshot_loaded:
+            self.viewers.save(self.snapshot_path)
+        await super().close()
+
     def last_interact_of(self, uid) -> InteractChecker:
         if uid not in self.ics:
             self.ics[uid] = make_ic(self.method)
         return self.ics[uid]
 
+    def see_entrance(self, uid):
+        if self.method == 'last':
+            self.viewers.see_entrance(uid)
+        else:
+            self.last_interact_of(uid).see_entrance()
+
+    def shift_danmaku(self, uid, message: models.DanmakuCommand) -> tuple[list[str], int]:
+        """与 ``LastInteract.shift_danmaku`` 相同的判断，状态保存在 ``viewers`` 里"""
+        if self.method != 'last':
+            return self.last_interact_of(uid).shift_danmaku(message)
+        now = time.time()
+        state: ViewerState = self.viewers.push_danmaku(uid, message.info.msg, now)
+        problems, score = message_problems(message)
+        score = history_problems(
+            problems, score, state.repeats / state.distinct,
+            None if state.entrance is None else datetime.fromtimestamp(state.entrance).astimezone(),
+            None if state.danmu is None else datetime.fromtimestamp(state.danmu).astimezone(),
+            datetime.fromtimestamp(now).astimezone())
+        return problems, self.viewers.set_score(uid, score)
+
     async def on_danmu_msg(self, client, message: models.DanmakuCommand):
         uname = message.info.uname
         msg = message.info.msg
@@ -190,14 +247,13 @@ class WarnNoEntranceButDanmakuHandler(BaseHandler):
             face = message.info.mode_info.user.base.face
         else:
             face = ''
-        interact = self.last_interact_of(uid)
         segments = [
             ColorSeeSee(text=f"[{room_id}] "),
             User(name=uname, uid=uid, face=face),
             PlainText(text=f": "),
             PlainText(text=msg),
         ]
-        problems, score = interact.shift_danmaku(message)
+        problems, score = self.shift_danmaku(uid, message)
         for problem in problems:
             segments.append(ColorSeeSee(text="[" + problem + "]"))
         segments.append(PlainText(text=f"{score=}"))
@@ -214,4 +270,4 @@ class WarnNoEntranceButDanmakuHandler(BaseHandler):
             PlainText(text="了直播间"),
         ], time=model.ct, importance=0))
         if model.data.msg_type == 1:  # 进入
-            self.last_interact_of(uid).see_entrance()
+            self.see_entrance(uid)
@@ -0,0 +1,286 @@
+"""进程内指标，Prometheus 文本格式输出
+
+热路径上只做字典查找和数值累加；固定标签的子指标应由调用方缓存，例如::
+
+    messages = ws_messages.labels(str(room_id))  # 连接建立时
+    messages.inc()                               # 每条消息
+"""
+import asyncio
+import logging
+import math
+import re
+import threading
+from bisect import bisect_left
+from typing import Callable, Iterable
+
+__all__ = (
+    'Counter', 'Gauge', 'Histogram', 'MetricsRegistry', 'registry', 'serve_metrics',
+    'LATENCY_BUCKETS',
+    'ws_messages', 'ws_bytes', 'ws_reconnects', 'commands', 'command_bytes', 'decompress_seconds', 'parse_seconds',
+    'validate_seconds', 'handler_seconds', 'queue_depth', 'api_seconds', 'api_errors',
+)
+
+logger = logging.getLogger('ubw.metrics')
+
+LATENCY_BUCKETS = (.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10.)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = '') -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    type: str = ''
+    _child_class: type
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        if not self.labelnames:
+            self._default = self._children[()] = self._new_child()
+
+    def _new_child(self):
+        return self._child_class()
+
+    def labels(self, *values: str):
+        """按标签值取子指标；同一组标签值总是返回同一个对象"""
+        try:
+            return self._children[values]
+        except KeyError:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f'{self.name} expects labels {self.labelnames}, got {values}')
+            child = self._children[values] = self._new_child()
+            return child
+
+    def remove(self, *values: str):
+        self._children.pop(values, None)
+
+    def clear(self):
+        self._children.clear()
+        if not self.labelnames:
+            self._default = self._children[()] = self._new_child()
+
+    def samples(self) -> Iterable[str]:
+        for values, child in list(self._children.items()):
+            yield f'{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}'
+
+    def render(self) -> Iterable[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} {self.type}'
+        yield from self.samples()
+
+
+class _CounterChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n: float = 1):
+        self.value += n
+
+
+class Counter(_Metric):
+    type = 'counter'
+    _child_class = _CounterChild
+
+    def inc(self, n: float = 1):
+        self._default.value += n
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def set(self, value: float):
+        self.value = value
+
+    def dec(self, n: float = 1):
+        self.value -= n
+
+
+class Gauge(Counter):
+    type = 'gauge'
+    _child_class = _GaugeChild
+
+    def set(self, value: float):
+        self._default.value = value
+
+
+class _HistogramChild:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+    def samples(self) -> Iterable[str]:
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for le, n in zip((*self.buckets, math.inf), list(child.counts)):
+                cumulative += n
+                labels = _format_labels(self.labelnames, values, f'le="{_format_value(float(le))}"')
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.labelnames, values)
+            yield f'{self.name}_sum{labels} {_format_value(child.sum)}'
+            yield f'{self.name}_count{labels} {child.count}'
+
+
+class MetricsRegistry:
+    """指标注册表；除直接注册的指标外，还可注册 ``stats()`` 一类返回 dict 的函数，抓取时才调用"""
+
+    def __init__(self, prefix: str = 'ubw'):
+        self.prefix = prefix
+        self.metrics: dict[str, _Metric] = {}
+        self.stats_sources: dict[str, tuple[Callable[[], dict], str | None]] = {}
+
+    def _register(self, metric: _Metric):
+        if metric.name in self.metrics:
+            return self.metrics[metric.name]
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(f'{self.prefix}_{name}', documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge(f'{self.prefix}_{name}', documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(f'{self.prefix}_{name}', documentation, labelnames, buckets))
+
+    def register_stats(self, name: str, source: Callable[[], dict], label: str | None = None):
+        """注册一个 stats 函数，数值项输出为 ``{prefix}_{name}_{key}`` 的 gauge
+
+        :param label: 若给出，*source* 返回 ``{标签值: {key: 数值}}``
+        """
+        self.stats_sources[name] = (source, label)
+
+    def _render_stats(self, name: str, source: Callable[[], dict], label: str | None) -> Iterable[str]:
+        try:
+            stats = source()
+        except Exception as e:
+            logger.warning(f'failed to collect {name}: {e!r}')
+            return
+        groups = stats.items() if label is not None else [(None, stats)]
+        series: dict[str, list[str]] = {}
+        for value, group in groups:
+            labels = _format_labels((label,), (str(value),)) if label is not None else ''
+            for key, v in _flatten(group):
+                series.setdefault(f'{self.prefix}_{name}_{key}', []).append(f'{labels} {_format_value(v)}')
+        for metric, lines in series.items():
+            yield f'# TYPE {metric} gauge'
+            for line in lines:
+                yield metric + line
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        for name, (source, label) in list(self.stats_sources.items()):
+            lines.extend(self._render_stats(name, source, label))
+        lines.append('')
+        return '\n'.join(lines)
+
+
+def _flatten(stats: dict, prefix: str = '') -> Iterable[tuple[str, float]]:
+    for key, value in stats.items():
+        key = re.sub(r'\W', '_', f'{prefix}{key}', flags=re.ASCII)
+        if isinstance(value, bool):
+            yield key, int(value)
+        elif isinstance(value, (int, float)):
+            yield key, value
+        elif isinstance(value, dict):
+            yield from _flatten(value, f'{key}_')
+
+
+registry = MetricsRegistry()
+
+ws_messages = registry.counter('ws_messages_total', 'websocket messages received', ['room'])
+ws_bytes = registry.counter('ws_bytes_total', 'websocket bytes received', ['room'])
+ws_reconnects = registry.counter('ws_reconnects_total', 'websocket reconnections', ['room'])
+commands = registry.counter('commands_total', 'commands received', ['room', 'cmd'])
+command_bytes = registry.counter('command_bytes_total', 'decompressed command payload bytes', ['room', 'cmd'])
+decompress_seconds = registry.histogram('decompress_seconds', 'time decompressing brotli packs')
+parse_seconds = registry.histogram('parse_seconds', 'time decoding json bodies')
+validate_seconds = registry.histogram('validate_seconds', 'time validating commands into models', ['handler'])
+handler_seconds = registry.histogram('handler_seconds', 'time handling a command', ['handler'])
+queue_depth = registry.gauge('queue_depth', 'commands waiting in a handler queue', ['handler'])
+api_seconds = registry.histogram('api_seconds', 'bilibili api call latency', ['endpoint'])
+api_errors = registry.counter('api_errors_total', 'failed bilibili api calls', ['endpoint'])
+
+
+def serve_metrics(host: str = 'localhost', port: int = 9464, *, metrics_registry: MetricsRegistry = registry,
+                  ) -> threading.Thread:
+    """在后台线程里起一个 aiohttp 服务，``GET /metrics`` 返回 Prometheus 文本格式，另有 ``/profile/...`` 开关性能分析"""
+    from aiohttp import web
+    from .profiling import add_routes
+
+    async def handler(request: web.Request):
+        return web.Response(text=metrics_registry.render(), content_type='text/plain',
+                            headers={'X-Content-Type-Options': 'nosniff'}, charset='utf-8')
+
+    started = threading.Event()
+    errors = []
+
+    async def main():
+        try:
+            app = web.Application()
+            app.router.add_get('/metrics', handler)
+            add_routes(app)
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, host, port).start()
+        except Exception as e:
+            errors.append(e)
+            return
+        finally:
+            started.set()
+        logger.info(f'metrics served at http://{host}:{port}/metrics')
+        await asyncio.Event().wait()
+
+    thread = threading.Thread(target=asyncio.run, args=(main(),), name='ubw-metrics', daemon=True)
+    thread.start()
+    started.wait()
+    if errors:
+        raise errors[0]
+    return thread
@@ -1,9 +1,12 @@
 import json
 from base64 import b64decode
+from collections import OrderedDict
 
-from pydantic import BeforeValidator, TypeAdapter, BaseModel
+from pydantic import BeforeValidator, TypeAdapter, BaseModel, ValidationInfo, model_validator
 
-__all__ = ('strange_dict', 'protobuf_decoder',)
+from .. import metrics
+
+__all__ = ('strange_dict', 'protobuf_decoder', 'Interner', 'default_interner', 'interned',)
 
 
 def strange_dict(cls, v):
@@ -39,3 +42,81 @@ def protobuf_decoder(pb, model_type: type[BaseModel], *, base64=True):
         return model
 
     return BeforeValidator(validator)
+
+
+def _freeze(v):
+    if isinstance(v, dict):
+        return tuple((k, _freeze(x)) for k, x in v.items())
+    elif isinstance(v, (list, tuple)):
+        return tuple(_freeze(x) for x in v)
+    return v
+
+
+class Interner:
+    """按内容去重的 LRU 缓存，令重复出现的不可变子模型共用一个实例。
+
+    通过验证上下文启用：``ADAPTER.validate_python(data, context={'interner': interner})``
+    """
+
+    def __init__(self, maxsize: int = 65536):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._cache: OrderedDict[tuple, object] = OrderedDict()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def intern(self, cls, data, factory):
+        try:
+            key = (cls, _freeze(data))
+            cached = self._cache.get(key)
+        except TypeError:  # unhashable leaf, give up interning
+            return factory(data)
+        if cached is not None:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return cached
+        self.misses += 1
+        value = self._cache[key] = factory(data)
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+            self.evictions += 1
+        return value
+
+    def clear(self):
+        self._cache.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {'size': len(self._cache), 'maxsize': self.maxsize,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': self.hit_rate}
+
+
+default_interner = Interner()
+metrics.registry.register_stats('interner', default_interner.stats)
+
+
+def interned():
+    """Example Usage:
+        class SomeSubModel(BaseModel):
+            # ...
+            _intern = interned()
+    """
+
+    def validator(cls, data, handler, info: ValidationInfo):
+        if isinstance(data, BaseModel) or info.context is None:
+            return handler(data)
+        interner: Interner | None = info.context.get('interner')
+        if interner is None:
+            return handler(data)
+        return interner.intern(cls, data, handler)
+
+    return model_validator(mode='wrap')(validator)
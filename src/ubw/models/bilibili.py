@@ -9,7 +9,7 @@ from pydantic import BaseModel, Field, AliasPath, TypeAdapter, AliasChoices, Jso
 
 __all__ = (
     'Response', 'ResponseF', 'OffsetList',
-    'RoomInfo', 'InfoByRoom', 'DanmuInfo', 'RoomEmoticons', 'FingerSPI', 'RoomPlayInfo',
+    'RoomInfo', 'InfoByRoom', 'DanmuInfo', 'RoomEmoticons', 'FingerSPI', 'RoomPlayInfo', 'StatusInfo',
     'Dynamic', 'DynamicItem', 'AccountInfo',
     'Nav',
     'VideoP', 'VideoPlayInfo',
@@ -82,6 +82,33 @@ class InfoByRoom(BaseModel):
     ct: datetime = Field(default_factory=lambda: datetime.now().astimezone())
 
 
+class StatusInfo(BaseModel):
+    """
+    批量直播状态接口中单个主播的信息
+    :var live_status: 0=未开播 1=直播中 2=轮播中
+    :var live_time: API result ``0`` is validated as ``None``
+    """
+    uid: int
+    room_id: int
+    short_id: int = 0
+    uname: str = ''
+    face: str = ''
+    title: str = ''
+    live_status: int
+    live_time: Annotated[datetime | None, BeforeValidator(lambda v: None if v == 0 else v)] = None
+    online: int = 0
+    area_v2_id: int = 0
+    area_v2_name: str = ''
+    area_v2_parent_id: int = 0
+    area_v2_parent_name: str = ''
+    cover_from_user: str = ''
+    keyframe: str = ''
+
+    @property
+    def living(self) -> bool:
+        return self.live_status == 1
+
+
 class Host(BaseModel):
     host: str
     port: int
@@ -774,6 +801,7 @@ class FavMedia(BaseModel):
     page: int
     bvid: str
     title: str
+    cover: str = ''
 
 
 class FavList(BaseModel):
@@ -27,7 +27,7 @@ __all__ = (
     # common types
     'Scatter', 'MedalInfo', 'Color', 'Uinfo', 'UinfoLow', 'UserInfo', 'GroupMedal',
     # common validator
-    'strange_dict', 'protobuf_decoder', 'convert_ns', 'Json',
+    'strange_dict', 'protobuf_decoder', 'convert_ns', 'Json', 'interned',
 )
 
 
@@ -60,10 +60,15 @@ class CommandModel(BaseModel):
     p_is_ack: bool | None = None
     p_msg_type: int | None = None
 
+    # 不来自原始数据：EventDeduper 的 tag 模式下，由 handler 在校验后填入最先收到同一事件的房间号
+    dup_of: int | None = None
+
 
 class Color(RootModel):
     root: tuple[int, int, int] | tuple[int, int, int, int]
 
+    _intern = interned()
+
     @model_validator(mode='before')
     def parse_color(cls, data):
         if isinstance(data, str):
@@ -152,6 +157,8 @@ class MedalInfo(BaseModel):
     is_lighted: int
     target_id: int
 
+    _intern = interned()
+
 
 class RiskCtrlInfo(BaseModel):
     name: str
@@ -208,6 +215,8 @@ class UinfoMedal(BaseModel):
     v2_medal_color_start: str = ''
     v2_medal_color_text: str = ''
 
+    _intern = interned()
+
 
 class UinfoWealth(BaseModel):
     level: int
@@ -239,6 +248,8 @@ class Uinfo(BaseModel):
     uhead_frame: UheadFrame | None = None
     guard_leader: UinfoGuardLeader | None = None
 
+    _intern = interned()
+
 
 class UinfoLowBase(BaseModel):
     uname: str
@@ -184,7 +184,7 @@ class DanmakuInfo(BaseModel):
 
 def parse_medal_info(v3):
     if v3:
-        return MedalInfo(
+        return dict(
             medal_level=v3[0],
             medal_name=v3[1],
             anchor_uname=v3[2],
@@ -0,0 +1,245 @@
+"""弹幕热词：分词、按滑动窗口的近似计数和突增检测
+
+- 分词用 jieba，在单独的进程池里成批进行，不占事件循环；重复的弹幕（复读很常见）直接取 LRU 缓存
+- 计数用 count-min sketch：窗口等分为若干桶，每桶只记本桶改动过的格子，累计表是 ``depth × width`` 的 ``array('I')``
+- 每个房间保留有限个候选词，查询时用堆取估计值最大的 *k* 个；短窗口的计数远高于长窗口的平均水平即为突增
+"""
+import asyncio
+import functools
+import heapq
+import logging
+import multiprocessing
+import re
+from array import array
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Iterable, NamedTuple
+
+__all__ = ('normalize', 'tokenize', 'tokenize_batch', 'TokenCache', 'Tokenizer', 'CountMinWindow', 'PhraseTrends',
+           'Spike',)
+
+logger = logging.getLogger('ubw.phrases')
+
+STOPWORDS = frozenset(
+    '的 了 是 我 你 他 她 它 这 那 啊 吗 吧 呢 呀 哦 嗯 也 就 都 有 在 不 和 与 把 被 个 之 着 给 让 还 又 很 '
+    '我们 你们 他们 这个 那个 什么 怎么 没有 就是 还是 可以 一个 不是 自己 真的'.split())
+
+_REPEATS = re.compile(r'(.)\1{3,}')
+_WORD = re.compile(r'\w')
+
+
+def normalize(text: str) -> str:
+    """去掉首尾空白、小写，把四个以上的连续重复字符缩成三个（"哈哈哈哈哈" -> "哈哈哈"）"""
+    return _REPEATS.sub(r'\1\1\1', text.strip().lower())
+
+
+def _init_worker():
+    import jieba
+    jieba.setLogLevel(logging.WARNING)
+    jieba.initialize()
+
+
+def tokenize(text: str) -> tuple[str, ...]:
+    """*text* 应已经过 ``normalize``；去掉标点、停用词，同一条里重复的词只计一次"""
+    import jieba
+    seen = {}
+    for token in jieba.lcut(text):
+        token = token.strip()
+        if token and token not in STOPWORDS and _WORD.search(token):
+            seen.setdefault(token, None)
+    return tuple(seen)
+
+
+def tokenize_batch(texts: list[str]) -> list[tuple[str, ...]]:
+    return [tokenize(t) for t in texts]
+
+
+class TokenCache:
+    """文本 -> 分词结果，按最近使用淘汰"""
+    __slots__ = ('maxsize', 'data', 'hits', 'misses')
+
+    def __init__(self, maxsize: int = 1 << 16):
+        self.maxsize = maxsize
+        self.data: dict[str, tuple[str, ...]] = {}
+        self.hits = self.misses = 0
+
+    def get(self, text: str) -> tuple[str, ...] | None:
+        if (tokens := self.data.pop(text, None)) is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.data[text] = tokens
+        return tokens
+
+    def put(self, text: str, tokens: tuple[str, ...]):
+        self.data.pop(text, None)
+        self.data[text] = tokens
+        while len(self.data) > self.maxsize:
+            del self.data[next(iter(self.data))]
+
+
+class Tokenizer:
+    """
+    :param workers: 分词进程数；0 表示在线程池里分词（仍会占用 GIL，仅用于测试或单房间）
+    """
+
+    def __init__(self, workers: int = 1, cache_size: int = 1 << 16, batch_size: int = 512):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.cache = TokenCache(cache_size)
+        self.batches = 0
+        self._executor: Executor | None = None
+
+    @property
+    def executor(self) -> Executor | None:
+        if self._executor is None and self.workers > 0:
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                                 initializer=_init_worker)
+        return self._executor
+
+    async def tokenize_many(self, texts: list[str]) -> list[tuple[str, ...]]:
+        """*texts* 应已经过 ``normalize``；缓存未命中的文本去重后分批交给进程池"""
+        results: list[tuple[str, ...] | None] = [None] * len(texts)
+        missing: dict[str, list[int]] = {}
+        for i, text in enumerate(texts):
+            if (tokens := self.cache.get(text)) is None:
+                missing.setdefault(text, []).append(i)
+            else:
+                results[i] = tokens
+        if missing:
+            unique = list(missing)
+            chunks = [unique[i:i + self.batch_size] for i in range(0, len(unique), self.batch_size)]
+            loop = asyncio.get_running_loop()
+            done = await asyncio.gather(*(loop.run_in_executor(self.executor, tokenize_batch, c) for c in chunks))
+            self.batches += len(chunks)
+            for chunk, tokenized in zip(chunks, done):
+                for text, tokens in zip(chunk, tokenized):
+                    self.cache.put(text, tokens)
+                    for i in missing[text]:
+                        results[i] = tokens
+        return results
+
+    def close(self):
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {'cache_hits': self.cache.hits, 'cache_misses': self.cache.misses, 'cache_size': len(self.cache.data),
+                'batches': self.batches}
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _cells(token: str, width: int, depth: int) -> tuple[int, ...]:
+    """*token* 在各行的格子（已加上行偏移），双重哈希得到"""
+    from .userdata.sketches import mix64
+    h = mix64(hash(token))
+    h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+    return tuple(row * width + (h1 + row * h2) % width for row in range(depth))
+
+
+class CountMinWindow:
+    """时长 *span* 秒的滑动窗口 count-min sketch"""
+    __slots__ = ('span', 'step', 'size', 'head', 'buckets', 'total')
+
+    def __init__(self, span: float, buckets: int = 6, width: int = 2048, depth: int = 4):
+        self.span = span
+        self.step = span / buckets
+        self.size = buckets
+        self.head: int | None = None
+        self.buckets: list[dict[int, int]] = [{} for _ in range(buckets)]
+        self.total = array('I', [0]) * (width * depth)
+
+    def _bucket(self, ts: float) -> dict[int, int] | None:
+        idx = int(ts // self.step)
+        if self.head is None:
+            self.head = idx
+        elif idx > self.head:
+            if idx - self.head >= self.size:
+                self.buckets = [{} for _ in range(self.size)]
+                self.total = array('I', [0]) * len(self.total)
+            else:
+                total = self.total
+                for k in range(self.head + 1, idx + 1):
+                    bucket = self.buckets[k % self.size]
+                    for cell, n in bucket.items():
+                        total[cell] -= n
+                    bucket.clear()
+            self.head = idx
+        elif idx <= self.head - self.size:
+            return None
+        return self.buckets[idx % self.size]
+
+    def add(self, ts: float, cells: Iterable[int], n: int = 1):
+        if (bucket := self._bucket(ts)) is None:
+            return
+        total = self.total
+        for cell in cells:
+            bucket[cell] = bucket.get(cell, 0) + n
+            total[cell] += n
+
+    def advance(self, ts: float):
+        self._bucket(ts)
+
+    def estimate(self, cells: Iterable[int]) -> int:
+        return min(map(self.total.__getitem__, cells))
+
+
+class Spike(NamedTuple):
+    """
+    :var count: 短窗口内的次数
+    :var expected: 按长窗口里其余时间的平均水平，短窗口内应有的次数
+    """
+    phrase: str
+    count: int
+    expected: float
+
+
+class PhraseTrends:
+    """一个房间的热词统计；候选词超过 *max_candidates* 时按长窗口的估计值只保留前一半"""
+    __slots__ = ('short', 'long', 'cms_width', 'depth', 'max_candidates', 'candidates')
+
+    def __init__(self, short: float = 60., long: float = 600., buckets: int = 6, width: int = 2048, depth: int = 4,
+                 max_candidates: int = 256):
+        if long <= short:
+            raise ValueError(f'long window {long} should be longer than short window {short}')
+        self.short = CountMinWindow(short, buckets, width, depth)
+        self.long = CountMinWindow(long, buckets, width, depth)
+        self.cms_width = width
+        self.depth = depth
+        self.max_candidates = max_candidates
+        self.candidates: dict[str, None] = {}
+
+    def add(self, ts: float, tokens: Iterable[str]):
+        for token in tokens:
+            cells = _cells(token, self.cms_width, self.depth)
+            self.short.add(ts, cells)
+            self.long.add(ts, cells)
+            self.candidates[token] = None
+        if len(self.candidates) > self.max_candidates:
+            keep = self._largest(self.long, self.max_candidates // 2)
+            self.candidates = dict.fromkeys(phrase for phrase, _ in keep)
+
+    def _largest(self, window: CountMinWindow, k: int) -> list[tuple[str, int]]:
+        w, d = self.cms_width, self.depth
+        counts = ((phrase, window.estimate(_cells(phrase, w, d))) for phrase in self.candidates)
+        return [(p, n) for p, n in heapq.nlargest(k, counts, key=lambda pn: pn[1]) if n > 0]
+
+    def top(self, now: float, k: int = 10, window: str = 'short') -> list[tuple[str, int]]:
+        window = self.short if window == 'short' else self.long
+        window.advance(now)
+        return self._largest(window, k)
+
+    def spikes(self, now: float, ratio: float = 3., min_count: int = 8) -> list[Spike]:
+        self.short.advance(now)
+        self.long.advance(now)
+        rest = self.long.span - self.short.span
+        result = []
+        for phrase in self.candidates:
+            cells = _cells(phrase, self.cms_width, self.depth)
+            if (count := self.short.estimate(cells)) < min_count:
+                continue
+            expected = max(self.long.estimate(cells) - count, 0) / rest * self.short.span
+            if count >= ratio * max(expected, 1.):
+                result.append(Spike(phrase, count, expected))
+        result.sort(key=lambda s: s.count, reverse=True)
+        return result
@@ -0,0 +1,278 @@
+"""运行时开关的性能分析，不需要重启进程
+
+- 栈采样：后台线程按固定频率采样事件循环线程的调用栈，输出 flamegraph 可用的 collapsed-stack 格式
+- 慢调用记录：记录最慢的 N 次 ``process_one``，事件循环被卡住时附带当时的调用栈
+
+可通过 ``ubw --profile``、``SIGUSR1`` / ``SIGUSR2`` 信号或指标服务的 ``/profile/...`` 开关。
+"""
+import heapq
+import itertools
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from types import FrameType
+from typing import Literal
+
+__all__ = ('StackSampler', 'SlowCall', 'SlowCallRecorder', 'Profiler', 'profiler', 'install_signal_handlers',
+           'add_routes',)
+
+logger = logging.getLogger('ubw.profiling')
+
+_frame_names: dict = {}
+
+
+def _frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    try:
+        return _frame_names[code]
+    except KeyError:
+        name = _frame_names[code] = f'{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+        return name
+
+
+def _stack(frame: FrameType | None) -> list[str]:
+    """从外到内的帧名"""
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    names.reverse()
+    return names
+
+
+class StackSampler:
+    """在后台线程里采样 *thread_id* 线程的调用栈"""
+
+    def __init__(self, thread_id: int | None = None, interval: float = 0.005):
+        self.thread_id = thread_id if thread_id is not None else threading.main_thread().ident
+        self.interval = interval
+        self.counts: Counter[str] = Counter()
+        self.samples = 0
+        self.started = 0.
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='ubw-stack-sampler', daemon=True)
+
+    def start(self):
+        self.started = time.time()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.counts[';'.join(_stack(frame))] += 1
+            self.samples += 1
+            del frame
+
+    def collapsed(self) -> str:
+        return ''.join(f'{stack} {n}\n' for stack, n in self.counts.most_common())
+
+
+class SlowCall:
+    __slots__ = ('handler', 'cmd', 'room_id', 'started', 'duration', 'frame', 'stack', 'blocking')
+
+    def __init__(self, handler: str, cmd: str, room_id: int, frame: FrameType | None):
+        self.handler = handler
+        self.cmd = cmd
+        self.room_id = room_id
+        self.started = time.perf_counter()
+        self.duration = 0.
+        self.frame = frame
+        self.stack: list[str] | None = None
+        self.blocking = False
+
+    def summary(self) -> dict:
+        return {'handler': self.handler, 'cmd': self.cmd, 'room_id': self.room_id, 'duration': self.duration,
+                'blocking': self.blocking, 'stack': self.stack}
+
+
+class SlowCallRecorder:
+    """保留最慢的 *size* 次调用；超过 *threshold* 仍未结束的调用若正卡住事件循环，则由看门狗线程抓取调用栈"""
+
+    def __init__(self, size: int = 20, threshold: float = 0.05, thread_id: int | None = None):
+        self.size = size
+        self.threshold = threshold
+        self.thread_id = thread_id if thread_id is not None else threading.main_thread().ident
+        self.active: dict[int, SlowCall] = {}
+        self.slowest: list[tuple[float, int, SlowCall]] = []
+        self._seq = itertools.count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._watchdog, name='ubw-slow-calls', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def begin(self, handler: str, cmd: str, room_id: int, frame: FrameType | None = None) -> SlowCall:
+        call = SlowCall(handler, cmd, room_id, frame)
+        self.active[id(call)] = call
+        return call
+
+    def end(self, call: SlowCall):
+        self.active.pop(id(call), None)
+        call.duration = time.perf_counter() - call.started
+        call.frame = None
+        if len(self.slowest) < self.size:
+            heapq.heappush(self.slowest, (call.duration, next(self._seq), call))
+        elif call.duration > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (call.duration, next(self._seq), call))
+
+    def _watchdog(self):
+        interval = max(self.threshold / 2, 0.005)
+        while not self._stop.wait(interval):
+            now = time.perf_counter()
+            overdue = [call for call in list(self.active.values())
+                       if call.stack is None and now - call.started >= self.threshold]
+            if not overdue:
+                continue
+            frames = []
+            frame = sys._current_frames().get(self.thread_id)
+            while frame is not None:
+                frames.append(frame)
+                frame = frame.f_back
+            ids = {id(f) for f in frames}
+            for call in overdue:
+                if id(call.frame) in ids:  # 这次调用正占着事件循环
+                    call.stack = [_frame_name(f) for f in reversed(frames)]
+                    call.blocking = True
+            del frames, frame
+
+    def report(self) -> list[dict]:
+        return [call.summary() for _, _, call in sorted(list(self.slowest), key=lambda t: -t[0])]
+
+
+class Profiler:
+    """进程内唯一的开关"""
+
+    def __init__(self):
+        self.sampler: StackSampler | None = None
+        self.slow_calls: SlowCallRecorder | None = None
+        self.output_dir = Path('output/profile')
+        self._lock = threading.Lock()
+
+    def start_sampling(self, interval: float = 0.005) -> bool:
+        with self._lock:
+            if self.sampler is not None:
+                return False
+            self.sampler = StackSampler(interval=interval)
+            self.sampler.start()
+        logger.info(f'stack sampling started, {interval=}')
+        return True
+
+    def stop_sampling(self) -> StackSampler | None:
+        with self._lock:
+            sampler, self.sampler = self.sampler, None
+        if sampler is not None:
+            sampler.stop()
+            logger.info(f'stack sampling stopped, {sampler.samples} samples')
+        return sampler
+
+    def start_slow_calls(self, size: int = 20, threshold: float = 0.05) -> bool:
+        with self._lock:
+            if self.slow_calls is not None:
+                return False
+            recorder = SlowCallRecorder(size, threshold)
+            recorder.start()
+            self.slow_calls = recorder
+        logger.info(f'slow call recording started, {size=} {threshold=}')
+        return True
+
+    def stop_slow_calls(self) -> SlowCallRecorder | None:
+        with self._lock:
+            recorder, self.slow_calls = self.slow_calls, None
+        if recorder is not None:
+            recorder.stop()
+            logger.info('slow call recording stopped')
+        return recorder
+
+    def dump(self, mode: Literal['stacks', 'slow']) -> Path | None:
+        """停止并写入 ``output_dir``"""
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        if mode == 'stacks':
+            if (sampler := self.stop_sampling()) is None:
+                return None
+            path = self.output_dir / f'stacks-{stamp}.collapsed'
+            path.write_text(sampler.collapsed(), encoding='utf-8')
+        else:
+            if (recorder := self.stop_slow_calls()) is None:
+                return None
+            path = self.output_dir / f'slow-{stamp}.json'
+            path.write_text(json.dumps(recorder.report(), indent=2, ensure_ascii=False), encoding='utf-8')
+        logger.info(f'profile written to {path}')
+        return path
+
+    def toggle(self, mode: Literal['stacks', 'slow']) -> Path | None:
+        running = self.sampler if mode == 'stacks' else self.slow_calls
+        if running is not None:
+            return self.dump(mode)
+        if mode == 'stacks':
+            self.start_sampling()
+        else:
+            self.start_slow_calls()
+        return None
+
+
+profiler = Profiler()
+
+
+def add_routes(app):
+    """给 aiohttp 应用加上 ``/profile/...`` 接口，例如 ``curl -X POST localhost:9464/profile/stacks/start``"""
+    from aiohttp import web
+
+    async def stacks_start(request: web.Request):
+        started = profiler.start_sampling(float(request.query.get('interval', 0.005)))
+        return web.json_response({'started': started})
+
+    async def stacks_stop(request: web.Request):
+        if (sampler := profiler.stop_sampling()) is None:
+            raise web.HTTPConflict(text='stack sampling is not running')
+        return web.Response(text=sampler.collapsed())
+
+    async def slow_start(request: web.Request):
+        started = profiler.start_slow_calls(int(request.query.get('size', 20)),
+                                            float(request.query.get('threshold', 0.05)))
+        return web.json_response({'started': started})
+
+    async def slow_report(request: web.Request):
+        if (recorder := profiler.slow_calls) is None:
+            raise web.HTTPConflict(text='slow call recording is not running')
+        return web.json_response(recorder.report())
+
+    async def slow_stop(request: web.Request):
+        if (recorder := profiler.stop_slow_calls()) is None:
+            raise web.HTTPConflict(text='slow call recording is not running')
+        return web.json_response(recorder.report())
+
+    app.router.add_post('/profile/stacks/start', stacks_start)
+    app.router.add_post('/profile/stacks/stop', stacks_stop)
+    app.router.add_post('/profile/slow/start', slow_start)
+    app.router.add_get('/profile/slow', slow_report)
+    app.router.add_post('/profile/slow/stop', slow_stop)
+
+
+def install_signal_handlers():
+    """``SIGUSR1`` 开关栈采样，``SIGUSR2`` 开关慢调用记录，再次收到时写入文件"""
+    if not hasattr(signal, 'SIGUSR1'):
+        return
+
+    def handler(mode):
+        # 信号处理函数里不做 IO，交给线程
+        return lambda signum, frame: threading.Thread(target=profiler.toggle, args=(mode,), daemon=True).start()
+
+    signal.signal(signal.SIGUSR1, handler('stacks'))
+    signal.signal(signal.SIGUSR2, handler('slow'))
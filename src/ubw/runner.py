@@ -0,0 +1,167 @@
+"""事件循环的启动方式：asyncio 或 uvloop（已安装时），并附带一个循环延迟探针"""
+import asyncio
+import inspect
+import logging
+import sys
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, Coroutine, Literal, TypeVar
+
+from pydantic import BaseModel
+
+from . import metrics
+from .profiling import _stack
+
+__all__ = ('RunnerConfig', 'runner_config', 'configure', 'loop_factory', 'LagProbe', 'run',)
+
+logger = logging.getLogger('ubw.runner')
+
+_T = TypeVar('_T')
+
+lag_seconds = metrics.registry.histogram(
+    'loop_lag_seconds', 'event loop scheduling delay',
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5.))
+
+
+class RunnerConfig(BaseModel):
+    """
+    :var loop: ``auto`` 在装有 uvloop 时使用它
+    :var lag_interval: 探针的唤醒间隔
+    :var lag_threshold: 延迟超过它时警告，并抓取卡住循环的调用栈
+    """
+    loop: Literal['auto', 'asyncio', 'uvloop'] = 'auto'
+    lag_probe: bool = True
+    lag_interval: float = 0.1
+    lag_threshold: float = 0.25
+    lag_history: int = 1024
+
+
+runner_config = RunnerConfig()
+
+
+def configure(**kwargs):
+    global runner_config
+    runner_config = RunnerConfig.model_validate({**runner_config.model_dump(), **kwargs})
+
+
+def loop_factory(kind: Literal['auto', 'asyncio', 'uvloop'] = 'auto') -> Callable[[], asyncio.AbstractEventLoop] | None:
+    """返回 ``asyncio.Runner`` 的 loop_factory，``None`` 为默认的 asyncio 循环"""
+    if kind == 'asyncio':
+        return None
+    try:
+        import uvloop
+    except ImportError:
+        if kind == 'uvloop':
+            raise
+        return None
+    return uvloop.new_event_loop
+
+
+def _innermost_coro(frame) -> str | None:
+    """正在执行的最内层协程"""
+    while frame is not None:
+        if frame.f_code.co_flags & inspect.CO_COROUTINE:
+            return frame.f_code.co_qualname
+        frame = frame.f_back
+    return None
+
+
+class LagProbe:
+    """周期性地 sleep，实际唤醒时间与预期之差即为循环延迟。
+
+    另有一个看门狗线程，发现探针迟迟未唤醒时抓取事件循环线程的调用栈和当前 task，用于定位卡住循环的回调。
+    """
+
+    def __init__(self, interval: float = 0.1, threshold: float = 0.25, history: int = 1024):
+        self.interval = interval
+        self.threshold = threshold
+        self.samples: deque[float] = deque(maxlen=history)
+        self.max_lag = 0.
+        self.stalls = 0
+        self.last_stall: dict | None = None
+        self._beat = 0.
+        self._pending_stall: dict | None = None
+        self._thread_id: int | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._stop = threading.Event()
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._thread_id = threading.get_ident()
+        self._stop.clear()
+        watchdog = threading.Thread(target=self._watchdog, name='ubw-lag-probe', daemon=True)
+        self._beat = time.monotonic()
+        watchdog.start()
+        try:
+            while True:
+                expected = time.monotonic() + self.interval
+                self._beat = expected
+                await asyncio.sleep(self.interval)
+                self.record(max(time.monotonic() - expected, 0.))
+        finally:
+            self._stop.set()
+
+    def record(self, lag: float):
+        self.samples.append(lag)
+        lag_seconds.observe(lag)
+        if lag > self.max_lag:
+            self.max_lag = lag
+        stall, self._pending_stall = self._pending_stall, None
+        if lag > self.threshold:
+            self.stalls += 1
+            if stall is not None:
+                stall['lag'] = lag
+                self.last_stall = stall
+                logger.warning(f'event loop lagged {lag:.3f}s, held by {stall["coro"]} in task {stall["task"]} at\n  '
+                               + '\n  '.join(stall['stack'][-8:]))
+            else:
+                logger.warning(f'event loop lagged {lag:.3f}s')
+
+    def _watchdog(self):
+        while not self._stop.wait(self.threshold / 2):
+            late = time.monotonic() - self._beat
+            if late <= self.threshold or self._pending_stall is not None:
+                continue
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            task = asyncio.current_task(self._loop)
+            self._pending_stall = {'task': task.get_name() if task is not None else None,
+                                   'coro': _innermost_coro(frame),
+                                   'stack': _stack(frame)}
+            del frame
+
+    def percentiles(self, *ps: float) -> dict[str, float]:
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {f'p{p:g}': 0. for p in ps}
+        return {f'p{p:g}': ordered[min(int(len(ordered) * p / 100), len(ordered) - 1)] for p in ps}
+
+    def stats(self) -> dict:
+        return {**self.percentiles(50, 90, 99), 'max': self.max_lag, 'stalls': self.stalls}
+
+
+async def _with_probe(main: Awaitable[_T], probe: LagProbe) -> _T:
+    task = asyncio.create_task(probe.run(), name='ubw-lag-probe')
+    try:
+        return await main
+    finally:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+
+def run(main: Coroutine[None, None, _T], *, config: RunnerConfig | None = None) -> _T:
+    """代替 ``asyncio.run``，按配置选择事件循环并启动延迟探针"""
+    config = config or runner_config
+    factory = loop_factory(config.loop)
+    if config.lag_probe:
+        probe = LagProbe(config.lag_interval, config.lag_threshold, config.lag_history)
+        metrics.registry.register_stats('loop_lag', probe.stats)
+        main = _with_probe(main, probe)
+    logger.debug(f'running with {"uvloop" if factory is not None else "asyncio"}')
+    with asyncio.Runner(loop_factory=factory) as runner:
+        return runner.run(main)
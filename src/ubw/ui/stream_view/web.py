@@ -4,13 +4,16 @@ import json
 import logging
 from functools import cached_property
 from typing import Union, NamedTuple
+from urllib.parse import quote
 
 import aiohttp
 import lxml
 from aiohttp import web
 from lxml.html.builder import HTML, BODY, HEAD, DIV, META, TITLE, SCRIPT, STYLE, SPAN, A, IMG, ATTR, CLASS, BR
+from yarl import URL
 
 from ._base import *
+from ...downloader.asset_cache import AssetCache, shared_asset_cache
 
 logger = logging.getLogger('ubw.stream_view.web')
 
@@ -40,6 +43,13 @@ class Web(BaseStreamView):
 
     cache_max_len: int = 20
 
+    # 头像和图片经本地缓存转发，不直接盗链
+    proxy_assets: bool = True
+    asset_hosts: list[str] = ['hdslb.com', 'biliimg.com']  # 只转发图片 CDN
+
+    # DI
+    asset_cache: AssetCache = Field(default_factory=shared_asset_cache)
+
     _runner: web.AppRunner | None = None
     _site: web.TCPSite | None = None
     _task: asyncio.Task | None = None
@@ -91,6 +101,15 @@ class Web(BaseStreamView):
         else:
             return ''
 
+    def is_asset_allowed(self, url: str) -> bool:
+        host = URL(url).host or ''
+        return any(host == h or host.endswith('.' + h) for h in self.asset_hosts)
+
+    def asset_src(self, url: str) -> str:
+        if not self.proxy_assets or not self.is_asset_allowed(url):
+            return url
+        return f'/asset?url={quote(url, safe="")}'
+
     def format_record(self, record: Record) -> lxml.html.HtmlElement:
         if self.show_date:
             h = [SPAN({'class': 'datetime'}, record.time.astimezone().strftime('[%Y-%m-%d %H:%M:%S] '))]
@@ -114,7 +133,7 @@ class Web(BaseStreamView):
                         h.append(
                             A(ATTR(href=f"https://space.bilibili.com/{uid}", target='_blank'),
                               CLASS(self.color_class(str(uid))),
-                              IMG(src=face, style="height: 1em; width: 1em; border-radius: 0.5em;"),
+                              IMG(src=self.asset_src(face), style="height: 1em; width: 1em; border-radius: 0.5em;"),
                               name))
                 case Room(owner_name=name, room_id=room_id):
                     h.append(
@@ -138,7 +157,7 @@ class Web(BaseStreamView):
                             SPAN(CLASS('currency'),
                                  f" [{mark}{price}]"))
                 case Picture(url=url, alt=alt):
-                    h.append(IMG(CLASS('picture'), src=url, alt=alt, title=alt))
+                    h.append(IMG(CLASS('picture'), src=self.asset_src(url), alt=alt, title=alt))
                 case LineBreak():
                     h.append(BR())
                 case Emoji(codepoint=cp):
@@ -219,6 +238,17 @@ class Web(BaseStreamView):
 
         return ws
 
+    async def asset_handler(self, request: web.Request):
+        url = request.query.get('url', '')
+        if not self.is_asset_allowed(url):
+            raise web.HTTPForbidden()
+        try:
+            path = await self.asset_cache.fetch(url)
+        except Exception as e:
+            logger.warning(f'failed to cache asset {url}: {e!r}')
+            raise web.HTTPFound(url)
+        return web.FileResponse(path, headers={'Cache-Control': 'max-age=86400'})
+
     async def index_handler(self, request: web.Request):
         script = """
 const socket = new WebSocket("ws://localhost:8080/ws");
@@ -312,6 +342,7 @@ span.debug-info { color: orange; }
         app.add_routes([
             web.get('/', self.index_handler),
             web.get('/ws', self.websocket_handler),
+            web.get('/asset', self.asset_handler),
         ])
         return app
 
@@ -335,6 +366,7 @@ span.debug-info { color: orange; }
             await ws.close()
         await self._site.stop()
         await self._runner.cleanup()
+        await self.asset_cache.save()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,255 @@
+"""SQLite 存档：每条事件一行，按房间、时间、用户、cmd 建索引，不必为了查询读入整个 TinyDB 分片
+
+::
+
+    archive = shared_event_archive(Path('output/blive_saver/events.sqlite3'))
+    archive.select(uid=12345, cmd='SUPER_CHAT_MESSAGE', since=datetime(2024, 3, 1).astimezone())
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from contextlib import closing
+from datetime import datetime, timezone
+from functools import cached_property
+from pathlib import Path
+from typing import Any, Iterable, NamedTuple
+
+from pydantic import BaseModel
+
+from .. import metrics
+
+__all__ = ('ArchivedEvent', 'EventArchive', 'shared_event_archive',)
+
+logger = logging.getLogger('userdata.archive')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    room_id INTEGER NOT NULL,
+    ts INTEGER NOT NULL,  -- 毫秒
+    cmd TEXT NOT NULL,
+    uid INTEGER,
+    price REAL NOT NULL DEFAULT 0,
+    text TEXT,
+    raw TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_room_ts ON events (room_id, ts);
+CREATE INDEX IF NOT EXISTS events_uid_ts ON events (uid, ts) WHERE uid IS NOT NULL;
+CREATE INDEX IF NOT EXISTS events_cmd_ts ON events (cmd, ts);
+"""
+
+archive_write_seconds = metrics.registry.histogram('archive_write_seconds', 'time committing a batch to the archive')
+
+_Row = tuple[int, int, str, int | None, float, str | None, str]
+
+
+def _ms(t: datetime) -> int:
+    return int(t.timestamp() * 1000)
+
+
+class ArchivedEvent(NamedTuple):
+    room_id: int
+    ts: datetime
+    cmd: str
+    uid: int | None
+    price: float
+    text: str | None
+    raw: str
+
+    @classmethod
+    def from_row(cls, row: _Row) -> 'ArchivedEvent':
+        room_id, ts, cmd, uid, price, text, raw = row
+        return cls(room_id, datetime.fromtimestamp(ts / 1000, timezone.utc).astimezone(), cmd, uid, price, text, raw)
+
+    def json(self) -> dict:
+        return json.loads(self.raw)
+
+
+class EventArchive(BaseModel):
+    """WAL 模式的 SQLite 存档，可由多个 handler 共享。
+
+    ``put`` 只把行追加到内存缓冲区；写入 task 每 *flush_interval* 秒或攒够 *batch_size* 行时
+    在线程里用一个事务写入。读取用独立的连接，不会被写入阻塞。
+    """
+    path: Path = Path('output/blive_saver/events.sqlite3')
+    batch_size: int = 512
+    flush_interval: float = 1.
+
+    # runtime
+    _task: asyncio.Task | None = None
+    _users: int = 0
+    _stopping: bool = False
+    _written: int = 0
+    _batches: int = 0
+
+    @cached_property
+    def _pending(self) -> list[_Row]:
+        return []
+
+    @cached_property
+    def _wakeup(self) -> asyncio.Event:
+        return asyncio.Event()
+
+    @cached_property
+    def _conn(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(SCHEMA)
+        logger.info(f'opened archive {self.path}')
+        return conn
+
+    def connect(self) -> sqlite3.Connection:
+        """只读查询用的新连接"""
+        self._conn  # 确保表已建立
+        return sqlite3.connect(f'file:{self.path.resolve()}?mode=ro', uri=True)
+
+    async def start(self):
+        self._users += 1
+        if self._task is None:
+            await asyncio.to_thread(lambda: self._conn)
+            self._stopping = False
+            self._wakeup.clear()
+            self._task = asyncio.create_task(self._writer(), name=f'archive-writer-{self.path.name}')
+
+    async def stop(self):
+        """最后一个使用者退出时写完缓冲区并关闭连接"""
+        self._users -= 1
+        if self._users > 0 or self._task is None:
+            return
+        task, self._task = self._task, None
+        self._stopping = True
+        self._wakeup.set()
+        await task
+        if (conn := self.__dict__.pop('_conn', None)) is not None:
+            conn.close()
+
+    def put(self, room_id: int, doc: dict | BaseModel, *, ts: datetime | None = None, cmd: str | None = None,
+            uid: int | None = None, price: float = 0, text: str | None = None):
+        """追加一条事件；对 :class:`~ubw.models.Summarizer` 的命令自动填入摘要里的时间、用户、金额和文本
+
+        其他房间先收到过的重复事件（带 ``dup_of`` 标记的）不写入
+        """
+        if getattr(doc, 'dup_of', None) is not None:
+            return
+        if isinstance(doc, BaseModel):
+            from ..models import Summarizer
+            if isinstance(doc, Summarizer):
+                summary = doc.summarize()
+                ts = ts or summary.t
+                if summary.user is not None and uid is None:
+                    uid = summary.user[0]
+                price = price or summary.price
+                text = text if text is not None else summary.msg
+            if ts is None and isinstance(ct := getattr(doc, 'ct', None), datetime):
+                ts = ct
+            cmd = cmd or getattr(doc, 'cmd', None)
+            raw = doc.model_dump_json(exclude_defaults=True, by_alias=True)
+        else:
+            cmd = cmd or doc.get('cmd')
+            raw = json.dumps(doc, ensure_ascii=False, default=str)
+        ms = _ms(ts) if ts is not None else int(time.time() * 1000)
+        self._pending.append((room_id, ms, str(cmd or ''), uid, float(price), text, raw))
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self):
+        rows = self._pending
+        if not rows:
+            return
+        self.__dict__['_pending'] = []
+        await asyncio.to_thread(self._write, rows)
+
+    def _write(self, rows: list[_Row]):
+        conn = self._conn
+        start = time.perf_counter()
+        conn.execute('BEGIN')
+        try:
+            conn.executemany('INSERT INTO events (room_id, ts, cmd, uid, price, text, raw) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        self._written += len(rows)
+        self._batches += 1
+        archive_write_seconds.observe(time.perf_counter() - start)
+
+    async def _writer(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.exception(f'failed to write archive {self.path}', exc_info=e)
+        await self.flush()
+
+    def select(self, *, room_id: int | None = None, uid: int | None = None, cmd: str | Iterable[str] | None = None,
+               since: datetime | None = None, until: datetime | None = None, text_like: str | None = None,
+               limit: int | None = None, desc: bool = False) -> list[ArchivedEvent]:
+        """按条件查询，结果按时间排序
+
+        :param text_like: SQL ``LIKE`` 模式，例如 ``'%草%'``
+        """
+        where, params = [], []
+        if room_id is not None:
+            where.append('room_id = ?')
+            params.append(room_id)
+        if uid is not None:
+            where.append('uid = ?')
+            params.append(uid)
+        if isinstance(cmd, str):
+            where.append('cmd = ?')
+            params.append(cmd)
+        elif cmd is not None:
+            cmd = list(cmd)
+            where.append(f'cmd IN ({",".join("?" * len(cmd))})')
+            params.extend(cmd)
+        if since is not None:
+            where.append('ts >= ?')
+            params.append(_ms(since))
+        if until is not None:
+            where.append('ts < ?')
+            params.append(_ms(until))
+        if text_like is not None:
+            where.append('text LIKE ?')
+            params.append(text_like)
+        sql = 'SELECT room_id, ts, cmd, uid, price, text, raw FROM events'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY ts DESC' if desc else ' ORDER BY ts'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        with closing(self.connect()) as conn:
+            return [ArchivedEvent.from_row(row) for row in conn.execute(sql, params)]
+
+    def query(self, sql: str, params: Iterable[Any] = ()) -> list[tuple]:
+        """只读的任意 SQL，例如按用户汇总金额"""
+        with closing(self.connect()) as conn:
+            return conn.execute(sql, tuple(params)).fetchall()
+
+    def stats(self) -> dict:
+        return {'pending': len(self._pending), 'written': self._written, 'batches': self._batches}
+
+
+_archives: dict[Path, EventArchive] = {}
+
+
+def shared_event_archive(path: Path = EventArchive.model_fields['path'].default) -> EventArchive:
+    """同一文件只有一个写入者"""
+    path = Path(path)
+    if (archive := _archives.get(path)) is None:
+        archive = _archives[path] = EventArchive(path=path)
+    return archive
+
+
+metrics.registry.register_stats('archive', lambda: {str(p): a.stats() for p, a in list(_archives.items())},
+                                label='path')
@@ -0,0 +1,215 @@
+"""把已关闭的 TinyDB 分片转成压缩的每行一条记录格式，附带按块的时间 / cmd 索引
+
+- ``<分片名>.jsonl.gz``：若干个 gzip member 首尾相接，整个文件仍可用 ``zcat`` 读取；每行为 ``[doc_id, 记录]``
+- ``<分片名>.idx.json``：每个 member 的偏移、长度、记录数、时间范围和 cmd 集合，查询时据此跳过整块
+
+索引文件在逐条比对通过后才写入，之后才删除原文件；没有索引的压缩文件视为未完成。
+"""
+import asyncio
+import functools
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterator
+
+from pydantic import BaseModel
+
+from .shards import Shard, compact_paths, find_shards, iter_tinydb, map_shards, record_fields
+
+__all__ = ('CompactError', 'BlockIndex', 'ShardIndex', 'read_index', 'iter_compact', 'compact_shard',
+           'closed_shards', 'compact_all', 'compact_in_background',)
+
+logger = logging.getLogger('userdata.compact')
+
+_READ_SIZE = 1 << 16
+
+
+class CompactError(Exception):
+    pass
+
+
+class BlockIndex(BaseModel):
+    """
+    :var untimed: 取不到时间的记录数；不为 0 时不能按时间跳过这一块
+    """
+    offset: int
+    length: int
+    table: str
+    count: int
+    ts_min: float | None = None
+    ts_max: float | None = None
+    untimed: int = 0
+    cmds: list[str] = []
+
+    def may_match(self, since: float | None = None, until: float | None = None,
+                  cmds: list[str] | None = None) -> bool:
+        if cmds and not any(c in self.cmds for c in cmds):
+            return False
+        if self.untimed or self.ts_min is None:
+            return True
+        if since is not None and self.ts_max < since:
+            return False
+        if until is not None and self.ts_min >= until:
+            return False
+        return True
+
+
+class ShardIndex(BaseModel):
+    version: int = 1
+    source: str
+    source_size: int
+    records: int
+    blocks: list[BlockIndex]
+
+
+def read_index(data_path: Path) -> ShardIndex | None:
+    try:
+        return ShardIndex.model_validate_json(compact_paths(data_path)[1].read_bytes())
+    except FileNotFoundError:
+        return None
+
+
+def _iter_block(f, block: BlockIndex) -> Iterator[tuple[int, dict]]:
+    f.seek(block.offset)
+    d = zlib.decompressobj(wbits=31)
+    remaining = block.length
+    pending = b''
+    while remaining:
+        data = f.read(min(_READ_SIZE, remaining))
+        if not data:
+            raise CompactError(f'truncated block at {block.offset}')
+        remaining -= len(data)
+        *lines, pending = (pending + d.decompress(data)).split(b'\n')
+        for line in lines:
+            doc_id, doc = json.loads(line)
+            yield doc_id, doc
+    if pending + d.flush():
+        raise CompactError(f'trailing data in block at {block.offset}')
+
+
+def iter_compact(data_path: Path, index: ShardIndex | None = None, *, since: float | None = None,
+                 until: float | None = None, cmds: list[str] | None = None) -> Iterator[tuple[str, int, dict]]:
+    """产出 (表名, doc_id, 记录)；给出条件时跳过索引表明不可能匹配的块，块内仍需逐条过滤"""
+    if index is None and (index := read_index(data_path)) is None:
+        raise CompactError(f'{data_path} has no index')
+    with data_path.open('rb') as f:
+        for block in index.blocks:
+            if block.may_match(since, until, cmds):
+                for doc_id, doc in _iter_block(f, block):
+                    yield block.table, doc_id, doc
+
+
+class _BlockWriter:
+    def __init__(self, f, table: str, level: int):
+        self.f = f
+        self.block = BlockIndex(offset=f.tell(), length=0, table=table, count=0)
+        self.cmds: set[str] = set()
+        self.c = zlib.compressobj(level, wbits=31)
+
+    def add(self, doc_id: int, doc: dict):
+        fields = record_fields(doc)
+        self.cmds.add(fields.cmd)
+        if fields.ts is None:
+            self.block.untimed += 1
+        else:
+            b = self.block
+            b.ts_min = fields.ts if b.ts_min is None else min(b.ts_min, fields.ts)
+            b.ts_max = fields.ts if b.ts_max is None else max(b.ts_max, fields.ts)
+        self.block.count += 1
+        self.f.write(self.c.compress(json.dumps([doc_id, doc], ensure_ascii=False).encode('utf-8') + b'\n'))
+
+    def close(self) -> BlockIndex:
+        self.f.write(self.c.flush())
+        self.block.length = self.f.tell() - self.block.offset
+        self.block.cmds = sorted(self.cmds)
+        return self.block
+
+
+def _verify(path: Path, data_path: Path, index: ShardIndex):
+    n = 0
+    for n, (a, b) in enumerate(itertools.zip_longest(iter_tinydb(path), iter_compact(data_path, index)), 1):
+        if a != b:
+            raise CompactError(f'{data_path} differs from {path} at record {n}: {a!r:.200} != {b!r:.200}')
+    if n != index.records:
+        raise CompactError(f'{data_path} has {n} records, index says {index.records}')
+
+
+def compact_shard(path: Path, *, block_records: int = 4096, level: int = 6,
+                  keep_original: bool = False) -> ShardIndex:
+    """压缩一个分片并逐条比对；通过后写索引、删除原文件"""
+    data_path, index_path = compact_paths(path)
+    source_size = path.stat().st_size
+    blocks = []
+    records = 0
+    tmp = data_path.with_name(data_path.name + '.tmp')
+    with tmp.open('wb') as f:
+        writer = None
+        for table, doc_id, doc in iter_tinydb(path):
+            if writer is not None and (writer.block.table != table or writer.block.count >= block_records):
+                blocks.append(writer.close())
+                writer = None
+            if writer is None:
+                writer = _BlockWriter(f, table, level)
+            writer.add(doc_id, doc)
+            records += 1
+        if writer is not None:
+            blocks.append(writer.close())
+        f.flush()
+        os.fsync(f.fileno())
+    index = ShardIndex(source=path.name, source_size=source_size, records=records, blocks=blocks)
+    try:
+        _verify(path, tmp, index)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    os.replace(tmp, data_path)
+    index_tmp = index_path.with_name(index_path.name + '.tmp')
+    index_tmp.write_text(index.model_dump_json(), encoding='utf-8')
+    os.replace(index_tmp, index_path)
+    if not keep_original:
+        path.unlink()
+    logger.info(f'compacted {path}: {records} records, {source_size} -> {data_path.stat().st_size} bytes')
+    return index
+
+
+def closed_shards(shards: list[Shard]) -> list[Shard]:
+    """已有后继分片（不会再被写入）且尚未压缩的 TinyDB 分片"""
+    return [s for s in shards if s.end is not None and s.path.suffix == '.json']
+
+
+def _compact_one(shard: Shard, keep_original: bool = False) -> ShardIndex | str:
+    """进程池里运行，失败时返回错误信息而不是抛出，以免中断其它分片"""
+    try:
+        return compact_shard(shard.path, keep_original=keep_original)
+    except Exception as e:
+        logger.exception(f'failed to compact {shard.path}', exc_info=e)
+        return repr(e)
+
+
+def compact_all(shards: list[Shard], jobs: int | None = None, keep_original: bool = False,
+                ) -> Iterator[tuple[Shard, ShardIndex | str]]:
+    """并行压缩 *shards* 中已关闭的分片"""
+    return map_shards(functools.partial(_compact_one, keep_original=keep_original), closed_shards(shards), jobs)
+
+
+def _compact_room(root: Path, room_id: int) -> int:
+    return sum(isinstance(result, ShardIndex) for _, result in compact_all(find_shards(root, [room_id]), jobs=1))
+
+
+_executor: ProcessPoolExecutor | None = None
+
+
+async def compact_in_background(root: Path, room_id: int) -> int:
+    """在单独的进程里压缩一个房间已关闭的分片，返回成功的个数；供 handler 在切换分片后调用"""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn'))
+    n = await asyncio.get_running_loop().run_in_executor(_executor, _compact_room, root, room_id)
+    if n:
+        logger.info(f'compacted {n} shards of room {room_id} under {root}')
+    return n
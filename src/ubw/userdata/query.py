@@ -0,0 +1,159 @@
+"""离线查询保存的分片：多进程扫描，过滤条件尽早生效，聚合结果在主进程合并
+
+过滤顺序：房间目录 → 分片文件名里的时间 → cmd → 时间 → uid → 正则 → shark 表达式（``--where``）。
+"""
+import functools
+import json
+import logging
+import re
+from datetime import datetime
+from functools import cached_property
+from typing import Any, Callable, Iterable
+
+from pydantic import BaseModel
+
+from ..handlers.shark import eval_on_cmd, parse_expr
+from .shards import Fields, Shard, iter_shard, map_shards, record_fields
+
+__all__ = ('Query', 'GROUP_KEYS', 'aggregate', 'iter_records',)
+
+logger = logging.getLogger('userdata.query')
+
+GROUP_KEYS: dict[str, Callable[[Shard, Fields], Any]] = {
+    'room': lambda shard, f: shard.room_id,
+    'cmd': lambda shard, f: f.cmd,
+    'uid': lambda shard, f: f.uid,
+    'month': lambda shard, f: _local(f, shard).strftime('%Y-%m'),
+    'day': lambda shard, f: _local(f, shard).strftime('%Y-%m-%d'),
+    'hour': lambda shard, f: _local(f, shard).strftime('%Y-%m-%d %H:00'),
+}
+
+
+def _local(f: Fields, shard: Shard) -> datetime:
+    return datetime.fromtimestamp(f.ts).astimezone() if f.ts is not None else shard.start
+
+
+class Query(BaseModel):
+    """
+    :var where: shark 表达式，例如 ``data.price >= 100``
+    :var group_by: :data:`GROUP_KEYS` 里的键或 shark 表达式
+    :var sum: ``price``（统一换算为元）或 shark 表达式
+    """
+    since: datetime | None = None
+    until: datetime | None = None
+    cmds: list[str] = []
+    uids: list[int] = []
+    regex: str | None = None
+    where: str | None = None
+    group_by: list[str] = []
+    sum: str | None = None
+    limit: int | None = None
+
+    @cached_property
+    def _since(self) -> float | None:
+        return self.since.timestamp() if self.since is not None else None
+
+    @cached_property
+    def _until(self) -> float | None:
+        return self.until.timestamp() if self.until is not None else None
+
+    @cached_property
+    def _regex(self) -> re.Pattern | None:
+        return re.compile(self.regex) if self.regex is not None else None
+
+    @cached_property
+    def _where(self):
+        return parse_expr(self.where) if self.where is not None else None
+
+    @property
+    def aggregating(self) -> bool:
+        return bool(self.group_by) or self.sum is not None
+
+    def match(self, doc: dict) -> Fields | None:
+        f = record_fields(doc)
+        if self.cmds and f.cmd not in self.cmds:
+            return None
+        if f.ts is not None:
+            if self._since is not None and f.ts < self._since:
+                return None
+            if self._until is not None and f.ts >= self._until:
+                return None
+        if self.uids and f.uid not in self.uids:
+            return None
+        if self._regex is not None and (f.msg is None or not self._regex.search(f.msg)):
+            return None
+        if self._where is not None:
+            try:
+                if not eval_on_cmd(self._where, doc):
+                    return None
+            except (KeyError, IndexError, TypeError, ValueError):
+                return None
+        return f
+
+    def group_key(self, shard: Shard, doc: dict, f: Fields) -> tuple:
+        key = []
+        for g in self.group_by:
+            if (builtin := GROUP_KEYS.get(g)) is not None:
+                key.append(builtin(shard, f))
+                continue
+            try:
+                value = eval_on_cmd(parse_expr(g), doc)
+            except (KeyError, IndexError, TypeError, ValueError):
+                value = None
+            key.append(json.dumps(value, ensure_ascii=False) if isinstance(value, (dict, list)) else value)
+        return tuple(key)
+
+    def sum_value(self, doc: dict, f: Fields) -> float:
+        if self.sum is None:
+            return 0.
+        if self.sum == 'price':
+            return f.price
+        try:
+            value = eval_on_cmd(parse_expr(self.sum), doc)
+        except (KeyError, IndexError, TypeError, ValueError):
+            return 0.
+        return value if isinstance(value, (int, float)) and not isinstance(value, bool) else 0.
+
+
+def _scan_aggregate(query: Query, shard: Shard) -> dict[tuple, list[float]]:
+    groups: dict[tuple, list[float]] = {}
+    for doc in iter_shard(shard.path, since=query._since, until=query._until, cmds=query.cmds):
+        if (f := query.match(doc)) is None:
+            continue
+        acc = groups.get(key := query.group_key(shard, doc, f))
+        if acc is None:
+            acc = groups[key] = [0, 0.]
+        acc[0] += 1
+        acc[1] += query.sum_value(doc, f)
+    return groups
+
+
+def _scan_records(query: Query, shard: Shard) -> list[dict]:
+    records = []
+    for doc in iter_shard(shard.path, since=query._since, until=query._until, cmds=query.cmds):
+        if query.match(doc) is not None:
+            records.append(doc)
+            if query.limit is not None and len(records) >= query.limit:
+                break
+    return records
+
+
+def aggregate(query: Query, shards: list[Shard], jobs: int | None = None) -> dict[tuple, tuple[int, float]]:
+    """返回 {分组键: (条数, 求和)}"""
+    merged: dict[tuple, list[float]] = {}
+    for shard, groups in map_shards(functools.partial(_scan_aggregate, query), shards, jobs):
+        for key, (count, total) in groups.items():
+            acc = merged.setdefault(key, [0, 0.])
+            acc[0] += count
+            acc[1] += total
+    return {key: (int(count), total) for key, (count, total) in merged.items()}
+
+
+def iter_records(query: Query, shards: list[Shard], jobs: int | None = None) -> Iterable[tuple[Shard, dict]]:
+    n = 0
+    for shard, records in map_shards(functools.partial(_scan_records, query), shards, jobs):
+        for doc in records:
+            yield shard, doc
+            n += 1
+            if query.limit is not None and n >= query.limit:
+                return
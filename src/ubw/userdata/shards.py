@@ -0,0 +1,247 @@
+"""``SaverHandler`` / ``DumpRawHandler`` 写下的 TinyDB 分片：查找、流式读取、提取常用字段
+
+分片文件形如 ``{"_default": {"1": {...}, "2": {...}}}``，可能有数 GB，这里逐条解析，内存占用只与单条记录有关。
+"""
+import itertools
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import IO, Callable, Iterator, NamedTuple, TypeVar
+
+__all__ = ('SHARD_ROOTS', 'COMPACT_SUFFIX', 'INDEX_SUFFIX', 'Shard', 'find_shards', 'map_shards', 'compact_paths',
+           'iter_tinydb', 'iter_shard', 'Fields', 'record_fields',)
+
+_T = TypeVar('_T')
+
+SHARD_ROOTS = {
+    'saver': Path('output/blive_saver'),
+    'dump_raw': Path('output/blive_dumpraw'),
+}
+
+SHARD_STEM_FORMAT = '%Y年%m月%d日%H点%M%S'
+COMPACT_SUFFIX = '.jsonl.gz'
+INDEX_SUFFIX = '.idx.json'
+
+_TINY_DATE = '{TinyDate}:'
+_WS = re.compile(r'[ \t\n\r]*')
+_decoder = json.JSONDecoder()
+
+
+class Shard(NamedTuple):
+    """
+    :var end: 同一房间下一个分片的开始时间，最后一个分片为 ``None``
+    """
+    room_id: int
+    start: datetime
+    end: datetime | None
+    path: Path
+
+    def overlaps(self, since: datetime | None, until: datetime | None) -> bool:
+        if until is not None and self.start >= until:
+            return False
+        if since is not None and self.end is not None and self.end <= since:
+            return False
+        return True
+
+
+def compact_paths(path: Path) -> tuple[Path, Path]:
+    """分片对应的 (压缩文件, 索引文件)"""
+    stem = path.name.split('.', 1)[0]
+    return path.with_name(stem + COMPACT_SUFFIX), path.with_name(stem + INDEX_SUFFIX)
+
+
+def _shard_start(path: Path) -> datetime | None:
+    try:
+        return datetime.strptime(path.name.split('.', 1)[0], SHARD_STEM_FORMAT).astimezone()
+    except ValueError:
+        return None
+
+
+def find_shards(root: Path, rooms: list[int] | None = None, since: datetime | None = None,
+                until: datetime | None = None) -> list[Shard]:
+    """按房间目录和文件名里的开始时间筛选分片，不打开文件"""
+    shards = []
+    room_dirs = [root / str(r) for r in rooms] if rooms else sorted(root.iterdir()) if root.is_dir() else []
+    for room_dir in room_dirs:
+        if not room_dir.is_dir() or not room_dir.name.isdigit():
+            continue
+        found: dict[datetime, Path] = {}
+        for path in room_dir.rglob('*.json*'):
+            if path.name.endswith(INDEX_SUFFIX) or (start := _shard_start(path)) is None:
+                continue
+            if path.name.endswith('.json'):
+                found.setdefault(start, path)
+            elif path.name.endswith(COMPACT_SUFFIX) and compact_paths(path)[1].exists():
+                found[start] = path  # 压缩并校验过的优先
+        starts = sorted(found)
+        for start, end in itertools.zip_longest(starts, starts[1:]):
+            shard = Shard(int(room_dir.name), start, end, found[start])
+            if shard.overlaps(since, until):
+                shards.append(shard)
+    return shards
+
+
+def map_shards(fn: Callable[[Shard], _T], shards: list[Shard], jobs: int | None = None,
+               ) -> Iterator[tuple[Shard, _T]]:
+    """在进程池里对每个分片调用 *fn*，按分片顺序产出结果；*jobs* 为 1 时不起进程池"""
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(shards) <= 1:
+        for shard in shards:
+            yield shard, fn(shard)
+        return
+    executor = ProcessPoolExecutor(min(jobs, len(shards)))
+    try:
+        yield from zip(shards, executor.map(fn, shards))
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+class _Reader:
+    """按块读取，逐个解析 JSON 值"""
+
+    def __init__(self, f: IO[str], chunk_size: int):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+
+    def _fill(self, size: int | None = None) -> bool:
+        chunk = self.f.read(size or self.chunk_size)
+        if not chunk:
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            self.pos = _WS.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def take(self, expected: str) -> str:
+        ch = self.peek()
+        if not ch or ch not in expected:
+            raise ValueError(f'expected one of {expected!r} at {self.f.tell()}, got {ch!r}')
+        self.pos += 1
+        return ch
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # 记录被块边界截断；记录很大时每次多读一倍
+                if self._fill(max(self.chunk_size, len(self.buf) - self.pos)):
+                    continue
+                raise
+            if end == len(self.buf) and self._fill():  # 数字可能被截断
+                continue
+            self.pos = end
+            return value
+
+
+def iter_tinydb(path: Path, chunk_size: int = 1 << 20) -> Iterator[tuple[str, int, dict]]:
+    """流式遍历 TinyDB JSON 文件，产出 (表名, doc_id, 记录)"""
+    with open(path, encoding='utf-8') as f:
+        r = _Reader(f, chunk_size)
+        if r.peek() == '':
+            return
+        r.take('{')
+        if r.peek() == '}':
+            return
+        while True:
+            table = r.value()
+            r.take(':')
+            r.take('{')
+            if r.peek() == '}':
+                r.take('}')
+            else:
+                while True:
+                    doc_id = r.value()
+                    r.take(':')
+                    yield table, int(doc_id), r.value()
+                    if r.take(',}') == '}':
+                        break
+            if r.take(',}') == '}':
+                return
+
+
+def iter_shard(path: Path, *, since: float | None = None, until: float | None = None,
+               cmds: list[str] | None = None) -> Iterator[dict]:
+    """分片里的记录；压缩过的分片按索引跳过不可能匹配的块，其余条件仍需调用方逐条判断"""
+    if path.name.endswith(COMPACT_SUFFIX):
+        from .compact import iter_compact
+        records = iter_compact(path, since=since, until=until, cmds=cmds)
+    else:
+        records = iter_tinydb(path)
+    for _, _, doc in records:
+        yield doc
+
+
+class Fields(NamedTuple):
+    cmd: str
+    ts: float | None
+    uid: int | None
+    msg: str | None
+    price: float
+
+
+def _ts(value) -> float | None:
+    match value:
+        case str() if value.startswith(_TINY_DATE):
+            return datetime.fromisoformat(value[len(_TINY_DATE):]).timestamp()
+        case bool() | None:
+            return None
+        case int() | float():
+            return value / 1000 if value > 1e11 else float(value)
+    return None
+
+
+def _int(value) -> int | None:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def record_fields(doc: dict) -> Fields:
+    """从原始命令（``DumpRawHandler``）或 ``model_dump`` 后的命令（``SaverHandler``）里取出时间、用户、文本和金额
+
+    没有自带时间的记录退回到 ``ct``，仍然没有时为 ``None``。
+    """
+    cmd = doc.get('cmd') or ''
+    if (pos := cmd.find(':')) != -1:
+        cmd = cmd[:pos]
+    ts = uid = msg = None
+    price = 0.
+    data = doc.get('data')
+    data = data if isinstance(data, dict) else {}
+    match cmd:
+        case 'DANMU_MSG':
+            match doc.get('info'):
+                case [[_, _, _, _, ts, *_], msg, [uid, *_], *_]:
+                    ts = _ts(ts)
+                case {'msg': msg, 'uid': uid, **info}:
+                    ts = _ts(info.get('timestamp'))
+        case 'SUPER_CHAT_MESSAGE':
+            uid, msg, ts, price = data.get('uid'), data.get('message'), _ts(data.get('start_time')), data.get('price')
+        case 'SEND_GIFT':
+            uid, ts = data.get('uid'), _ts(data.get('timestamp'))
+            msg = f"{data.get('giftName')}x{data.get('num')}"
+            if data.get('coin_type') == 'gold':
+                price = (data.get('price') or 0) * (data.get('num') or 0) / 1000
+        case 'GUARD_BUY':
+            uid, ts, msg = data.get('uid'), _ts(data.get('start_time')), data.get('gift_name')
+            price = (data.get('price') or 0) / 1000
+        case _:
+            uid = data.get('uid')
+    if ts is None:
+        ts = _ts(doc.get('ct'))
+    return Fields(cmd, ts, _int(uid), msg if isinstance(msg, str) else None, float(price or 0))
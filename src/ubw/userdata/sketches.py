@@ -0,0 +1,244 @@
+"""可合并的去重计数草图，以及按 (日期, 房间, 类别) 保存它们的 SQLite 库
+
+- ``HyperLogLog``：估计去重人数，*p* = 12 时 4 KB、误差约 1.6%；合并即逐个寄存器取最大值
+- ``BottomK``：保留最小的 *k* 个哈希值（KMV，MinHash 的一种），用于估计多个房间之间的重合比例
+
+两者都只依赖 uid 的哈希，不同进程各自统计后写入同一个库时按上述规则合并，结果与在一个进程里统计相同。
+"""
+import logging
+import math
+import sqlite3
+from array import array
+from bisect import bisect_left
+from contextlib import closing
+from datetime import date
+from pathlib import Path
+from typing import Iterable, NamedTuple
+
+__all__ = ('mix64', 'HyperLogLog', 'BottomK', 'RoomDaySketch', 'SketchStore', 'default_sketch_path', 'AudienceEstimate', 'estimate',)
+
+logger = logging.getLogger('userdata.sketches')
+
+_MASK64 = (1 << 64) - 1
+_INV_POW = [2.0 ** -i for i in range(66)]
+
+
+def mix64(x: int) -> int:
+    """splitmix64 的末尾混合，把 uid 这类连续整数打散成均匀的 64 位值"""
+    x &= _MASK64
+    x = (x ^ (x >> 30)) * 0xBF58476D1CE4E5B9 & _MASK64
+    x = (x ^ (x >> 27)) * 0x94D049BB133111EB & _MASK64
+    return x ^ (x >> 31)
+
+
+class HyperLogLog:
+    __slots__ = ('p', 'registers')
+
+    def __init__(self, p: int = 12, registers: bytes | bytearray | None = None):
+        self.p = p
+        self.registers = bytearray(registers) if registers is not None else bytearray(1 << p)
+        if len(self.registers) != 1 << p:
+            raise ValueError(f'expected {1 << p} registers, got {len(self.registers)}')
+
+    def add_hash(self, h: int):
+        p = self.p
+        rest = h & ((1 << (64 - p)) - 1)
+        rank = 64 - p - rest.bit_length() + 1
+        idx = h >> (64 - p)
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def add(self, uid: int):
+        self.add_hash(mix64(uid))
+
+    def merge(self, *others: 'HyperLogLog') -> 'HyperLogLog':
+        if others:
+            self.registers = bytearray(map(max, self.registers, *(o.registers for o in others)))
+        return self
+
+    @classmethod
+    def union(cls, sketches: Iterable['HyperLogLog']) -> 'HyperLogLog':
+        sketches = list(sketches)
+        if not sketches:
+            return cls()
+        return cls(sketches[0].p).merge(*sketches)
+
+    def count(self) -> float:
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(map(_INV_POW.__getitem__, self.registers))
+        if estimate <= 2.5 * m and (zeros := self.registers.count(0)):
+            return m * math.log(m / zeros)
+        return estimate
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'HyperLogLog':
+        return cls(len(data).bit_length() - 1, data)
+
+
+class BottomK:
+    """升序保存的最小 *k* 个哈希值；大多数哈希值不小于当前第 k 小，只需一次比较"""
+    __slots__ = ('k', 'values')
+
+    def __init__(self, k: int = 256, values: Iterable[int] = ()):
+        self.k = k
+        self.values = array('Q', sorted(set(values))[:k])
+
+    def add_hash(self, h: int):
+        values = self.values
+        if len(values) >= self.k and h >= values[-1]:
+            return
+        i = bisect_left(values, h)
+        if i < len(values) and values[i] == h:
+            return
+        values.insert(i, h)
+        if len(values) > self.k:
+            values.pop()
+
+    def add(self, uid: int):
+        self.add_hash(mix64(uid))
+
+    def merge(self, *others: 'BottomK') -> 'BottomK':
+        if others:
+            self.values = BottomK(self.k, self._union_values(self, *others)).values
+        return self
+
+    @staticmethod
+    def _union_values(*sketches: 'BottomK') -> set[int]:
+        union = set()
+        for s in sketches:
+            union.update(s.values)
+        return union
+
+    def count(self) -> float:
+        if len(self.values) < self.k:
+            return float(len(self.values))
+        return (self.k - 1) / ((self.values[-1] + 1) / (1 << 64))
+
+    @classmethod
+    def jaccard(cls, sketches: list['BottomK']) -> float:
+        """所有草图的交集占并集的比例"""
+        if not sketches:
+            return 0.
+        k = min(s.k for s in sketches)
+        union = sorted(cls._union_values(*sketches))[:k]
+        if not union:
+            return 0.
+        members = [set(s.values) for s in sketches]
+        return sum(all(v in m for m in members) for v in union) / len(union)
+
+    def to_bytes(self) -> bytes:
+        return self.values.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes, k: int = 256) -> 'BottomK':
+        values = array('Q')
+        values.frombytes(data)
+        return cls(max(k, len(values)), values)
+
+
+class RoomDaySketch:
+    __slots__ = ('hll', 'kmv')
+
+    def __init__(self, p: int = 12, k: int = 256):
+        self.hll = HyperLogLog(p)
+        self.kmv = BottomK(k)
+
+    def add(self, uid: int):
+        h = mix64(uid)
+        self.hll.add_hash(h)
+        self.kmv.add_hash(h)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sketches (
+    day TEXT NOT NULL,
+    room_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    hll BLOB NOT NULL,
+    kmv BLOB NOT NULL,
+    PRIMARY KEY (day, room_id, kind)
+) WITHOUT ROWID;
+"""
+
+
+def default_sketch_path() -> Path:
+    from .paths import get_path
+    return get_path(ensure_exists=False).data_path / 'sketches.sqlite3'
+
+
+class SketchStore:
+    """``sketches(day, room_id, kind, hll, kmv)``；写入时与已有的草图合并，多个进程可以写同一个文件"""
+
+    def __init__(self, path: Path | None = None):
+        self.path = Path(path) if path is not None else default_sketch_path()
+
+    def connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(_SCHEMA)
+        return conn
+
+    def merge(self, sketches: dict[tuple[str, int, str], RoomDaySketch]):
+        if not sketches:
+            return
+        with closing(self.connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for (day, room_id, kind), sketch in sketches.items():
+                    row = conn.execute('SELECT hll, kmv FROM sketches WHERE day = ? AND room_id = ? AND kind = ?',
+                                       (day, room_id, kind)).fetchone()
+                    hll, kmv = sketch.hll, sketch.kmv
+                    if row is not None:
+                        hll = HyperLogLog.from_bytes(row[0]).merge(hll)
+                        kmv = BottomK.from_bytes(row[1], kmv.k).merge(kmv)
+                    conn.execute('INSERT OR REPLACE INTO sketches VALUES (?, ?, ?, ?, ?)',
+                                 (day, room_id, kind, hll.to_bytes(), kmv.to_bytes()))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+
+    def load(self, rooms: Iterable[int], since: date, until: date, kind: str = 'viewers',
+             ) -> dict[int, list[tuple[HyperLogLog, BottomK]]]:
+        """[since, until] 内每个房间每天的草图"""
+        rooms = list(rooms)
+        result: dict[int, list[tuple[HyperLogLog, BottomK]]] = {r: [] for r in rooms}
+        if not self.path.exists() or not rooms:
+            return result
+        with closing(self.connect()) as conn:
+            placeholders = ','.join('?' * len(rooms))
+            for room_id, hll, kmv in conn.execute(
+                    f'SELECT room_id, hll, kmv FROM sketches WHERE kind = ? AND day >= ? AND day <= ? '
+                    f'AND room_id IN ({placeholders})', (kind, since.isoformat(), until.isoformat(), *rooms)):
+                result[room_id].append((HyperLogLog.from_bytes(hll), BottomK.from_bytes(kmv)))
+        return result
+
+
+class AudienceEstimate(NamedTuple):
+    """
+    :var union: 这些房间合计的去重人数
+    :var shared: 在所有房间都出现过的人数
+    :var jaccard: shared / union
+    """
+    per_room: dict[int, float]
+    union: float
+    shared: float
+    jaccard: float
+
+
+def estimate(store: SketchStore, rooms: Iterable[int], since: date, until: date | None = None,
+             kind: str = 'viewers') -> AudienceEstimate:
+    until = until or since
+    loaded = store.load(rooms, since, until, kind)
+    per_room_hll, per_room_kmv = {}, []
+    for room_id, sketches in loaded.items():
+        hll = HyperLogLog.union(h for h, _ in sketches)
+        per_room_hll[room_id] = hll
+        per_room_kmv.append(BottomK(256).merge(*(k for _, k in sketches)))
+    union = HyperLogLog.union(per_room_hll.values()).count() if per_room_hll else 0.
+    jaccard = BottomK.jaccard(per_room_kmv) if len(per_room_kmv) > 1 else 1. if per_room_kmv else 0.
+    return AudienceEstimate({r: h.count() for r, h in per_room_hll.items()}, union, union * jaccard, jaccard)
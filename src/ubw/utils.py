@@ -6,6 +6,7 @@ from typing import Callable
 
 from .clients import BilibiliCookieClient, WSWebCookieLiveClient, HandlerInterface, BilibiliClientABC
 from .handlers import BaseHandler
+from .runner import run
 
 __all__ = ('listen_to_all', 'sync')
 
@@ -58,7 +59,7 @@ def sync(f):
     @wraps(f)
     def wrapper(*args, **kwargs):
         try:
-            return asyncio.run(f(*args, **kwargs))
+            return run(f(*args, **kwargs))
         except KeyboardInterrupt:
             print("...user abort...", file=sys.stderr)
             return None
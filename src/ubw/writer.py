@@ -0,0 +1,237 @@
+"""追加写文件的共享服务：每个输出文件一个写入 task，记录先进内存，攒够 *batch_size* 条或每 *flush_interval* 秒
+在线程里一次写入，避免每条记录一次 open / write / flush。
+
+::
+
+    writer = shared_writer('output/edge_collect/{date}.jsonl', durability='fsync')
+    writer.write_nowait(json.dumps(command) + '\\n')
+"""
+import asyncio
+import atexit
+import csv
+import io
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from functools import cached_property
+from pathlib import Path
+from typing import IO, Iterable, Literal
+
+from pydantic import BaseModel
+
+from . import metrics
+
+__all__ = ('FileWriter', 'shared_writer', 'close_all', 'format_csv_row',)
+
+logger = logging.getLogger('ubw.writer')
+
+commit_seconds = metrics.registry.histogram('writer_commit_seconds', 'time writing a batch to a file')
+
+
+def format_csv_row(fieldnames: Iterable[str], row: dict | None = None) -> str:
+    """一行 CSV 文本；*row* 为 ``None`` 时为表头"""
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, list(fieldnames))
+    if row is None:
+        writer.writeheader()
+    else:
+        writer.writerow(row)
+    return buf.getvalue()
+
+
+class FileWriter(BaseModel):
+    """
+    :var path: 可包含 ``{date}``（``%Y%m%d``），日期变化时换到新文件
+    :var header: 新文件（或空文件）开头写入的内容，例如 CSV 表头
+    :var durability: 每批写入后 ``none`` 不做处理，``flush`` 交给操作系统，``fsync`` 等待落盘
+    :var rotate_size: 文件超过这个大小后写入 ``name.1.ext``、``name.2.ext`` ……
+    :var max_pending: 内存里最多积压的记录数；``write`` 会等待，``write_nowait`` 会丢弃并计数
+    """
+    path: str
+    header: str = ''
+    batch_size: int = 1024
+    flush_interval: float = 1.
+    durability: Literal['none', 'flush', 'fsync'] = 'flush'
+    rotate_size: int | None = None
+    max_pending: int = 65536
+    encoding: str = 'utf-8'
+
+    # runtime
+    _task: asyncio.Task | None = None
+    _loop: asyncio.AbstractEventLoop | None = None
+    _wakeup: asyncio.Event | None = None
+    _drained: asyncio.Event | None = None
+    _file: IO[str] | None = None
+    _file_path: Path | None = None
+    _date: str = ''
+    _part: int = 0
+    _written: int = 0
+    _commits: int = 0
+    _dropped: int = 0
+
+    @cached_property
+    def _pending(self) -> list[str]:
+        return []
+
+    @cached_property
+    def _lock(self) -> threading.Lock:
+        return threading.Lock()
+
+    def _ensure_task(self):
+        loop = asyncio.get_running_loop()
+        if self._task is not None and self._loop is loop and not self._task.done():
+            return
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._drained = asyncio.Event()
+        self._task = loop.create_task(self._run(), name=f'writer {self.path}')
+
+    def write_nowait(self, data: str) -> bool:
+        """放入队列，积压已满时丢弃并返回 ``False``"""
+        if len(self._pending) >= self.max_pending:
+            if not self._dropped:
+                logger.warning(f'writer of {self.path} is full, dropping records')
+            self._dropped += 1
+            return False
+        self._pending.append(data)
+        self._ensure_task()
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    async def write(self, data: str):
+        """放入队列，积压已满时等待写入 task 清空"""
+        while len(self._pending) >= self.max_pending:
+            self._ensure_task()
+            self._drained.clear()
+            self._wakeup.set()
+            await self._drained.wait()
+        self.write_nowait(data)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.exception(f'failed to write {self.path}', exc_info=e)
+
+    def _take(self) -> list[str]:
+        batch = self._pending
+        self.__dict__['_pending'] = []
+        return batch
+
+    async def flush(self):
+        """把积压的记录写入文件"""
+        if batch := self._take():
+            await asyncio.to_thread(self._commit, batch)
+        if self._drained is not None:
+            self._drained.set()
+
+    def _target(self) -> Path:
+        path = Path(self.path.replace('{date}', self._date))
+        if self._part:
+            path = path.with_name(f'{path.stem}.{self._part}{path.suffix}')
+        return path
+
+    def _open(self) -> IO[str]:
+        date = datetime.today().strftime('%Y%m%d')
+        if date != self._date:
+            self._date, self._part = date, 0
+        elif self._file is not None and self.rotate_size is not None and self._file.tell() >= self.rotate_size:
+            self._part += 1
+        if self._file is not None:
+            if self._target() == self._file_path:
+                return self._file
+            self._file.close()
+            self._file = self._file_path = None
+        while True:
+            target = self._target()
+            target.parent.mkdir(parents=True, exist_ok=True)
+            f = target.open('a', encoding=self.encoding, newline='')
+            if self.rotate_size is None or f.tell() < self.rotate_size:
+                break
+            f.close()  # 上次运行已经写满
+            self._part += 1
+        if self.header and f.tell() == 0:
+            f.write(self.header)
+        self._file, self._file_path = f, target
+        logger.debug(f'writing to {target}')
+        return f
+
+    def _commit(self, batch: list[str]):
+        with self._lock:
+            start = time.perf_counter()
+            f = self._open()
+            f.write(''.join(batch))
+            if self.durability != 'none':
+                f.flush()
+                if self.durability == 'fsync':
+                    os.fsync(f.fileno())
+            self._written += len(batch)
+            self._commits += 1
+            commit_seconds.observe(time.perf_counter() - start)
+
+    def _close_file(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = self._file_path = None
+
+    async def close(self):
+        """写完积压的记录并关闭文件"""
+        task, self._task = self._task, None
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+        self._close_file()
+        if _writers.get(self.path) is self:
+            del _writers[self.path]
+
+    def close_sync(self):
+        """事件循环已经结束时使用"""
+        if batch := self._take():
+            self._commit(batch)
+        self._close_file()
+
+    def stats(self) -> dict:
+        return {'pending': len(self._pending), 'written': self._written, 'commits': self._commits,
+                'dropped': self._dropped}
+
+
+_writers: dict[str, FileWriter] = {}
+
+
+def shared_writer(path: str | os.PathLike, **kwargs) -> FileWriter:
+    """同一路径只有一个写入者；*kwargs* 只在第一次创建时生效"""
+    path = str(path)
+    if (writer := _writers.get(path)) is None:
+        writer = _writers[path] = FileWriter(path=path, **kwargs)
+    return writer
+
+
+async def close_all():
+    for writer in list(_writers.values()):
+        await writer.close()
+
+
+@atexit.register
+def _close_all_sync():
+    for writer in list(_writers.values()):
+        try:
+            writer.close_sync()
+        except Exception as e:
+            logger.exception(f'failed to close writer of {writer.path}', exc_info=e)
+
+
+metrics.registry.register_stats('writer', lambda: {p: w.stats() for p, w in list(_writers.items())}, label='path')
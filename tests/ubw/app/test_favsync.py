@@ -0,0 +1,76 @@
+import asyncio
+import json
+from unittest.mock import patch, AsyncMock, MagicMock
+
+import pytest
+
+from ubw.app.favsync import FavSyncApp
+from ubw.clients import MockBilibiliClient
+from ubw.downloader import DownloadScheduler
+from ubw.downloader.asset_cache import AssetCache, AssetEntry
+from ubw.models.bilibili import FavMedia
+
+
+@pytest.mark.asyncio
+async def test_favsync_incremental(tmp_path):
+    (tmp_path / '.archive.json').write_text(json.dumps({'A': ['v1'], 'B': []}))
+    (tmp_path / '.archive.journal').write_text('["B", "p1"]\n["B", "p')  # torn by a crash
+
+    listed = []
+
+    async def fetch_fav_list(self, credential):
+        for media in [FavMedia(bvid='C', title='c', page=2), FavMedia(bvid='A', title='a', page=1),
+                      FavMedia(bvid='D', title='d', page=1)]:
+            listed.append(media.bvid)
+            yield media
+
+    synced = []
+
+    async def sync_page(self, credential, bvid, bvid_root, page):
+        synced.append((bvid, bvid_root.name, page))
+        if (bvid, page) == ('C', 2):
+            raise RuntimeError('boom')
+
+    info = {'title': 'b', 'pages': [{}, {}]}
+    video_cls = MagicMock(return_value=MagicMock(get_info=AsyncMock(return_value=info)))
+    with (patch.object(FavSyncApp, '_fetch_fav_list', fetch_fav_list),
+          patch.object(FavSyncApp, '_sync_page', sync_page),
+          patch('ubw.app.favsync.video.Video', video_cls)):
+        app = FavSyncApp(favlist_id=1, target_path=tmp_path, bilibili_client=MockBilibiliClient(),
+                         stop_after_synced=1)
+        async with asyncio.timeout(5):
+            await app._run()
+
+    assert listed == ['C', 'A']  # stopped at the synced media
+    assert sorted(synced) == [('B', 'b [B]', 2), ('C', 'c [C]', 1), ('C', 'c [C]', 2)]
+    assert json.loads((tmp_path / '.archive.json').read_text()) == {
+        'A': ['v1'], 'B': ['p1', 'p2', 'v1'], 'C': ['p1']}
+    assert not (tmp_path / '.archive.journal').exists()
+
+
+@pytest.mark.asyncio
+async def test_fav_list_rate_limited():
+    from ubw.clients._ratelimit import rate_limiter
+
+    def page(n, has_more):
+        return {'code': 0, 'message': '0', 'data': {
+            'info': {'title': 'fav', 'media_count': 2}, 'has_more': has_more,
+            'medias': [{'bvid': f'BV{n}', 'title': str(n), 'page': 1}]}}
+
+    fav_list = MagicMock(get_content=AsyncMock(side_effect=[page(1, True), page(2, False)]))
+    app = FavSyncApp(favlist_id=1, target_path='.', bilibili_client=MockBilibiliClient())
+    before = rate_limiter.bucket('get_fav_list').acquired
+    with patch('ubw.app.favsync.FavoriteList', MagicMock(return_value=fav_list)):
+        async with asyncio.timeout(5):
+            assert [m.bvid async for m in app._fetch_fav_list(None)] == ['BV1', 'BV2']
+    assert rate_limiter.bucket('get_fav_list').acquired - before == 2
+
+
+@pytest.mark.asyncio
+async def test_close_saves_asset_index(tmp_path):
+    cache = AssetCache(root=tmp_path / 'assets', scheduler=DownloadScheduler())
+    cache.index['https://i0.hdslb.com/cover.jpg'] = AssetEntry(hash='0' * 64, ext='.jpg', size=1, checked=0, used=0)
+    cache._dirty = True
+    app = FavSyncApp(favlist_id=1, target_path=tmp_path, bilibili_client=MockBilibiliClient(), asset_cache=cache)
+    await app.close()
+    assert 'cover.jpg' in cache.index_path.read_text()
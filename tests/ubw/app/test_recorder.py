@@ -0,0 +1,78 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from ubw import models
+from ubw.app.recorder import LiveSignalHandler, RecorderApp
+from ubw.clients import MockBilibiliClient
+from ubw.testing.generate import generate_type
+
+
+@pytest.mark.asyncio
+async def test_live_signal():
+    calls = []
+
+    async def callback(room_id, living):
+        calls.append((room_id, living))
+
+    handler = LiveSignalHandler(callback=callback)
+    client = SimpleNamespace(room_id=42)
+    await handler.on_live(client, generate_type(models.LiveCommand, {}))
+    await handler.on_preparing(client, generate_type(models.PreparingCommand, {}))
+    assert calls == [(42, True), (42, False)]
+
+
+@pytest.mark.asyncio
+async def test_on_live_status(tmp_path):
+    client = MockBilibiliClient()
+    blocked = asyncio.Event()
+
+    async def play_info(room_id, qn):
+        blocked.set()
+        await asyncio.sleep(3600)
+
+    client.get_room_play_info.side_effect = play_info
+    app = RecorderApp(rooms=[1], listen_live=False, bilibili_client=client, bilibili_client_owner=False,
+                      options={'out_dir': tmp_path})
+    async with asyncio.timeout(5):
+        await app.on_live_status(1, True)
+        await blocked.wait()
+        recorder = app._recorders[1]
+        assert recorder.is_running and app.stats()[1]['running'] == 1
+
+        await app.on_live_status(1, True)  # 已在录制
+        assert app._recorders[1] is recorder and client.get_room_play_info.await_count == 1
+
+        await app.on_live_status(1, False)
+        assert not recorder.is_running
+        await app.on_live_status(2, False)
+        assert 2 not in app._recorders
+        await app.close()
+
+
+@pytest.mark.asyncio
+async def test_run_without_listening(tmp_path):
+    client = MockBilibiliClient()
+    finished = asyncio.Event()
+
+    async def play_info(room_id, qn):
+        if client.get_room_play_info.await_count > 1:  # 录制中的那次
+            await finished.wait()
+            return SimpleNamespace(live_status=0)
+        return SimpleNamespace(live_status=1)
+
+    client.get_room_play_info.side_effect = play_info
+    app = RecorderApp(rooms=[1], listen_live=False, bilibili_client=client, bilibili_client_owner=False,
+                      options={'out_dir': tmp_path})
+    async with asyncio.timeout(5):
+        await app.start()
+        join = asyncio.create_task(app.join())
+        while client.get_room_play_info.await_count < 2:
+            await asyncio.sleep(0.01)
+        assert not join.done() and app._recorders[1].is_running
+
+        finished.set()
+        await join
+        assert not app._recorders[1].is_running
+        await app.stop_and_close()
@@ -0,0 +1,92 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+from bilibili_api import Credential
+
+from ubw.clients import BilibiliUnauthorizedClient
+from ubw.clients._cache import TTLCache
+
+
+@pytest.mark.asyncio
+async def test_ttl_cache_coalesce():
+    cache = TTLCache()
+    calls = 0
+    gate = asyncio.Event()
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await gate.wait()
+        return calls
+
+    async with asyncio.timeout(5):
+        tasks = [asyncio.create_task(cache.get_or_fetch('k', 60, fetch)) for _ in range(10)]
+        await asyncio.sleep(0)
+        gate.set()
+        assert await asyncio.gather(*tasks) == [1] * 10
+        assert await cache.get_or_fetch('k', 60, fetch) == 1
+        assert calls == 1
+        assert cache.stats() == {'size': 1, 'inflight': 0, 'hits': 1, 'misses': 1, 'coalesced': 9}
+
+        cache.invalidate('k')
+        assert await cache.get_or_fetch('k', 60, fetch) == 2
+
+
+@pytest.mark.asyncio
+async def test_ttl_cache_expire_and_error():
+    cache = TTLCache()
+
+    async def boom():
+        raise ValueError
+
+    async def ok():
+        return 'ok'
+
+    with pytest.raises(ValueError):
+        await cache.get_or_fetch('k', 60, boom)
+    assert len(cache) == 0
+    with patch('ubw.clients._cache.time.monotonic', return_value=0):
+        assert await cache.get_or_fetch('k', 60, ok) == 'ok'
+    with patch('ubw.clients._cache.time.monotonic', return_value=61):
+        assert cache.get('k') is None
+
+
+@pytest.mark.asyncio
+async def test_cached_api():
+    client = BilibiliUnauthorizedClient(cache_ttl={'get_account_info': 60})
+    with patch('ubw.clients._b_base.user.User') as user_class:
+        async def get_user_info():
+            await asyncio.sleep(0)
+            return {}
+
+        user_class.return_value.get_user_info.side_effect = get_user_info
+        with patch('ubw.clients._b_base.AccountInfo.model_validate', side_effect=lambda x: object()):
+            client._credential = Credential()
+            a, b = await asyncio.gather(client.get_account_info(1), client.get_account_info(1))
+            assert a is b
+            assert user_class.return_value.get_user_info.call_count == 1
+            client.invalidate_cache('get_account_info', 1)
+            assert await client.get_account_info(1) is not a
+
+
+@pytest.mark.asyncio
+async def test_cached_api_per_account():
+    def client(sessdata):
+        c = BilibiliUnauthorizedClient(cache_ttl={'get_danmaku_server': 60})
+        c._credential = Credential(sessdata=sessdata)
+        return c
+
+    a, a2, b = client('account-a'), client('account-a'), client('account-b')
+    with patch('bilibili_api.live.LiveRoom') as room_class:
+        async def get_danmu_info():
+            return {}
+
+        room_class.return_value.get_danmu_info.side_effect = get_danmu_info
+        with patch('ubw.clients._b_base.DanmuInfo.model_validate', side_effect=lambda x: object()):
+            token_a = await a.get_danmaku_server(1)
+            assert await a2.get_danmaku_server(1) is token_a  # 同一账号仍共享
+            assert await b.get_danmaku_server(1) is not token_a
+            assert room_class.return_value.get_danmu_info.call_count == 2
+            b.invalidate_cache('get_danmaku_server', 1)
+            assert await a.get_danmaku_server(1) is token_a
@@ -0,0 +1,149 @@
+import copy
+import json
+from datetime import timedelta
+from pathlib import Path
+
+import pytest
+
+from ubw import models
+from ubw.clients._dedup import EventDeduper, dup_of, event_identity
+from ubw.clients._wsbase import WSMessageParserMixin
+from ubw.handlers import BaseHandler
+from ubw.handlers.saver import SaverHandler
+from ubw.userdata.archive import EventArchive
+
+RAW_DANMAKU = json.loads(
+    (Path(__file__).parent.parent / 'handlers' / 'danmu_msg_emoticon_unique.json').read_text(encoding='utf-8'))
+
+
+def test_event_identity():
+    mirror = copy.deepcopy(RAW_DANMAKU)
+    mirror['cmd'] = 'DANMU_MSG_MIRROR'
+    assert event_identity(RAW_DANMAKU) == event_identity(mirror) == ('danmaku', '343a52f34489799508c91605ae6625ef14')
+
+    no_id = copy.deepcopy(RAW_DANMAKU)
+    no_id['info'][0][15]['extra'] = '{}'
+    assert event_identity(no_id) == ('danmaku', 2351778, 1713762065361, 1713703506)
+
+    assert event_identity({'cmd': 'SEND_GIFT', 'msg_id': '1:2:3', 'data': {}}) == ('SEND_GIFT', '1:2:3')
+    assert event_identity({'cmd': 'SUPER_CHAT_MESSAGE', 'data': {'id_str': 'abc'}}) == ('SUPER_CHAT_MESSAGE', 'abc')
+    online = {'cmd': 'COLLABORATION_LIVE_ONLINE', 'data': {'num': 3, 'text': '3'}}
+    assert event_identity(online) == event_identity({'cmd': 'COLLABORATION_LIVE_ONLINE',
+                                                      'data': {'text': '3', 'num': 3}})
+    assert event_identity({'cmd': 'X_UBW_HEARTBEAT', 'popularity': 1}) is None
+    assert event_identity({'cmd': 'DANMU_MSG', 'info': []}) is None
+
+
+def test_window_and_bound(monkeypatch):
+    now = [100.]
+    monkeypatch.setattr('ubw.clients._dedup.time.monotonic', lambda: now[0])
+    deduper = EventDeduper(window=timedelta(seconds=10), max_entries=2)
+    a, b, c = ({'cmd': 'X', 'msg_id': i} for i in 'abc')
+    assert deduper.check(1, a) is None
+    assert deduper.check(2, a) == 1 and deduper.check(1, a) is None
+    now[0] = 105.
+    assert deduper.check(2, b) is None
+    now[0] = 111.  # a expired
+    assert deduper.check(2, a) is None
+    assert deduper.check(3, c) is None  # over max_entries, b is evicted
+    assert deduper.check(1, b) is None
+    assert deduper.stats() == {'tracked': 2, 'duplicates': 1, 'evicted': 2}
+
+
+class StubClient(WSMessageParserMixin):
+    clientc: str = 'stub'
+
+    @property
+    def user_ident(self) -> str:
+        return 'stub'
+
+    async def start(self):
+        pass
+
+    async def join(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('mode', ['drop', 'tag'])
+async def test_shared_across_clients(mode):
+    deduper = EventDeduper(mode=mode)
+    received = []
+
+    class Recording(BaseHandler):
+        cls: str = 'recording'
+
+        async def on_danmu_msg(self, client, message):
+            received.append((client.room_id, message))
+
+        async def on_danmu_msg_mirror(self, client, message):
+            received.append((client.room_id, message))
+
+    handler = Recording()
+    clients = [StubClient(room_id=room_id, deduper=deduper) for room_id in (1, 2)]
+    for client in clients:
+        client.add_handler(handler)
+    mirror = copy.deepcopy(RAW_DANMAKU)
+    mirror['cmd'] = 'DANMU_MSG_MIRROR'
+    await clients[0]._handle_command(copy.deepcopy(RAW_DANMAKU))
+    await clients[1]._handle_command(mirror)
+
+    if mode == 'drop':
+        assert [room_id for room_id, _ in received] == [1]
+    else:
+        assert [(room_id, m.dup_of) for room_id, m in received] == [(1, None), (2, 1)]
+        assert isinstance(received[1][1], models.DanmakuMirrorCommand)
+
+
+@pytest.mark.asyncio
+async def test_same_room_clients():
+    deduper = EventDeduper(mode='drop')
+    received = []
+
+    class Recording(BaseHandler):
+        cls: str = 'recording'
+
+        async def on_danmu_msg(self, client, message):
+            received.append((id(client), message.dup_of))
+
+    clients = [StubClient(room_id=81004, deduper=deduper) for _ in range(2)]
+    for client in clients:
+        client.add_handler(Recording())
+        await client._handle_command(copy.deepcopy(RAW_DANMAKU))
+    assert received == [(id(clients[0]), None), (id(clients[1]), None)]
+    assert deduper.stats()['duplicates'] == 0
+
+
+def test_default_mode_tags():
+    assert EventDeduper().mode == 'tag'
+
+
+@pytest.mark.asyncio
+async def test_tag_kept_out_of_raw(tmp_path):
+    deduper = EventDeduper()
+    raw = []
+
+    class Raw(BaseHandler):
+        cls: str = 'raw'
+
+        async def handle(self, client, command):
+            raw.append(command)
+
+    archive = EventArchive(path=tmp_path / 'events.sqlite3')
+    saver = SaverHandler(room_id=1, backend='sqlite', archive=archive)
+    clients = [StubClient(room_id=room_id, deduper=deduper) for room_id in (1, 2)]
+    for client in clients:
+        client.add_handler(Raw())
+        client.add_handler(saver)
+        await client._handle_command(copy.deepcopy(RAW_DANMAKU))
+
+    assert raw == [RAW_DANMAKU, RAW_DANMAKU]  # 原始数据不多出字段
+    assert [dup_of(command) for command in raw] == [None, 1]
+    assert json.loads(json.dumps(raw[1])) == RAW_DANMAKU
+    assert len(archive._pending) == 1  # 重复的只存一份
@@ -0,0 +1,62 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, Mock
+
+import pytest
+
+from ubw.clients import DynamicFeedScheduler, MockBilibiliClient, shared_dynamic_feed
+
+
+def item(id_str, hours_ago, is_topped=False):
+    return Mock(id_str=id_str, pub_date=datetime(2024, 1, 10).astimezone() - timedelta(hours=hours_ago),
+                is_topped=is_topped)
+
+
+def page(items, offset='', has_more=True):
+    return Mock(items=items, offset=offset, has_more=has_more)
+
+
+@pytest.mark.asyncio
+async def test_dynamic_feed():
+    b = MockBilibiliClient()
+    feed = DynamicFeedScheduler(bilibili_client=b, bilibili_client_owner=False, max_interval=timedelta(hours=6))
+    received = []
+    on_items = AsyncMock(side_effect=received.append)
+
+    async with asyncio.timeout(5):
+        b.get_user_dynamic.return_value = page([item('top', 1000, True), item('3', 3), item('2', 15), item('1', 27)])
+        history = await feed.subscribe(1, on_items)
+        await feed.stop()  # drive polls by hand
+        assert [i.id_str for i in history] == ['top', '3', '2', '1']
+        assert feed.feeds[1].interval == 60 * 60 * 12 / 4 == 3 * 60 * 60
+        assert 0 <= feed.feeds[1].due - time.monotonic() <= 3 * 60 * 60 + 1
+
+        # new items span two pages, paging stops at the first known id
+        b.get_user_dynamic.reset_mock()
+        b.get_user_dynamic.side_effect = [
+            page([item('top', 1000, True), item('5', 1), item('4', 2)], offset='o1'),
+            page([item('3', 3), item('2', 15)], offset='o2'),
+        ]
+        await feed.poll_uid(1)
+        assert [c.args for c in b.get_user_dynamic.call_args_list] == [(1, ''), (1, 'o1')]
+        assert [[i.id_str for i in items] for items in received] == [['4', '5']]
+        assert feed.feeds[1].interval == 2 * 60 * 60
+
+        # nothing new: single request, backs off
+        b.get_user_dynamic.reset_mock()
+        b.get_user_dynamic.side_effect = [page([item('top', 1000, True), item('5', 1), item('4', 2)], offset='o1')]
+        await feed.poll_uid(1)
+        assert b.get_user_dynamic.call_count == 1
+        assert len(received) == 1
+        assert feed.feeds[1].interval == 3 * 60 * 60
+        assert feed.stats() == {'uids': 1, 'polls': 2, 'requests': 4, 'new_items': 2}
+
+        feed.unsubscribe(1, on_items)
+        assert feed.feeds == {}
+
+
+def test_shared_feed_owns_client(monkeypatch):
+    monkeypatch.setattr('ubw.clients.dynamic_feed._shared_dynamic_feed', None)
+    feed = shared_dynamic_feed()
+    assert feed is shared_dynamic_feed() and feed.bilibili_client_owner
@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+from ubw.clients._b_base import BilibiliApiError
+from ubw.clients._ratelimit import Priority, RateLimiter, TokenBucket, is_risk_control
+
+
+def test_is_risk_control():
+    assert is_risk_control(BilibiliApiError('风控', code=-352))
+    assert is_risk_control(BilibiliApiError('风控', code=-412))
+    assert not is_risk_control(BilibiliApiError('房间已加密', code=19002005))
+    assert not is_risk_control(ValueError())
+
+
+@pytest.mark.asyncio
+async def test_bucket_priority():
+    bucket = TokenBucket('test', rate=100, burst=1)
+    order = []
+
+    async def worker(name, priority):
+        await bucket.acquire(priority)
+        order.append(name)
+
+    async with asyncio.timeout(5):
+        await bucket.acquire()  # drain the only token so later waiters queue up
+        tasks = [
+            asyncio.create_task(worker('bulk', Priority.BULK)),
+            asyncio.create_task(worker('normal', Priority.NORMAL)),
+            asyncio.create_task(worker('critical', Priority.CRITICAL)),
+        ]
+        await asyncio.gather(*tasks)
+    assert order == ['critical', 'normal', 'bulk']
+    assert bucket.stats()['acquired'] == 4
+
+
+@pytest.mark.asyncio
+async def test_limiter_aimd():
+    limiter = RateLimiter({
+        'global': {'rate': 100, 'burst': 10, 'cooldown': 0},
+        'ep': {'rate': 8, 'burst': 10, 'cooldown': 0},
+    })
+
+    async with asyncio.timeout(5):
+        with pytest.raises(BilibiliApiError):
+            async with limiter.limit('ep'):
+                raise BilibiliApiError('风控', code=-352)
+        assert limiter.bucket('ep').rate == 4
+        assert limiter.bucket('ep').throttled == 1
+
+        async with limiter.limit('ep'):
+            pass
+        assert limiter.bucket('ep').rate == pytest.approx(4.05)
+
+        with pytest.raises(ValueError):  # ordinary errors do not slow the bucket down
+            async with limiter.limit('ep'):
+                raise ValueError
+        assert limiter.bucket('ep').rate == pytest.approx(4.05)
+    assert set(limiter.stats()) == {'global', 'ep'}
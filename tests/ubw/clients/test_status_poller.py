@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+
+from ubw.clients import BilibiliUnauthorizedClient, LiveStatusPoller
+
+
+def status(uid, live_status, title='title', area=1):
+    return {'uid': uid, 'room_id': uid * 10, 'uname': f'up{uid}', 'title': title, 'live_status': live_status,
+            'live_time': 1712308994 if live_status == 1 else 0,
+            'area_v2_id': area, 'area_v2_name': f'area{area}', 'area_v2_parent_id': 9, 'area_v2_parent_name': 'p'}
+
+
+@pytest.mark.asyncio
+async def test_status_poller():
+    rounds = [
+        {1: status(1, 0), 2: status(2, 1)},
+        {1: status(1, 1), 2: status(2, 0, title='new title', area=2)},
+    ]
+    requested = []
+
+    async def handler(request: web.Request):
+        uids = (await request.json())['uids']
+        requested.append(uids)
+        data = rounds[min((len(requested) - 1) // 2, len(rounds) - 1)]  # two batches per round
+        return web.json_response({'code': 0, 'message': '0', 'data': {
+            str(uid): data[uid] for uid in uids if uid in data}})
+
+    app = web.Application()
+    app.router.add_post('/status', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = runner.addresses[0][1]
+
+    async with asyncio.timeout(5):
+        async with BilibiliUnauthorizedClient() as b:
+            poller = LiveStatusPoller(bilibili_client=b, bilibili_client_owner=False,
+                                      url=f'http://127.0.0.1:{port}/status', batch_size=1)
+            received = {1: [], 2: []}
+
+            async def on_1(command):
+                received[1].append(command)
+
+            async def on_2(command):
+                received[2].append(command)
+
+            poller._subscribers.update({1: [on_1], 2: [on_2]})  # subscribe without starting t_poll
+            await poller.poll_once()
+            assert requested == [[1], [2]]
+            assert poller.status[2].living and not poller.status[1].living
+            assert received == {1: [], 2: []}
+
+            await poller.poll_once()
+            assert [c['cmd'] for c in received[1]] == ['LIVE']
+            assert received[1][0]['roomid'] == 10 and received[1][0]['live_time'] == 1712308994
+            assert [c['cmd'] for c in received[2]] == ['ROOM_CHANGE', 'PREPARING']
+            assert received[2][0]['data']['title'] == 'new title'
+
+            poller.unsubscribe(2, on_2)
+            assert 2 not in poller.status
+    await runner.cleanup()
+
+
+def test_diff_validates():
+    from ubw import models
+    from ubw.models.bilibili import StatusInfo
+    old = StatusInfo.model_validate(status(1, 0))
+    new = StatusInfo.model_validate(status(1, 1, title='t2'))
+    for command in LiveStatusPoller.diff(old, new) + LiveStatusPoller.diff(new, old):
+        models.BLIVE_ADAPTER.validate_python(command)
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+
+from ubw.downloader.asset_cache import AssetCache
+from ubw.downloader.scheduler import DownloadScheduler
+
+FILES = {'a.jpg': b'a' * 1000, 'b.jpg': b'b' * 1000, 'same.jpg': b'a' * 1000, 'face': b'c' * 500}
+
+
+async def serve():
+    """stub CDN，ETag 为文件名，命中时返回 304"""
+    requested = []
+
+    async def handler(request: web.Request):
+        name = request.match_info['name']
+        etag = f'"{name}"'
+        conditional = request.headers.get('If-None-Match') == etag
+        requested.append((name, conditional))
+        if conditional:
+            return web.Response(status=304, headers={'ETag': etag})
+        await asyncio.sleep(0.05)
+        return web.Response(body=FILES[name], content_type='image/png', headers={'ETag': etag})
+
+    app = web.Application()
+    app.router.add_get('/{name}', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', 0).start()
+    return runner, f'http://127.0.0.1:{runner.addresses[0][1]}', requested
+
+
+@pytest.mark.asyncio
+async def test_asset_cache(tmp_path):
+    runner, base, requested = await serve()
+    cache = AssetCache(root=tmp_path / 'assets', max_size=2000, scheduler=DownloadScheduler())
+    try:
+        async with asyncio.timeout(10):
+            # concurrent requests for one URL are coalesced
+            a1, a2 = await asyncio.gather(cache.fetch(f'{base}/a.jpg'), cache.fetch(f'{base}/a.jpg'))
+            assert a1 == a2 and a1.read_bytes() == FILES['a.jpg'] and a1.suffix == '.jpg'
+            # identical content is stored once
+            assert await cache.fetch(f'{base}/same.jpg') == a1
+            assert (await cache.fetch(f'{base}/face')).suffix == '.png'
+            assert cache.stats()['objects'] == 2 and cache.size == 1500
+
+            # fresh entries are served without a request, stale ones are revalidated
+            await cache.fetch(f'{base}/a.jpg')
+            assert len(requested) == 3
+            cache.index[f'{base}/a.jpg'].checked = 0
+            assert await cache.fetch(f'{base}/a.jpg') == a1
+            assert requested[-1] == ('a.jpg', True)
+
+            # least recently used entries are evicted once over max_size
+            await cache.fetch(f'{base}/b.jpg')
+            assert cache.size <= 2000
+            assert f'{base}/face' not in cache.index and f'{base}/b.jpg' in cache.index
+
+            target = await cache.materialize(f'{base}/b.jpg', tmp_path / 'out' / 'pic')
+            assert target.name == 'pic.jpg' and target.read_bytes() == FILES['b.jpg']
+            assert list(cache.index) == [f'{base}/a.jpg', f'{base}/b.jpg']  # least recently used first
+
+            # the index is persisted in the background
+            await cache._saving
+            assert cache.index_path.exists()
+    finally:
+        await runner.cleanup()
+    await cache.save()
+
+    reloaded = AssetCache(root=tmp_path / 'assets')
+    assert reloaded.lookup(f'{base}/b.jpg').read_bytes() == FILES['b.jpg']
+    assert reloaded.stats()['size'] == cache.size
@@ -0,0 +1,121 @@
+import asyncio
+import os
+import re
+
+import pytest
+from aiohttp import web
+
+from ubw.downloader._base import BaseDownloader, DownloadJournal, Segment
+
+DATA = os.urandom(300_000)
+
+
+async def serve(ranged=True, fail_once=(), data=DATA):
+    """stub CDN；*fail_once* 中的起始偏移第一次请求时只发一半就断开"""
+    requested = []
+    failed = set()
+
+    async def handler(request: web.Request):
+        m = re.fullmatch(r'bytes=(\d+)-(\d+)', request.headers.get('Range', ''))
+        if not ranged or m is None:
+            requested.append(None)
+            return web.Response(body=data)
+        start, end = int(m.group(1)), min(int(m.group(2)), len(data) - 1)
+        requested.append((start, end))
+        if start >= len(data):
+            return web.Response(status=416, headers={'Content-Range': f'bytes */{len(data)}'})
+        body = data[start:end + 1]
+        headers = {'Content-Range': f'bytes {start}-{end}/{len(data)}', 'ETag': '"v1"'}
+        if start in fail_once and start not in failed:
+            failed.add(start)
+            resp = web.StreamResponse(status=206, headers={**headers, 'Content-Length': str(len(body))})
+            await resp.prepare(request)
+            await resp.write(body[:len(body) // 2])
+            request.transport.close()
+            return resp
+        return web.Response(status=206, body=body, headers=headers)
+
+    app = web.Application()
+    app.router.add_get('/f', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', 0).start()
+    return runner, f'http://127.0.0.1:{runner.addresses[0][1]}/f', requested
+
+
+@pytest.mark.asyncio
+async def test_ranged_download(tmp_path):
+    runner, url, requested = await serve(fail_once={100_000})
+    events = []
+    try:
+        async with asyncio.timeout(10), BaseDownloader(out_dir=tmp_path, segment_size=100_000,
+                                                       chunk_size=10_000, progress_interval=0) as d:
+            d.progress_listeners.append(events.append)
+            assert await d.download_file(url, 'f.bin') == ['f.bin']
+    finally:
+        await runner.cleanup()
+    assert (tmp_path / 'f.bin').read_bytes() == DATA
+    assert not (tmp_path / 'f.bin.part').exists() and not (tmp_path / 'f.bin.part.json').exists()
+    assert len(requested) == 4
+    assert [end for _, end in requested].count(199_999) == 2  # the broken segment was retried
+    assert events[-1].finished and events[-1].received == len(DATA)
+
+
+@pytest.mark.asyncio
+async def test_resume_download(tmp_path):
+    part = bytearray(len(DATA))
+    part[:100_000] = DATA[:100_000]
+    part[100_000:150_000] = DATA[100_000:150_000]
+    (tmp_path / 'f.bin.part').write_bytes(part)
+    (tmp_path / 'f.bin.part.json').write_text(DownloadJournal(size=len(DATA), validator='"v1"', segments=[
+        Segment(start=0, end=99_999, done=100_000),
+        Segment(start=100_000, end=199_999, done=50_000),
+        Segment(start=200_000, end=299_999),
+    ]).model_dump_json())
+
+    runner, url, requested = await serve()
+    try:
+        async with asyncio.timeout(10), BaseDownloader(out_dir=tmp_path, segment_size=100_000) as d:
+            assert await d.download_file(url, 'f.bin') == ['f.bin']
+    finally:
+        await runner.cleanup()
+    assert (tmp_path / 'f.bin').read_bytes() == DATA
+    assert sorted(requested) == [(150_000, 199_999), (200_000, 299_999)]
+
+
+@pytest.mark.asyncio
+async def test_unranged_download(tmp_path):
+    runner, url, requested = await serve(ranged=False)
+    try:
+        async with asyncio.timeout(10), BaseDownloader(out_dir=tmp_path, segment_size=100_000) as d:
+            assert await d.download_file(url, 'f.bin') == ['f.bin']
+    finally:
+        await runner.cleanup()
+    assert (tmp_path / 'f.bin').read_bytes() == DATA
+    assert requested == [None]
+
+
+@pytest.mark.asyncio
+async def test_empty_download(tmp_path):
+    (tmp_path / 'f.bin.part').write_bytes(b'')  # left over by an earlier attempt
+    (tmp_path / 'f.bin.part.json').write_text(DownloadJournal(size=0, segments=[]).model_dump_json())
+    runner, url, requested = await serve(data=b'')
+    try:
+        async with asyncio.timeout(10), BaseDownloader(out_dir=tmp_path, segment_size=100_000) as d:
+            assert await d.download_file(url, 'f.bin') == ['f.bin']
+    finally:
+        await runner.cleanup()
+    assert (tmp_path / 'f.bin').read_bytes() == b''
+    assert requested == [(0, -1), None]  # the 416 probe falls back to a plain request
+    assert not (tmp_path / 'f.bin.part.json').exists()
+
+
+@pytest.mark.asyncio
+async def test_journal_replaced_atomically(tmp_path):
+    from ubw.downloader._base import _JournalSaver
+    path = tmp_path / 'f.bin.part.json'
+    path.write_text('old')
+    journal = DownloadJournal(size=10, segments=[Segment(start=0, end=9, done=4)])
+    await _JournalSaver(journal, path, 0).save()
+    assert DownloadJournal.model_validate_json(path.read_bytes()) == journal
+    assert list(tmp_path.iterdir()) == [path]
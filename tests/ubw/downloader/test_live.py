@@ -0,0 +1,170 @@
+import asyncio
+import time
+from datetime import timedelta
+
+import pytest
+from aiohttp import web
+
+from ubw.clients import MockBilibiliClient
+from ubw.downloader.live import (FlvParser, LiveRecorder, RecordOptions, parse_playlist, stream_candidates)
+from ubw.models import RoomPlayInfo
+
+
+def tag(tag_type: int, ts: int, body: bytes) -> bytes:
+    return (bytes([tag_type]) + len(body).to_bytes(3, 'big') + (ts & 0xFFFFFF).to_bytes(3, 'big')
+            + bytes([ts >> 24 & 0xFF]) + b'\0\0\0' + body + (11 + len(body)).to_bytes(4, 'big'))
+
+
+HEADER = b'FLV\x01\x05\x00\x00\x00\x09' + b'\0\0\0\0'
+INIT = tag(18, 0, b'\x02\x00\x0aonMetaData') + tag(9, 0, b'\x17\x00\0\0\0seq') + tag(8, 0, b'\xaf\x00\x12\x10')
+
+
+def frame(i: int) -> bytes:
+    video = tag(9, i * 40, bytes([0x17 if i % 10 == 0 else 0x27, 1, 0, 0, 0, i]) + b'v' * 2000)
+    return video + tag(8, i * 40, b'\xaf\x01' + b'a' * 200)
+
+
+def frames_in(data: bytes) -> list[int]:
+    parser = FlvParser()
+    out, _ = parser.feed(data)
+    assert out == data and not parser.pending
+    frames, pos = [], len(parser.header)
+    while pos < len(data):
+        size = int.from_bytes(data[pos + 1:pos + 4], 'big')
+        if data[pos] == 9 and data[pos + 12] == 1:
+            frames.append(data[pos + 16])
+        pos += 11 + size + 4
+    return frames
+
+
+def play_info(live_status: int, hosts: list[str], protocol='http_stream', fmt='flv', base_url='/live.flv'):
+    return RoomPlayInfo.model_validate({
+        'all_special_types': [], 'is_portrait': False, 'live_status': live_status, 'live_time': 1700000000,
+        'official_room_id': 0, 'official_type': 0, 'room_id': 1, 'short_id': 0, 'uid': 2,
+        'playurl_info': {
+            'conf_json': '{"cdn_rate": 1, "report_interval_sec": 1}',
+            'playurl': {
+                'cid': 1, 'dolby_qn': None, 'g_qn_desc': [],
+                'p2p_data': {'m_p2p': False, 'm_servers': None, 'p2p': False, 'p2p_type': 0},
+                'stream': [{'protocol_name': protocol, 'format': [{'format_name': fmt, 'codec': [{
+                    'codec_name': 'avc', 'accept_qn': [10000], 'attr_name': '', 'base_url': base_url,
+                    'current_qn': 10000, 'dolby_type': 0, 'hdr_qn': None,
+                    'url_info': [{'host': host, 'extra': f'?expires={int(time.time()) + 3600}', 'stream_ttl': 3600}
+                                 for host in hosts]}]}]}],
+            }}})
+
+
+async def serve(routes) -> tuple[web.AppRunner, str]:
+    app = web.Application()
+    for path, handler in routes.items():
+        app.router.add_get(path, handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', 0).start()
+    return runner, f'http://127.0.0.1:{runner.addresses[0][1]}'
+
+
+def test_stream_candidates():
+    info = play_info(1, ['https://a', 'https://b'])
+    candidates = stream_candidates(info)
+    assert [c.host for c in candidates] == ['https://a', 'https://b']
+    assert candidates[0].url.startswith('https://a/live.flv?expires=') and candidates[0].expires > time.time()
+    assert stream_candidates(info, protocols=('http_hls',)) == []
+
+
+def test_flv_parser():
+    data = HEADER + INIT + b''.join(frame(i) for i in range(12))
+    parser = FlvParser()
+    outs = [parser.feed(data[i:i + 999]) for i in range(0, len(data), 999)]
+    assert b''.join(out for out, _ in outs) == data
+    assert parser.init_bytes() == HEADER + INIT
+    assert sum(len(k) for _, k in outs) == 2  # frames 0 and 10
+
+
+def test_parse_playlist():
+    playlist = parse_playlist('#EXTM3U\n#EXT-X-TARGETDURATION:2\n#EXT-X-MEDIA-SEQUENCE:7\n'
+                              '#EXT-X-MAP:URI="h.mp4"\n#EXTINF:1.0,\n7.m4s\n#EXTINF:1.0,\n/x/8.m4s\n',
+                              'http://h/live/index.m3u8?k=1')
+    assert playlist.target_duration == 2 and playlist.map_uri == 'http://h/live/h.mp4' and not playlist.ended
+    assert playlist.segments == [(7, 'http://h/live/7.m4s'), (8, 'http://h/x/8.m4s')]
+
+
+@pytest.mark.asyncio
+async def test_flv_switch_and_split(tmp_path):
+    release = asyncio.Event()
+
+    async def stalling(request):  # 发一半后卡住
+        resp = web.StreamResponse()
+        await resp.prepare(request)
+        await resp.write(HEADER + INIT)
+        for i in range(50):
+            await resp.write(frame(i))
+        await release.wait()
+        return resp
+
+    async def healthy(request):
+        resp = web.StreamResponse()
+        await resp.prepare(request)
+        await resp.write(HEADER + INIT)
+        for i in range(50, 100):
+            await resp.write(frame(i))
+        return resp
+
+    runner, base = await serve({'/a/live.flv': stalling, '/b/live.flv': healthy})
+    client = MockBilibiliClient()
+    client.get_room_play_info.side_effect = [play_info(1, [f'{base}/a', f'{base}/b']), play_info(0, [])]
+    recorder = LiveRecorder(room_id=1, bilibili_client=client, options=RecordOptions(
+        out_dir=tmp_path, segment_size=50_000, buffer_size=16 << 10, stall_timeout=timedelta(seconds=0.5)))
+    try:
+        async with asyncio.timeout(10):
+            await recorder.start()
+    finally:
+        release.set()
+        await recorder.close()
+        await runner.cleanup()
+
+    assert recorder.stats()['switches'] == 1 and not recorder.is_running
+    files = [p.read_bytes() for p in recorder.segments]
+    assert all(p.parent == tmp_path / '1' for p in recorder.segments) and len(files) > 2
+    assert all(f.startswith(HEADER + INIT) for f in files)
+    frames = [frames_in(f) for f in files]
+    assert sum(frames, []) == list(range(100))  # nothing lost before the stall, nothing duplicated
+    assert all(f[0] % 10 == 0 for f in frames)  # every file starts at a keyframe
+    replayed = (len(files) - 2) * len(HEADER + INIT)  # 两个连接各自带的头部不算重放
+    assert sum(map(len, files)) - replayed == recorder.stats()['received']
+
+
+@pytest.mark.asyncio
+async def test_hls(tmp_path):
+    polls = []
+
+    async def playlist(request):
+        polls.append(request.query.get('expires'))
+        first = 0 if len(polls) == 1 else 2
+        lines = ['#EXTM3U', '#EXT-X-TARGETDURATION:0.1', f'#EXT-X-MEDIA-SEQUENCE:{first}', '#EXT-X-MAP:URI="h.mp4"']
+        for seq in range(first, first + 3):
+            lines += ['#EXTINF:0.1,', f'{seq}.m4s']
+        if len(polls) > 1:
+            lines.append('#EXT-X-ENDLIST')
+        return web.Response(text='\n'.join(lines))
+
+    async def fragment(request):
+        return web.Response(body=b'frag' + request.match_info['seq'].encode())
+
+    async def init(request):
+        return web.Response(body=b'INIT')
+
+    runner, base = await serve({'/a/index.m3u8': playlist, '/a/h.mp4': init, '/a/{seq}.m4s': fragment})
+    client = MockBilibiliClient()
+    client.get_room_play_info.side_effect = [
+        play_info(1, [f'{base}/a'], 'http_hls', 'fmp4', '/index.m3u8'), play_info(0, [])]
+    recorder = LiveRecorder(room_id=1, bilibili_client=client, options=RecordOptions(out_dir=tmp_path, segment_size=8))
+    try:
+        async with asyncio.timeout(10):
+            await recorder.start()
+    finally:
+        await recorder.close()
+        await runner.cleanup()
+
+    assert len(polls) == 2 and [p.suffix for p in recorder.segments] == ['.mp4'] * 5
+    assert [p.read_bytes() for p in recorder.segments] == [b'INITfrag%d' % i for i in range(5)]
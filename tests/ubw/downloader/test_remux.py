@@ -0,0 +1,97 @@
+import asyncio
+import os
+import re
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+from aiohttp import web
+
+from ubw.downloader._base import BaseDownloader
+from ubw.downloader.remux import RemuxError, RemuxPool
+
+# stands in for ffmpeg: concatenates its two inputs into the output
+FAKE_FFMPEG = '''\
+import sys
+args = sys.argv[1:]
+inputs = [args[i + 1] for i, a in enumerate(args) if a == '-i']
+with open(args[-1], 'wb') as out:
+    for i in inputs:
+        with (open(int(i[5:]), 'rb', closefd=False) if i.startswith('pipe:') else open(i, 'rb')) as f:
+            out.write(f.read())
+'''
+
+
+async def serve(files: dict[str, bytes]):
+    requested = []
+
+    async def handler(request: web.Request):
+        data = files[request.match_info['name']]
+        m = re.fullmatch(r'bytes=(\d+)-(\d+)', request.headers['Range'])
+        start, end = int(m.group(1)), min(int(m.group(2)), len(data) - 1)
+        requested.append((request.match_info['name'], start))
+        return web.Response(status=206, body=data[start:end + 1],
+                            headers={'Content-Range': f'bytes {start}-{end}/{len(data)}'})
+
+    app = web.Application()
+    app.router.add_get('/{name}', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', 0).start()
+    return runner, f'http://127.0.0.1:{runner.addresses[0][1]}', requested
+
+
+def fake_ffmpeg(tmp_path: Path) -> Path:
+    script = tmp_path / 'fake_ffmpeg'
+    script.write_text(f'#!{sys.executable}\n{FAKE_FFMPEG}')
+    script.chmod(0o755)
+    return script
+
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(os.name != 'posix', reason='pipes are passed by fd number')
+async def test_iter_content_and_remux(tmp_path):
+    video, audio = os.urandom(250_000), os.urandom(70_000)
+    runner, base, requested = await serve({'v': video, 'a': audio})
+    try:
+        async with asyncio.timeout(10), BaseDownloader(out_dir=tmp_path, segment_size=50_000, max_segments=2) as d:
+            assert b''.join([chunk async for chunk in d.iter_content(f'{base}/v', 'v')]) == video
+
+            pool = RemuxPool(ffmpeg=fake_ffmpeg(tmp_path), max_workers=1)
+            out = await pool.remux(d.iter_content(f'{base}/v', 'v'), d.iter_content(f'{base}/a', 'a'),
+                                   tmp_path / 'out' / 'x.mp4')
+            assert out.read_bytes() == video + audio
+            assert not (tmp_path / 'out' / 'x.mp4.part').exists()
+
+            with pytest.raises(RemuxError):
+                await RemuxPool(ffmpeg=Path(shutil.which('false'))).remux(
+                    d.iter_content(f'{base}/v', 'v'), d.iter_content(f'{base}/a', 'a'), tmp_path / 'y.mp4')
+            assert not (tmp_path / 'y.mp4').exists() and not (tmp_path / 'y.mp4.part').exists()
+            assert d.scheduler.stats()['active'] == 0
+    finally:
+        await runner.cleanup()
+    assert sorted(start for name, start in requested[:5]) == [0, 50_000, 100_000, 150_000, 200_000]
+
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg not installed')
+async def test_remux_real_media(tmp_path):
+    def generate(name, *args):
+        subprocess.run(['ffmpeg', '-v', 'error', '-y', *args, '-t', '1', '-f', 'mp4',
+                        '-movflags', 'frag_keyframe+empty_moov', str(tmp_path / name)], check=True)
+        return (tmp_path / name).read_bytes()
+
+    video = generate('v.m4s', '-f', 'lavfi', '-i', 'testsrc=size=64x64:rate=10', '-c:v', 'mpeg4')
+    audio = generate('a.m4a', '-f', 'lavfi', '-i', 'sine=frequency=440', '-c:a', 'aac')
+    runner, base, _ = await serve({'v': video, 'a': audio})
+    try:
+        async with asyncio.timeout(30), BaseDownloader(out_dir=tmp_path, segment_size=4096) as d:
+            out = await RemuxPool().remux(d.iter_content(f'{base}/v', 'v'), d.iter_content(f'{base}/a', 'a'),
+                                          tmp_path / 'out.mp4')
+    finally:
+        await runner.cleanup()
+    probe = subprocess.run(['ffmpeg', '-v', 'error', '-i', str(out), '-f', 'null', '-'], capture_output=True)
+    assert probe.returncode == 0
+    assert out.stat().st_size > 0
@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+
+from ubw.downloader.scheduler import DownloadPriority, DownloadScheduler
+
+
+@pytest.mark.asyncio
+async def test_scheduler_limits_and_priority():
+    scheduler = DownloadScheduler(max_connections=2, max_connections_per_host=1)
+    a1 = scheduler.job('a1', 'https://a.example/1')
+    b1 = scheduler.job('b1', 'https://b.example/1')
+    a_video = scheduler.job('a_video', 'https://a.example/v', DownloadPriority.VIDEO)
+    a_pic = scheduler.job('a_pic', 'https://a.example/p', DownloadPriority.PICTURE)
+    c1 = scheduler.job('c1', 'https://c.example/1')
+    order = []
+
+    async def run(job):
+        async with scheduler.connection(job):
+            order.append(job.target)
+            await scheduler.consume(job, 10)
+
+    async with asyncio.timeout(5):
+        await scheduler.acquire(a1)
+        await scheduler.acquire(b1)
+        tasks = [asyncio.create_task(run(job)) for job in (a_video, a_pic, c1)]
+        await asyncio.sleep(0)
+        assert scheduler.stats()['queued'] == 3  # global limit reached
+
+        scheduler.release(b1)  # frees a global slot, host a is still busy so c goes first
+        await asyncio.sleep(0)
+        assert order == ['c1']
+
+        scheduler.release(a1)
+        await asyncio.gather(*tasks)
+    assert order == ['c1', 'a_pic', 'a_video']
+    assert scheduler.stats()['active'] == 0
+
+    for job in (a1, b1, a_video, a_pic, c1):
+        scheduler.finish(job)
+    summary = {j['target']: j for j in scheduler.stats()['jobs']}
+    assert summary['a_pic']['received'] == 10 and summary['a_pic']['connections'] == 1
+    assert summary['a_video']['waited'] > 0
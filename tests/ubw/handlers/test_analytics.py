@@ -0,0 +1,65 @@
+from datetime import timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from ubw import models
+from ubw.handlers.analytics import AnalyticsHandler, RingWindow, RoomAnalytics, window_name
+from ubw.metrics import MetricsRegistry
+from ubw.testing.generate import generate_type
+
+
+def test_ring_window():
+    w = RingWindow(60, buckets=6)
+    for ts in range(100, 160):
+        w.add(ts, 'danmaku', uid=ts % 5)
+    assert w.snapshot(159)['danmaku'] == 60 and w.snapshot(159)['senders'] == 5
+    # [100, 110) and [110, 120) fall out of the window
+    assert w.snapshot(175)['danmaku'] == 40
+    w.add(100, 'danmaku')  # too old, ignored
+    assert w.snapshot(175)['danmaku'] == 40
+    assert w.snapshot(1000) == {'danmaku': 0, 'senders': 0, 'revenue': 0, 'gift': 0, 'guard': 0, 'super_chat': 0,
+                                'entries': 0, 'popularity': 0}
+
+
+def test_distinct_senders():
+    w = RingWindow(60, sender_bits=2048)
+    for uid in range(1000):
+        w.add(0, 'danmaku', uid=uid * 7919)
+        w.add(0, 'danmaku', uid=uid * 7919)
+    assert w.snapshot(0)['senders'] == pytest.approx(1000, rel=0.05)
+
+
+def test_room_analytics():
+    room = RoomAnalytics([timedelta(minutes=1), timedelta(hours=1)])
+    assert list(room.windows) == ['1m', '1h'] and window_name(timedelta(seconds=90)) == '90s'
+    room.add(0, 'gift', 1.5)
+    room.add(0, 'super_chat', 30)
+    room.add(0, 'popularity', 100)
+    room.add(0, 'heartbeats')
+    room.add(120, 'popularity', 300)
+    room.add(120, 'heartbeats')
+    snapshot = room.snapshot(120)
+    assert (snapshot['1m']['revenue'], snapshot['1m']['popularity']) == (0, 300)
+    assert (snapshot['1h']['revenue'], snapshot['1h']['popularity']) == (31.5, 200)
+
+
+@pytest.mark.asyncio
+async def test_analytics_handler(monkeypatch):
+    monkeypatch.setattr('ubw.handlers.analytics.metrics.registry', registry := MetricsRegistry())
+    handler = AnalyticsHandler(refresh_interval=timedelta(hours=1))
+    client = SimpleNamespace(room_id=1)
+    await handler.start(client)
+    try:
+        for uid in (1, 2, 1):
+            await handler.on_danmu_msg(client, generate_type(models.DanmakuCommand, {'info': {'uid': uid}}))
+        await handler.on_guard_buy(client, generate_type(models.GuardBuyCommand, {
+            'data': {'price': 138000, 'num': 2}}))
+        await handler.on_interact_word(client, generate_type(models.InteractWordCommand, {'data': {'msg_type': 1}}))
+        await handler.on_interact_word(client, generate_type(models.InteractWordCommand, {'data': {'msg_type': 2}}))
+        s = handler.stats()[1]['5m']
+        assert (s['danmaku'], s['senders'], s['guard'], s['entries']) == (3, 2, 276, 1)
+        assert 'ubw_analytics_1h_danmaku{room="1"} 3' in registry.render()
+        await handler.refresh_records()
+    finally:
+        await handler.stop()
@@ -0,0 +1,35 @@
+import json
+from unittest.mock import patch
+
+from ubw.handlers._sampler import UnknownCmdSampler, iter_samples, shape_hash
+
+
+def test_shape_hash():
+    assert shape_hash({'a': 1, 'b': ['x']}) == shape_hash({'b': ['y', 'z'], 'a': 2.5})
+    assert shape_hash({'a': 1}) != shape_hash({'a': '1'})
+    assert shape_hash({'a': 1}) != shape_hash({'a': 1, 'b': None})
+
+
+def test_sampler(tmp_path):
+    sampler = UnknownCmdSampler(root=tmp_path, examples_per_shape=2, flush_interval=3600, sentry_max_per_minute=2)
+    with patch('ubw.handlers._sampler.sentry_sdk.capture_event') as capture:
+        for i in range(100):
+            sampler.capture('NEW_CMD', {'cmd': 'NEW_CMD', 'data': {'n': i}}, event={'message': 'new'})
+        sampler.capture('NEW_CMD', {'cmd': 'NEW_CMD', 'data': {'n': 'x'}}, event={'message': 'new'})
+        sampler.capture('OTHER', {'cmd': 'OTHER'}, event={'message': 'new'})
+    # one event per shape, capped globally
+    assert capture.call_count == 2
+
+    samples = list(iter_samples(tmp_path, 'NEW_CMD'))
+    assert len(samples) == 3
+    assert samples.count(('NEW_CMD', {'cmd': 'NEW_CMD', 'data': {'n': 0}})) == 1
+    assert sorted(sampler.stats()['NEW_CMD'].values()) == [1, 100]
+
+    sampler.flush()
+    summary = json.loads((tmp_path / 'summary.json').read_text())
+    assert sorted(s['count'] for s in summary['NEW_CMD'].values()) == [1, 100]
+
+    # the stored count survives a restart, so no more examples are written
+    restarted = UnknownCmdSampler(root=tmp_path, examples_per_shape=2)
+    restarted.record('NEW_CMD', {'cmd': 'NEW_CMD', 'data': {'n': -1}})
+    assert len(list(iter_samples(tmp_path, 'NEW_CMD'))) == 3
@@ -11,6 +11,7 @@ from ubw import models
 from ubw.clients.testing import MockBilibiliClient, MockClient
 from ubw.handlers.saver import SaverHandler, TimeDeltaSerializer
 from ubw.testing.generate import generate_type
+from ubw.userdata.archive import EventArchive
 
 
 class MockAIOTinyDB:
@@ -142,3 +143,32 @@ async def test_saver():
 
             await handler.stop()
             await handler.close()
+
+
+@pytest.mark.asyncio
+async def test_saver_sqlite(tmp_path):
+    room_id = random.randrange(10000, 1000000)
+    handler = SaverHandler(room_id=room_id, backend='sqlite',
+                           archive=EventArchive(path=tmp_path / 'events.sqlite3', flush_interval=0.01))
+    bilibili_client = MockBilibiliClient()
+    client = MockClient(room_id=room_id)
+
+    async with asyncio.timeout(5):
+        with patch('ubw.handlers.saver.BilibiliUnauthorizedClient') as p:
+            p.return_value = bilibili_client
+            bilibili_client.__aenter__.return_value = bilibili_client
+            bilibili_client.get_info_by_room.return_value = generate_type(models.InfoByRoom, {
+                'room_info': {'room_id': room_id, 'live_start_time': 0}})
+            await handler.start(client)
+            while bilibili_client.get_info_by_room.await_count == 0:
+                await asyncio.sleep(0.01)
+
+            danmaku_command = generate_type(models.DanmakuCommand)
+            await handler.on_danmu_msg(client, danmaku_command)
+            await handler.stop()
+            await handler.close()
+
+    events = handler.archive.select(room_id=room_id)
+    assert [e.cmd for e in events if e.cmd != 'DANMU_MSG'] == ['X_UBW_INFO_BY_ROOM']
+    danmaku, = handler.archive.select(room_id=room_id, cmd='DANMU_MSG')
+    assert (danmaku.uid, danmaku.text) == (danmaku_command.info.uid, danmaku_command.info.msg)
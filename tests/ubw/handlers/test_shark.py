@@ -0,0 +1,18 @@
+import json
+from datetime import datetime
+
+import pytest
+
+from ubw.handlers.shark import SharkHandler
+
+
+@pytest.mark.asyncio
+async def test_shark_jsonl(tmp_path):
+    handler = SharkHandler(rule='cmd == "SEND_GIFT" and data.num > 1', out_dir=tmp_path)
+    commands = [{'cmd': 'SEND_GIFT', 'data': {'num': n, 'text': '多行\n文本'}} for n in (1, 2, 3)]
+    for command in commands + [{'cmd': 'DANMU_MSG', 'info': []}]:
+        await handler.process_one(None, command)
+    await handler.writer.close()
+
+    path = tmp_path / f'{datetime.now():%Y%m%d}.jsonl'
+    assert [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()] == commands[1:]
@@ -0,0 +1,70 @@
+import asyncio
+import time
+from datetime import timedelta
+
+import pytest
+
+from ubw.handlers.vod.cache import VideoMetaCache
+
+
+def detail(bvid):
+    return {
+        'View': {'title': f'title of {bvid}', 'duration': 200, 'pic': 'cover.jpg',
+                 'owner': {'name': 'owner', 'mid': 1, 'face': 'face.jpg'}},
+        'Tags': [{'tag_name': '音乐', 'tag_type': 'old_channel'}, {'tag_name': '翻唱', 'tag_type': 'topic'}],
+    }
+
+
+class FakeBilibiliClient:
+    async def get_credential(self):
+        return None
+
+
+@pytest.fixture
+def fetched(monkeypatch):
+    calls = []
+
+    class Video:
+        def __init__(self, bvid, credential=None):
+            self.bvid = bvid
+
+        async def get_detail(self):
+            calls.append(self.bvid)
+            await asyncio.sleep(0.05)
+            if self.bvid == 'BVbroken':
+                raise ValueError(self.bvid)
+            return detail(self.bvid)
+
+    monkeypatch.setattr('ubw.handlers.vod.cache.Video', Video)
+    return calls
+
+
+@pytest.mark.asyncio
+async def test_video_cache(tmp_path, fetched):
+    cache = VideoMetaCache(path=tmp_path / 'video_meta.json', save_interval=0)
+    bclient = FakeBilibiliClient()
+
+    start = time.perf_counter()
+    cache.prefetch(['BV1', 'BV2', 'BV1'], bclient)
+    a, b, c = await asyncio.gather(cache.get('BV1', bclient), cache.get('BV2', bclient), cache.get('BV1', bclient))
+    assert time.perf_counter() - start < 0.1  # fetched concurrently
+    assert fetched == ['BV1', 'BV2'] and a is c
+    assert (a.title, a.duration, a.owner_uid, a.tags) == ('title of BV1', timedelta(seconds=200), 1, ['音乐', '#翻唱#'])
+
+    assert await cache.get('BV2', bclient) is b
+    with pytest.raises(ValueError):
+        await cache.get('BVbroken', bclient)
+    assert cache.stats() == {'entries': 2, 'inflight': 0, 'hits': 1, 'misses': 3, 'coalesced': 3, 'errors': 1}
+    await cache._saving  # 在后台线程里写出
+    await cache.save()
+
+    # persisted across restarts
+    cache = VideoMetaCache(path=tmp_path / 'video_meta.json')
+    assert (await cache.get('BV1', bclient)).title == 'title of BV1'
+    assert fetched == ['BV1', 'BV2', 'BVbroken']
+
+    # expired entries are fetched again
+    cache = VideoMetaCache(path=tmp_path / 'video_meta.json', ttl=timedelta(0))
+    assert cache.lookup('BV1') is None
+    await cache.get('BV1', bclient)
+    assert fetched[-1] == 'BV1'
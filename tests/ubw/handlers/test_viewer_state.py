@@ -0,0 +1,97 @@
+import copy
+import json
+from datetime import timedelta
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import pytest
+
+from ubw import models
+from ubw.handlers.warn_nebd import ExpDecayInteract, LastInteract, WarnNoEntranceButDanmakuHandler
+from ubw.handlers._viewer_state import ViewerStateStore, msg_hash
+from ubw.testing.generate import generate_type
+from ubw.ui.stream_view import Richy
+
+RAW_DANMAKU = json.loads((Path(__file__).parent / 'danmu_msg_emoticon_unique.json').read_text(encoding='utf-8'))
+
+
+def test_ring():
+    store = ViewerStateStore(memory_limit=3)
+    assert store.push_danmaku(1, 'a', 100) == (None, None, 1, 1, 0)
+    assert store.set_score(1, 5) == 5
+    store.see_entrance(1, 101)
+    assert store.push_danmaku(1, 'a', 102) == (101, 100, 2, 1, 5)
+    assert store.set_score(1, 1) == 6
+    assert store.push_danmaku(1, 'b', 103) == (101, 102, 1, 2, 6)
+    assert store.set_score(1, 2) == 8
+    # the first 'a' falls out of the ring
+    assert store.push_danmaku(1, 'c', 104) == (101, 103, 1, 3, 3)
+    assert store.set_score(1, 0) == 3
+    assert store.push_danmaku(1, 'c', 105) == (101, 104, 2, 2, 2)
+
+
+def test_eviction(tmp_path):
+    store = ViewerStateStore(max_viewers=2, ttl=timedelta(seconds=10))
+    store.push_danmaku(1, 'a', 100)
+    store.push_danmaku(2, 'a', 100)
+    store.see_entrance(1, 101)  # 1 is the most recently used now
+    store.push_danmaku(3, 'a', 102)
+    assert 1 in store and 2 not in store and 3 in store
+    store.see_entrance(4, 112)
+    assert 1 not in store and 3 in store and len(store) == 2
+    assert store.stats()['slots'] == 2 and store.stats()['evicted'] == 2  # slots are reused
+
+    path = tmp_path / 'viewers.bin'
+    store.set_score(3, 7)
+    store.save(path)
+    restored = ViewerStateStore(max_viewers=2, ttl=None)
+    assert restored.load(path)
+    assert len(restored) == 2 and restored.stats()['slots'] == 2
+    assert restored.push_danmaku(3, 'a', 113) == (None, 102, 2, 1, 7)
+    assert not ViewerStateStore(memory_limit=5).load(path)
+    assert not ViewerStateStore().load(tmp_path / 'missing.bin')
+
+
+def test_counts_follow_slot_reuse():
+    store = ViewerStateStore(max_viewers=1, memory_limit=3)
+    for ts in range(4):
+        store.push_danmaku(1, 'a', 100 + ts)
+    store.push_danmaku(2, 'a', 110)  # 1 is evicted and its slot reused
+    assert store.push_danmaku(2, 'a', 111) == (None, 110, 2, 1, 0)
+    assert store._counts == {0: {msg_hash('a'): 2}}
+
+
+@pytest.mark.parametrize('msgs', [
+    ['1', '草', '草', '草', 'hello', '草'] * 5,
+    [str(i % 7) for i in range(50)],
+])
+def test_same_as_last_interact(msgs):
+    handler = WarnNoEntranceButDanmakuHandler(memory_limit=4)
+    legacy = LastInteract(memory_limit=4)
+    handler.see_entrance(1)
+    legacy.see_entrance()
+    for msg in msgs:
+        raw = copy.deepcopy(RAW_DANMAKU)
+        raw['info'][1] = msg
+        message = models.DanmakuCommand.model_validate(raw)
+        assert handler.shift_danmaku(1, message) == legacy.shift_danmaku(message)
+
+
+class MockUI(AsyncMock):
+    @property
+    def uic(self):
+        return 'richy'
+
+    @property
+    def __class__(self):
+        return Richy
+
+
+@pytest.mark.asyncio
+async def test_exp_decay_entrance():
+    handler = WarnNoEntranceButDanmakuHandler(method='exp_decay', ui=MockUI())
+    await handler.on_interact_word(SimpleNamespace(room_id=1), generate_type(models.InteractWordCommand, {
+        'data': {'uid': 42, 'msg_type': 1, 'uinfo': {'base': {'face': ''}}}}))
+    assert isinstance(handler.ics[42], ExpDecayInteract)
+    assert 42 not in handler.viewers
@@ -62,3 +62,21 @@ def test_convert_ns():
 
     b = NS.model_validate({'ns': 1711418057}).ns
     assert b.isoformat() == '2024-03-26T01:54:17+00:00'
+
+
+def test_interned():
+    from ubw.models._base import Interner
+    from ubw.models.blive._base import Uinfo
+
+    interner = Interner(maxsize=2)
+    data = {'uid': 1, 'base': {'name': 'a', 'name_color': '#abc'}}
+    a = Uinfo.model_validate(data, context={'interner': interner})
+    b = Uinfo.model_validate(dict(data), context={'interner': interner})
+    assert a is b
+    assert a.base.name_color == TAC.validate_python('#abc')
+    assert Uinfo.model_validate(data) is not a
+    assert interner.hits == 1 and interner.misses == 2  # Uinfo and Color
+
+    Uinfo.model_validate({'uid': 2}, context={'interner': interner})
+    assert interner.evictions == 1 and len(interner) == 2
+    assert interner.stats()['hit_rate'] == 1 / 4
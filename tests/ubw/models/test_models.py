@@ -1,8 +1,8 @@
 import json
-from json import JSONDecoder
 from pathlib import Path
 
 from ubw import models
+from ubw.handlers._sampler import iter_samples
 
 
 def test_exports_not_over():
@@ -11,20 +11,12 @@ def test_exports_not_over():
 
 
 def test_with_history():
-    decoder = JSONDecoder()
-    for jsonfile in Path("output/unknown_cmd").glob("*.json"):
-        if jsonfile.name.startswith('XX_EXTRA_'):
+    for name, jj in iter_samples(Path("output/unknown_cmd")):
+        if name.startswith('XX_EXTRA_'):
             continue
-        jsons = jsonfile.read_text('utf-8')
-        idx = 0
-        while idx < len(jsons):
-            if jsons[idx].isspace():
-                idx += 1
-                continue
-            jj, idx = decoder.raw_decode(jsons, idx)
-            m = models.BLIVE_ADAPTER.validate_python(jj)
-            c = m.__class__
-            assert models.CommandModel in c.mro() and c is not models.CommandModel
+        m = models.BLIVE_ADAPTER.validate_python(jj)
+        c = m.__class__
+        assert models.CommandModel in c.mro() and c is not models.CommandModel
 
 
 def test_summary_guard_achievement_room():
@@ -0,0 +1,85 @@
+import json
+import socket
+import urllib.request
+
+import pytest
+
+from ubw import metrics
+from ubw.clients._wsbase import HEADER_STRUCT, Operation, ProtoVer, WSMessageParserMixin
+from ubw.metrics import MetricsRegistry, serve_metrics
+
+
+def test_render():
+    r = MetricsRegistry(prefix='t')
+    c = r.counter('messages_total', 'messages', ['room', 'cmd'])
+    c.labels('1', 'DANMU_MSG').inc()
+    c.labels('1', 'DANMU_MSG').inc(2)
+    c.labels('2', 'a"b').inc()
+    assert c.labels('1', 'DANMU_MSG') is c.labels('1', 'DANMU_MSG')
+    h = r.histogram('seconds', 'latency', buckets=[.1, 1])
+    for v in [.05, .5, .5, 3]:
+        h.observe(v)
+    g = r.gauge('depth', 'depth')
+    g.set(4)
+    r.register_stats('cache', lambda: {'hits': 3, 'ratio': .5, 'name': 'x', 'nested': {'a-b': 1}})
+    r.register_stats('bucket', lambda: {'global': {'rate': 10}, 'get_nav': {'rate': 1}}, label='bucket')
+    r.register_stats('broken', lambda: 1 / 0)
+
+    text = r.render()
+    assert '# TYPE t_messages_total counter' in text
+    assert 't_messages_total{room="1",cmd="DANMU_MSG"} 3' in text
+    assert 't_messages_total{room="2",cmd="a\\"b"} 1' in text
+    assert 't_seconds_bucket{le="0.1"} 1' in text
+    assert 't_seconds_bucket{le="1"} 3' in text
+    assert 't_seconds_bucket{le="+Inf"} 4' in text
+    assert 't_seconds_count 4' in text and 't_seconds_sum 4.05' in text
+    assert 't_depth 4' in text
+    assert 't_cache_hits 3' in text and 't_cache_ratio 0.5' in text and 't_cache_nested_a_b 1' in text
+    assert 't_cache_name' not in text
+    assert 't_bucket_rate{bucket="get_nav"} 1' in text
+    with pytest.raises(ValueError):
+        c.labels('1')
+
+
+def test_serve_metrics():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    r = MetricsRegistry(prefix='t')
+    r.counter('up', 'up').inc()
+    serve_metrics('127.0.0.1', port, metrics_registry=r)
+    with urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics', timeout=5) as resp:
+        assert resp.headers['Content-Type'].startswith('text/plain')
+        assert 't_up 1' in resp.read().decode()
+
+
+class StubClient(WSMessageParserMixin):
+    clientc: str = 'stub'
+
+    @property
+    def user_ident(self) -> str:
+        return 'stub'
+
+    async def start(self):
+        pass
+
+    async def join(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_command_metrics():
+    body = json.dumps({'cmd': 'X_METRICS_TEST', 'data': {}}).encode()
+    pack = HEADER_STRUCT.pack(HEADER_STRUCT.size + len(body), HEADER_STRUCT.size, ProtoVer.NORMAL,
+                              Operation.SEND_MSG_REPLY, 1) + body
+    client = StubClient(room_id=98765, deduper=None)
+    await client._parse_ws_message(pack * 2)
+    assert metrics.commands.labels('98765', 'X_METRICS_TEST').value == 2
+    assert metrics.command_bytes.labels('98765', 'X_METRICS_TEST').value == 2 * len(body)
+    assert client._metrics_cmds['X_METRICS_TEST'][1] is metrics.command_bytes.labels('98765', 'X_METRICS_TEST')
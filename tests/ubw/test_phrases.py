@@ -0,0 +1,100 @@
+import asyncio
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from ubw import models
+from ubw.handlers.trends import TrendsHandler
+from ubw.phrases import CountMinWindow, PhraseTrends, TokenCache, Tokenizer, _cells, normalize, tokenize
+from ubw.testing.generate import generate_type
+
+
+def test_tokenize():
+    assert normalize('  哈哈哈哈哈哈 OK ') == '哈哈哈 ok'
+    tokens = tokenize(normalize('主播 好强啊，好强！！！'))
+    assert '好强' in tokens and len(tokens) == len(set(tokens))
+    assert all(t not in ('啊', '，', '！') for t in tokens)
+
+
+def test_token_cache():
+    cache = TokenCache(maxsize=2)
+    cache.put('a', ('a',))
+    cache.put('b', ('b',))
+    assert cache.get('a') == ('a',)
+    cache.put('c', ('c',))  # 'b' is the least recently used
+    assert cache.get('b') is None and cache.get('a') == ('a',)
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_count_min_window():
+    w = CountMinWindow(60, buckets=6, width=256, depth=4)
+    cells = _cells('草', 256, 4)
+    for ts in range(100, 160):
+        w.add(ts, cells)
+    assert w.estimate(cells) == 60
+    w.advance(175)  # [100, 120) falls out
+    assert w.estimate(cells) == 40
+    w.add(100, cells)  # too old, ignored
+    assert w.estimate(cells) == 40
+    w.advance(1000)
+    assert w.estimate(cells) == 0 and not any(w.total)
+
+
+def test_trends_top_and_spikes():
+    trends = PhraseTrends(short=60, long=600, width=1024, max_candidates=16)
+    for ts in range(0, 540):  # steady background chatter
+        trends.add(ts, ['主播', f'路人{ts % 40}'])
+    for ts in range(540, 600):
+        trends.add(ts, ['主播'])
+        trends.add(ts + .5, ['上舰', '主播'])
+    top = trends.top(599, k=2)
+    assert [phrase for phrase, _ in top] == ['主播', '上舰'] and top[0][1] >= 120
+    assert len(trends.candidates) <= 16
+    assert [s.phrase for s in trends.spikes(599)] == ['上舰']
+    assert trends.top(599, k=1, window='long')[0][0] == '主播'
+
+
+def test_trends_windows():
+    with pytest.raises(ValueError):
+        PhraseTrends(short=60, long=60)
+    with pytest.raises(ValueError):
+        TrendsHandler(short_window=timedelta(minutes=1), long_window=timedelta(minutes=1))
+
+
+@pytest.mark.asyncio
+async def test_tokenizer_dedups_batches():
+    tokenizer = Tokenizer(workers=0, batch_size=2)
+    texts = ['好强', '好强', '晚上好', '草', '好强']
+    results = await tokenizer.tokenize_many(texts)
+    assert results[0] == results[1] == results[4] and tokenizer.cache.misses == 5
+    assert tokenizer.batches == 2  # three distinct texts
+    await tokenizer.tokenize_many(['好强'])
+    assert tokenizer.cache.hits == 1 and tokenizer.batches == 2
+
+
+@pytest.mark.asyncio
+async def test_trends_handler():
+    handler = TrendsHandler(workers=0, batch_interval=timedelta(milliseconds=10), refresh_interval=timedelta(hours=1),
+                            spike_min_count=3, publish_metrics=False)
+    client = SimpleNamespace(room_id=1)
+    await handler.start(client)
+    try:
+        for _ in range(5):
+            await handler.on_danmu_msg(client, generate_type(models.DanmakuCommand, {
+                'info': {'msg': '好强', 'dm_type': 0}}))
+        await handler.on_danmu_msg(client, generate_type(models.DanmakuCommand, {
+            'info': {'msg': '[dog]', 'dm_type': 1}}))
+        for _ in range(100):
+            if not handler.pending and handler.tokenizer.batches:
+                break
+            await asyncio.sleep(0.01)
+        await handler.on_danmu_msg(client, generate_type(models.DanmakuCommand, {
+            'info': {'msg': '好强', 'dm_type': 0}}))  # cached, counted immediately
+        assert handler.rooms[1].top(time.time(), 1)[0] == ('好强', 6)
+        assert handler.stats()['cache_hits'] >= 1 and handler.stats()['dropped'] == 0
+        await handler.refresh_records()
+        assert '好强' in handler._spiking[1]
+    finally:
+        await handler.stop()
@@ -0,0 +1,84 @@
+import asyncio
+import json
+import time
+from unittest.mock import MagicMock
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from ubw.handlers._base import BaseHandler
+from ubw.profiling import StackSampler, add_routes, profiler
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_stack_sampler():
+    sampler = StackSampler(interval=0.001)
+    sampler.start()
+    busy(0.2)
+    sampler.stop()
+    assert sampler.samples > 0
+    lines = sampler.collapsed().splitlines()
+    assert any('test_stack_sampler' in line and line.split(';')[-1].startswith('busy ') for line in lines)
+    assert all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+
+
+class SlowHandler(BaseHandler):
+    cls: str = 'slow'
+
+    async def process_one(self, client, command):
+        if command['cmd'] == 'BLOCK':
+            busy(0.2)
+        else:
+            await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_slow_calls(tmp_path):
+    client = MagicMock(room_id=1)
+    handler = SlowHandler()
+    assert profiler.start_slow_calls(size=2, threshold=0.05)
+    try:
+        for cmd in ['FAST', 'BLOCK', 'FAST', 'FAST']:
+            await handler.handle(client, {'cmd': cmd})
+    finally:
+        profiler.output_dir = tmp_path
+        path = profiler.dump('slow')
+    assert profiler.slow_calls is None
+    report = json.loads(path.read_text())
+    assert len(report) == 2
+    assert report[0]['cmd'] == 'BLOCK' and report[0]['handler'] == 'slow' and report[0]['room_id'] == 1
+    assert report[0]['blocking'] and report[0]['stack'][-1].startswith('busy ')
+    assert report[1]['cmd'] == 'FAST' and report[1]['stack'] is None
+
+
+@pytest.mark.asyncio
+async def test_profile_routes():
+    app = web.Application()
+    add_routes(app)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', 0).start()
+    base = f'http://127.0.0.1:{runner.addresses[0][1]}/profile'
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.post(f'{base}/stacks/start', params={'interval': '0.001'}) as resp:
+                assert await resp.json() == {'started': True}
+            await asyncio.sleep(0.1)
+            async with session.post(f'{base}/stacks/stop') as resp:
+                assert '_run_once' in await resp.text()  # the loop idling in select
+            async with session.post(f'{base}/stacks/stop') as resp:
+                assert resp.status == 409
+            async with session.post(f'{base}/slow/start') as resp:
+                assert await resp.json() == {'started': True}
+            async with session.get(f'{base}/slow') as resp:
+                assert await resp.json() == []
+            async with session.post(f'{base}/slow/stop') as resp:
+                assert await resp.json() == []
+    finally:
+        await runner.cleanup()
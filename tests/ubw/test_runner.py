@@ -0,0 +1,42 @@
+import asyncio
+import time
+
+import pytest
+
+from ubw.runner import LagProbe, RunnerConfig, _with_probe, loop_factory, run
+
+
+def hold_the_loop(seconds):
+    time.sleep(seconds)
+
+
+def test_lag_probe():
+    probe = LagProbe(interval=0.01, threshold=0.1)
+
+    async def main():
+        await asyncio.sleep(0.05)
+        hold_the_loop(0.3)
+        await asyncio.sleep(0.05)
+        return 'done'
+
+    assert asyncio.run(_with_probe(main(), probe)) == 'done'
+    assert probe.stalls == 1 and probe.max_lag >= 0.2
+    assert probe.last_stall['stack'][-1].startswith('hold_the_loop ')
+    assert probe.last_stall['coro'].endswith('main')
+    assert probe.percentiles(50)['p50'] < 0.1
+
+
+def test_run():
+    async def main():
+        return asyncio.get_running_loop()
+
+    assert isinstance(run(main(), config=RunnerConfig(loop='asyncio')), asyncio.AbstractEventLoop)
+    assert loop_factory('asyncio') is None
+    try:
+        import uvloop
+    except ImportError:
+        with pytest.raises(ImportError):
+            loop_factory('uvloop')
+        assert loop_factory('auto') is None
+    else:
+        assert loop_factory('auto') is uvloop.new_event_loop
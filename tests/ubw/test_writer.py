@@ -0,0 +1,62 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from ubw.writer import FileWriter, format_csv_row, shared_writer
+
+
+@pytest.mark.asyncio
+async def test_group_commit(tmp_path):
+    writer = FileWriter(path=str(tmp_path / 'out' / '{date}.csv'), header=format_csv_row(['a', 'b']),
+                        batch_size=10, flush_interval=60)
+    for i in range(20):
+        writer.write_nowait(format_csv_row(['a', 'b'], {'a': i, 'b': 'x,y'}))
+    await asyncio.sleep(0.1)
+    # records queued before the writer task ran are committed together
+    assert writer.stats() == {'pending': 0, 'written': 20, 'commits': 1, 'dropped': 0}
+    for i in range(20, 25):
+        writer.write_nowait(format_csv_row(['a', 'b'], {'a': i, 'b': 'x,y'}))
+    await asyncio.sleep(0.1)
+    # less than a batch waits for the timer
+    assert writer.stats() == {'pending': 5, 'written': 20, 'commits': 1, 'dropped': 0}
+    await writer.close()
+    assert writer.stats()['commits'] == 2
+
+    path = tmp_path / 'out' / f"{datetime.today().strftime('%Y%m%d')}.csv"
+    lines = path.read_text(encoding='utf-8').splitlines()
+    assert lines[0] == 'a,b' and lines[1] == '0,"x,y"' and len(lines) == 26
+
+    # the header is written only once
+    writer = FileWriter(path=str(tmp_path / 'out' / '{date}.csv'), header=format_csv_row(['a', 'b']))
+    await writer.write(format_csv_row(['a', 'b'], {'a': 25, 'b': ''}))
+    await writer.close()
+    assert path.read_text(encoding='utf-8').splitlines()[1:] == [f'{i},"x,y"' for i in range(25)] + ['25,']
+
+
+@pytest.mark.asyncio
+async def test_rotate_and_backpressure(tmp_path):
+    writer = FileWriter(path=str(tmp_path / 'a.log'), rotate_size=10, max_pending=2, flush_interval=0.01,
+                        durability='fsync')
+    assert writer.write_nowait('12345\n') and writer.write_nowait('12345\n')
+    assert not writer.write_nowait('dropped\n')
+    for i in range(4):
+        await writer.write(f'{i}' * 10 + '\n')
+    await writer.close()
+    assert writer.stats()['dropped'] == 1
+    assert (tmp_path / 'a.log').read_text() == '12345\n12345\n'
+    parts = [tmp_path / 'a.log'] + [tmp_path / f'a.{i}.log' for i in range(1, len(list(tmp_path.iterdir())))]
+    assert all(p.exists() for p in parts) and len(parts) >= 3
+    assert ''.join(p.read_text() for p in parts[1:]) == ''.join(f'{i}' * 10 + '\n' for i in range(4))
+
+
+@pytest.mark.asyncio
+async def test_shared_writer(tmp_path):
+    path = tmp_path / 'shared.json'
+    writer = shared_writer(path, batch_size=1)
+    assert shared_writer(str(path)) is writer and writer.batch_size == 1
+    writer.write_nowait('{}')
+    await writer.close()
+    assert path.read_text() == '{}'
+    assert shared_writer(path) is not writer
+    shared_writer(path).close_sync()
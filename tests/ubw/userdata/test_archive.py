@@ -0,0 +1,64 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from ubw import models
+from ubw.testing.generate import generate_type
+from ubw.userdata.archive import EventArchive
+
+
+@pytest.mark.asyncio
+async def test_archive(tmp_path):
+    archive = EventArchive(path=tmp_path / 'events.sqlite3', batch_size=3, flush_interval=60)
+    await archive.start()
+    await archive.start()  # shared by two handlers
+    async with asyncio.timeout(5):
+        sc = generate_type(models.SuperChatCommand, {
+            'data': {'uid': 42, 'price': 30, 'message': '草', 'start_time': 1712308994}})
+        archive.put(1, sc)
+        archive.put(2, {'cmd': 'NEW_CMD', 'x': 1}, ts=datetime(2024, 1, 1).astimezone())
+        assert archive.select() == []  # still buffered
+
+        archive.put(2, generate_type(models.WarningCommand, {'msg': 'warn'}))  # batch_size reached
+        while archive.stats()['written'] < 3:
+            await asyncio.sleep(0.01)
+        assert archive.stats()['batches'] == 1
+
+        e, = archive.select(uid=42, cmd='SUPER_CHAT_MESSAGE')
+        assert (e.room_id, e.uid, e.price) == (1, 42, 30)
+        assert e.text == sc.summarize().msg
+        assert e.ts == sc.data.start_time
+        assert e.json()['data']['message'] == '草'
+
+        e, = archive.select(until=datetime(2024, 1, 2).astimezone())
+        assert e.cmd == 'NEW_CMD' and e.json() == {'cmd': 'NEW_CMD', 'x': 1}
+        assert len(archive.select(room_id=2)) == 2
+        assert [e.cmd for e in archive.select(room_id=2, desc=True, limit=1)] == ['WARNING']
+        assert archive.select(text_like='%草%', cmd=['SUPER_CHAT_MESSAGE', 'DANMU_MSG'])[0].uid == 42
+        assert archive.query('SELECT uid, SUM(price) FROM events WHERE uid IS NOT NULL GROUP BY uid') == [(42, 30.)]
+
+        archive.put(1, {'cmd': 'LAST'})
+        await archive.stop()
+        assert archive._task is not None  # still used by the other handler
+        await archive.stop()
+        assert archive._task is None
+
+    assert archive.select(cmd='LAST')[0].room_id == 1
+    plan = archive.query('EXPLAIN QUERY PLAN SELECT * FROM events WHERE uid = 42 AND ts >= 0')
+    assert 'events_uid_ts' in str(plan)
+    assert archive.query('PRAGMA journal_mode') == [('wal',)]
+
+
+@pytest.mark.asyncio
+async def test_archive_flush_interval(tmp_path):
+    archive = EventArchive(path=tmp_path / 'events.sqlite3', flush_interval=0.05)
+    await archive.start()
+    try:
+        async with asyncio.timeout(5):
+            archive.put(1, {'cmd': 'A'}, uid=1, ts=datetime.now().astimezone() - timedelta(days=40))
+            while not archive.stats()['written']:
+                await asyncio.sleep(0.01)
+            assert archive.select(uid=1, since=datetime.now().astimezone() - timedelta(days=31)) == []
+    finally:
+        await archive.stop()
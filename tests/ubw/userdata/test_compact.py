@@ -0,0 +1,96 @@
+import asyncio
+import gzip
+import json
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+from ubw.userdata.compact import CompactError, closed_shards, compact_all, compact_in_background, compact_shard, \
+    iter_compact, read_index
+from ubw.userdata.query import Query, aggregate
+from ubw.userdata.shards import compact_paths, find_shards, iter_shard, iter_tinydb
+
+
+def t(day, hour=12):
+    return datetime(2024, 4, day, hour).astimezone()
+
+
+def danmaku(uid, ts: datetime, msg='hi'):
+    return {'cmd': 'DANMU_MSG', 'info': [[0, 1, 25, 16777215, int(ts.timestamp() * 1000)], msg, [uid, 'name']]}
+
+
+def write_shard(root: Path, room_id: int, start: datetime, docs: list[dict]) -> Path:
+    path = root / str(room_id) / start.strftime('%Y年%m月%d日%H点%M%S.json')
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps({'_default': {str(i): doc for i, doc in enumerate(docs, 1)},
+                                'other': {'1': {'cmd': 'X'}}}, ensure_ascii=False), encoding='utf-8')
+    return path
+
+
+@pytest.fixture
+def root(tmp_path):
+    root = tmp_path / 'blive_dumpraw'
+    write_shard(root, 1, t(1), [danmaku(i % 7, t(1, i // 5), f'第{i}条') for i in range(100)]
+                + [{'cmd': 'ONLINE_RANK_COUNT', 'data': {'count': 1}}])
+    write_shard(root, 1, t(2), [danmaku(1, t(2))])
+    write_shard(root, 2, t(1), [danmaku(1, t(1))])
+    return root
+
+
+def test_compact_shard(root):
+    shard, = closed_shards(find_shards(root))
+    original = list(iter_tinydb(shard.path))
+    index = compact_shard(shard.path, block_records=16)
+    data_path, index_path = compact_paths(shard.path)
+
+    assert not shard.path.exists() and index_path.exists()
+    assert index.records == 102 and len(index.blocks) == 8  # 101 records in 7 blocks, plus the other table
+    assert read_index(data_path) == index
+    assert list(iter_compact(data_path)) == original
+    # still readable as a whole
+    with gzip.open(data_path, 'rt', encoding='utf-8') as f:
+        assert [json.loads(line) for line in f] == [[doc_id, doc] for _, doc_id, doc in original]
+
+    # blocks are skipped by cmd and time
+    assert [doc['cmd'] for doc in iter_shard(data_path, cmds=['ONLINE_RANK_COUNT'])] == ['DANMU_MSG'] * 4 + [
+        'ONLINE_RANK_COUNT']
+    # the first block, and the last one because ONLINE_RANK_COUNT has no timestamp
+    assert len(list(iter_shard(data_path, cmds=['DANMU_MSG'], until=t(1, 1).timestamp()))) == 16 + 5
+
+    # the compacted shard replaces the original
+    shards = find_shards(root, [1])
+    assert [s.path.name for s in shards] == [data_path.name, '2024年04月02日12点0000.json']
+    assert closed_shards(shards) == []
+
+
+def test_compact_verification_failure(root, monkeypatch):
+    shard, = closed_shards(find_shards(root))
+
+    def broken(path, index=None, **kwargs):
+        for i, record in enumerate(iter_compact.__wrapped__(path, index, **kwargs)):
+            yield record if i != 50 else (*record[:2], {})
+
+    iter_compact.__wrapped__ = iter_compact
+    monkeypatch.setattr('ubw.userdata.compact.iter_compact', broken)
+    with pytest.raises(CompactError, match='at record 51'):
+        compact_shard(shard.path)
+    data_path, index_path = compact_paths(shard.path)
+    assert shard.path.exists() and not data_path.exists() and not index_path.exists()
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_compact_all(root, jobs):
+    write_shard(root, 2, t(3), [])
+    before = aggregate(Query(group_by=['room', 'uid']), find_shards(root))
+    results = list(compact_all(find_shards(root), jobs, keep_original=True))
+    assert [(s.room_id, r.records) for s, r in results] == [(1, 102), (2, 2)]
+    assert all(s.path.exists() for s, _ in results)
+    assert aggregate(Query(group_by=['room', 'uid']), find_shards(root)) == before
+
+
+@pytest.mark.asyncio
+async def test_compact_in_background(root):
+    async with asyncio.timeout(60):
+        assert await compact_in_background(root, 1) == 1
+        assert await compact_in_background(root, 1) == 0
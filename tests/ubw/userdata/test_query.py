@@ -0,0 +1,102 @@
+import json
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+from tinydb import TinyDB
+from tinydb.storages import JSONStorage
+from tinydb_serialization import SerializationMiddleware
+from tinydb_serialization.serializers import DateTimeSerializer
+
+from ubw import models
+from ubw.handlers.saver import TimeDeltaSerializer
+from ubw.testing.generate import generate_type
+from ubw.userdata.query import Query, aggregate, iter_records
+from ubw.userdata.shards import find_shards, iter_tinydb, record_fields
+
+RAW_DANMAKU = json.loads((Path(__file__).parent.parent / 'handlers' / 'danmu_msg_3_7_1_1_1_1.json')
+                         .read_text(encoding='utf-8'))
+
+
+def t(month, day=1):
+    return datetime(2024, month, day, 12).astimezone()
+
+
+def sc(uid, price, month):
+    return generate_type(models.SuperChatCommand, {
+        'data': {'uid': uid, 'price': price, 'message': f'sc from {uid}', 'start_time': t(month).timestamp()}})
+
+
+def write_saver_shard(root: Path, room_id: int, start: datetime, commands: list):
+    path = root / str(room_id) / start.strftime('%Y年%m月/%Y年%m月%d日%H点%M%S.json')
+    path.parent.mkdir(parents=True, exist_ok=True)
+    serialization = SerializationMiddleware(JSONStorage)
+    serialization.register_serializer(DateTimeSerializer(), 'TinyDate')
+    serialization.register_serializer(TimeDeltaSerializer(), 'timedelta')
+    with TinyDB(path, storage=serialization) as db:
+        for c in commands:
+            db.insert(c.model_dump(exclude_defaults=True, by_alias=True) if not isinstance(c, dict) else c)
+    return path
+
+
+@pytest.fixture
+def saver_root(tmp_path):
+    root = tmp_path / 'blive_saver'
+    write_saver_shard(root, 1, t(1), [sc(10, 30, 1), sc(11, 50, 1), {'cmd': 'NEW_CMD'}])
+    write_saver_shard(root, 1, t(2), [sc(10, 100, 2), RAW_DANMAKU])
+    write_saver_shard(root, 2, t(1), [sc(10, 1000, 1)])
+    return root
+
+
+def test_iter_tinydb(saver_root):
+    for path in saver_root.rglob('*.json'):
+        with path.open(encoding='utf-8') as f:
+            expected = [(table, int(i), doc) for table, docs in json.load(f).items() for i, doc in docs.items()]
+        for chunk_size in (1, 7, 1 << 20):
+            assert list(iter_tinydb(path, chunk_size)) == expected
+
+
+def test_record_fields(saver_root):
+    f = record_fields(RAW_DANMAKU)
+    assert (f.cmd, f.ts, f.uid, f.msg) == ('DANMU_MSG', 1713788399.263, 0, RAW_DANMAKU['info'][1])
+
+    (_, _, saved), = iter_tinydb(next((saver_root / '2').rglob('*.json')))
+    f = record_fields(saved)
+    assert (f.cmd, f.ts, f.uid, f.price) == ('SUPER_CHAT_MESSAGE', t(1).timestamp(), 10, 1000)
+
+    danmaku = generate_type(models.DanmakuCommand, {'info': {'uid': 5, 'msg': 'hi'}})
+    f = record_fields(danmaku.model_dump(exclude_defaults=True, by_alias=True))
+    assert (f.cmd, f.uid, f.msg) == ('DANMU_MSG', 5, 'hi')
+
+
+def test_find_shards(saver_root):
+    assert len(find_shards(saver_root)) == 3
+    assert [s.start for s in find_shards(saver_root, [1])] == [t(1), t(2)]
+    assert find_shards(saver_root, [1])[0].end == t(2)
+    # the first shard of room 1 ends when the second begins
+    assert [s.start for s in find_shards(saver_root, [1], since=t(3))] == [t(2)]
+    assert [s.room_id for s in find_shards(saver_root, until=t(2))] == [1, 2]
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_aggregate(saver_root, jobs):
+    shards = find_shards(saver_root)
+    q = Query(cmds=['SUPER_CHAT_MESSAGE'], group_by=['room', 'uid'], sum='price')
+    assert aggregate(q, shards, jobs) == {(1, 10): (2, 130.), (1, 11): (1, 50.), (2, 10): (1, 1000.)}
+
+    q = Query(uids=[10], since=t(1, 15), group_by=['month'], sum='data.price')
+    assert aggregate(q, shards, jobs) == {('2024-02',): (1, 100.)}
+
+    q = Query(where='data.price >= 50 and data.price < 1000')
+    assert aggregate(q, shards, jobs) == {(): (2, 0.)}
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_iter_records(saver_root, jobs):
+    shards = find_shards(saver_root)
+    (shard, doc), = iter_records(Query(regex='大白猫'), shards, jobs)
+    assert shard.room_id == 1 and doc == RAW_DANMAKU
+
+    records = list(iter_records(Query(uids=[10]), shards, jobs))
+    assert [(s.room_id, d['data']['price']) for s, d in records] == [(1, 30), (1, 100), (2, 1000)]
+    assert len(list(iter_records(Query(limit=2), shards, jobs))) == 2
@@ -0,0 +1,83 @@
+import sqlite3
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from ubw import models
+from ubw.handlers.audience import AudienceHandler
+from ubw.testing.generate import generate_type
+from ubw.userdata.sketches import BottomK, HyperLogLog, RoomDaySketch, SketchStore, estimate
+
+
+@pytest.mark.parametrize('n', [10, 1000, 50000])
+def test_hyperloglog(n):
+    hll = HyperLogLog()
+    for uid in range(n):
+        hll.add(uid)
+        hll.add(uid)
+    assert hll.count() == pytest.approx(n, rel=0.05)
+    assert HyperLogLog.from_bytes(hll.to_bytes()).registers == hll.registers
+
+
+def test_hyperloglog_merge():
+    a, b = HyperLogLog(), HyperLogLog()
+    for uid in range(20000):
+        a.add(uid)
+    for uid in range(10000, 30000):
+        b.add(uid)
+    assert HyperLogLog.union([a, b]).count() == pytest.approx(30000, rel=0.05)
+    assert a.merge(b).registers == HyperLogLog.union([b, a]).registers
+
+
+def test_bottom_k():
+    a, b = BottomK(k=256), BottomK(k=256)
+    for uid in range(20000):
+        a.add(uid)
+    for uid in range(10000, 30000):
+        b.add(uid)
+    assert list(a.values) == sorted(a.values) and len(a.values) == 256
+    assert a.count() == pytest.approx(20000, rel=0.2)
+    assert BottomK.jaccard([a, b]) == pytest.approx(1 / 3, abs=0.1)
+    assert BottomK.from_bytes(a.to_bytes()).values == a.values
+    small = BottomK(k=256, values=[3, 1, 2, 1])
+    assert list(small.values) == [1, 2, 3] and small.count() == 3
+
+
+def test_store_merges(tmp_path):
+    path = tmp_path / 'sketches.sqlite3'
+    day = date(2024, 5, 1)
+    for lo, hi in ((0, 6000), (3000, 9000)):  # two writers, same key
+        sketch = RoomDaySketch()
+        for uid in range(lo, hi):
+            sketch.add(uid)
+        SketchStore(path).merge({(day.isoformat(), 1, 'viewers'): sketch})
+    sketch = RoomDaySketch()
+    for uid in range(6000, 12000):
+        sketch.add(uid)
+    SketchStore(path).merge({(day.isoformat(), 2, 'viewers'): sketch})
+
+    with sqlite3.connect(path) as conn:
+        assert conn.execute('SELECT count(*) FROM sketches').fetchone() == (2,)
+    result = estimate(SketchStore(path), [1, 2], day)
+    assert result.per_room[1] == pytest.approx(9000, rel=0.05)
+    assert result.union == pytest.approx(12000, rel=0.05)
+    assert result.jaccard == pytest.approx(0.25, abs=0.1)
+    assert estimate(SketchStore(path), [1], day + timedelta(days=1)).per_room == {1: 0}
+    assert estimate(SketchStore(tmp_path / 'missing.sqlite3'), [1], day).union == 0
+
+
+@pytest.mark.asyncio
+async def test_audience_handler(tmp_path):
+    handler = AudienceHandler(path=tmp_path / 'sketches.sqlite3', flush_interval=timedelta(hours=1))
+    client = SimpleNamespace(room_id=1)
+    await handler.start(client)
+    ct = datetime.now().astimezone()
+    for uid in (1, 2, 3):
+        await handler.on_interact_word(client, generate_type(models.InteractWordCommand, {'data': {'uid': uid}}))
+    await handler.on_danmu_msg(client, generate_type(models.DanmakuCommand, {'info': {'uid': 4}}))
+    await handler.stop()
+    assert not handler.pending
+    today = ct.date()
+    assert estimate(handler.store, [1], today).union == pytest.approx(4, abs=0.5)
+    assert estimate(handler.store, [1], today, kind='chatters').union == pytest.approx(1, abs=0.5)